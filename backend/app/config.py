@@ -24,6 +24,32 @@ class Settings(BaseSettings):
     SMTP_EMAIL: str = os.getenv("SMTP_EMAIL")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD")
     
+    # Analytics snapshot (NumPy .npy, mmap)
+    ANALYTICS_DIR: str = os.getenv("ANALYTICS_DIR", "data/analytics")
+    ANALYTICS_APPEND_INTERVAL: int = int(os.getenv("ANALYTICS_APPEND_INTERVAL", 60))
+    ANALYTICS_REBUILD_INTERVAL: int = int(os.getenv("ANALYTICS_REBUILD_INTERVAL", 3600))
+    DASHBOARD_STALE_AFTER: int = int(os.getenv("DASHBOARD_STALE_AFTER", 60))
+    DASHBOARD_REFRESH_INTERVAL: int = int(os.getenv("DASHBOARD_REFRESH_INTERVAL", 300))
+    
+    # Export jobs (file CSV ghi ra đĩa)
+    EXPORT_DIR: str = os.getenv("EXPORT_DIR", "data/exports")
+    EXPORT_ARTIFACT_TTL: int = int(os.getenv("EXPORT_ARTIFACT_TTL", 24 * 3600))
+    EXPORT_DEDUPE_WINDOW: int = int(os.getenv("EXPORT_DEDUPE_WINDOW", 300))
+    EXPORT_CLEANUP_INTERVAL: int = int(os.getenv("EXPORT_CLEANUP_INTERVAL", 3600))
+    
+    # Booking metrics (chuỗi thời gian phút / giờ / ngày)
+    METRICS_ROLLUP_INTERVAL: int = int(os.getenv("METRICS_ROLLUP_INTERVAL", 60))
+    METRICS_MINUTE_RETENTION: int = int(os.getenv("METRICS_MINUTE_RETENTION", 2 * 24 * 3600))
+    METRICS_HOUR_RETENTION: int = int(os.getenv("METRICS_HOUR_RETENTION", 90 * 24 * 3600))
+    METRICS_DAY_RETENTION: int = int(os.getenv("METRICS_DAY_RETENTION", 2 * 365 * 24 * 3600))
+    
+    # Trip scheduler (chuyển trạng thái lịch chạy, một leader)
+    TRIP_SCHEDULER_INTERVAL: int = int(os.getenv("TRIP_SCHEDULER_INTERVAL", 15))
+    TRIP_LEADER_TTL: int = int(os.getenv("TRIP_LEADER_TTL", 60))
+    
+    # Cascade jobs (xóa liên kết): chu kỳ chạy tiếp các job bị bỏ dở
+    CASCADE_RESUME_INTERVAL: int = int(os.getenv("CASCADE_RESUME_INTERVAL", 60))
+    
     # API
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "Booking Ticket API"
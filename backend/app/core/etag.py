@@ -0,0 +1,54 @@
+"""
+ETag / Conditional GET helpers
+
+ETag được tạo từ các version counters (ver:*) trong Redis, nên có thể kiểm tra
+If-None-Match chỉ với một lệnh MGET mà không cần tính lại payload.
+"""
+import hashlib
+from typing import Iterable
+from fastapi import Request, Response
+
+
+def build_etag(versions: Iterable[int], *extra) -> str:
+    """
+    Tạo weak ETag từ danh sách version và các tham số ảnh hưởng tới response
+
+    Args:
+        versions: Giá trị các version counters
+        extra: Tham số request (ngày, sessionId, ...) làm response khác nhau
+    """
+    raw = "|".join(str(v) for v in versions)
+    if extra:
+        raw += "#" + "|".join("" if e is None else str(e) for e in extra)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Kiểm tra header If-None-Match có khớp ETag hiện tại không (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = _strip_weak(etag)
+    return any(_strip_weak(tag) == current for tag in header.split(","))
+
+
+def not_modified_response(etag: str, cache_control: str = "no-cache") -> Response:
+    """Response 304 Not Modified kèm ETag"""
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+
+def set_etag_headers(response: Response, etag: str, cache_control: str = "no-cache"):
+    """Gắn ETag và Cache-Control vào response trả về"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
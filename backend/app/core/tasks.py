@@ -0,0 +1,88 @@
+"""
+Background Tasks - Các vòng lặp định kỳ chạy cùng vòng đời ứng dụng
+
+Được khởi động / dừng trong lifespan của FastAPI (main.py).
+Mỗi worker đều chạy các vòng lặp; việc chỉ một worker thực sự làm việc nặng
+được đảm bảo bên trong từng service (lock SET NX trong Redis).
+"""
+import asyncio
+from typing import Awaitable, Callable, List
+
+from app.config import settings
+
+_tasks: List[asyncio.Task] = []
+
+
+async def _run_periodic(name: str, interval: int, func: Callable[[], Awaitable], initial_delay: int = 0):
+    """Gọi `func` mỗi `interval` giây; lỗi chỉ được log để vòng lặp không dừng"""
+    if initial_delay:
+        await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Background task {name} failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_periodic(name: str, interval: int, func: Callable[[], Awaitable], initial_delay: int = 0):
+    """Đăng ký một vòng lặp định kỳ"""
+    _tasks.append(asyncio.create_task(_run_periodic(name, interval, func, initial_delay), name=name))
+
+
+def start_background_tasks():
+    """Khởi động các background task của ứng dụng"""
+    from app.services.analytics_snapshot_service import analytics_snapshot_service
+    from app.services.dashboard_service import dashboard_service
+    from app.services.export_job_service import export_job_service
+    from app.services.booking_metrics_service import booking_metrics_service
+    from app.services.trip_scheduler_service import trip_scheduler_service
+    from app.services.cascade_service import cascade_service
+
+    start_periodic(
+        "analytics-append",
+        settings.ANALYTICS_APPEND_INTERVAL,
+        analytics_snapshot_service.append,
+        initial_delay=settings.ANALYTICS_APPEND_INTERVAL
+    )
+    start_periodic(
+        "analytics-rebuild",
+        settings.ANALYTICS_REBUILD_INTERVAL,
+        analytics_snapshot_service.rebuild
+    )
+    start_periodic(
+        "dashboard-refresh",
+        settings.DASHBOARD_REFRESH_INTERVAL,
+        dashboard_service.refresh
+    )
+    start_periodic(
+        "export-cleanup",
+        settings.EXPORT_CLEANUP_INTERVAL,
+        export_job_service.cleanup
+    )
+    start_periodic(
+        "metrics-rollup",
+        settings.METRICS_ROLLUP_INTERVAL,
+        booking_metrics_service.rollup
+    )
+    start_periodic(
+        "trip-scheduler",
+        settings.TRIP_SCHEDULER_INTERVAL,
+        trip_scheduler_service.tick
+    )
+    start_periodic(
+        "cascade-resume",
+        settings.CASCADE_RESUME_INTERVAL,
+        cascade_service.resume,
+        initial_delay=settings.CASCADE_RESUME_INTERVAL
+    )
+
+
+async def stop_background_tasks():
+    """Hủy tất cả background task khi tắt ứng dụng"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
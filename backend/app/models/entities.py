@@ -251,6 +251,21 @@ class RouteSearchRequest(BaseModel):
     diemDen: str
     ngayDi: str  # format: "YYYY-MM-DD"
     limit: Optional[int] = Field(default=50, ge=1, le=200)  # Giới hạn số kết quả trả về
+    
+    # Bộ lọc (tùy chọn)
+    giaMin: Optional[float] = Field(default=None, ge=0)
+    giaMax: Optional[float] = Field(default=None, ge=0)
+    gioDiTu: Optional[str] = None  # "HH:MM"
+    gioDiDen: Optional[str] = None  # "HH:MM"
+    loaiXe: Optional[List[str]] = None  # Danh sách loại xe chấp nhận
+    soGheToiThieu: Optional[int] = Field(default=None, ge=1)
+    
+    # Sắp xếp: "gioKhoiHanh" | "giaVe" | "soGheTrong"
+    sortBy: Optional[str] = None
+    sortOrder: str = "asc"  # "asc" | "desc"
+    
+    # Session của client, dùng cho thống kê nhu cầu (mặc định dùng IP)
+    sessionId: Optional[str] = None
 
 
 class RouteSearchResponse(BaseModel):
@@ -266,8 +281,9 @@ class RouteSearchResponse(BaseModel):
     thoiGianDenDuKien: str = ""
     thoiGianChay: str = ""  # Có thể là string hoặc số phút
     loaiXe: str = ""
-    soGheTrong: int = 0
-    soGheDaDat: int = 0
+    soGheTrong: int = 0     # Trừ cả ghế đã đặt và ghế đang giữ
+    soGheDaDat: int = 0     # Ghế đã đặt (vé đã thanh toán / xác nhận)
+    soGheDangGiu: int = 0   # Ghế đang được giữ chờ thanh toán
     ngayKhoiHanh: str = ""  # Thêm ngày khởi hành
     gioKhoiHanh: str = ""   # Thêm giờ khởi hành
     
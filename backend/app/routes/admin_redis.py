@@ -1,13 +1,20 @@
 """
 Admin Routes - Quản lý khách hàng, nhân viên, xe sử dụng Redis
 """
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from datetime import datetime, timedelta
-from typing import Optional, List
-from pydantic import BaseModel, EmailStr
+from typing import Optional, List, Literal
+from pydantic import BaseModel, EmailStr, Field
 
 from app.services.redis_service import redis_service
+from app.services.departure_board_service import departure_board_service
+from app.services.aggregate_service import aggregate_service
+from app.services.trip_scheduler_service import trip_scheduler_service
+from app.services.cascade_service import cascade_service
+from app.services.fleet_service import fleet_service, parse_import
+from app.services.recurring_schedule_service import recurring_schedule_service, build_schedule, recurring_dates
 from app.core.middleware import get_current_employee, get_current_admin
+from app.utils import local_now
 
 router = APIRouter(prefix="/api/v1/admin", tags=["Admin"])
 
@@ -50,23 +57,39 @@ class EmployeeUpdate(BaseModel):
     maCV: Optional[str] = None
 
 
+def set_page_headers(response: Response, page: dict):
+    """Thông tin phân trang cho các endpoint trả về danh sách (giữ nguyên body dạng list)"""
+    response.headers["X-Total-Count"] = str(page["total"])
+    if page["nextCursor"]:
+        response.headers["X-Next-Cursor"] = page["nextCursor"]
+
+
 # ========== CUSTOMERS ENDPOINTS ==========
 
 @router.get("/customers")
-async def get_all_customers(current_user: dict = Depends(get_current_employee)):
+async def get_all_customers(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Số khách hàng mỗi trang (mặc định: tất cả)"),
+    cursor: Optional[str] = Query(None, description="Giá trị X-Next-Cursor của trang trước"),
+    current_user: dict = Depends(get_current_employee)
+):
     """
-    Lấy danh sách tất cả khách hàng
+    Lấy danh sách khách hàng (mới tạo trước)
+    Tổng số trả về ở header X-Total-Count, cursor trang sau ở X-Next-Cursor
     """
     try:
-        customers = await redis_service.get_all("khachHang")
+        page = await redis_service.page("khachHang", "created", cursor=cursor, limit=limit)
+        set_page_headers(response, page)
         
         # Remove passwords from response
         result = []
-        for c in customers:
+        for c in page["items"]:
             customer_data = {k: v for k, v in c.items() if k != "password"}
             result.append(customer_data)
         
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách khách hàng: {str(e)}")
 
@@ -159,6 +182,8 @@ async def create_customer(data: CustomerCreate, current_user: dict = Depends(get
         return {k: v for k, v in customer_data.items() if k != "password"}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi tạo khách hàng: {str(e)}")
 
@@ -188,23 +213,26 @@ async def update_customer(maKH: str, data: CustomerUpdate, current_user: dict =
         return {k: v for k, v in updated.items() if k != "password"}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật: {str(e)}")
 
 
-@router.delete("/customers/{maKH}")
+@router.delete("/customers/{maKH}", status_code=202)
 async def delete_customer(maKH: str, current_user: dict = Depends(get_current_admin)):
     """
     Xóa khách hàng (chỉ admin)
+    Yêu cầu hủy được lưu trữ, vé và hóa đơn được gỡ maKH ở background (theo dõi qua job)
     """
     try:
         customer = await redis_service.get_khach_hang(maKH)
         if not customer:
             raise HTTPException(status_code=404, detail="Không tìm thấy khách hàng")
         
-        await redis_service.delete("khachHang", maKH)
+        job = await cascade_service.delete("khachHang", maKH)
         
-        return {"message": "Đã xóa khách hàng thành công"}
+        return {"message": "Đã xóa khách hàng thành công", "job": job}
     except HTTPException:
         raise
     except Exception as e:
@@ -214,26 +242,36 @@ async def delete_customer(maKH: str, current_user: dict = Depends(get_current_ad
 # ========== EMPLOYEES ENDPOINTS ==========
 
 @router.get("/employees")
-async def get_all_employees(current_user: dict = Depends(get_current_employee)):
+async def get_all_employees(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Số nhân viên mỗi trang (mặc định: tất cả)"),
+    cursor: Optional[str] = Query(None, description="Giá trị X-Next-Cursor của trang trước"),
+    current_user: dict = Depends(get_current_employee)
+):
     """
-    Lấy danh sách tất cả nhân viên
+    Lấy danh sách nhân viên (mới tạo trước)
+    Tổng số trả về ở header X-Total-Count, cursor trang sau ở X-Next-Cursor
     """
     try:
-        employees = await redis_service.get_all("nhanVien")
+        page = await redis_service.page("nhanVien", "created", cursor=cursor, limit=limit)
+        set_page_headers(response, page)
+        employees = page["items"]
+        
+        # Get role info (một lần đọc cho cả trang)
+        ma_cv_list = list({e.get("maCV") for e in employees if e.get("maCV")})
+        chuc_vu_map = dict(zip(ma_cv_list, await redis_service.get_multiple("chucVu", ma_cv_list)))
         
         # Add role info and remove passwords
         result = []
         for e in employees:
             emp_data = {k: v for k, v in e.items() if k != "password"}
-            
-            # Get role info
             if e.get("maCV"):
-                chuc_vu = await redis_service.get_chuc_vu(e.get("maCV"))
-                emp_data["chucVuInfo"] = chuc_vu
-            
+                emp_data["chucVuInfo"] = chuc_vu_map.get(e.get("maCV"))
             result.append(emp_data)
         
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách nhân viên: {str(e)}")
 
@@ -300,6 +338,8 @@ async def create_employee(data: EmployeeCreate, current_user: dict = Depends(get
         return {k: v for k, v in employee_data.items() if k != "password"}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi tạo nhân viên: {str(e)}")
 
@@ -329,23 +369,26 @@ async def update_employee(maNV: str, data: EmployeeUpdate, current_user: dict =
         return {k: v for k, v in updated.items() if k != "password"}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật: {str(e)}")
 
 
-@router.delete("/employees/{maNV}")
+@router.delete("/employees/{maNV}", status_code=202)
 async def delete_employee(maNV: str, current_user: dict = Depends(get_current_admin)):
     """
     Xóa nhân viên (chỉ admin)
+    Xe và lịch chạy đang gán tài xế này được gỡ maNV ở background (theo dõi qua job)
     """
     try:
         employee = await redis_service.get_nhan_vien(maNV)
         if not employee:
             raise HTTPException(status_code=404, detail="Không tìm thấy nhân viên")
         
-        await redis_service.delete("nhanVien", maNV)
+        job = await cascade_service.delete("nhanVien", maNV)
         
-        return {"message": "Đã xóa nhân viên thành công"}
+        return {"message": "Đã xóa nhân viên thành công", "job": job}
     except HTTPException:
         raise
     except Exception as e:
@@ -441,14 +484,12 @@ async def create_bus(data: BusCreate, current_user: dict = Depends(get_current_a
     Tạo xe mới (chỉ admin)
     """
     try:
-        # Check biển số exists
-        existing_buses = await redis_service.get_all_xe()
-        for bus in existing_buses:
-            if bus.get("bienSoXe") == data.bienSoXe:
-                raise HTTPException(status_code=400, detail="Biển số xe đã tồn tại")
+        # Check biển số exists (set index biển số)
+        if await fleet_service.plate_exists(data.bienSoXe):
+            raise HTTPException(status_code=400, detail="Biển số xe đã tồn tại")
         
         # Generate new ID
-        maXe = await redis_service.generate_id("xe", "XE")
+        maXe = (await fleet_service.next_ids(1))[0]
         
         # Create bus
         bus_data = {
@@ -460,36 +501,45 @@ async def create_bus(data: BusCreate, current_user: dict = Depends(get_current_a
             "ngayTao": datetime.now().isoformat()
         }
         
-        await redis_service.create("xe", "maXe", bus_data)
-        
-        # Create seats for this bus
-        seat_prefixes = ["A", "B", "C", "D"]
-        seats_per_row = (data.soChoNgoi + len(seat_prefixes) - 1) // len(seat_prefixes)
-        
-        seat_count = 0
-        for prefix in seat_prefixes:
-            for num in range(1, seats_per_row + 1):
-                if seat_count >= data.soChoNgoi:
-                    break
-                seat_name = f"{prefix}{str(num).zfill(2)}"
-                maGhe = f"{maXe}_{seat_name}"
-                
-                seat_data = {
-                    "maGhe": maGhe,
-                    "maXe": maXe,
-                    "tenGhe": seat_name
-                }
-                await redis_service.create("gheNgoi", "maGhe", seat_data)
-                seat_count += 1
+        # Xe và toàn bộ ghế ghi trong một pipeline
+        seat_count = await fleet_service.create_bus(bus_data)
         
         bus_data["soGheDaTao"] = seat_count
         return bus_data
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi tạo xe: {str(e)}")
 
 
+@router.post("/buses/import")
+async def import_buses(
+    request: Request,
+    dryRun: bool = Query(False, description="Chỉ kiểm tra, không tạo xe"),
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    Import đội xe hàng loạt (chỉ admin)
+    
+    Body là nội dung file CSV (Content-Type: text/csv, dòng tiêu đề
+    bienSoXe,soChoNgoi,loaiXe,trangThai) hoặc JSON (mảng các xe).
+    Mỗi xe được tạo kèm ghế; trả về báo cáo kiểm tra từng dòng.
+    """
+    try:
+        rows = parse_import(await request.body(), request.headers.get("content-type"))
+        if not rows:
+            raise HTTPException(status_code=400, detail="File import không có dữ liệu")
+        return await fleet_service.import_buses(rows, dry_run=dryRun)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi import xe: {str(e)}")
+
+
 @router.put("/buses/{maXe}")
 async def update_bus(maXe: str, data: BusUpdate, current_user: dict = Depends(get_current_admin)):
     """
@@ -505,99 +555,115 @@ async def update_bus(maXe: str, data: BusUpdate, current_user: dict = Depends(ge
         
         # Check biển số if changed
         if "bienSoXe" in update_data and update_data["bienSoXe"] != bus.get("bienSoXe"):
-            existing_buses = await redis_service.get_all_xe()
-            for b in existing_buses:
-                if b.get("bienSoXe") == update_data["bienSoXe"]:
-                    raise HTTPException(status_code=400, detail="Biển số xe đã tồn tại")
+            if await fleet_service.plate_exists(update_data["bienSoXe"]):
+                raise HTTPException(status_code=400, detail="Biển số xe đã tồn tại")
         
         updated = await redis_service.update("xe", "maXe", maXe, update_data)
+        # Bảng giờ xuất bến chép sẵn biển số / loại xe của các chuyến sắp chạy
+        await departure_board_service.sync_related("maXe", maXe)
         return updated
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật: {str(e)}")
 
 
-@router.delete("/buses/{maXe}")
+@router.delete("/buses/{maXe}", status_code=202)
 async def delete_bus(maXe: str, current_user: dict = Depends(get_current_admin)):
     """
-    Xóa xe (chỉ admin) - Cũng xóa tất cả ghế của xe đó
+    Xóa xe (chỉ admin)
+    Ghế của xe bị xóa, lịch chạy đã kết thúc được lưu trữ, lịch chạy chưa chạy
+    được gỡ maXe để gán xe khác; phần này chạy ở background (theo dõi qua job)
     """
     try:
         bus = await redis_service.get_xe(maXe)
         if not bus:
             raise HTTPException(status_code=404, detail="Không tìm thấy xe")
         
-        # Delete all seats of this bus
-        seats = await redis_service.get_ghe_by_xe(maXe)
-        for seat in seats:
-            await redis_service.delete("gheNgoi", seat.get("maGhe"))
+        job = await cascade_service.delete("xe", maXe)
         
-        # Delete bus
-        await redis_service.delete("xe", maXe)
-        
-        return {"message": f"Đã xóa xe và {len(seats)} ghế thành công"}
+        return {"message": "Đã xóa xe, đang xóa ghế và cập nhật lịch chạy liên quan", "job": job}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xóa: {str(e)}")
 
 
+@router.get("/jobs/cascade/{jobId}")
+async def get_cascade_job(jobId: str, current_user: dict = Depends(get_current_admin)):
+    """
+    Tiến độ xóa liên kết (document phụ thuộc) sau khi xóa xe / khách hàng / nhân viên
+    """
+    try:
+        job = await cascade_service.get(jobId)
+        if not job:
+            raise HTTPException(status_code=404, detail="Không tìm thấy job hoặc job đã hết hạn")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
+
+
 # ========== BOOKINGS ENDPOINTS ==========
 
 @router.get("/bookings/all")
 async def get_all_bookings(
     limit: int = Query(50, ge=1, le=200),
     status: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="nextCursor của trang trước"),
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Lấy danh sách tất cả vé
+    Lấy danh sách vé (mới đặt trước), phân trang theo cursor
     """
     try:
-        all_tickets = await redis_service.get_all("veXe")
-        
-        # Filter by status if provided
-        if status:
-            all_tickets = [t for t in all_tickets if t.get("trangThai") == status]
-        
-        # Sort by date (newest first)
-        all_tickets = sorted(all_tickets, key=lambda x: x.get("ngayDat", ""), reverse=True)[:limit]
+        page = await redis_service.page("veXe", "created", status=status, cursor=cursor, limit=limit)
+        tickets = page["items"]
+        
+        # Đọc theo lô thông tin khách hàng, lịch chạy, chuyến xe và hóa đơn của cả trang
+        def unique(values):
+            return list({v for v in values if v})
+        
+        ma_kh_list = unique(t.get("maKH") for t in tickets)
+        ma_lc_list = unique(t.get("maLC") for t in tickets)
+        ma_hd_list = unique(t.get("maHD") for t in tickets)
+        customers = dict(zip(ma_kh_list, await redis_service.get_multiple("khachHang", ma_kh_list)))
+        schedules = dict(zip(ma_lc_list, await redis_service.get_multiple("lichChay", ma_lc_list)))
+        invoices = dict(zip(ma_hd_list, await redis_service.get_multiple("hoaDon", ma_hd_list)))
+        ma_cx_list = unique((lc or {}).get("maCX") for lc in schedules.values())
+        routes = dict(zip(ma_cx_list, await redis_service.get_multiple("chuyenXe", ma_cx_list)))
         
         # Add customer and route info
         bookings = []
-        for ticket in all_tickets:
-            # Get customer info
-            customer = None
-            if ticket.get("maKH"):
-                customer = await redis_service.get_khach_hang(ticket.get("maKH"))
+        for ticket in tickets:
+            customer = customers.get(ticket.get("maKH"))
             
             # Get route info and price from chuyenXe
             route_info = None
             gia_ve = ticket.get("giaVe", 0)
             
-            if ticket.get("maLC"):
-                lich_chay = await redis_service.get_lich_chay(ticket.get("maLC"))
-                if lich_chay and lich_chay.get("maCX"):
-                    chuyen_xe = await redis_service.get_chuyen_xe(lich_chay.get("maCX"))
-                    if chuyen_xe:
-                        route_info = {
-                            "diemDi": chuyen_xe.get("diemDi"),
-                            "diemDen": chuyen_xe.get("diemDen")
-                        }
-                        # Fallback: lấy giá từ chuyenXe nếu vé không có giaVe
-                        if not gia_ve:
-                            gia_ve = chuyen_xe.get("giaChuyenXe", 0)
+            lich_chay = schedules.get(ticket.get("maLC"))
+            chuyen_xe = routes.get(lich_chay.get("maCX")) if lich_chay else None
+            if chuyen_xe:
+                route_info = {
+                    "diemDi": chuyen_xe.get("diemDi"),
+                    "diemDen": chuyen_xe.get("diemDen")
+                }
+                # Fallback: lấy giá từ chuyenXe nếu vé không có giaVe
+                if not gia_ve:
+                    gia_ve = chuyen_xe.get("giaChuyenXe", 0)
             
             # Lấy tổng tiền từ hóa đơn nếu có
             tong_tien = gia_ve
-            if ticket.get("maHD"):
-                hoa_don = await redis_service.get_hoa_don(ticket.get("maHD"))
-                if hoa_don:
-                    # Tổng tiền hóa đơn chia cho số vé trong hóa đơn
-                    so_ve = len(hoa_don.get("danhSachVe", [1]))
-                    if so_ve > 0:
-                        tong_tien = hoa_don.get("tongTien", 0) / so_ve
+            hoa_don = invoices.get(ticket.get("maHD"))
+            if hoa_don:
+                # Tổng tiền hóa đơn chia cho số vé trong hóa đơn
+                so_ve = len(hoa_don.get("danhSachVe", [1]))
+                if so_ve > 0:
+                    tong_tien = hoa_don.get("tongTien", 0) / so_ve
             
             bookings.append({
                 **ticket,
@@ -610,7 +676,9 @@ async def get_all_bookings(
                 "soGheNgoi": [ticket.get("maGhe")] if ticket.get("maGhe") else []
             })
         
-        return {"bookings": bookings, "total": len(bookings)}
+        return {"bookings": bookings, "total": page["total"], "nextCursor": page["nextCursor"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -627,8 +695,7 @@ async def get_bookings_stats(current_user: dict = Depends(get_current_employee))
         total_revenue = sum(float(hd.get("tongTien", 0) or 0) for hd in all_invoices)
         
         # Đếm yêu cầu hủy pending
-        all_cancel_requests = await redis_service.get_all("yeuCauHuy")
-        cancel_pending_count = len([r for r in all_cancel_requests if r.get("trangThai") == "pending"])
+        cancel_pending_count = await redis_service.count_yeu_cau_huy("pending")
         
         stats = {
             "total_bookings": len(all_tickets),
@@ -653,65 +720,65 @@ class CancelRequestAction(BaseModel):
 async def get_all_cancel_requests(
     limit: int = Query(50, ge=1, le=200),
     status: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="nextCursor của trang trước"),
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Lấy danh sách tất cả yêu cầu hủy vé
+    Lấy danh sách yêu cầu hủy vé (mới tạo trước), phân trang theo cursor
     """
     try:
-        all_requests = await redis_service.get_all("yeuCauHuy")
+        page = await redis_service.page("yeuCauHuy", "created", status=status, cursor=cursor, limit=limit)
+        requests = page["items"]
         
-        # Filter by status if provided
-        if status:
-            all_requests = [r for r in all_requests if r.get("trangThai") == status]
-        
-        # Sort by date (newest first)
-        all_requests = sorted(
-            all_requests, 
-            key=lambda x: x.get("ngayTao", ""), 
-            reverse=True
-        )[:limit]
+        # Đọc theo lô vé, lịch chạy và chuyến xe của cả trang
+        ma_ve_list = list({r.get("maDatVe") for r in requests if r.get("maDatVe")})
+        tickets = dict(zip(ma_ve_list, await redis_service.get_multiple("veXe", ma_ve_list)))
+        ma_lc_list = list({ve.get("maLC") for ve in tickets.values() if ve and ve.get("maLC")})
+        schedules = dict(zip(ma_lc_list, await redis_service.get_multiple("lichChay", ma_lc_list)))
+        ma_cx_list = list({lc.get("maCX") for lc in schedules.values() if lc and lc.get("maCX")})
+        routes = dict(zip(ma_cx_list, await redis_service.get_multiple("chuyenXe", ma_cx_list)))
         
         # Enrich with route info
         result = []
-        for req in all_requests:
+        for req in requests:
             # Get route info from ticket
             route_info = None
-            if req.get("maDatVe"):
-                ve = await redis_service.get_ve_xe(req.get("maDatVe"))
-                if ve and ve.get("maLC"):
-                    lich_chay = await redis_service.get_lich_chay(ve.get("maLC"))
-                    if lich_chay and lich_chay.get("maCX"):
-                        chuyen_xe = await redis_service.get_chuyen_xe(lich_chay.get("maCX"))
-                        if chuyen_xe:
-                            route_info = {
-                                "diemDi": chuyen_xe.get("diemDi"),
-                                "diemDen": chuyen_xe.get("diemDen")
-                            }
-                        # Get date/time from lichChay
-                        if not req.get("ngayDi"):
-                            req["ngayDi"] = lich_chay.get("ngayKhoiHanh", lich_chay.get("ngayChay", ""))
-                        if not req.get("gioDi"):
-                            req["gioDi"] = lich_chay.get("gioKhoiHanh", lich_chay.get("thoiGianXuatBen", ""))
-                    # Get seat info
-                    if not req.get("soGheNgoi"):
-                        req["soGheNgoi"] = [ve.get("maGhe")] if ve.get("maGhe") else []
-                    # Get price from ticket
-                    if not req.get("tongTien"):
-                        req["tongTien"] = ve.get("giaVe", 0)
+            ve = tickets.get(req.get("maDatVe"))
+            if ve:
+                lich_chay = schedules.get(ve.get("maLC"))
+                if lich_chay and lich_chay.get("maCX"):
+                    chuyen_xe = routes.get(lich_chay.get("maCX"))
+                    if chuyen_xe:
+                        route_info = {
+                            "diemDi": chuyen_xe.get("diemDi"),
+                            "diemDen": chuyen_xe.get("diemDen")
+                        }
+                    # Get date/time from lichChay
+                    if not req.get("ngayDi"):
+                        req["ngayDi"] = lich_chay.get("ngayKhoiHanh", lich_chay.get("ngayChay", ""))
+                    if not req.get("gioDi"):
+                        req["gioDi"] = lich_chay.get("gioKhoiHanh", lich_chay.get("thoiGianXuatBen", ""))
+                # Get seat info
+                if not req.get("soGheNgoi"):
+                    req["soGheNgoi"] = [ve.get("maGhe")] if ve.get("maGhe") else []
+                # Get price from ticket
+                if not req.get("tongTien"):
+                    req["tongTien"] = ve.get("giaVe", 0)
             
             req["routeInfo"] = route_info
             result.append(req)
         
-        # Count pending requests
-        all_reqs = await redis_service.get_all("yeuCauHuy")
-        pending_count = len([r for r in all_reqs if r.get("trangThai") == "pending"])
+        # Count pending requests (ZCARD của index trạng thái)
+        pending_count = await redis_service.count_yeu_cau_huy("pending")
         
         return {
             "requests": result,
-            "total": len(result),
+            "total": page["total"],
+            "nextCursor": page["nextCursor"],
             "pending_count": pending_count
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -722,8 +789,8 @@ async def get_cancel_requests_pending_count(current_user: dict = Depends(get_cur
     Đếm số yêu cầu hủy đang chờ xử lý
     """
     try:
-        all_requests = await redis_service.get_all("yeuCauHuy")
-        pending_count = len([r for r in all_requests if r.get("trangThai") == "pending"])
+        # ZCARD của index trạng thái (badge admin poll liên tục, không duyệt collection)
+        pending_count = await redis_service.count_yeu_cau_huy("pending")
         
         return {"count": pending_count}
     except Exception as e:
@@ -739,12 +806,8 @@ async def get_cancel_request_detail(
     Lấy chi tiết một yêu cầu hủy vé
     """
     try:
-        # Find the request
-        all_requests = await redis_service.get_all("yeuCauHuy")
-        request_data = next(
-            (r for r in all_requests if r.get("maYeuCauHuy") == maYeuCauHuy), 
-            None
-        )
+        # Document lưu tại yeuCauHuy:{maYeuCauHuy}
+        request_data = await redis_service.get_yeu_cau_huy(maYeuCauHuy)
         
         if not request_data:
             raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu hủy")
@@ -803,12 +866,8 @@ async def process_cancel_request(
     action: "approve" | "reject"
     """
     try:
-        # Find the request
-        all_requests = await redis_service.get_all("yeuCauHuy")
-        request_data = next(
-            (r for r in all_requests if r.get("maYeuCauHuy") == maYeuCauHuy), 
-            None
-        )
+        # Document lưu tại yeuCauHuy:{maYeuCauHuy}
+        request_data = await redis_service.get_yeu_cau_huy(maYeuCauHuy)
         
         if not request_data:
             raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu hủy")
@@ -819,7 +878,8 @@ async def process_cancel_request(
                 detail=f"Yêu cầu hủy đã được xử lý với trạng thái: {request_data.get('trangThai')}"
             )
         
-        now = datetime.now().isoformat()
+        # Giờ Việt Nam: ngày hoàn tiền được cộng vào bucket ngày / tháng như thanh toán
+        now = local_now().isoformat()
         nguoi_xu_ly = current_user.get("hoTen", current_user.get("maNV", "Admin"))
         
         if action_data.action == "approve":
@@ -844,7 +904,20 @@ async def process_cancel_request(
                 
                 # Release seat in lichChay
                 ve = await redis_service.get_ve_xe(ma_dat_ve)
+                if ve:
+                    # Cộng tiền hoàn vào các bucket thống kê
+                    hoa_don = await redis_service.get_hoa_don(ve.get("maHD", "")) if ve.get("maHD") else None
+                    lich_chay_ve = await redis_service.get_lich_chay(ve.get("maLC", "")) if ve.get("maLC") else None
+                    await aggregate_service.record_refund(
+                        ma_dat_ve,
+                        request_data.get("tienHoanDuKien", 0),
+                        now,
+                        ve.get("maCX") or (lich_chay_ve or {}).get("maCX"),
+                        (hoa_don or {}).get("phuongThucThanhToan"),
+                        ve.get("maKH")
+                    )
                 if ve and ve.get("maLC") and ve.get("maGhe"):
+                    await redis_service.remove_booked_seats(ve.get("maLC"), [ve.get("maGhe")])
                     lich_chay = await redis_service.get_lich_chay(ve.get("maLC"))
                     if lich_chay:
                         ghe_da_dat = lich_chay.get("gheDaDat", [])
@@ -912,6 +985,19 @@ class ScheduleCreate(BaseModel):
     thoiGianChay: str = "5 giờ"
 
 
+class RecurringScheduleCreate(BaseModel):
+    """Tạo hàng loạt lịch chạy lặp lại, xoay vòng xe và tài xế"""
+    maCX: str
+    ngayBatDau: str  # "2025-12-01"
+    soTuan: int = Field(1, ge=1, le=26)
+    gioKhoiHanh: List[str] = Field(..., min_items=1)  # ["06:00", "14:00"]
+    thuTrongTuan: Optional[List[int]] = None  # 0 = Thứ 2 ... 6 = Chủ nhật, mặc định mọi ngày
+    danhSachXe: List[str] = Field(..., min_items=1)
+    danhSachTaiXe: List[str] = Field(..., min_items=1)
+    thoiGianChay: str = "5 giờ"
+    chiKiemTra: bool = False  # Chỉ trả về báo cáo xung đột, không tạo
+
+
 class ScheduleUpdate(BaseModel):
     ngayKhoiHanh: Optional[str] = None
     gioKhoiHanh: Optional[str] = None
@@ -920,40 +1006,43 @@ class ScheduleUpdate(BaseModel):
 
 
 @router.get("/trips")
-async def get_all_schedules(current_user: dict = Depends(get_current_employee)):
+async def get_all_schedules(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Số lịch chạy mỗi trang (mặc định: tất cả)"),
+    cursor: Optional[str] = Query(None, description="Giá trị X-Next-Cursor của trang trước"),
+    status: Optional[str] = Query(None, description="Lọc theo trạng thái"),
+    order: Literal["asc", "desc"] = Query("desc", description="Theo giờ khởi hành: desc (mới nhất trước) hoặc asc"),
+    current_user: dict = Depends(get_current_employee)
+):
     """
-    Lấy danh sách tất cả lịch chạy (chuyến xe cụ thể)
-    Tự động đánh dấu hoàn thành nếu quá giờ khởi hành
+    Lấy danh sách lịch chạy (chuyến xe cụ thể) theo giờ khởi hành
+    Chỉ đọc: trạng thái running / completed do trip scheduler cập nhật theo giờ
+    Tổng số trả về ở header X-Total-Count, cursor trang sau ở X-Next-Cursor
     """
     try:
-        all_schedules = await redis_service.get_all_lich_chay()
-        now = datetime.now()
+        page = await redis_service.page(
+            "lichChay", "departure", status=status, cursor=cursor, limit=limit,
+            descending=order == "desc"
+        )
+        set_page_headers(response, page)
+        schedules = page["items"]
+        
+        # Đọc theo lô chuyến xe, xe, tài xế và số ghế đã đặt của cả trang
+        ma_cx_list = list({lc.get("maCX") for lc in schedules if lc.get("maCX")})
+        ma_xe_list = list({lc.get("maXe") for lc in schedules if lc.get("maXe")})
+        routes = dict(zip(ma_cx_list, await redis_service.get_multiple("chuyenXe", ma_cx_list)))
+        buses = dict(zip(ma_xe_list, await redis_service.get_multiple("xe", ma_xe_list)))
+        ma_nv_list = list({
+            lc.get("maNV") or (buses.get(lc.get("maXe")) or {}).get("maNV")
+            for lc in schedules
+        } - {None, ""})
+        drivers = dict(zip(ma_nv_list, await redis_service.get_multiple("nhanVien", ma_nv_list)))
+        availability = await redis_service.get_availability([lc.get("maLC") for lc in schedules])
         
         result = []
-        for schedule in all_schedules:
-            # Parse ngày và giờ khởi hành
-            ngay_kh = schedule.get("ngayKhoiHanh", schedule.get("ngayChay", ""))
-            gio_kh = schedule.get("gioKhoiHanh", schedule.get("thoiGianXuatBen", "06:00"))
-            
-            departure_time = None
-            if ngay_kh:
-                try:
-                    # Combine date and time
-                    date_str = ngay_kh.split("T")[0] if "T" in ngay_kh else ngay_kh
-                    time_str = gio_kh.replace(":", "")[:4]
-                    hour = int(time_str[:2]) if len(time_str) >= 2 else 6
-                    minute = int(time_str[2:4]) if len(time_str) >= 4 else 0
-                    departure_time = datetime.strptime(date_str, "%Y-%m-%d").replace(hour=hour, minute=minute)
-                    
-                    # Tự động đánh dấu completed nếu quá giờ
-                    if departure_time < now and schedule.get("trangThai") not in ["completed", "cancelled"]:
-                        schedule["trangThai"] = "completed"
-                        await redis_service.update("lichChay", "maLC", schedule.get("maLC"), {"trangThai": "completed"})
-                except Exception as e:
-                    print(f"Error parsing date: {e}")
-            
+        for schedule in schedules:
             # Lấy thông tin chuyến xe (tuyến đường)
-            chuyen_xe = await redis_service.get_chuyen_xe(schedule.get("maCX"))
+            chuyen_xe = routes.get(schedule.get("maCX"))
             if chuyen_xe:
                 schedule["chuyenXeInfo"] = chuyen_xe
                 schedule["diemDi"] = chuyen_xe.get("diemDi", "")
@@ -962,28 +1051,24 @@ async def get_all_schedules(current_user: dict = Depends(get_current_employee)):
                 schedule["quangDuong"] = chuyen_xe.get("quangDuong", chuyen_xe.get("khoangCach", 0))
             
             # Lấy thông tin xe
-            xe = await redis_service.get_xe(schedule.get("maXe"))
+            xe = buses.get(schedule.get("maXe"))
             if xe:
                 schedule["xeInfo"] = xe
                 # Tài xế có thể được gán trong xe hoặc trong schedule
-                ma_nv = schedule.get("maNV") or xe.get("maNV")
-                if ma_nv:
-                    nv = await redis_service.get_nhan_vien(ma_nv)
-                    if nv:
-                        schedule["taiXeInfo"] = {"maNV": nv.get("maNV"), "hoTen": nv.get("hoTen"), "SDT": nv.get("SDT")}
+                nv = drivers.get(schedule.get("maNV") or xe.get("maNV"))
+                if nv:
+                    schedule["taiXeInfo"] = {"maNV": nv.get("maNV"), "hoTen": nv.get("hoTen"), "SDT": nv.get("SDT")}
             
-            # Đếm số vé đã bán
-            ve_list = await redis_service.get_ve_by_lich_chay(schedule.get("maLC"))
-            paid_tickets = [v for v in ve_list if v.get("trangThai") in ["paid", "confirmed"]]
-            schedule["soVeDaBan"] = len(paid_tickets)
-            schedule["soGheTrong"] = schedule.get("soGheTrong", 34) - len(paid_tickets)
+            # Số ghế đã bán (index booked:{maLC})
+            sold = availability.get(schedule.get("maLC"), {}).get("booked", 0)
+            schedule["soVeDaBan"] = sold
+            schedule["soGheTrong"] = schedule.get("soGheTrong", 34) - sold
             
             result.append(schedule)
         
-        # Sort by ngayKhoiHanh (newest first)
-        result = sorted(result, key=lambda x: (x.get("ngayKhoiHanh", x.get("ngayChay", "")), x.get("gioKhoiHanh", "")), reverse=True)
-        
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1012,38 +1097,15 @@ async def get_available_buses(
     Xe đang hoạt động và không bận trong ngày đó
     """
     try:
-        all_buses = await redis_service.get_all_xe()
-        all_schedules = await redis_service.get_all_lich_chay()
-        
         # Parse target date
         try:
             target_date_str = ngayKhoiHanh.split("T")[0] if "T" in ngayKhoiHanh else ngayKhoiHanh
-            target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+            datetime.strptime(target_date_str, "%Y-%m-%d")
         except:
             raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ (cần YYYY-MM-DD)")
         
-        # Tìm xe đang bận trong ngày đó
-        busy_buses = set()
-        for schedule in all_schedules:
-            if schedule.get("trangThai") not in ["completed", "cancelled"]:
-                schedule_date_str = schedule.get("ngayKhoiHanh", schedule.get("ngayChay", ""))
-                if schedule_date_str:
-                    try:
-                        schedule_date_str = schedule_date_str.split("T")[0] if "T" in schedule_date_str else schedule_date_str
-                        schedule_date = datetime.strptime(schedule_date_str, "%Y-%m-%d").date()
-                        if schedule_date == target_date:
-                            busy_buses.add(schedule.get("maXe"))
-                    except:
-                        pass
-        
-        # Lọc xe available (active và không bận)
-        available = []
-        for bus in all_buses:
-            trang_thai = bus.get("trangThai", "active")
-            if trang_thai == "active" and bus.get("maXe") not in busy_buses:
-                available.append(bus)
-        
-        return available
+        # Xe active trừ xe bận trong ngày, tính trên index (không duyệt toàn bộ lịch chạy)
+        return await redis_service.get_available_buses(target_date_str)
     except HTTPException:
         raise
     except Exception as e:
@@ -1059,67 +1121,31 @@ async def get_available_drivers(
     Lấy danh sách tài xế có thể lái (chức vụ CV03 = Tài xế) và không bận trong ngày
     """
     try:
-        all_employees = await redis_service.get_all("nhanVien")
-        all_schedules = await redis_service.get_all_lich_chay()
-        all_buses = await redis_service.get_all_xe()
-        
         # Parse target date
         try:
             target_date_str = ngayKhoiHanh.split("T")[0] if "T" in ngayKhoiHanh else ngayKhoiHanh
-            target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+            datetime.strptime(target_date_str, "%Y-%m-%d")
         except:
             raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ")
         
-        # Tìm tài xế đang bận trong ngày đó (từ schedules và buses)
-        busy_drivers = set()
-        for schedule in all_schedules:
-            if schedule.get("trangThai") not in ["completed", "cancelled"]:
-                schedule_date_str = schedule.get("ngayKhoiHanh", schedule.get("ngayChay", ""))
-                if schedule_date_str:
-                    try:
-                        schedule_date_str = schedule_date_str.split("T")[0] if "T" in schedule_date_str else schedule_date_str
-                        schedule_date = datetime.strptime(schedule_date_str, "%Y-%m-%d").date()
-                        if schedule_date == target_date:
-                            # Tài xế có thể trong schedule hoặc trong xe
-                            if schedule.get("maNV"):
-                                busy_drivers.add(schedule.get("maNV"))
-                            # Check xe của schedule
-                            ma_xe = schedule.get("maXe")
-                            for bus in all_buses:
-                                if bus.get("maXe") == ma_xe and bus.get("maNV"):
-                                    busy_drivers.add(bus.get("maNV"))
-                    except:
-                        pass
-        
-        # Lọc tài xế available (chức vụ tài xế CV03 và không bận)
-        available = []
-        for emp in all_employees:
-            maCV = emp.get("maCV", emp.get("maChucVu", ""))
-            
-            # Kiểm tra chức vụ tài xế
-            is_driver = False
-            if maCV:
-                # CV03 là tài xế theo backup data
-                if maCV.upper() == "CV03":
-                    is_driver = True
-                else:
-                    # Fallback: check tên chức vụ
-                    chuc_vu = await redis_service.get_chuc_vu(maCV)
-                    if chuc_vu:
-                        ten_cv = chuc_vu.get("tenChucVu", "").lower()
-                        if "tài xế" in ten_cv or "driver" in ten_cv or "lái xe" in ten_cv:
-                            is_driver = True
-            
-            if is_driver and emp.get("maNV") not in busy_drivers:
-                emp_info = {
-                    "maNV": emp.get("maNV"),
-                    "hoTen": emp.get("hoTen"),
-                    "SDT": emp.get("SDT"),
-                    "trangThai": "available"
-                }
-                available.append(emp_info)
-        
-        return available
+        # Chức vụ tài xế: CV03 theo backup data, hoặc tên chức vụ là tài xế
+        driver_roles = {"CV03"}
+        for chuc_vu in await redis_service.get_all_chuc_vu():
+            ten_cv = chuc_vu.get("tenChucVu", "").lower()
+            if "tài xế" in ten_cv or "driver" in ten_cv or "lái xe" in ten_cv:
+                driver_roles.add(chuc_vu.get("maCV"))
+        
+        # Tài xế bận = lái lịch chạy trong ngày hoặc là tài xế của xe có lịch chạy trong ngày
+        drivers = await redis_service.get_available_drivers(target_date_str, sorted(driver_roles - {None, ""}))
+        return [
+            {
+                "maNV": emp.get("maNV"),
+                "hoTen": emp.get("hoTen"),
+                "SDT": emp.get("SDT"),
+                "trangThai": "available"
+            }
+            for emp in drivers
+        ]
     except HTTPException:
         raise
     except Exception as e:
@@ -1194,26 +1220,15 @@ async def create_schedule(data: ScheduleCreate, current_user: dict = Depends(get
         # Parse ngày
         try:
             target_date_str = data.ngayKhoiHanh.split("T")[0] if "T" in data.ngayKhoiHanh else data.ngayKhoiHanh
-            target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+            datetime.strptime(target_date_str, "%Y-%m-%d")
         except:
             raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ (cần YYYY-MM-DD)")
         
-        # Kiểm tra xe và tài xế không bận
-        all_schedules = await redis_service.get_all_lich_chay()
-        for schedule in all_schedules:
-            if schedule.get("trangThai") not in ["completed", "cancelled"]:
-                schedule_date_str = schedule.get("ngayKhoiHanh", schedule.get("ngayChay", ""))
-                if schedule_date_str:
-                    try:
-                        schedule_date_str = schedule_date_str.split("T")[0] if "T" in schedule_date_str else schedule_date_str
-                        schedule_date = datetime.strptime(schedule_date_str, "%Y-%m-%d").date()
-                        if schedule_date == target_date:
-                            if schedule.get("maXe") == data.maXe:
-                                raise HTTPException(status_code=400, detail="Xe đã có lịch chạy trong ngày này")
-                            if schedule.get("maNV") == data.maNV:
-                                raise HTTPException(status_code=400, detail="Tài xế đã có lịch chạy trong ngày này")
-                    except ValueError:
-                        pass
+        # Kiểm tra xe và tài xế không bận (index busy theo ngày)
+        if await redis_service.is_busy("xe", target_date_str, data.maXe):
+            raise HTTPException(status_code=400, detail="Xe đã có lịch chạy trong ngày này")
+        if await redis_service.is_busy("nv", target_date_str, data.maNV):
+            raise HTTPException(status_code=400, detail="Tài xế đã có lịch chạy trong ngày này")
         
         # Generate mã lịch chạy
         maLC = f"LC_{data.maCX}_{target_date_str}_{data.gioKhoiHanh.replace(':', '')}"
@@ -1224,40 +1239,14 @@ async def create_schedule(data: ScheduleCreate, current_user: dict = Depends(get
             # Generate unique maLC
             maLC = await redis_service.generate_id("lichChay", "LC")
         
-        # Tính thời gian đến dự kiến
-        try:
-            hours = int(data.thoiGianChay.split()[0])
-        except:
-            hours = int(chuyen_xe.get("thoiGianDuKien", "5").split()[0]) if chuyen_xe.get("thoiGianDuKien") else 5
-        
-        gio_parts = data.gioKhoiHanh.split(":")
-        hour_start = int(gio_parts[0])
-        minute_start = int(gio_parts[1]) if len(gio_parts) > 1 else 0
-        
-        arrival_hour = (hour_start + hours) % 24
-        arrival_time = f"{arrival_hour:02d}:{minute_start:02d}"
-        
-        # Lấy số ghế từ xe
-        so_ghe = int(xe.get("soChoNgoi", xe.get("soGhe", 34)))
-        
-        # Tạo lịch chạy
-        schedule_data = {
-            "maLC": maLC,
-            "maCX": data.maCX,
-            "maXe": data.maXe,
-            "maNV": data.maNV,
-            "ngayKhoiHanh": target_date_str,
-            "gioKhoiHanh": data.gioKhoiHanh,
-            "thoiGianXuatBen": data.gioKhoiHanh,
-            "thoiGianChay": data.thoiGianChay,
-            "thoiGianDenDuKien": arrival_time,
-            "trangThai": "scheduled",
-            "soGheTrong": so_ghe,
-            "gheDaDat": [],
-            "ngayTao": datetime.now().isoformat()
-        }
+        # Tạo lịch chạy (giờ đến dự kiến, số ghế lấy từ xe)
+        schedule_data = build_schedule(
+            maLC, chuyen_xe, xe, data.maNV, target_date_str, data.gioKhoiHanh, data.thoiGianChay
+        )
         
         await redis_service.create("lichChay", "maLC", schedule_data)
+        await departure_board_service.sync_schedule(maLC)
+        await trip_scheduler_service.schedule(schedule_data)
         
         # Thêm thông tin xe và tài xế vào response
         schedule_data["xeInfo"] = xe
@@ -1275,6 +1264,55 @@ async def create_schedule(data: ScheduleCreate, current_user: dict = Depends(get
         raise HTTPException(status_code=500, detail=f"Lỗi tạo lịch chạy: {str(e)}")
 
 
+@router.post("/trips/recurring")
+async def create_recurring_schedules(data: RecurringScheduleCreate, current_user: dict = Depends(get_current_employee)):
+    """
+    Tạo lịch chạy lặp lại cho một tuyến (vd: 06:00 và 14:00 mỗi ngày trong 8 tuần)
+    
+    Xe / tài xế được xoay vòng theo danhSachXe / danhSachTaiXe, mỗi người / xe tối đa
+    một lịch chạy mỗi ngày. Slot không xếp được (hoặc đã tồn tại) được bỏ qua và
+    báo lại theo từng ngày.
+    """
+    try:
+        chuyen_xe = await redis_service.get_chuyen_xe(data.maCX)
+        if not chuyen_xe:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tuyến đường")
+        
+        try:
+            dates = recurring_dates(data.ngayBatDau.split("T")[0], data.soTuan, data.thuTrongTuan)
+            for gio in data.gioKhoiHanh:
+                datetime.strptime(gio, "%H:%M")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Định dạng ngày (YYYY-MM-DD) hoặc giờ (HH:MM) không hợp lệ")
+        if data.thuTrongTuan and any(thu not in range(7) for thu in data.thuTrongTuan):
+            raise HTTPException(status_code=400, detail="thuTrongTuan chỉ nhận giá trị 0 (Thứ 2) đến 6 (Chủ nhật)")
+        
+        # Validate xe tồn tại và đang hoạt động, tài xế tồn tại
+        ma_xe_list = list(dict.fromkeys(data.danhSachXe))
+        ma_nv_list = list(dict.fromkeys(data.danhSachTaiXe))
+        buses = await redis_service.get_multiple("xe", ma_xe_list)
+        for maXe, xe in zip(ma_xe_list, buses):
+            if not xe:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy xe {maXe}")
+            if xe.get("trangThai") not in ["active", None, ""]:
+                raise HTTPException(status_code=400, detail=f"Xe {maXe} không trong trạng thái hoạt động")
+        drivers = await redis_service.get_multiple("nhanVien", ma_nv_list)
+        for maNV, nv in zip(ma_nv_list, drivers):
+            if not nv:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy tài xế {maNV}")
+        
+        return await recurring_schedule_service.generate(
+            chuyen_xe, buses, ma_nv_list, dates, list(dict.fromkeys(data.gioKhoiHanh)),
+            data.thoiGianChay, dry_run=data.chiKiemTra
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tạo lịch chạy: {str(e)}")
+
+
 @router.put("/trips/{maLC}")
 async def update_schedule(maLC: str, data: ScheduleUpdate, current_user: dict = Depends(get_current_employee)):
     """
@@ -1287,6 +1325,11 @@ async def update_schedule(maLC: str, data: ScheduleUpdate, current_user: dict =
         
         update_data = data.dict(exclude_unset=True)
         updated = await redis_service.update("lichChay", "maLC", maLC, update_data)
+        await departure_board_service.sync_schedule(maLC)
+        if updated:
+            await trip_scheduler_service.schedule(updated)
+        if updated and updated.get("trangThai") == "completed":
+            await aggregate_service.record_trip(updated)
         
         return updated
     except HTTPException:
@@ -1317,6 +1360,8 @@ async def cancel_schedule(maLC: str, current_user: dict = Depends(get_current_em
         
         # Xóa lịch chạy
         await redis_service.delete("lichChay", maLC)
+        await departure_board_service.remove_schedule(maLC)
+        await trip_scheduler_service.unschedule(maLC)
         
         return {"message": "Đã hủy lịch chạy thành công"}
     except HTTPException:
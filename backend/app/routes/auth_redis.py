@@ -28,7 +28,7 @@ from app.services.otp_service import (
 )
 from app.core import hash_password, verify_password, create_access_token
 from app.core.middleware import get_current_customer
-from app.services.redis_service import redis_service
+from app.services.redis_service import redis_service, UniqueConstraintError
 from app.utils import format_datetime_hcm
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -163,7 +163,7 @@ async def complete_registration(request: CompleteRegistrationRequest):
         )
     
     # Check if CCCD already exists
-    existing_cccd = await redis_service.find_one("khachHang", {"CCCD": request.CCCD})
+    existing_cccd = await redis_service.find_unique("khachHang", "CCCD", request.CCCD)
     if existing_cccd:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -187,8 +187,14 @@ async def complete_registration(request: CompleteRegistrationRequest):
         "lanCuoiDangNhap": None
     }
     
-    # Save to Redis
-    await redis_service.create_khach_hang(customer_data)
+    # Save to Redis (email / CCCD / SDT được giành nguyên tử, đăng ký đồng thời chỉ một bên thắng)
+    try:
+        await redis_service.create_khach_hang(customer_data)
+    except UniqueConstraintError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     # Clean up registration data
     await delete_registration_step(request.email)
@@ -18,7 +18,7 @@ from typing import List, Optional
 from pydantic import BaseModel, Field
 import json
 import time
-from app.utils import get_current_time_hcm, get_current_timestamp_hcm, format_datetime_hcm
+from app.utils import get_current_time_hcm, get_current_timestamp_hcm, format_datetime_hcm, doc_epoch
 import random
 
 from app.models.entities import (
@@ -31,6 +31,10 @@ from app.core.database import redis_client
 from app.core.middleware import get_current_customer
 from app.services.vietqr_service import vietqr_service
 from app.services.redis_service import redis_service
+from app.services.aggregate_service import aggregate_service
+from app.services.analytics_snapshot_service import analytics_snapshot_service
+from app.services.booking_metrics_service import booking_metrics_service
+from app.services.sketch_service import sketch_service
 
 router = APIRouter(prefix="/api/v1/bookings", tags=["Bookings"])
 
@@ -190,6 +194,7 @@ async def create_pending_booking(
         HOLD_DURATION,
         json.dumps({"maLC": maLC, "ngayDi": ngayDi, "sessionId": sessionId})
     )
+    booking_metrics_service.record_nowait(booking_metrics_service.record_hold(maHD, expire_at))
     
     return {
         "success": True,
@@ -258,39 +263,30 @@ async def check_available_seats(request: AvailableSeatsRequest):
     Kiểm tra ghế khả dụng cho một lịch chạy
     Kết hợp ghế đã thanh toán (Redis veXe) và ghế đang pending
     """
-    # Lấy thông tin lịch chạy để biết xe nào
-    lich_chay = await redis_service.get_lich_chay(request.maLC)
-    if not lich_chay:
+    # Tình trạng ghế (đã đặt + đang giữ) lấy trong một lần pipeline
+    availability = await redis_service.get_availability(
+        [request.maLC],
+        ngayDi=request.ngayDi,
+        sessionId=request.sessionId,
+        include_seats=True
+    )
+    info = availability.get(request.maLC)
+    if not info:
         raise HTTPException(status_code=404, detail="Không tìm thấy lịch chạy")
     
-    maXe = lich_chay.get("maXe", "")
+    lich_chay = await redis_service.get_lich_chay(request.maLC)
     
     # Lấy danh sách ghế của xe
-    ghe_list = await redis_service.get_ghe_by_xe(maXe)
+    ghe_list = await redis_service.get_ghe_by_xe(lich_chay.get("maXe", ""))
     all_seats = [g.get("maGhe") for g in ghe_list]
-    total_seats = len(all_seats)
-    
-    if total_seats == 0:
-        xe = await redis_service.get_xe(maXe)
-        total_seats = xe.get("soChoNgoi", 40) if xe else 40
-    
-    # Lấy ghế đã thanh toán (từ veXe)
-    booked_seats = await redis_service.get_booked_seats_by_lich_chay(request.maLC)
+    total_seats = len(all_seats) or info["totalSeats"]
     
-    # Lấy ghế đang pending
-    pending = await get_pending_bookings(request.maLC, request.ngayDi)
-    pending_seats = []
-    my_pending = []
-    
-    for session, booking in pending.items():
-        seats = booking.get("danhSachGhe", [])
-        if session == request.sessionId:
-            my_pending.extend(seats)
-        else:
-            pending_seats.extend(seats)
+    booked_seats = info["bookedSeats"]
+    pending_seats = info["heldSeats"]
+    my_pending = info["myHeldSeats"]
     
     # Ghế còn trống
-    occupied = set(booked_seats + pending_seats)
+    occupied = set(booked_seats) | set(pending_seats)
     available = [s for s in all_seats if s not in occupied]
     
     return AvailableSeatsResponse(
@@ -350,6 +346,9 @@ async def create_booking(request: BookingCreateRequest, current_user: dict = Dep
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("message"))
     
+    # Ghế đang giữ thay đổi -> tăng version để ETag của trang chọn ghế hết hiệu lực
+    await redis_service.bump_seat_version(request.maLC, lich_chay.get("maCX"))
+    
     # Tạo QR code thanh toán
     qr_code = await vietqr_service.create_payment_qr(
         ma_dat_ve=maHD,
@@ -411,6 +410,22 @@ async def confirm_payment(request: PaymentConfirmRequest, current_user: dict = D
     
     now = get_current_time_hcm()
     
+    # Lấy lịch chạy + chuyến xe để tính giá vé và lưu kèm tuyến vào hóa đơn / vé
+    lich_chay = await redis_service.get_lich_chay(booking_info["maLC"])
+    chuyen_xe = None
+    gia_ve = 0
+    if lich_chay:
+        chuyen_xe = await redis_service.get_chuyen_xe(lich_chay.get("maCX", ""))
+        if chuyen_xe:
+            gia_ve = chuyen_xe.get("giaChuyenXe", 0)
+    
+    # Thông tin tuyến (denormalize để thống kê không phải tra vé -> lịch chạy -> chuyến xe)
+    route_info = {
+        "maCX": lich_chay.get("maCX") if lich_chay else None,
+        "diemDi": chuyen_xe.get("diemDi", "") if chuyen_xe else "",
+        "diemDen": chuyen_xe.get("diemDen", "") if chuyen_xe else ""
+    }
+    
     # Tạo hóa đơn
     hoa_don = {
         "maHD": booking_info["maHD"],
@@ -419,19 +434,13 @@ async def confirm_payment(request: PaymentConfirmRequest, current_user: dict = D
         "ngayLap": now.isoformat(),
         "tongTien": booking_info["tongTien"],
         "phuongThucThanhToan": "Online",
-        "danhSachVe": booking_info["danhSachVe"]
+        "danhSachVe": booking_info["danhSachVe"],
+        "maLC": booking_info["maLC"],
+        **route_info
     }
     await redis_service.create_hoa_don(hoa_don)
     
     # Tạo các vé
-    # Lấy giá vé từ chuyến xe
-    lich_chay = await redis_service.get_lich_chay(booking_info["maLC"])
-    gia_ve = 0
-    if lich_chay:
-        chuyen_xe = await redis_service.get_chuyen_xe(lich_chay.get("maCX", ""))
-        if chuyen_xe:
-            gia_ve = chuyen_xe.get("giaChuyenXe", 0)
-    
     for i, maVe in enumerate(booking_info["danhSachVe"]):
         ve_xe = {
             "maVe": maVe,
@@ -441,16 +450,37 @@ async def confirm_payment(request: PaymentConfirmRequest, current_user: dict = D
             "maHD": booking_info["maHD"],
             "giaVe": gia_ve,
             "ngayDat": now.isoformat(),
-            "trangThai": "paid"
+            "trangThai": "paid",
+            **route_info
         }
         await redis_service.create_ve_xe(ve_xe)
     
+    # Ghi ghế vào index booked:{maLC} trước khi nhả giữ chỗ
+    await redis_service.add_booked_seats(booking_info["maLC"], booking_info["danhSachGhe"])
+    
     # Xóa pending booking
     await confirm_booking(
         booking_info["maLC"],
         booking_info["ngayDi"],
         booking_info["sessionId"]
     )
+    await redis_service.bump_seat_version(
+        booking_info["maLC"],
+        lich_chay.get("maCX") if lich_chay else None
+    )
+    
+    # Cộng doanh thu vào các bucket thống kê và bảng xếp hạng
+    await aggregate_service.record_payment(hoa_don)
+    await analytics_snapshot_service.enqueue_invoice(hoa_don["maHD"])
+    booking_metrics_service.record_nowait(booking_metrics_service.record_booking(hoa_don))
+    so_ve = len(booking_info["danhSachVe"])
+    sketch_service.record_payment_nowait(
+        hoa_don,
+        [gia_ve or booking_info["tongTien"] / max(so_ve, 1)] * so_ve,
+        int(now.timestamp()),
+        departure_ts=doc_epoch("lichChay", lich_chay, "ngayKhoiHanhTs") if lich_chay else None,
+        hold_started_ts=booking_info["expire_at"] - HOLD_DURATION if booking_info.get("expire_at") else None
+    )
     
     return BookingCreateResponse(
         maHD=booking_info["maHD"],
@@ -491,6 +521,12 @@ async def cancel_payment(request: PaymentCancelRequest, current_user: dict = Dep
             booking_info["ngayDi"],
             session_id
         )
+        booking_metrics_service.record_nowait(booking_metrics_service.release_hold(request.maHD))
+        lich_chay = await redis_service.get_lich_chay(booking_info["maLC"])
+        await redis_service.bump_seat_version(
+            booking_info["maLC"],
+            lich_chay.get("maCX") if lich_chay else None
+        )
     
     return {"success": True, "message": "Đã hủy booking và giải phóng ghế"}
 
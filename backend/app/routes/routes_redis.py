@@ -7,8 +7,12 @@ Sử dụng Redis để lưu trữ:
 - xe:{maXe} - Thông tin xe
 - gheNgoi:{maGhe} - Ghế ngồi
 - veXe:{maVe} - Vé xe (để kiểm tra ghế đã đặt)
+
+Các endpoint đọc công khai hỗ trợ ETag / If-None-Match dựa trên version counters
+(ver:*) do RedisService tăng khi ghi, nên request lặp lại chỉ tốn một lệnh MGET.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from datetime import datetime
 from typing import List, Optional
 from app.models.entities import (
@@ -21,11 +25,37 @@ from app.models.entities import (
     GheNgoiWithStatus
 )
 from app.services.redis_service import redis_service
+from app.services.search_snapshot_service import search_snapshot_service
+from app.services.departure_board_service import departure_board_service
+from app.services.trip_scheduler_service import trip_scheduler_service
+from app.services.demand_service import demand_service
+from app.core.etag import build_etag, is_not_modified, not_modified_response, set_etag_headers
 from app.utils import get_current_time_hcm
-import json
+import time
 
 router = APIRouter(prefix="/routes", tags=["Routes"])
 
+# Ghế đang giữ hết hạn theo TTL (không có thao tác ghi), nên ETag của các response
+# có trạng thái giữ ghế được gắn thêm mốc thời gian để tự hết hạn sau tối đa 60 giây
+SEAT_HOLD_ETAG_WINDOW = 60
+
+# Giới hạn số lịch chạy trong một request /routes/availability
+MAX_AVAILABILITY_SCHEDULES = 100
+
+
+async def _conditional_etag(request: Request, version_keys: List[str], *extra, cache_control: str = "no-cache"):
+    """
+    Đọc version counters (một lệnh MGET) và so sánh với If-None-Match
+    
+    Returns:
+        (etag, response 304 nếu client đã có bản mới nhất, ngược lại None)
+    """
+    versions = await redis_service.get_versions(version_keys)
+    etag = build_etag(versions, *extra)
+    if is_not_modified(request, etag):
+        return etag, not_modified_response(etag, cache_control)
+    return etag, None
+
 
 @router.post("/build-indexes")
 async def build_indexes():
@@ -34,17 +64,24 @@ async def build_indexes():
     """
     try:
         await redis_service.build_indexes()
-        return {"message": "Indexes built successfully"}
+        departures = await departure_board_service.rebuild()
+        scheduled_trips = await trip_scheduler_service.rebuild()
+        return {"message": "Indexes built successfully", "departures": departures, "scheduledTrips": scheduled_trips}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xây dựng index: {str(e)}")
 
 
 @router.get("/cities")
-async def get_cities():
+async def get_cities(request: Request, response: Response):
     """
     Lấy danh sách các thành phố có tuyến xe (điểm đi và điểm đến)
     """
     try:
+        etag, not_modified = await _conditional_etag(request, [redis_service.version_key("chuyenXe")])
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag)
+        
         # Lấy tất cả chuyến xe
         routes = await redis_service.get_all_chuyen_xe()
         
@@ -63,11 +100,19 @@ async def get_cities():
 
 
 @router.get("/all")
-async def get_all_routes():
+async def get_all_routes(request: Request, response: Response):
     """
     Lấy toàn bộ chuyến xe để hiển thị lịch trình
     """
     try:
+        etag, not_modified = await _conditional_etag(request, [
+            redis_service.version_key("chuyenXe"),
+            redis_service.version_key("xe")
+        ])
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag)
+        
         routes = await redis_service.get_all_chuyen_xe()
         
         result = []
@@ -86,11 +131,20 @@ async def get_all_routes():
 
 
 @router.get("/schedules")
-async def get_all_schedules():
+async def get_all_schedules(request: Request, response: Response):
     """
     Lấy toàn bộ lịch chạy
     """
     try:
+        etag, not_modified = await _conditional_etag(request, [
+            redis_service.version_key("lichChay"),
+            redis_service.version_key("chuyenXe"),
+            redis_service.version_key("xe")
+        ])
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag)
+        
         schedules = await redis_service.get_all_lich_chay()
         
         result = []
@@ -131,14 +185,15 @@ async def get_schedule_by_id(maLC: str):
 
 
 @router.post("/search", response_model=List[RouteSearchResponse])
-async def search_routes(search: RouteSearchRequest):
+async def search_routes(search: RouteSearchRequest, request: Request):
     """
     Tìm kiếm tuyến xe theo điểm đi, điểm đến và ngày đi.
     
     Workflow:
-    1. Tìm chuyến xe theo điểm đi/đến
-    2. Lấy lịch chạy của các chuyến xe đó
-    3. Kiểm tra ghế còn trống cho ngày được chọn
+    1. Lấy snapshot dạng cột của (điểm đi, điểm đến, ngày đi), build lại nếu dữ liệu đã đổi
+    2. Lọc theo giá, giờ đi, loại xe, số ghế trống tối thiểu và sắp xếp trên các cột
+    3. Chỉ đọc số ghế đã đặt cho các dòng cần thiết, trả về tối đa `limit` kết quả
+    4. Ghi thống kê nhu cầu ở background (không chờ)
     """
     try:
         # Parse ngày đi
@@ -152,151 +207,151 @@ async def search_routes(search: RouteSearchRequest):
         if ngay_di.date() < today:
             raise HTTPException(status_code=400, detail="Ngày đi không được trong quá khứ")
         
-        # Check cache first
-        cache_key = f"search:{search.diemDi}:{search.diemDen}:{search.ngayDi}:{search.limit}"
-        redis_client = await redis_service._get_client()
-        try:
-            cached_result = await redis_client.get(cache_key)
-            if cached_result:
-                # Redis returns bytes, decode and parse
-                cached_dicts = json.loads(cached_result.decode('utf-8'))
-                return [RouteSearchResponse(**item) for item in cached_dicts]
-        except Exception:
-            # If cache fails, continue without it
-            pass
-        
-        # Tìm chuyến xe theo điểm đi/đến
-        chuyen_xe_list = await redis_service.search_chuyen_xe(search.diemDi, search.diemDen)
-        
-        if not chuyen_xe_list:
-            return []
-        
-        # Collect all maXe for batch fetch
-        ma_xe_list = [chuyen_xe.get("maXe") for chuyen_xe in chuyen_xe_list if chuyen_xe.get("maXe")]
-        xe_dict = {}
-        if ma_xe_list:
-            try:
-                xe_list = await redis_service.get_multiple("xe", ma_xe_list)
-                xe_dict = {ma_xe: xe for ma_xe, xe in zip(ma_xe_list, xe_list) if xe}
-            except Exception:
-                # If batch fetch fails, fetch individually
-                xe_dict = {}
-                for ma_xe in ma_xe_list:
-                    try:
-                        xe = await redis_service.get_xe(ma_xe)
-                        if xe:
-                            xe_dict[ma_xe] = xe
-                    except Exception:
-                        continue
-        
-        # Cache ghe_list per xe
-        ghe_cache = {}
-        
-        result = []
-        
-        for chuyen_xe in chuyen_xe_list:
-            maCX = chuyen_xe.get("maCX")
-            maXe = chuyen_xe.get("maXe")
-            
-            # Lấy thông tin xe từ dict
-            xe = xe_dict.get(maXe)
-            if not xe:
-                continue
-            
-            # Lấy danh sách lịch chạy của chuyến xe này
-            lich_chay_list = await redis_service.get_lich_chay_by_chuyen(maCX)
-            
-            # Nếu không có lịch chạy, tạo một lịch chạy mặc định từ chuyến xe
-            if not lich_chay_list:
-                # Tạo lịch chạy ảo cho ngày được search
-                lich_chay_list = [{
-                    "maLC": f"LC_{maCX}_{search.ngayDi}_0600",
-                    "maCX": maCX,
-                    "maXe": maXe,
-                    "ngayKhoiHanh": search.ngayDi,
-                    "gioKhoiHanh": "06:00",
-                    "thoiGianXuatBen": "06:00",
-                    "thoiGianDenDuKien": "",
-                    "thoiGianChay": chuyen_xe.get("thoiGianDuKien", ""),
-                }]
-            
-            for lich_chay in lich_chay_list:
-                maLC = lich_chay.get("maLC") or lich_chay.get("maLich", "")
-                ngayKhoiHanh = lich_chay.get("ngayKhoiHanh", "")
-                
-                # Filter theo ngày đi nếu có
-                if ngayKhoiHanh and ngayKhoiHanh != search.ngayDi:
-                    continue
-                
-                # Lấy tất cả ghế của xe (từ cache)
-                if maXe not in ghe_cache:
-                    ghe_cache[maXe] = await redis_service.get_ghe_by_xe(maXe)
-                ghe_list = ghe_cache[maXe]
-                total_seats = len(ghe_list) if ghe_list else xe.get("soGhe", 34)
-                
-                # Lấy ghế đã đặt cho lịch chạy + ngày này
-                booked_seats = await redis_service.get_booked_seats_by_lich_chay(maLC)
-                
-                # Tính số ghế còn trống
-                so_ghe_trong = total_seats - len(booked_seats)
-                
-                # Convert thoiGianChay sang string nếu là số
-                thoi_gian_chay = lich_chay.get("thoiGianChay", chuyen_xe.get("thoiGianDuKien", ""))
-                if isinstance(thoi_gian_chay, (int, float)):
-                    # Chuyển từ phút sang định dạng "X giờ Y phút"
-                    hours = int(thoi_gian_chay) // 60
-                    mins = int(thoi_gian_chay) % 60
-                    thoi_gian_chay = f"{hours} giờ" if mins == 0 else f"{hours} giờ {mins} phút"
-                
-                gia_ve = float(chuyen_xe.get("giaChuyenXe", chuyen_xe.get("giaVe", 0)))
-                
-                result.append(RouteSearchResponse(
-                    maCX=maCX,
-                    maLC=maLC,
-                    maXe=maXe,
-                    diemDi=chuyen_xe.get("diemDi", ""),
-                    diemDen=chuyen_xe.get("diemDen", ""),
-                    quangDuong=float(chuyen_xe.get("quangDuong", chuyen_xe.get("khoangCach", 0))),
-                    giaChuyenXe=gia_ve,
-                    thoiGianXuatBen=str(lich_chay.get("thoiGianXuatBen", lich_chay.get("gioKhoiHanh", ""))),
-                    thoiGianDenDuKien=str(lich_chay.get("thoiGianDenDuKien", "")),
-                    thoiGianChay=str(thoi_gian_chay),
-                    loaiXe=xe.get("loaiXe", ""),
-                    soGheTrong=so_ghe_trong,
-                    soGheDaDat=len(booked_seats),
-                    ngayKhoiHanh=ngayKhoiHanh,
-                    gioKhoiHanh=lich_chay.get("gioKhoiHanh", ""),
-                    # Alias fields cho frontend
-                    maTuyenXe=maCX,
-                    giaVe=gia_ve,
-                    thoiGianQuangDuong=str(thoi_gian_chay)
-                ))
-                
-                # Check limit
-                if len(result) >= search.limit:
-                    break
-            
-            if len(result) >= search.limit:
-                break
+        snapshot = await search_snapshot_service.get_snapshot(search.diemDi, search.diemDen, search.ngayDi)
         
-        # Cache result for 5 minutes
-        if result:
+        try:
+            rows = await search_snapshot_service.query(
+                snapshot,
+                limit=search.limit,
+                gia_min=search.giaMin,
+                gia_max=search.giaMax,
+                gio_di_tu=search.gioDiTu,
+                gio_di_den=search.gioDiDen,
+                loai_xe=search.loaiXe,
+                so_ghe_toi_thieu=search.soGheToiThieu,
+                sort_by=search.sortBy,
+                sort_order=search.sortOrder
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        demand_service.record_search_nowait(
+            search.diemDi,
+            search.diemDen,
+            search.ngayDi,
+            search.sessionId or (request.client.host if request.client else None),
+            matched=any(row["soGheTrong"] > 0 for row in rows)
+        )
+        
+        return [RouteSearchResponse(**row) for row in rows]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tìm kiếm: {str(e)}")
+
+
+@router.get("/departures")
+async def get_departures(
+    request: Request,
+    response: Response,
+    city: str,
+    hours: int = Query(6, ge=1, le=48),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """
+    Bảng giờ xuất bến: các chuyến khởi hành từ `city` trong `hours` giờ tới
+    
+    Args:
+        city: Thành phố đi (diemDi)
+        hours: Cửa sổ thời gian (giờ)
+        limit: Số dòng tối đa
+    """
+    try:
+        # Bảng cuộn theo thời gian nên ETag gắn thêm mốc phút
+        etag, not_modified = await _conditional_etag(
+            request,
+            [departure_board_service.version_key(city)],
+            city, hours, limit, int(time.time() // SEAT_HOLD_ETAG_WINDOW)
+        )
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag)
+        
+        return await departure_board_service.get_board(city, hours, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy bảng giờ xuất bến: {str(e)}")
+
+
+@router.get("/departures/stream")
+async def stream_departures(
+    city: str,
+    hours: int = Query(6, ge=1, le=48),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """
+    Server-Sent Events cho màn hình tại bến: snapshot khi kết nối,
+    sau đó là các sự kiện upsert / remove khi lịch chạy thay đổi
+    """
+    return StreamingResponse(
+        departure_board_service.stream(city, hours, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/availability")
+async def get_availability(
+    request: Request,
+    response: Response,
+    maLC: str,
+    date: Optional[str] = None,
+    sessionId: Optional[str] = None,
+    seats: bool = False
+):
+    """
+    Tình trạng ghế của nhiều lịch chạy trong một request (dùng cho trang kết quả tìm kiếm)
+    
+    Args:
+        maLC: Danh sách mã lịch chạy, phân tách bằng dấu phẩy (vd: LC001,LC002)
+        date: Ngày đi (YYYY-MM-DD); mặc định là ngày khởi hành của từng lịch chạy
+        sessionId: Session ID của user để tách ghế user đang giữ
+        seats: Trả kèm danh sách mã ghế đã đặt / đang giữ
+    """
+    try:
+        ma_lc_list = list(dict.fromkeys(m.strip() for m in maLC.split(",") if m.strip()))
+        if not ma_lc_list:
+            raise HTTPException(status_code=400, detail="Thiếu mã lịch chạy")
+        if len(ma_lc_list) > MAX_AVAILABILITY_SCHEDULES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Tối đa {MAX_AVAILABILITY_SCHEDULES} lịch chạy mỗi request"
+            )
+        if date:
             try:
-                result_dicts = [r.dict() for r in result]
-                await redis_client.setex(cache_key, 300, json.dumps(result_dicts))
-            except Exception:
-                # If caching fails, just continue
-                pass
+                datetime.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Ngày không hợp lệ. Định dạng: YYYY-MM-DD")
         
-        return result
+        cache_control = "private, no-cache" if sessionId else "no-cache"
+        etag, not_modified = await _conditional_etag(
+            request,
+            [redis_service.version_key("schedule", m) for m in ma_lc_list] + [redis_service.version_key("xe")],
+            date, sessionId, seats, int(time.time() // SEAT_HOLD_ETAG_WINDOW),
+            cache_control=cache_control
+        )
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag, cache_control)
+        
+        availability = await redis_service.get_availability(
+            ma_lc_list,
+            ngayDi=date,
+            sessionId=sessionId,
+            include_seats=seats
+        )
+        
+        # Giữ đúng thứ tự request; lịch chạy không tồn tại bị bỏ qua
+        return [availability[m] for m in ma_lc_list if m in availability]
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi tìm kiếm: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy tình trạng ghế: {str(e)}")
 
 
 @router.get("/schedule/{maLC}")
-async def get_schedule_detail(maLC: str, date: Optional[str] = None):
+async def get_schedule_detail(request: Request, response: Response, maLC: str, date: Optional[str] = None):
     """
     Lấy chi tiết lịch chạy và danh sách ghế
     
@@ -305,6 +360,16 @@ async def get_schedule_detail(maLC: str, date: Optional[str] = None):
         date: Ngày đi (YYYY-MM-DD) để kiểm tra ghế đã đặt
     """
     try:
+        etag, not_modified = await _conditional_etag(request, [
+            redis_service.version_key("schedule", maLC),
+            redis_service.version_key("chuyenXe"),
+            redis_service.version_key("xe"),
+            redis_service.version_key("gheNgoi")
+        ], date)
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag)
+        
         # Lấy thông tin lịch chạy
         lich_chay = await redis_service.get_lich_chay(maLC)
         if not lich_chay:
@@ -321,14 +386,16 @@ async def get_schedule_detail(maLC: str, date: Optional[str] = None):
         ghe_list = await redis_service.get_ghe_by_xe(maXe)
         
         # Nếu có ngày, kiểm tra ghế đã đặt
-        booked_seats = []
+        booked_seats = set()
         if date:
             try:
                 datetime.strptime(date, "%Y-%m-%d")
             except ValueError:
                 raise HTTPException(status_code=400, detail="Ngày không hợp lệ. Định dạng: YYYY-MM-DD")
             
-            booked_seats = await redis_service.get_booked_seats_by_lich_chay(maLC)
+            availability = await redis_service.get_availability([maLC], ngayDi=date, include_seats=True)
+            if maLC in availability:
+                booked_seats = set(availability[maLC]["bookedSeats"])
         
         # Tạo danh sách ghế với trạng thái
         seats_with_status = []
@@ -355,7 +422,13 @@ async def get_schedule_detail(maLC: str, date: Optional[str] = None):
 
 
 @router.get("/{maCX}")
-async def get_route_detail(maCX: str, date: Optional[str] = None, sessionId: Optional[str] = None):
+async def get_route_detail(
+    request: Request,
+    response: Response,
+    maCX: str,
+    date: Optional[str] = None,
+    sessionId: Optional[str] = None
+):
     """
     Lấy chi tiết chuyến xe và danh sách ghế
     
@@ -365,6 +438,17 @@ async def get_route_detail(maCX: str, date: Optional[str] = None, sessionId: Opt
         sessionId: Session ID của user để xác định ghế user đang giữ
     """
     try:
+        hold_window = int(time.time() // SEAT_HOLD_ETAG_WINDOW) if date else None
+        cache_control = "private, no-cache" if sessionId else "no-cache"
+        etag, not_modified = await _conditional_etag(request, [
+            redis_service.version_key("route", maCX),
+            redis_service.version_key("xe"),
+            redis_service.version_key("gheNgoi")
+        ], date, sessionId, hold_window, cache_control=cache_control)
+        if not_modified:
+            return not_modified
+        set_etag_headers(response, etag, cache_control)
+        
         chuyen_xe = await redis_service.get_chuyen_xe(maCX)
         
         if not chuyen_xe:
@@ -385,27 +469,25 @@ async def get_route_detail(maCX: str, date: Optional[str] = None, sessionId: Opt
         # Lấy danh sách ghế của xe
         ghe_list = await redis_service.get_ghe_by_xe(maXe)
         
-        # Lấy ghế đã đặt và ghế đang pending nếu có date và lịch chạy
+        # Lấy ghế đã đặt và ghế đang pending của tất cả lịch chạy trong một lần pipeline
         booked_seats = []
         held_seats = []  # Ghế đang được người khác giữ
         my_held_seats = []  # Ghế tôi đang giữ
         
         if date and lich_chay_list:
-            for lc in lich_chay_list:
-                maLC = lc.get("maLC") or lc.get("maLich", "")
-                if maLC:
-                    # Lấy ghế đã thanh toán
-                    seats = await redis_service.get_booked_seats_by_lich_chay(maLC)
-                    booked_seats.extend(seats)
-                    
-                    # Lấy ghế đang pending (giữ chỗ)
-                    pending_info = await redis_service.get_pending_seats_by_lich_chay(maLC, date)
-                    if pending_info:
-                        for session, seats_list in pending_info.items():
-                            if sessionId and session == sessionId:
-                                my_held_seats.extend(seats_list)
-                            else:
-                                held_seats.extend(seats_list)
+            availability = await redis_service.get_availability(
+                [lc.get("maLC") or lc.get("maLich", "") for lc in lich_chay_list],
+                ngayDi=date,
+                sessionId=sessionId,
+                include_seats=True
+            )
+            for info in availability.values():
+                booked_seats.extend(info["bookedSeats"])
+                held_seats.extend(info["heldSeats"])
+                my_held_seats.extend(info["myHeldSeats"])
+        
+        booked_set = set(booked_seats)
+        held_set = set(held_seats)
         
         # Thêm trạng thái cho từng ghế
         ghe_with_status = []
@@ -413,18 +495,16 @@ async def get_route_detail(maCX: str, date: Optional[str] = None, sessionId: Opt
             maGhe = ghe.get("maGhe", "")
             
             # Xác định trạng thái ghế
-            if maGhe in booked_seats:
+            if maGhe in booked_set:
                 trang_thai = False  # Đã đặt
-            elif maGhe in held_seats:
+            elif maGhe in held_set:
                 trang_thai = False  # Đang được người khác giữ (không khả dụng)
-            elif maGhe in my_held_seats:
-                trang_thai = True  # Tôi đang giữ (vẫn có thể chọn)
             else:
-                trang_thai = True  # Còn trống
+                trang_thai = True  # Còn trống hoặc tôi đang giữ (vẫn có thể chọn)
             
             ghe_with_status.append({
                 **ghe,
-                "dadat": maGhe in booked_seats,
+                "dadat": maGhe in booked_set,
                 "trangThai": trang_thai
             })
         
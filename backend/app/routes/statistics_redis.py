@@ -1,50 +1,40 @@
 """
 Statistics Routes - Thống kê doanh thu và tuyến xe sử dụng Redis
 """
-from fastapi import APIRouter, HTTPException, Depends, Query
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse, FileResponse
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator, Callable, Literal
 from pydantic import BaseModel
 import csv
 import io
+import os
+import zlib
 
 from app.services.redis_service import redis_service
-from app.core.middleware import get_current_employee
+from app.services.demand_service import demand_service
+from app.services.aggregate_service import aggregate_service
+from app.services.analytics_snapshot_service import analytics_snapshot_service, SnapshotUnavailableError
+from app.services.dashboard_service import dashboard_service
+from app.services.export_job_service import export_job_service
+from app.services.booking_metrics_service import booking_metrics_service
+from app.services.sketch_service import sketch_service
+from app.core.middleware import get_current_employee, get_current_admin
+from app.utils import to_epoch, epoch_date, doc_epoch, day_range, local_now, get_current_timestamp_hcm
 
 router = APIRouter(prefix="/api/v1/statistics", tags=["Statistics"])
 
 
 # ========== HELPER FUNCTIONS ==========
 
-def parse_date(date_str: str) -> datetime:
-    """Parse date string to datetime"""
-    if not date_str:
-        return None
-    
-    # Normalize: lấy phần date nếu có T
-    date_part = date_str.split('T')[0] if 'T' in date_str else date_str
-    
-    # Try multiple formats
-    formats = ["%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"]
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_part, fmt)
-        except:
-            continue
-    return None
-
-
-def get_invoice_date(hoa_don: dict) -> datetime:
-    """Lấy ngày của hóa đơn từ ngayTao hoặc ngayLap"""
-    # Ưu tiên ngayTao
-    ngay = hoa_don.get("ngayTao") or hoa_don.get("ngayLap")
-    return parse_date(ngay) if ngay else None
+def invoice_ts(hoa_don: dict) -> Optional[int]:
+    """Epoch ngày lập hóa đơn (ngayLapTs, hoặc tính từ ngayTao / ngayLap nếu chưa backfill)"""
+    return doc_epoch("hoaDon", hoa_don, "ngayLapTs")
 
 
 def get_date_range(period: str):
     """Lấy khoảng thời gian theo period"""
-    now = datetime.now()
+    now = local_now()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     
     if period == "today":
@@ -64,12 +54,19 @@ def get_date_range(period: str):
         return today_start, now
 
 
+def get_ts_range(period: str):
+    """Khoảng thời gian theo period dưới dạng epoch giây"""
+    start_dt, _ = get_date_range(period)
+    return to_epoch(start_dt), int(get_current_timestamp_hcm())
+
+
 # ========== ENDPOINTS ==========
 
 @router.get("/overview")
 async def get_overview_stats(current_user: dict = Depends(get_current_employee)):
     """
     Lấy thống kê tổng quan cho dashboard
+    Doanh thu đọc từ bucket tổng hợp (agg:total, agg:month:*)
     """
     try:
         # Đếm số lượng
@@ -77,30 +74,11 @@ async def get_overview_stats(current_user: dict = Depends(get_current_employee))
         total_employees = await redis_service.count("nhanVien")
         total_buses = await redis_service.count("xe")
         total_routes = await redis_service.count("chuyenXe")
-        total_tickets = await redis_service.count("veXe")
         total_invoices = await redis_service.count("hoaDon")
         
-        # Lấy tất cả hóa đơn để tính doanh thu
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Tính doanh thu tổng
-        total_revenue = sum(float(hd.get("tongTien", 0) or 0) for hd in all_invoices)
-        
-        # Tính doanh thu tháng này
-        now = datetime.now()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        month_revenue = 0
-        month_bookings = 0
-        for hd in all_invoices:
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao and ngay_tao >= month_start:
-                month_revenue += float(hd.get("tongTien", 0) or 0)
-                month_bookings += 1
-        
-        # Lấy vé để tính số vé đã bán
-        all_tickets = await redis_service.get_all("veXe")
-        paid_tickets = [t for t in all_tickets if t.get("trangThai") in ["paid", "confirmed"]]
+        now = local_now()
+        total = await aggregate_service.get_bucket("total")
+        month = await aggregate_service.get_bucket(f"month:{now.strftime('%Y-%m')}")
         
         return {
             "counts": {
@@ -108,13 +86,15 @@ async def get_overview_stats(current_user: dict = Depends(get_current_employee))
                 "total_employees": total_employees,
                 "total_buses": total_buses,
                 "total_routes": total_routes,
-                "total_tickets": len(paid_tickets),
+                "total_tickets": total["tickets"] - total["refunded_tickets"],
                 "total_invoices": total_invoices
             },
             "revenue": {
-                "total": total_revenue,
-                "this_month": month_revenue,
-                "this_month_bookings": month_bookings
+                "total": total["revenue"],
+                "refunds": total["refunds"],
+                "net": total["net_revenue"],
+                "this_month": month["revenue"],
+                "this_month_bookings": month["bookings"]
             }
         }
     except Exception as e:
@@ -127,33 +107,17 @@ async def get_revenue_stats(
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Lấy thống kê doanh thu theo khoảng thời gian
+    Lấy thống kê doanh thu theo khoảng thời gian (cộng các bucket ngày)
     """
     try:
         start_dt, end_dt = get_date_range(period)
         
-        # Lấy tất cả hóa đơn
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Filter theo thời gian
-        filtered_invoices = []
-        for hd in all_invoices:
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao and start_dt <= ngay_tao <= end_dt:
-                filtered_invoices.append(hd)
-        
-        # Tính toán
-        total_revenue = sum(float(hd.get("tongTien", 0) or 0) for hd in filtered_invoices)
-        total_bookings = len(filtered_invoices)
-        
-        # Đếm số vé
-        total_tickets = 0
-        for hd in filtered_invoices:
-            danh_sach_ve = hd.get("danhSachVe", [])
-            if isinstance(danh_sach_ve, list):
-                total_tickets += len(danh_sach_ve)
+        stats = aggregate_service.sum_buckets(await aggregate_service.get_days(start_dt, end_dt))
+        total_revenue = stats["revenue"]
+        total_tickets = stats["tickets"]
         
         avg_price = total_revenue / total_tickets if total_tickets > 0 else 0
+        price = await sketch_service.get_quantiles("price", start_dt, end_dt)
         
         return {
             "period": period,
@@ -161,9 +125,12 @@ async def get_revenue_stats(
             "end_date": end_dt.strftime("%Y-%m-%d"),
             "stats": {
                 "total_revenue": total_revenue,
-                "total_bookings": total_bookings,
+                "total_bookings": stats["bookings"],
                 "total_tickets": total_tickets,
-                "average_ticket_price": avg_price
+                "average_ticket_price": avg_price,
+                "ticket_price_percentiles": price["quantiles"],
+                "total_refunds": stats["refunds"],
+                "net_revenue": stats["net_revenue"]
             }
         }
     except Exception as e:
@@ -179,62 +146,34 @@ async def get_daily_revenue(
     Lấy doanh thu theo từng ngày (để vẽ biểu đồ)
     """
     try:
-        now = datetime.now()
+        now = local_now()
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # Lấy tất cả hóa đơn
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Group theo ngày
-        revenue_by_date = {}
-        for hd in all_invoices:
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao:
-                date_key = ngay_tao.strftime("%Y-%m-%d")
-                if date_key not in revenue_by_date:
-                    revenue_by_date[date_key] = {"revenue": 0, "bookings": 0, "tickets": 0}
-                
-                revenue_by_date[date_key]["revenue"] += float(hd.get("tongTien", 0) or 0)
-                revenue_by_date[date_key]["bookings"] += 1
-                
-                danh_sach_ve = hd.get("danhSachVe", [])
-                if isinstance(danh_sach_ve, list):
-                    revenue_by_date[date_key]["tickets"] += len(danh_sach_ve)
-        
-        # Tạo danh sách đầy đủ các ngày
-        daily_data = []
-        for i in range(days):
-            date = (today_start - timedelta(days=days - 1 - i))
-            date_key = date.strftime("%Y-%m-%d")
-            
-            if date_key in revenue_by_date:
-                data = revenue_by_date[date_key]
-                daily_data.append({
-                    "date": date_key,
-                    "revenue": data["revenue"],
-                    "bookings": data["bookings"],
-                    "tickets": data["tickets"]
-                })
-            else:
-                daily_data.append({
-                    "date": date_key,
-                    "revenue": 0,
-                    "bookings": 0,
-                    "tickets": 0
-                })
+        buckets = await aggregate_service.get_days(today_start - timedelta(days=days - 1), today_start)
+        daily_data = [
+            {
+                "date": b["date"],
+                "revenue": b["revenue"],
+                "bookings": b["bookings"],
+                "tickets": b["tickets"],
+                "refunds": b["refunds"]
+            }
+            for b in buckets
+        ]
         
         # Tính tổng
-        total_revenue = sum(d["revenue"] for d in daily_data)
-        total_bookings = sum(d["bookings"] for d in daily_data)
-        total_tickets = sum(d["tickets"] for d in daily_data)
+        summary = aggregate_service.sum_buckets(buckets)
+        total_revenue = summary["revenue"]
         
         return {
             "days": days,
             "daily_data": daily_data,
             "summary": {
                 "total_revenue": total_revenue,
-                "total_bookings": total_bookings,
-                "total_tickets": total_tickets,
+                "total_bookings": summary["bookings"],
+                "total_tickets": summary["tickets"],
+                "total_refunds": summary["refunds"],
+                "net_revenue": summary["net_revenue"],
                 "average_daily_revenue": total_revenue / days if days > 0 else 0
             }
         }
@@ -242,6 +181,48 @@ async def get_daily_revenue(
         raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê hàng ngày: {str(e)}")
 
 
+@router.get("/revenue/monthly")
+async def get_monthly_revenue(
+    months: int = Query(12, ge=1, le=24, description="Số tháng gần đây"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Lấy doanh thu theo từng tháng (để vẽ biểu đồ), đọc bucket agg:month:*
+    """
+    try:
+        buckets = await aggregate_service.get_months(months)
+        
+        return {
+            "months": months,
+            "monthly_data": [
+                {
+                    "month": b["month"],
+                    "revenue": b["revenue"],
+                    "bookings": b["bookings"],
+                    "tickets": b["tickets"],
+                    "refunds": b["refunds"],
+                    "net_revenue": b["net_revenue"]
+                }
+                for b in buckets
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê hàng tháng: {str(e)}")
+
+
+@router.post("/aggregates/rebuild")
+async def rebuild_aggregates(current_user: dict = Depends(get_current_admin)):
+    """
+    Tính lại toàn bộ bucket doanh thu từ hoaDon / veXe (backfill dữ liệu cũ)
+    """
+    try:
+        result = await aggregate_service.rebuild()
+        sketches = await sketch_service.rebuild()
+        return {"message": "Đã tính lại thống kê doanh thu", **result, "sketchTickets": sketches["tickets"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tính lại thống kê: {str(e)}")
+
+
 @router.get("/routes/popular")
 async def get_popular_routes(
     period: str = Query("month", description="today, week, month, year, all"),
@@ -249,84 +230,24 @@ async def get_popular_routes(
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Lấy danh sách tuyến xe phổ biến nhất
+    Lấy danh sách tuyến xe phổ biến nhất (đọc từ bảng xếp hạng lb:route:*)
     """
     try:
         start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
         
-        # Lấy tất cả hóa đơn
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Filter theo thời gian nếu cần
-        filtered_invoices = all_invoices
-        if start_dt and end_dt:
-            filtered_invoices = []
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and start_dt <= ngay_tao <= end_dt:
-                    filtered_invoices.append(hd)
-        
-        # Lấy thông tin vé từ hóa đơn
-        route_stats = {}
-        for hd in filtered_invoices:
-            danh_sach_ve = hd.get("danhSachVe", [])
-            if not isinstance(danh_sach_ve, list):
-                continue
-            
-            for maVe in danh_sach_ve:
-                ve = await redis_service.get_ve_xe(maVe)
-                if not ve:
-                    continue
-                
-                maLC = ve.get("maLC", "")
-                if not maLC:
-                    continue
-                
-                # Lấy lịch chạy để biết chuyến xe
-                lich_chay = await redis_service.get_lich_chay(maLC)
-                if not lich_chay:
-                    continue
-                
-                maCX = lich_chay.get("maCX", "")
-                if not maCX:
-                    continue
-                
-                if maCX not in route_stats:
-                    # Lấy thông tin chuyến xe
-                    chuyen_xe = await redis_service.get_chuyen_xe(maCX)
-                    route_stats[maCX] = {
-                        "maCX": maCX,
-                        "diemDi": chuyen_xe.get("diemDi", "N/A") if chuyen_xe else "N/A",
-                        "diemDen": chuyen_xe.get("diemDen", "N/A") if chuyen_xe else "N/A",
-                        "total_bookings": 0,
-                        "total_tickets": 0,
-                        "total_revenue": 0
-                    }
-                
-                route_stats[maCX]["total_tickets"] += 1
-                route_stats[maCX]["total_revenue"] += float(ve.get("giaVe", 0) or 0)
-        
-        # Đếm bookings (1 hóa đơn = 1 booking)
-        for hd in filtered_invoices:
-            danh_sach_ve = hd.get("danhSachVe", [])
-            if not isinstance(danh_sach_ve, list) or len(danh_sach_ve) == 0:
-                continue
-            
-            # Lấy vé đầu tiên để xác định tuyến
-            ve = await redis_service.get_ve_xe(danh_sach_ve[0])
-            if not ve:
-                continue
-            
-            lich_chay = await redis_service.get_lich_chay(ve.get("maLC", ""))
-            if not lich_chay:
-                continue
-            
-            maCX = lich_chay.get("maCX", "")
-            if maCX in route_stats:
-                route_stats[maCX]["total_bookings"] += 1
-        
-        # Sort và limit
-        routes_list = sorted(route_stats.values(), key=lambda x: x["total_bookings"], reverse=True)[:limit]
+        top = await aggregate_service.get_leaderboard("route", "bookings", start_dt, end_dt, limit)
+        chuyen_xe_list = await redis_service.get_multiple("chuyenXe", [row["id"] for row in top])
+        
+        routes_list = []
+        for row, chuyen_xe in zip(top, chuyen_xe_list):
+            routes_list.append({
+                "maCX": row["id"],
+                "diemDi": chuyen_xe.get("diemDi", "N/A") if chuyen_xe else "N/A",
+                "diemDen": chuyen_xe.get("diemDen", "N/A") if chuyen_xe else "N/A",
+                "total_bookings": int(row["bookings"]),
+                "total_tickets": int(row["tickets"]),
+                "total_revenue": row["revenue"]
+            })
         
         return {
             "period": period,
@@ -336,59 +257,367 @@ async def get_popular_routes(
         raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê tuyến xe: {str(e)}")
 
 
-@router.get("/customers/top")
-async def get_top_customers(
+@router.get("/routes/{ma_cx}")
+async def get_route_stats(
+    ma_cx: str,
     period: str = Query("month", description="today, week, month, year, all"),
-    limit: int = Query(10, ge=1, le=50),
+    days: int = Query(30, ge=1, le=365, description="Số ngày của chuỗi theo ngày"),
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Lấy danh sách khách hàng đặt vé nhiều nhất
+    Lấy thống kê chi tiết cho một tuyến xe: tổng trong kỳ, tỷ lệ lấp đầy và chuỗi theo ngày
+    Đọc bucket agg:route:{maCX}[:month:|:day:], không quét hoaDon / veXe
     """
     try:
-        start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
+        chuyen_xe = await redis_service.get_chuyen_xe(ma_cx)
+        if not chuyen_xe:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tuyến xe")
         
-        # Lấy tất cả hóa đơn
-        all_invoices = await redis_service.get_all_hoa_don()
+        start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
+        stats = await aggregate_service.get_range(start_dt, end_dt, ma_cx)
         
-        # Filter theo thời gian nếu cần
-        filtered_invoices = all_invoices
-        if start_dt and end_dt:
-            filtered_invoices = []
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and start_dt <= ngay_tao <= end_dt:
-                    filtered_invoices.append(hd)
+        now = local_now()
+        daily = await aggregate_service.get_days(now - timedelta(days=days - 1), now, ma_cx)
         
-        # Group theo khách hàng
-        customer_stats = {}
-        for hd in filtered_invoices:
-            maKH = hd.get("maKH", "")
-            if not maKH:
-                continue
-            
-            if maKH not in customer_stats:
-                # Lấy thông tin khách hàng
-                kh = await redis_service.get_khach_hang(maKH)
-                customer_stats[maKH] = {
-                    "maKH": maKH,
-                    "hoTen": kh.get("hoTen", "N/A") if kh else "N/A",
-                    "email": kh.get("email", "N/A") if kh else "N/A",
-                    "SDT": kh.get("SDT", "N/A") if kh else "N/A",
-                    "total_bookings": 0,
-                    "total_tickets": 0,
-                    "total_spent": 0
+        return {
+            "route_info": {
+                "maCX": chuyen_xe.get("maCX"),
+                "diemDi": chuyen_xe.get("diemDi"),
+                "diemDen": chuyen_xe.get("diemDen"),
+                "giaVe": chuyen_xe.get("giaChuyenXe", chuyen_xe.get("giaVe", 0))
+            },
+            "period": period,
+            "stats": {
+                "total_bookings": stats["bookings"],
+                "total_tickets": stats["tickets"],
+                "total_revenue": stats["revenue"],
+                "total_refunds": stats["refunds"],
+                "net_revenue": stats["net_revenue"],
+                "trips": stats["trips"],
+                "seats": stats["seats"],
+                "seats_sold": stats["seats_sold"],
+                "occupancy": stats["occupancy"]
+            },
+            "daily_breakdown": [
+                {
+                    "date": d["date"],
+                    "bookings": d["bookings"],
+                    "tickets": d["tickets"],
+                    "revenue": d["revenue"],
+                    "trips": d["trips"],
+                    "occupancy": d["occupancy"]
                 }
-            
-            customer_stats[maKH]["total_bookings"] += 1
-            customer_stats[maKH]["total_spent"] += float(hd.get("tongTien", 0) or 0)
-            
-            danh_sach_ve = hd.get("danhSachVe", [])
-            if isinstance(danh_sach_ve, list):
-                customer_stats[maKH]["total_tickets"] += len(danh_sach_ve)
+                for d in daily
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê tuyến xe: {str(e)}")
+
+
+@router.get("/summary")
+async def get_summary_dashboard(current_user: dict = Depends(get_current_employee)):
+    """
+    Lấy tất cả dữ liệu thống kê tóm tắt: hôm nay / tuần / tháng, top tuyến tháng này,
+    doanh thu 7 ngày gần đây (đọc bucket tổng hợp và bảng xếp hạng)
+    """
+    try:
+        def period_stats(bucket: dict) -> dict:
+            return {
+                "total_revenue": bucket["revenue"],
+                "total_bookings": bucket["bookings"],
+                "total_tickets": bucket["tickets"],
+                "average_ticket_price": bucket["revenue"] / bucket["tickets"] if bucket["tickets"] > 0 else 0,
+                "total_refunds": bucket["refunds"],
+                "net_revenue": bucket["net_revenue"]
+            }
         
-        # Sort và limit
-        customers_list = sorted(customer_stats.values(), key=lambda x: x["total_spent"], reverse=True)[:limit]
+        overview = {}
+        for name, period in (("today", "today"), ("this_week", "week"), ("this_month", "month")):
+            start_dt, end_dt = get_date_range(period)
+            overview[name] = period_stats(await aggregate_service.get_range(start_dt, end_dt))
+        
+        # Top 5 tuyến phổ biến tháng này
+        month_start, now = get_date_range("month")
+        top = await aggregate_service.get_leaderboard("route", "bookings", month_start, now, 5)
+        chuyen_xe_list = await redis_service.get_multiple("chuyenXe", [row["id"] for row in top])
+        popular_routes = [
+            {
+                "maCX": row["id"],
+                "tenTuyen": f"{cx.get('diemDi', '')} → {cx.get('diemDen', '')}" if cx else "N/A",
+                "bookings": int(row["bookings"]),
+                "revenue": row["revenue"]
+            }
+            for row, cx in zip(top, chuyen_xe_list)
+        ]
+        
+        # Doanh thu 7 ngày gần đây
+        daily = await aggregate_service.get_days(now - timedelta(days=6), now)
+        last_7_days = [
+            {
+                "date": d["date"],
+                "day_name": ["T2", "T3", "T4", "T5", "T6", "T7", "CN"][datetime.strptime(d["date"], "%Y-%m-%d").weekday()],
+                "revenue": d["revenue"],
+                "bookings": d["bookings"]
+            }
+            for d in daily
+        ]
+        
+        # Đếm tổng
+        total_customers = await redis_service.count("khachHang")
+        total_routes = await redis_service.count("chuyenXe")
+        pending_cancels = await redis_service.count_yeu_cau_huy("pending")
+        
+        return {
+            "overview": overview,
+            "counts": {
+                "total_customers": total_customers,
+                "total_routes": total_routes,
+                "pending_cancel_requests": pending_cancels
+            },
+            "popular_routes": popular_routes,
+            "revenue_chart": last_7_days
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê tóm tắt: {str(e)}")
+
+
+def _ts_bounds(date_from: Optional[str], date_to: Optional[str]):
+    """Khoảng epoch [đầu date_from, cuối date_to] từ tham số YYYY-MM-DD (None = không giới hạn)"""
+    start = day_range(date_from) if date_from else None
+    end = day_range(date_to) if date_to else None
+    if (date_from and not start) or (date_to and not end):
+        raise HTTPException(status_code=400, detail="Ngày không hợp lệ. Định dạng: YYYY-MM-DD")
+    return (start[0] if start else None), (end[1] - 1 if end else None)
+
+
+@router.get("/occupancy/heatmap")
+async def get_occupancy_heatmap(
+    maCX: Optional[str] = Query(None, description="Lọc theo tuyến (mặc định: tất cả tuyến)"),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Heatmap tỷ lệ lấp đầy theo thứ x giờ khởi hành của các chuyến đã chạy
+    (đọc agg:occ:*, không chạm tới veXe)
+    """
+    try:
+        start_ts, end_ts = _ts_bounds(date_from, date_to)
+        heatmap = await aggregate_service.get_occupancy_heatmap(maCX, start_ts, end_ts)
+        return {"maCX": maCX, "dateFrom": date_from, "dateTo": date_to, **heatmap}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy heatmap lấp đầy: {str(e)}")
+
+
+@router.get("/occupancy/trips")
+async def get_trip_occupancy(
+    maCX: Optional[str] = Query(None, description="Lọc theo tuyến (mặc định: tất cả tuyến)"),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Tỷ lệ lấp đầy (ghế đã bán / tổng ghế) của từng lịch chạy đã hoàn thành, mới nhất trước
+    """
+    try:
+        start_ts, end_ts = _ts_bounds(date_from, date_to)
+        trips = await aggregate_service.get_trip_occupancy(maCX, start_ts, end_ts, limit)
+        return {"maCX": maCX, "trips": trips}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy tỷ lệ lấp đầy: {str(e)}")
+
+
+@router.get("/percentiles")
+async def get_percentiles(
+    metric: Literal["price", "lead_time", "hold_to_pay"] = Query("price"),
+    period: str = Query("month", description="today, week, month, year, last_7_days, last_30_days"),
+    maCX: Optional[str] = Query(None, description="Lọc theo tuyến (mặc định: tất cả tuyến)"),
+    q: str = Query("50,90,99", description="Các phân vị (0-100), phân tách bằng dấu phẩy"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Phân vị giá vé (VNĐ), thời gian đặt trước giờ khởi hành (phút) hoặc thời gian
+    từ giữ ghế đến thanh toán (giây), gộp từ sketch theo ngày
+    """
+    try:
+        try:
+            qs = [float(value) / 100 for value in q.split(",") if value.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Phân vị không hợp lệ")
+        if not qs or any(not 0 <= value <= 1 for value in qs):
+            raise HTTPException(status_code=400, detail="Phân vị phải nằm trong khoảng 0-100")
+
+        start_dt, end_dt = get_date_range(period)
+        result = await sketch_service.get_quantiles(metric, start_dt, end_dt, maCX, qs)
+        return {
+            "period": period,
+            "start_date": start_dt.strftime("%Y-%m-%d"),
+            "end_date": end_dt.strftime("%Y-%m-%d"),
+            "maCX": maCX,
+            **result
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tính phân vị: {str(e)}")
+
+
+@router.get("/bookings/timeseries")
+async def get_booking_timeseries(
+    minutes: int = Query(60, ge=1, le=2 * 365 * 24 * 60, description="Độ dài cửa sổ (phút) tính đến `end`"),
+    end: Optional[str] = Query(None, description="Thời điểm kết thúc ISO (mặc định: hiện tại)"),
+    resolution: Optional[Literal["1m", "1h", "1d"]] = Query(None, description="Mặc định: tự chọn theo cửa sổ"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Chuỗi thời gian đặt vé (bookings, tickets, revenue, holds, expiries)
+
+    Cửa sổ ngắn đọc bucket phút (gần thời gian thực), cửa sổ dài đọc bucket giờ / ngày
+    đã rollup; số điểm trả về luôn có giới hạn.
+    """
+    try:
+        end_ts = to_epoch(end) if end else int(get_current_timestamp_hcm())
+        if end_ts is None:
+            raise HTTPException(status_code=400, detail="Thời điểm kết thúc không hợp lệ")
+        series = await booking_metrics_service.get_series(end_ts - minutes * 60, end_ts, resolution)
+        return {"minutes": minutes, "end": end_ts, **series}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy chuỗi thời gian đặt vé: {str(e)}")
+
+
+@router.get("/search-demand")
+async def get_search_demand(
+    date_from: Optional[str] = Query(None, description="Ngày đi từ (YYYY-MM-DD), mặc định hôm nay"),
+    date_to: Optional[str] = Query(None, description="Ngày đi đến (YYYY-MM-DD), mặc định +30 ngày"),
+    top: int = Query(20, ge=1, le=100, description="Số tuyến hiển thị"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Nhu cầu tìm kiếm theo ngày đi: số lượt tìm, số lượt không có chuyến còn ghế,
+    số session duy nhất (ước lượng) và các cặp thành phố tìm nhiều nhưng không đặt được
+    """
+    try:
+        today = local_now()
+        date_from = date_from or today.strftime("%Y-%m-%d")
+        date_to = date_to or (today + timedelta(days=30)).strftime("%Y-%m-%d")
+        
+        try:
+            return await demand_service.get_demand(date_from, date_to, top)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê nhu cầu: {str(e)}")
+
+
+@router.get("/analytics")
+async def get_analytics(
+    table: str = Query("tickets", description="tickets, invoices"),
+    by: str = Query("route", description="route, customer, bus, status, method, day, month, weekday"),
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    status: Optional[str] = Query(None, description="Lọc trạng thái vé, phân tách bằng dấu phẩy"),
+    sort: str = Query("amount", description="amount, count, key"),
+    limit: int = Query(100, ge=1, le=10000),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Phân tích nhóm (group-by) trên snapshot dạng cột của vé / hóa đơn
+    """
+    try:
+        snapshot = await analytics_snapshot_service.ensure_snapshot()
+        try:
+            rows = analytics_snapshot_service.group_by(
+                snapshot, table, by, date_from, date_to,
+                status=[s.strip() for s in status.split(",") if s.strip()] if status else None
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if sort in ("amount", "count"):
+            rows.sort(key=lambda r: r[sort], reverse=True)
+        
+        return {
+            "generation": snapshot.generation,
+            "generatedAt": snapshot.generated_at,
+            "table": table,
+            "by": by,
+            "rows": rows[:limit]
+        }
+    except SnapshotUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi phân tích: {str(e)}")
+
+
+@router.post("/analytics/refresh")
+async def refresh_analytics(current_user: dict = Depends(get_current_admin)):
+    """
+    Build lại snapshot phân tích ngay (thay vì chờ lần build định kỳ)
+    """
+    try:
+        generation = await analytics_snapshot_service.rebuild()
+        if generation is None:
+            return {"message": "Snapshot đang được build bởi tiến trình khác"}
+        return {"message": "Đã build lại snapshot phân tích", "generation": generation}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi build snapshot: {str(e)}")
+
+
+async def _iter_customer_leaderboard(period: str, limit: Optional[int]) -> AsyncIterator[List[dict]]:
+    """Bảng xếp hạng khách hàng theo chi tiêu, thông tin hiển thị lấy theo lô 500 (MGET qua pipeline)"""
+    start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
+    top = await aggregate_service.get_leaderboard("customer", "spent", start_dt, end_dt, limit)
+    
+    for offset in range(0, len(top), 500):
+        batch = top[offset:offset + 500]
+        kh_list = await redis_service.get_multiple("khachHang", [row["id"] for row in batch])
+        yield [
+            {
+                "maKH": row["id"],
+                "hoTen": kh.get("hoTen", "N/A") if kh else "N/A",
+                "email": kh.get("email", "N/A") if kh else "N/A",
+                "SDT": kh.get("SDT", "N/A") if kh else "N/A",
+                "total_bookings": int(row["bookings"]),
+                "total_tickets": int(row["tickets"]),
+                "total_spent": row["spent"]
+            }
+            for row, kh in zip(batch, kh_list)
+        ]
+
+
+async def _customer_leaderboard(period: str, limit: Optional[int]) -> List[dict]:
+    """Bảng xếp hạng khách hàng theo chi tiêu (top-k)"""
+    return [c async for batch in _iter_customer_leaderboard(period, limit) for c in batch]
+
+
+@router.get("/customers/top")
+async def get_top_customers(
+    period: str = Query("month", description="today, week, month, year, all"),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Lấy danh sách khách hàng chi tiêu nhiều nhất (đọc từ bảng xếp hạng lb:customer:*)
+    """
+    try:
+        customers_list = await _customer_leaderboard(period, limit)
         
         return {
             "period": period,
@@ -402,146 +631,13 @@ async def get_top_customers(
 async def get_dashboard_data(current_user: dict = Depends(get_current_employee)):
     """
     Lấy tất cả dữ liệu cho dashboard admin
+    Đọc từ cache dashboard:admin; bản cache cũ được tính lại ở background
     """
     try:
-        # === COUNTS ===
-        total_customers = await redis_service.count("khachHang")
-        total_buses = await redis_service.count("xe")
-        total_routes = await redis_service.count("chuyenXe")
-        
-        # Vé đã bán (trạng thái paid hoặc confirmed)
-        all_tickets = await redis_service.get_all("veXe")
-        paid_tickets = [t for t in all_tickets if t.get("trangThai") in ["paid", "confirmed"]]
-        
-        # === DOANH THU ===
-        all_invoices = await redis_service.get_all_hoa_don()
-        total_revenue = sum(float(hd.get("tongTien", 0) or 0) for hd in all_invoices)
-        
-        # Doanh thu tháng này
-        now = datetime.now()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_revenue = 0
-        for hd in all_invoices:
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao and ngay_tao >= month_start:
-                month_revenue += float(hd.get("tongTien", 0) or 0)
-        
-        # === VÉ GẦN ĐÂY ===
-        recent_tickets = sorted(all_tickets, key=lambda x: x.get("ngayDat", ""), reverse=True)[:10]
-        
-        recent_bookings = []
-        for ticket in recent_tickets:
-            maKH = ticket.get("maKH", "")
-            kh = await redis_service.get_khach_hang(maKH) if maKH else None
-            
-            maLC = ticket.get("maLC", "")
-            lich_chay = await redis_service.get_lich_chay(maLC) if maLC else None
-            
-            route_name = "N/A"
-            gia_ve = ticket.get("giaVe", 0)
-            
-            if lich_chay:
-                maCX = lich_chay.get("maCX", "")
-                chuyen_xe = await redis_service.get_chuyen_xe(maCX) if maCX else None
-                if chuyen_xe:
-                    route_name = f"{chuyen_xe.get('diemDi', '')} → {chuyen_xe.get('diemDen', '')}"
-                    # Fallback: lấy giá từ chuyenXe nếu vé không có giaVe
-                    if not gia_ve:
-                        gia_ve = chuyen_xe.get("giaChuyenXe", 0)
-            
-            recent_bookings.append({
-                "maVe": ticket.get("maVe", ""),
-                "customer": kh.get("hoTen", "N/A") if kh else "N/A",
-                "route": route_name,
-                "seats": ticket.get("maGhe", "N/A"),
-                "price": gia_ve,
-                "status": ticket.get("trangThai", "unknown"),
-                "time": ticket.get("ngayDat", "N/A")
-            })
-        
-        # === XE ĐANG HOẠT ĐỘNG ===
-        all_buses = await redis_service.get_all_xe()
-        active_buses = []
-        for bus in all_buses[:5]:
-            active_buses.append({
-                "maXe": bus.get("maXe", ""),
-                "bienSo": bus.get("bienSoXe", "N/A"),
-                "loaiXe": bus.get("loaiXe", "N/A"),
-                "status": bus.get("trangThai", "active"),
-                "soChoNgoi": bus.get("soChoNgoi", 34)
-            })
-        
-        # === DOANH THU 6 THÁNG ===
-        monthly_revenue = []
-        for i in range(5, -1, -1):
-            month = now.month - i
-            year = now.year
-            while month <= 0:
-                month += 12
-                year -= 1
-            
-            month_name = f"Tháng {month}"
-            month_total = 0
-            
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and ngay_tao.month == month and ngay_tao.year == year:
-                    month_total += float(hd.get("tongTien", 0) or 0)
-            
-            monthly_revenue.append({
-                "month": month_name,
-                "revenue": month_total / 1000000  # Convert to millions
-            })
-        
-        # === TOP TUYẾN ===
-        route_stats = {}
-        for hd in all_invoices:
-            danh_sach_ve = hd.get("danhSachVe", [])
-            if not isinstance(danh_sach_ve, list):
-                continue
-            
-            for maVe in danh_sach_ve[:1]:  # Lấy 1 vé đầu để xác định tuyến
-                ve = await redis_service.get_ve_xe(maVe)
-                if not ve:
-                    continue
-                
-                lich_chay = await redis_service.get_lich_chay(ve.get("maLC", ""))
-                if not lich_chay:
-                    continue
-                
-                maCX = lich_chay.get("maCX", "")
-                if not maCX:
-                    continue
-                
-                if maCX not in route_stats:
-                    chuyen_xe = await redis_service.get_chuyen_xe(maCX)
-                    route_name = f"{chuyen_xe.get('diemDi', '')} - {chuyen_xe.get('diemDen', '')}" if chuyen_xe else "N/A"
-                    route_stats[maCX] = {"name": route_name, "count": 0}
-                
-                route_stats[maCX]["count"] += 1
-        
-        top_routes = sorted(route_stats.values(), key=lambda x: x["count"], reverse=True)[:5]
-        total_route_bookings = sum(r["count"] for r in top_routes)
-        
-        top_routes_data = []
-        for route in top_routes:
-            percentage = (route["count"] / total_route_bookings * 100) if total_route_bookings > 0 else 0
-            top_routes_data.append({
-                "name": route["name"],
-                "percentage": round(percentage)
-            })
-        
+        document = await dashboard_service.get_dashboard()
         return {
-            "stats": {
-                "totalUsers": total_customers,
-                "totalBookings": len(paid_tickets),
-                "totalBuses": len([b for b in all_buses if b.get("trangThai") == "active"]),
-                "totalRevenue": month_revenue
-            },
-            "recentBookings": recent_bookings,
-            "activeBuses": active_buses,
-            "revenueChart": monthly_revenue,
-            "topRoutes": top_routes_data
+            **document["data"],
+            "generatedAt": datetime.fromtimestamp(document["generatedAt"]).isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy dữ liệu dashboard: {str(e)}")
@@ -553,247 +649,170 @@ async def get_dashboard_data_debug():
     DEBUG: Lấy dữ liệu dashboard KHÔNG cần auth (chỉ dùng để test)
     """
     try:
-        # === COUNTS ===
-        total_customers = await redis_service.count("khachHang")
-        total_buses = await redis_service.count("xe")
-        total_routes = await redis_service.count("chuyenXe")
-        
-        # Vé đã bán (trạng thái paid hoặc confirmed)
-        all_tickets = await redis_service.get_all("veXe")
-        paid_tickets = [t for t in all_tickets if t.get("trangThai") in ["paid", "confirmed"]]
-        
-        # === DOANH THU ===
-        all_invoices = await redis_service.get_all_hoa_don()
-        total_revenue = sum(float(hd.get("tongTien", 0) or 0) for hd in all_invoices)
-        
-        # Doanh thu tháng này
-        now = datetime.now()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_revenue = 0
-        for hd in all_invoices:
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao and ngay_tao >= month_start:
-                month_revenue += float(hd.get("tongTien", 0) or 0)
-        
-        # === VÉ GẦN ĐÂY ===
-        recent_tickets = sorted(all_tickets, key=lambda x: x.get("ngayDat", ""), reverse=True)[:10]
-        
-        recent_bookings = []
-        for ticket in recent_tickets:
-            maKH = ticket.get("maKH", "")
-            kh = await redis_service.get_khach_hang(maKH) if maKH else None
-            
-            maLC = ticket.get("maLC", "")
-            lich_chay = await redis_service.get_lich_chay(maLC) if maLC else None
-            
-            route_name = "N/A"
-            gia_ve = ticket.get("giaVe", 0)
-            
-            if lich_chay:
-                maCX = lich_chay.get("maCX", "")
-                chuyen_xe = await redis_service.get_chuyen_xe(maCX) if maCX else None
-                if chuyen_xe:
-                    route_name = f"{chuyen_xe.get('diemDi', '')} → {chuyen_xe.get('diemDen', '')}"
-                    # Fallback: lấy giá từ chuyenXe nếu vé không có giaVe
-                    if not gia_ve:
-                        gia_ve = chuyen_xe.get("giaChuyenXe", 0)
-            
-            recent_bookings.append({
-                "maVe": ticket.get("maVe", ""),
-                "customer": kh.get("hoTen", "N/A") if kh else "N/A",
-                "route": route_name,
-                "seats": ticket.get("maGhe", "N/A"),
-                "price": gia_ve,
-                "status": ticket.get("trangThai", "unknown"),
-                "time": ticket.get("ngayDat", "N/A")
-            })
-        
-        # === XE ĐANG HOẠT ĐỘNG ===
-        all_buses = await redis_service.get_all_xe()
-        active_buses = []
-        for bus in all_buses[:5]:
-            active_buses.append({
-                "maXe": bus.get("maXe", ""),
-                "bienSo": bus.get("bienSoXe", "N/A"),
-                "loaiXe": bus.get("loaiXe", "N/A"),
-                "status": bus.get("trangThai", "active"),
-                "soChoNgoi": bus.get("soChoNgoi", 34)
-            })
-        
-        # === DOANH THU 6 THÁNG ===
-        monthly_revenue = []
-        for i in range(5, -1, -1):
-            month = now.month - i
-            year = now.year
-            while month <= 0:
-                month += 12
-                year -= 1
-            
-            month_name = f"Tháng {month}"
-            month_total = 0
-            
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and ngay_tao.month == month and ngay_tao.year == year:
-                    month_total += float(hd.get("tongTien", 0) or 0)
-            
-            monthly_revenue.append({
-                "month": month_name,
-                "revenue": month_total / 1000000  # Convert to millions
-            })
-        
-        # === TOP TUYẾN ===
-        # Đơn giản hóa - lấy từ chuyenXe trực tiếp
-        all_routes = await redis_service.get_all_chuyen_xe()
-        top_routes_data = []
-        for route in all_routes[:5]:
-            top_routes_data.append({
-                "name": f"{route.get('diemDi', '')} - {route.get('diemDen', '')}",
-                "percentage": 20  # Placeholder
-            })
-        
-        return {
-            "stats": {
-                "totalUsers": total_customers,
-                "totalBookings": len(paid_tickets),
-                "totalBuses": len([b for b in all_buses if b.get("trangThai") == "active"]),
-                "totalRevenue": month_revenue
-            },
-            "recentBookings": recent_bookings,
-            "activeBuses": active_buses,
-            "revenueChart": monthly_revenue,
-            "topRoutes": top_routes_data
-        }
+        return await dashboard_service.compute()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy dữ liệu dashboard: {str(e)}")
 
 
 # ========== EXPORT CSV ENDPOINTS ==========
+# Các file CSV được sinh dần theo lô (SSCAN + MGET), mỗi chunk gửi ngay khi đủ
+# CSV_CHUNK_SIZE ký tự nên bộ nhớ không phụ thuộc số dòng. Nếu client gửi
+# Accept-Encoding: gzip thì nội dung được nén dạng stream (Content-Encoding: gzip).
 
 # UTF-8 BOM để Excel đọc đúng tiếng Việt
 UTF8_BOM = '\ufeff'
+EXPORT_BATCH_SIZE = 500
+CSV_CHUNK_SIZE = 64 * 1024
 
-def create_csv_response(content: str, filename: str):
-    """Tạo response CSV với UTF-8 BOM"""
-    # Thêm BOM vào đầu content
-    content_with_bom = UTF8_BOM + content
-    
-    return StreamingResponse(
-        iter([content_with_bom]),
-        media_type="text/csv; charset=utf-8-sig",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
-            "Content-Type": "text/csv; charset=utf-8-sig"
-        }
-    )
 
+def accepts_gzip(request: Request) -> bool:
+    """Client có chấp nhận Content-Encoding: gzip hay không"""
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
 
-@router.get("/export/invoices")
-async def export_invoices_csv(
-    period: str = Query("month", description="today, week, month, year, all"),
-    current_user: dict = Depends(get_current_employee)
-):
+
+async def _csv_chunks(rows: AsyncIterator[list], compress: bool = False,
+                      swallow_errors: bool = False) -> AsyncIterator[bytes]:
     """
-    Xuất danh sách hóa đơn ra file CSV
+    Ghi các dòng CSV vào buffer nhỏ và trả ra từng chunk (đã nén nếu cần)
+
+    Lỗi giữa chừng được ném tiếp để job export chuyển sang failed; chỉ response stream
+    (swallow_errors=True, header đã gửi đi) mới ghi log rồi kết thúc file
     """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: định dạng gzip
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    buffer.write(UTF8_BOM)
     try:
-        start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
-        
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Filter theo thời gian
-        if start_dt and end_dt:
-            filtered = []
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and start_dt <= ngay_tao <= end_dt:
-                    filtered.append(hd)
-            all_invoices = filtered
-        
-        # Tạo CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "Mã HĐ", "Mã KH", "Tên KH", "Số vé", "Tổng tiền (VNĐ)", 
-            "Phương thức TT", "Trạng thái", "Ngày lập", "Ghi chú"
-        ])
-        
-        # Data
-        for hd in all_invoices:
-            # Lấy tên khách hàng
+        async for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CSV_CHUNK_SIZE:
+                chunk = drain()
+                if chunk:
+                    yield chunk
+    except Exception as e:
+        if not swallow_errors:
+            raise
+        # Header đã gửi đi nên không thể trả 500: ghi log và kết thúc file
+        print(f"❌ Error streaming CSV export: {e}")
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def create_csv_response(rows: AsyncIterator[list], filename: str, request: Request) -> StreamingResponse:
+    """Tạo response CSV (UTF-8 BOM) stream từ các dòng sinh dần"""
+    compress = accepts_gzip(request)
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
+        "Content-Type": "text/csv; charset=utf-8-sig",
+        "Vary": "Accept-Encoding"
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        _csv_chunks(rows, compress, swallow_errors=True),
+        media_type="text/csv; charset=utf-8-sig",
+        headers=headers
+    )
+
+
+async def _customer_names(docs: List[dict]) -> dict:
+    """Tên khách hàng cho một lô document (một MGET cho các maKH khác nhau)"""
+    ma_kh_list = list({d.get("maKH") for d in docs if d.get("maKH")})
+    kh_list = await redis_service.get_multiple("khachHang", ma_kh_list)
+    return {maKH: kh.get("hoTen", "N/A") for maKH, kh in zip(ma_kh_list, kh_list) if kh}
+
+
+async def _invoice_rows(period: str, progress: Optional[Callable[[int], None]] = None) -> AsyncIterator[list]:
+    """Các dòng CSV hóa đơn (header trước), duyệt hoaDon theo lô"""
+    start_ts, end_ts = get_ts_range(period) if period != "all" else (None, None)
+    
+    # Header
+    yield [
+        "Mã HĐ", "Mã KH", "Tên KH", "Số vé", "Tổng tiền (VNĐ)", 
+        "Phương thức TT", "Trạng thái", "Ngày lập", "Ghi chú"
+    ]
+    async for batch in redis_service.iter_batches("hoaDon", EXPORT_BATCH_SIZE):
+        if progress:
+            progress(len(batch))
+        # Filter theo thời gian (so sánh epoch)
+        if start_ts is not None:
+            batch = [hd for hd in batch
+                     if (ts := invoice_ts(hd)) is not None and start_ts <= ts <= end_ts]
+        names = await _customer_names(batch)
+        for hd in batch:
             maKH = hd.get("maKH", "")
-            kh = await redis_service.get_khach_hang(maKH) if maKH else None
-            ten_kh = kh.get("hoTen", "N/A") if kh else "N/A"
-            
-            writer.writerow([
+            yield [
                 hd.get("maHD", ""),
                 maKH,
-                ten_kh,
+                names.get(maKH, "N/A"),
                 hd.get("soLuongVe", len(hd.get("danhSachVe", []))),
                 hd.get("tongTien", 0),
                 hd.get("phuongThucThanhToan", "N/A"),
                 hd.get("trangThai", "N/A"),
                 hd.get("ngayLap", hd.get("ngayTao", "N/A")),
                 hd.get("ghiChu", "")
-            ])
-        
-        output.seek(0)
-        filename = f"hoa_don_{period}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        return create_csv_response(output.getvalue(), filename)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
+            ]
 
 
-@router.get("/export/tickets")
-async def export_tickets_csv(
+@router.get("/export/invoices")
+async def export_invoices_csv(
+    request: Request,
     period: str = Query("month", description="today, week, month, year, all"),
-    status: Optional[str] = Query(None, description="paid, confirmed, cancelled"),
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Xuất danh sách vé ra file CSV
+    Xuất danh sách hóa đơn ra file CSV
     """
     try:
-        all_tickets = await redis_service.get_all("veXe")
+        filename = f"hoa_don_{period}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
+        return create_csv_response(_invoice_rows(period), filename, request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
+
+
+async def _ticket_rows(period: str, status: Optional[str] = None,
+                       progress: Optional[Callable[[int], None]] = None) -> AsyncIterator[list]:
+    """Các dòng CSV vé xe (header trước), duyệt veXe theo lô"""
+    start_ts, end_ts = get_ts_range(period) if period != "all" else (None, None)
+    
+    # Header
+    yield [
+        "Mã vé", "Mã HĐ", "Mã KH", "Tên KH", "Điểm đi", "Điểm đến",
+        "Mã ghế", "Giá vé (VNĐ)", "Ngày đi", "Ngày đặt", "Trạng thái"
+    ]
+    async for batch in redis_service.iter_batches("veXe", EXPORT_BATCH_SIZE):
+        if progress:
+            progress(len(batch))
         # Filter by status
         if status:
-            all_tickets = [t for t in all_tickets if t.get("trangThai") == status]
-        
+            batch = [ve for ve in batch if ve.get("trangThai") == status]
         # Filter by date
-        start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
-        if start_dt and end_dt:
-            filtered = []
-            for ve in all_tickets:
-                ngay_dat = parse_date(ve.get("ngayDat", ""))
-                if ngay_dat and start_dt <= ngay_dat <= end_dt:
-                    filtered.append(ve)
-            all_tickets = filtered
-        
-        # Tạo CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "Mã vé", "Mã HĐ", "Mã KH", "Tên KH", "Điểm đi", "Điểm đến",
-            "Mã ghế", "Giá vé (VNĐ)", "Ngày đi", "Ngày đặt", "Trạng thái"
-        ])
-        
-        # Data
-        for ve in all_tickets:
+        if start_ts is not None:
+            batch = [ve for ve in batch
+                     if (ts := doc_epoch("veXe", ve, "ngayDatTs")) is not None and start_ts <= ts <= end_ts]
+        names = await _customer_names(batch)
+        for ve in batch:
             maKH = ve.get("maKH", "")
-            kh = await redis_service.get_khach_hang(maKH) if maKH else None
-            ten_kh = kh.get("hoTen", "N/A") if kh else "N/A"
-            
-            writer.writerow([
+            yield [
                 ve.get("maVe", ""),
                 ve.get("maHD", ""),
                 maKH,
-                ten_kh,
+                names.get(maKH, "N/A"),
                 ve.get("diemDi", "N/A"),
                 ve.get("diemDen", "N/A"),
                 ve.get("maGhe", "N/A"),
@@ -801,89 +820,67 @@ async def export_tickets_csv(
                 ve.get("ngayDi", "N/A"),
                 ve.get("ngayDat", "N/A"),
                 ve.get("trangThai", "N/A")
-            ])
-        
-        output.seek(0)
-        
+            ]
+
+
+@router.get("/export/tickets")
+async def export_tickets_csv(
+    request: Request,
+    period: str = Query("month", description="today, week, month, year, all"),
+    status: Optional[str] = Query(None, description="paid, confirmed, cancelled"),
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Xuất danh sách vé ra file CSV
+    """
+    try:
         filename = f"ve_xe_{period}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        return create_csv_response(output.getvalue(), filename)
+        return create_csv_response(_ticket_rows(period, status), filename, request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
 
 
+async def _revenue_rows(days: int, progress: Optional[Callable[[int], None]] = None) -> AsyncIterator[list]:
+    """Các dòng CSV doanh thu theo ngày (đọc bucket agg:day:*)"""
+    now = local_now()
+    
+    # Header
+    yield ["Ngày", "Số hóa đơn", "Số vé", "Doanh thu (VNĐ)"]
+    
+    # Data - đủ các ngày (ngày không có giao dịch = 0)
+    daily = await aggregate_service.get_days(now - timedelta(days=days - 1), now)
+    if progress:
+        progress(len(daily))
+    for data in daily:
+        yield [data["date"], data["bookings"], data["tickets"], data["revenue"]]
+    
+    # Tổng cộng
+    total = aggregate_service.sum_buckets(daily)
+    yield []
+    yield ["TỔNG CỘNG", total["bookings"], total["tickets"], total["revenue"]]
+
+
 @router.get("/export/revenue")
 async def export_revenue_csv(
+    request: Request,
     days: int = Query(30, ge=1, le=365),
     current_user: dict = Depends(get_current_employee)
 ):
     """
-    Xuất thống kê doanh thu theo ngày ra file CSV
+    Xuất thống kê doanh thu theo ngày ra file CSV (đọc bucket agg:day:*)
     """
     try:
-        now = datetime.now()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Group theo ngày
-        revenue_by_date = {}
-        for hd in all_invoices:
-            if hd.get("trangThai") == "cancelled":
-                continue
-            ngay_tao = get_invoice_date(hd)
-            if ngay_tao:
-                date_key = ngay_tao.strftime("%Y-%m-%d")
-                if date_key not in revenue_by_date:
-                    revenue_by_date[date_key] = {"revenue": 0, "bookings": 0, "tickets": 0}
-                
-                revenue_by_date[date_key]["revenue"] += float(hd.get("tongTien", 0) or 0)
-                revenue_by_date[date_key]["bookings"] += 1
-                revenue_by_date[date_key]["tickets"] += hd.get("soLuongVe", len(hd.get("danhSachVe", [])))
-        
-        # Tạo CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow(["Ngày", "Số hóa đơn", "Số vé", "Doanh thu (VNĐ)"])
-        
-        # Data - tạo đầy đủ các ngày
-        total_revenue = 0
-        total_bookings = 0
-        total_tickets = 0
-        
-        for i in range(days):
-            date = (today_start - timedelta(days=days - 1 - i))
-            date_key = date.strftime("%Y-%m-%d")
-            
-            data = revenue_by_date.get(date_key, {"revenue": 0, "bookings": 0, "tickets": 0})
-            writer.writerow([
-                date_key,
-                data["bookings"],
-                data["tickets"],
-                data["revenue"]
-            ])
-            
-            total_revenue += data["revenue"]
-            total_bookings += data["bookings"]
-            total_tickets += data["tickets"]
-        
-        # Tổng cộng
-        writer.writerow([])
-        writer.writerow(["TỔNG CỘNG", total_bookings, total_tickets, total_revenue])
-        
-        output.seek(0)
-        
         filename = f"doanh_thu_{days}ngay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        return create_csv_response(output.getvalue(), filename)
+        return create_csv_response(_revenue_rows(days), filename, request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
 
 
 @router.get("/export/customers")
 async def export_customers_csv(
+    request: Request,
     period: str = Query("all", description="today, week, month, year, all"),
     current_user: dict = Depends(get_current_employee)
 ):
@@ -891,81 +888,38 @@ async def export_customers_csv(
     Xuất thống kê khách hàng ra file CSV
     """
     try:
-        start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
-        
-        all_invoices = await redis_service.get_all_hoa_don()
-        
-        # Filter
-        if start_dt and end_dt:
-            filtered = []
-            for hd in all_invoices:
-                ngay_tao = get_invoice_date(hd)
-                if ngay_tao and start_dt <= ngay_tao <= end_dt:
-                    filtered.append(hd)
-            all_invoices = filtered
-        
-        # Group theo khách hàng
-        customer_stats = {}
-        for hd in all_invoices:
-            if hd.get("trangThai") == "cancelled":
-                continue
-            maKH = hd.get("maKH", "")
-            if not maKH:
-                continue
-            
-            if maKH not in customer_stats:
-                kh = await redis_service.get_khach_hang(maKH)
-                customer_stats[maKH] = {
-                    "maKH": maKH,
-                    "hoTen": kh.get("hoTen", "N/A") if kh else "N/A",
-                    "email": kh.get("email", "N/A") if kh else "N/A",
-                    "SDT": kh.get("SDT", "N/A") if kh else "N/A",
-                    "total_bookings": 0,
-                    "total_tickets": 0,
-                    "total_spent": 0
-                }
-            
-            customer_stats[maKH]["total_bookings"] += 1
-            customer_stats[maKH]["total_spent"] += float(hd.get("tongTien", 0) or 0)
-            customer_stats[maKH]["total_tickets"] += hd.get("soLuongVe", len(hd.get("danhSachVe", [])))
-        
-        # Sort by total_spent
-        customers_list = sorted(customer_stats.values(), key=lambda x: x["total_spent"], reverse=True)
-        
-        # Tạo CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "Hạng", "Mã KH", "Họ tên", "Email", "SĐT", 
-            "Số lần đặt", "Số vé", "Tổng chi tiêu (VNĐ)"
-        ])
-        
-        # Data
-        for i, c in enumerate(customers_list, 1):
-            writer.writerow([
-                i,
-                c["maKH"],
-                c["hoTen"],
-                c["email"],
-                c["SDT"],
-                c["total_bookings"],
-                c["total_tickets"],
-                c["total_spent"]
-            ])
-        
-        output.seek(0)
+        async def rows():
+            # Header
+            yield [
+                "Hạng", "Mã KH", "Họ tên", "Email", "SĐT", 
+                "Số lần đặt", "Số vé", "Tổng chi tiêu (VNĐ)"
+            ]
+            # Toàn bộ bảng xếp hạng, đã sắp theo tổng chi tiêu; thông tin khách hàng lấy theo lô
+            rank = 0
+            async for batch in _iter_customer_leaderboard(period, None):
+                for c in batch:
+                    rank += 1
+                    yield [
+                        rank,
+                        c["maKH"],
+                        c["hoTen"],
+                        c["email"],
+                        c["SDT"],
+                        c["total_bookings"],
+                        c["total_tickets"],
+                        c["total_spent"]
+                    ]
         
         filename = f"khach_hang_{period}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        return create_csv_response(output.getvalue(), filename)
+        return create_csv_response(rows(), filename, request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
 
 
 @router.get("/export/routes")
 async def export_routes_csv(
+    request: Request,
     period: str = Query("all", description="today, week, month, year, all"),
     current_user: dict = Depends(get_current_employee)
 ):
@@ -974,79 +928,148 @@ async def export_routes_csv(
     """
     try:
         start_dt, end_dt = get_date_range(period) if period != "all" else (None, None)
-        
-        all_tickets = await redis_service.get_all("veXe")
-        
-        # Filter
-        if start_dt and end_dt:
-            filtered = []
-            for ve in all_tickets:
-                ngay_dat = parse_date(ve.get("ngayDat", ""))
-                if ngay_dat and start_dt <= ngay_dat <= end_dt:
-                    filtered.append(ve)
-            all_tickets = filtered
-        
-        # Group theo tuyến
-        route_stats = {}
-        for ve in all_tickets:
-            if ve.get("trangThai") == "cancelled":
-                continue
+        # Lấy snapshot trước khi gửi header để còn trả 503 nếu chưa có
+        snapshot = await analytics_snapshot_service.ensure_snapshot()
+        
+        async def rows():
+            # Header
+            yield [
+                "Hạng", "Mã CX", "Điểm đi", "Điểm đến", "Giá vé (VNĐ)",
+                "Số vé bán", "Doanh thu (VNĐ)"
+            ]
             
-            maCX = ve.get("maCX", "")
-            if not maCX:
-                continue
+            # Group theo tuyến trên snapshot dạng cột (bỏ vé đã hủy)
+            groups = analytics_snapshot_service.group_by(
+                snapshot, "tickets", "route",
+                date_from=start_dt.strftime("%Y-%m-%d") if start_dt else None,
+                date_to=end_dt.strftime("%Y-%m-%d") if end_dt else None,
+                exclude_status=["cancelled"]
+            )
+            # Sort by revenue
+            groups = sorted((g for g in groups if g["key"]), key=lambda g: g["amount"], reverse=True)
             
-            if maCX not in route_stats:
-                cx = await redis_service.get_chuyen_xe(maCX)
-                route_stats[maCX] = {
-                    "maCX": maCX,
-                    "diemDi": cx.get("diemDi", "N/A") if cx else ve.get("diemDi", "N/A"),
-                    "diemDen": cx.get("diemDen", "N/A") if cx else ve.get("diemDen", "N/A"),
-                    "giaVe": cx.get("giaChuyenXe", 0) if cx else 0,
-                    "total_tickets": 0,
-                    "total_revenue": 0
-                }
+            total_tickets = 0
+            total_revenue = 0
+            rank = 0
+            for offset in range(0, len(groups), EXPORT_BATCH_SIZE):
+                batch = groups[offset:offset + EXPORT_BATCH_SIZE]
+                cx_list = await redis_service.get_multiple("chuyenXe", [g["key"] for g in batch])
+                for g, cx in zip(batch, cx_list):
+                    rank += 1
+                    yield [
+                        rank,
+                        g["key"],
+                        cx.get("diemDi", "N/A") if cx else "N/A",
+                        cx.get("diemDen", "N/A") if cx else "N/A",
+                        cx.get("giaChuyenXe", 0) if cx else 0,
+                        g["count"],
+                        g["amount"]
+                    ]
+                    total_tickets += g["count"]
+                    total_revenue += g["amount"]
             
-            route_stats[maCX]["total_tickets"] += 1
-            route_stats[maCX]["total_revenue"] += float(ve.get("giaVe", 0) or 0)
-        
-        # Sort by revenue
-        routes_list = sorted(route_stats.values(), key=lambda x: x["total_revenue"], reverse=True)
-        
-        # Tạo CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "Hạng", "Mã CX", "Điểm đi", "Điểm đến", "Giá vé (VNĐ)",
-            "Số vé bán", "Doanh thu (VNĐ)"
-        ])
-        
-        # Data
-        total_tickets = 0
-        total_revenue = 0
-        for i, r in enumerate(routes_list, 1):
-            writer.writerow([
-                i,
-                r["maCX"],
-                r["diemDi"],
-                r["diemDen"],
-                r["giaVe"],
-                r["total_tickets"],
-                r["total_revenue"]
-            ])
-            total_tickets += r["total_tickets"]
-            total_revenue += r["total_revenue"]
-        
-        # Tổng
-        writer.writerow([])
-        writer.writerow(["", "", "", "TỔNG CỘNG", "", total_tickets, total_revenue])
-        
-        output.seek(0)
+            # Tổng
+            yield []
+            yield ["", "", "", "TỔNG CỘNG", "", total_tickets, total_revenue]
         
         filename = f"tuyen_xe_{period}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        return create_csv_response(output.getvalue(), filename)
+        return create_csv_response(rows(), filename, request)
+    except SnapshotUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xuất CSV: {str(e)}")
+
+
+# ========== EXPORT JOBS (BACKGROUND) ==========
+# Export lớn (vd: vé / hóa đơn cả năm) chạy ở background và ghi file ra đĩa:
+# POST /export/jobs -> poll GET /export/jobs/{jobId} -> GET /export/jobs/{jobId}/download
+
+class ExportJobRequest(BaseModel):
+    type: Literal["invoices", "tickets", "revenue"]
+    period: str = "month"  # invoices, tickets: today, week, month, year, all
+    status: Optional[str] = None  # tickets: paid, confirmed, cancelled
+    days: int = 30  # revenue: 1-365
+
+
+@router.post("/export/jobs", status_code=202)
+async def create_export_job(
+    data: ExportJobRequest,
+    current_user: dict = Depends(get_current_employee)
+):
+    """
+    Tạo job export chạy nền (job giống hệt tạo gần đây sẽ được dùng lại)
+    """
+    try:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if data.type == "invoices":
+            params = {"period": data.period}
+            filename = f"hoa_don_{data.period}_{stamp}.csv"
+            total = await redis_service.count("hoaDon")
+            rows = lambda progress: _invoice_rows(data.period, progress)
+        elif data.type == "tickets":
+            params = {"period": data.period, "status": data.status}
+            filename = f"ve_xe_{data.period}_{stamp}.csv"
+            total = await redis_service.count("veXe")
+            rows = lambda progress: _ticket_rows(data.period, data.status, progress)
+        else:
+            if not 1 <= data.days <= 365:
+                raise HTTPException(status_code=400, detail="days phải trong khoảng 1-365")
+            params = {"days": data.days}
+            filename = f"doanh_thu_{data.days}ngay_{stamp}.csv"
+            total = data.days
+            rows = lambda progress: _revenue_rows(data.days, progress)
+        
+        return await export_job_service.submit(
+            data.type, params, filename, total,
+            lambda progress: _csv_chunks(rows(progress))
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tạo job export: {str(e)}")
+
+
+@router.get("/export/jobs/{job_id}")
+async def get_export_job(job_id: str, current_user: dict = Depends(get_current_employee)):
+    """
+    Trạng thái và tiến độ của job export
+    """
+    try:
+        job = await export_job_service.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Không tìm thấy job export hoặc job đã hết hạn")
+        if job["status"] == "done":
+            job["downloadUrl"] = f"{router.prefix}/export/jobs/{job_id}/download"
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy trạng thái job: {str(e)}")
+
+
+@router.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, current_user: dict = Depends(get_current_employee)):
+    """
+    Tải file kết quả của job export đã hoàn thành
+    """
+    try:
+        job = await export_job_service.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Không tìm thấy job export hoặc job đã hết hạn")
+        if job["status"] != "done":
+            raise HTTPException(status_code=409, detail=f"Job export chưa hoàn thành (trạng thái: {job['status']})")
+        
+        path = export_job_service.file_path(job_id)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=410, detail="File export đã bị xóa")
+        
+        return FileResponse(
+            path,
+            media_type="text/csv; charset=utf-8-sig",
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{job['filename']}"}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tải file export: {str(e)}")
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.core.middleware import get_current_customer
-from app.services.redis_service import redis_service
+from app.services.redis_service import redis_service, UniqueConstraintError
 from typing import Dict
 
 router = APIRouter(prefix="/users", tags=["Users"])
@@ -37,10 +37,16 @@ async def update_my_profile(
         )
     
     # Update user in Redis
-    updated_user = await redis_service.update_khach_hang(
-        current_user["maKH"],
-        update_fields
-    )
+    try:
+        updated_user = await redis_service.update_khach_hang(
+            current_user["maKH"],
+            update_fields
+        )
+    except UniqueConstraintError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     if not updated_user:
         raise HTTPException(
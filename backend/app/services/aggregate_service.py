@@ -0,0 +1,615 @@
+"""
+Aggregate Service - Doanh thu tổng hợp tại thời điểm ghi
+
+Mỗi bucket là một HASH với các field:
+    revenue (doanh thu gộp), bookings (số hóa đơn), tickets (số vé),
+    refunds (tiền hoàn), refunded_tickets (số vé đã hoàn),
+    trips / seats / seats_sold (chuyến đã chạy, tổng ghế, ghế đã bán -> tỷ lệ lấp đầy)
+
+Các bucket:
+- agg:day:{YYYY-MM-DD}, agg:month:{YYYY-MM}, agg:year:{YYYY}, agg:total
+- agg:route:{maCX}, agg:route:{maCX}:month:{YYYY-MM}, agg:route:{maCX}:day:{YYYY-MM-DD}
+- agg:method:{phuongThucThanhToan}, agg:method:{phuongThucThanhToan}:month:{YYYY-MM}
+- agg:recorded -> SET đánh dấu hóa đơn / vé đã được cộng (tránh cộng hai lần)
+
+Bảng xếp hạng (ZSET, member là mã thực thể, score là giá trị cộng dồn):
+- lb:route:{tickets|bookings|revenue}:{day:YYYY-MM-DD | month:YYYY-MM | all}
+- lb:customer:{spent|bookings|tickets}:{...} (hoàn vé trừ spent / tickets vào kỳ của ngày hoàn)
+Khoảng thời gian bất kỳ được ghép từ các ZSET tháng / ngày bằng ZUNIONSTORE.
+
+Tỷ lệ lấp đầy (ghi khi lịch chạy hoàn thành):
+- agg:occ:trips[:{maCX}] -> ZSET chuỗi thời gian theo chuyến
+  (member "maLC|ghế đã bán|tổng ghế", score: epoch giờ khởi hành)
+- agg:occ:heat[:{maCX}] -> HASH "{thứ}:{giờ}:{trips|seats|sold}" cho heatmap thứ x giờ khởi hành
+
+confirm_payment gọi record_payment, duyệt hoàn vé gọi record_refund, lịch chạy hoàn thành
+gọi record_trip (ghế tính theo ngày khởi hành); mỗi lần ghi đánh dấu agg:recorded và tăng
+tất cả bucket trong cùng một Lua script (RECORD_ONCE): ghi lỗi thì chưa có gì được đánh dấu,
+gọi lại vẫn cộng được. Thống kê chỉ đọc O(số ngày) hash thay vì toàn bộ hoaDon.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict
+
+from app.services.redis_service import redis_service
+from app.utils import epoch_date, doc_epoch, from_epoch, local_now
+
+AGG_FIELDS = ["revenue", "bookings", "tickets", "refunds", "refunded_tickets", "trips", "seats", "seats_sold"]
+RECORDED_KEY = "agg:recorded"
+DEFAULT_METHOD = "Khác"
+
+LEADERBOARD_METRICS = {
+    "route": ["tickets", "bookings", "revenue"],
+    "customer": ["spent", "bookings", "tickets"],
+}
+DAY_LEADERBOARD_TTL = 400 * 24 * 3600  # ZSET theo ngày chỉ cần cho các khoảng gần đây
+UNION_TTL = 60
+ROUTE_DAY_TTL = DAY_LEADERBOARD_TTL  # Bucket tuyến theo ngày chỉ phục vụ chuỗi ngày gần đây
+OCC_SEPARATOR = "|"
+WEEKDAY_NAMES = ["T2", "T3", "T4", "T5", "T6", "T7", "CN"]
+
+# Đánh dấu ARGV[1] trong KEYS[1] (agg:recorded) rồi chạy các lệnh ghi trong ARGV[2]
+# (JSON [[lệnh, vị trí key trong KEYS, tham số...], ...]); đã đánh dấu thì không làm gì.
+# Trả về 1 nếu đã cộng, 0 nếu giao dịch đã được cộng trước đó
+RECORD_ONCE = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local unpack = unpack or table.unpack
+for _, op in ipairs(cjson.decode(ARGV[2])) do
+    local args = {op[1], KEYS[op[2]]}
+    for i = 3, #op do
+        args[#args + 1] = op[i]
+    end
+    redis.call(unpack(args))
+end
+return 1
+"""
+
+
+def invoice_date(hoa_don: dict) -> Optional[str]:
+    """Ngày (YYYY-MM-DD) của hóa đơn từ ngayLapTs, hoặc ngayTao / ngayLap nếu chưa backfill"""
+    if hoa_don.get("ngayLapTs") is not None:
+        return epoch_date(hoa_don["ngayLapTs"])
+    ngay = hoa_don.get("ngayTao") or hoa_don.get("ngayLap")
+    if not ngay:
+        return None
+    date_part = str(ngay).split("T")[0]
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(date_part, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _bucket_keys(date: str, maCX: Optional[str], method: Optional[str]) -> List[str]:
+    """Danh sách bucket cần tăng cho một giao dịch vào ngày `date`"""
+    month = date[:7]
+    keys = [f"agg:day:{date}", f"agg:month:{month}", f"agg:year:{date[:4]}", "agg:total"]
+    if maCX:
+        keys += [f"agg:route:{maCX}", f"agg:route:{maCX}:month:{month}", f"agg:route:{maCX}:day:{date}"]
+    if method is not None:
+        method = method or DEFAULT_METHOD
+        keys += [f"agg:method:{method}", f"agg:method:{method}:month:{month}"]
+    return keys
+
+
+def _queue_expire(pipeline, key: str):
+    if key.startswith("agg:route:") and ":day:" in key:
+        pipeline.expire(key, ROUTE_DAY_TTL)
+
+
+def _leaderboard_periods(date: str) -> List[str]:
+    """Các kỳ của bảng xếp hạng chứa ngày `date`"""
+    return [f"day:{date}", f"month:{date[:7]}", "all"]
+
+
+def _range_periods(start: Optional[datetime], end: Optional[datetime]) -> List[str]:
+    """
+    Ghép khoảng [start, end] từ ít ZSET nhất: tháng trọn vẹn dùng ZSET tháng
+    (tháng hiện tại được tính là trọn vẹn nếu end là hôm nay), phần lẻ dùng ZSET ngày.
+    None -> toàn thời gian.
+    """
+    if start is None or end is None:
+        return ["all"]
+    today = local_now().date()
+    start_date, end_date = start.date(), end.date()
+    periods = []
+    day = start_date
+    while day <= end_date:
+        month_start = day.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        month_end = next_month - timedelta(days=1)
+        covers_month = day == month_start and (end_date >= month_end or end_date >= today >= day)
+        if covers_month:
+            periods.append(f"month:{day.strftime('%Y-%m')}")
+            day = next_month
+        else:
+            periods.append(f"day:{day.strftime('%Y-%m-%d')}")
+            day += timedelta(days=1)
+    return periods
+
+
+def _parse_bucket(data: Dict[str, str]) -> dict:
+    """Chuyển HASH bucket sang số, kèm doanh thu ròng"""
+    data = data or {}
+    result = {
+        "revenue": float(data.get("revenue", 0) or 0),
+        "bookings": int(data.get("bookings", 0) or 0),
+        "tickets": int(data.get("tickets", 0) or 0),
+        "refunds": float(data.get("refunds", 0) or 0),
+        "refunded_tickets": int(data.get("refunded_tickets", 0) or 0),
+        "trips": int(data.get("trips", 0) or 0),
+        "seats": int(data.get("seats", 0) or 0),
+        "seats_sold": int(data.get("seats_sold", 0) or 0),
+    }
+    result["net_revenue"] = result["revenue"] - result["refunds"]
+    result["occupancy"] = _occupancy(result)
+    return result
+
+
+def _occupancy(bucket: dict) -> float:
+    """Tỷ lệ lấp đầy (%) của các chuyến đã chạy"""
+    return round(bucket["seats_sold"] / bucket["seats"] * 100, 2) if bucket["seats"] else 0.0
+
+
+class _RecordOps:
+    """
+    Gom các lệnh ghi của _queue_* (cùng tên phương thức với pipeline) để chạy trong RECORD_ONCE
+    """
+
+    def __init__(self):
+        self.keys: List[str] = [RECORDED_KEY]
+        self.ops: List[list] = []
+
+    def _add(self, command: str, key: str, *args):
+        if key not in self.keys:
+            self.keys.append(key)
+        self.ops.append([command, self.keys.index(key) + 1, *[str(arg) for arg in args]])
+
+    def hincrby(self, key: str, field: str, amount: int):
+        self._add("HINCRBY", key, field, amount)
+
+    def hincrbyfloat(self, key: str, field: str, amount: float):
+        self._add("HINCRBYFLOAT", key, field, amount)
+
+    def zincrby(self, key: str, amount: float, member: str):
+        self._add("ZINCRBY", key, amount, member)
+
+    def zadd(self, key: str, mapping: Dict[str, float]):
+        for member, score in mapping.items():
+            self._add("ZADD", key, score, member)
+
+    def expire(self, key: str, seconds: int):
+        self._add("EXPIRE", key, seconds)
+
+
+class AggregateService:
+    """
+    Ghi và đọc các bucket doanh thu tổng hợp
+    """
+
+    @staticmethod
+    async def _record_once(marker: str, ops: _RecordOps) -> bool:
+        """
+        Đánh dấu và ghi một giao dịch trong cùng một lệnh (RECORD_ONCE)
+
+        Returns:
+            False nếu giao dịch đã được cộng trước đó
+        """
+        redis = await redis_service._get_client()
+        recorded = await redis.eval(
+            RECORD_ONCE, len(ops.keys), *ops.keys, marker, json.dumps(ops.ops, ensure_ascii=False)
+        )
+        return bool(recorded)
+
+    @staticmethod
+    def _queue_leaderboard(pipeline, entity: str, member: str, date: str, values: Dict[str, float]):
+        for period in _leaderboard_periods(date):
+            for metric, value in values.items():
+                key = f"lb:{entity}:{metric}:{period}"
+                pipeline.zincrby(key, value, member)
+                if period.startswith("day:"):
+                    pipeline.expire(key, DAY_LEADERBOARD_TTL)
+
+    @staticmethod
+    def _queue_payment(pipeline, date: str, amount: float, tickets: int,
+                       maCX: Optional[str], method: Optional[str], maKH: Optional[str] = None):
+        for key in _bucket_keys(date, maCX, method or ""):
+            pipeline.hincrbyfloat(key, "revenue", amount)
+            pipeline.hincrby(key, "bookings", 1)
+            pipeline.hincrby(key, "tickets", tickets)
+            _queue_expire(pipeline, key)
+        if maCX:
+            AggregateService._queue_leaderboard(
+                pipeline, "route", maCX, date,
+                {"tickets": tickets, "bookings": 1, "revenue": amount}
+            )
+        if maKH:
+            AggregateService._queue_leaderboard(
+                pipeline, "customer", maKH, date,
+                {"spent": amount, "bookings": 1, "tickets": tickets}
+            )
+
+    @staticmethod
+    def _queue_refund(pipeline, date: str, amount: float, tickets: int,
+                      maCX: Optional[str], method: Optional[str], maKH: Optional[str] = None):
+        for key in _bucket_keys(date, maCX, method or ""):
+            pipeline.hincrbyfloat(key, "refunds", amount)
+            pipeline.hincrby(key, "refunded_tickets", tickets)
+            _queue_expire(pipeline, key)
+        if maKH:
+            AggregateService._queue_leaderboard(
+                pipeline, "customer", maKH, date,
+                {"spent": -amount, "tickets": -tickets}
+            )
+
+    @staticmethod
+    async def record_payment(hoa_don: dict, maCX: Optional[str] = None):
+        """
+        Cộng một hóa đơn đã thanh toán vào các bucket (chỉ một lần cho mỗi maHD)
+
+        Args:
+            hoa_don: Hóa đơn vừa tạo
+            maCX: Chuyến xe của các vé trong hóa đơn (mặc định lấy từ hoa_don["maCX"])
+        """
+        date = invoice_date(hoa_don)
+        if not date:
+            return
+        ops = _RecordOps()
+        AggregateService._queue_payment(
+            ops,
+            date,
+            float(hoa_don.get("tongTien", 0) or 0),
+            len(hoa_don.get("danhSachVe", []) or []),
+            maCX or hoa_don.get("maCX"),
+            hoa_don.get("phuongThucThanhToan"),
+            hoa_don.get("maKH")
+        )
+        await AggregateService._record_once(f"pay:{hoa_don.get('maHD')}", ops)
+
+    @staticmethod
+    async def record_refund(maVe: str, amount: float, date: str, maCX: Optional[str] = None,
+                            method: Optional[str] = None, maKH: Optional[str] = None):
+        """
+        Cộng một vé đã hoàn tiền vào các bucket (chỉ một lần cho mỗi maVe)
+
+        Args:
+            maVe: Mã vé được hoàn
+            amount: Số tiền hoàn
+            date: Ngày duyệt hoàn (YYYY-MM-DD)
+            maCX: Chuyến xe của vé
+            method: Phương thức thanh toán của hóa đơn gốc
+            maKH: Khách hàng của vé (trừ vào bảng xếp hạng khách hàng)
+        """
+        ops = _RecordOps()
+        AggregateService._queue_refund(ops, date[:10], float(amount or 0), 1, maCX, method, maKH)
+        await AggregateService._record_once(f"refund:{maVe}", ops)
+
+    @staticmethod
+    def _queue_trip(pipeline, maLC: str, ts: int, maCX: Optional[str], seats: int, sold: int):
+        for key in _bucket_keys(epoch_date(ts), maCX, None):
+            pipeline.hincrby(key, "trips", 1)
+            pipeline.hincrby(key, "seats", seats)
+            pipeline.hincrby(key, "seats_sold", sold)
+            _queue_expire(pipeline, key)
+
+        departure = from_epoch(ts)
+        cell = f"{departure.weekday()}:{departure.hour}"
+        member = OCC_SEPARATOR.join([maLC, str(sold), str(seats)])
+        for suffix in ["", f":{maCX}"] if maCX else [""]:
+            pipeline.zadd(f"agg:occ:trips{suffix}", {member: ts})
+            heat_key = f"agg:occ:heat{suffix}"
+            pipeline.hincrby(heat_key, f"{cell}:trips", 1)
+            pipeline.hincrby(heat_key, f"{cell}:seats", seats)
+            pipeline.hincrby(heat_key, f"{cell}:sold", sold)
+
+    @staticmethod
+    def trip_capacity(xe: Optional[dict]) -> int:
+        """Tổng số ghế của lịch chạy theo xe (mặc định 34)"""
+        xe = xe or {}
+        return int(xe.get("soChoNgoi", xe.get("soGhe", 0)) or 0) or 34
+
+    @staticmethod
+    async def record_trip(lich_chay: dict):
+        """
+        Cộng một lịch chạy vừa hoàn thành vào các bucket (chỉ một lần cho mỗi maLC):
+        số chuyến, tổng ghế và số ghế đã bán (từ booked:{maLC}) theo ngày khởi hành
+        """
+        maLC = lich_chay.get("maLC")
+        ts = doc_epoch("lichChay", lich_chay, "ngayKhoiHanhTs")
+        if not maLC or ts is None:
+            return
+        redis = await redis_service._get_client()
+        if await redis.sismember(RECORDED_KEY, f"trip:{maLC}"):
+            return
+
+        xe = await redis_service.get_xe(lich_chay.get("maXe")) if lich_chay.get("maXe") else None
+        seats = AggregateService.trip_capacity(xe)
+        sold = len(await redis_service.get_booked_seats_by_lich_chay(maLC))
+        ops = _RecordOps()
+        AggregateService._queue_trip(ops, maLC, ts, lich_chay.get("maCX"), seats, min(sold, seats))
+        await AggregateService._record_once(f"trip:{maLC}", ops)
+
+    @staticmethod
+    async def get_trip_occupancy(maCX: Optional[str] = None, start_ts: Optional[int] = None,
+                                 end_ts: Optional[int] = None, limit: Optional[int] = 500) -> List[dict]:
+        """
+        Tỷ lệ lấp đầy từng chuyến đã chạy (mới nhất trước) trong [start_ts, end_ts]
+        (limit=None -> tất cả)
+        """
+        redis = await redis_service._get_client()
+        key = f"agg:occ:trips:{maCX}" if maCX else "agg:occ:trips"
+        page = {"start": 0, "num": limit} if limit else {}
+        rows = await redis.zrevrangebyscore(
+            key,
+            end_ts if end_ts is not None else "+inf",
+            start_ts if start_ts is not None else "-inf",
+            withscores=True, **page
+        )
+        result = []
+        for member, ts in rows:
+            maLC, sold, seats = member.rsplit(OCC_SEPARATOR, 2)
+            sold, seats = int(sold), int(seats)
+            result.append({
+                "maLC": maLC,
+                "departureTs": int(ts),
+                "seats": seats,
+                "seats_sold": sold,
+                "occupancy": round(sold / seats * 100, 2) if seats else 0.0
+            })
+        return result
+
+    @staticmethod
+    async def get_occupancy_heatmap(maCX: Optional[str] = None, start_ts: Optional[int] = None,
+                                    end_ts: Optional[int] = None) -> dict:
+        """
+        Heatmap tỷ lệ lấp đầy theo thứ (T2..CN) x giờ khởi hành (0..23)
+
+        Không có khoảng thời gian -> đọc HASH cộng dồn (một lệnh); có khoảng thời gian ->
+        cộng các chuyến trong ZSET chuỗi thời gian của khoảng đó.
+        """
+        cells: Dict[str, Dict[str, int]] = {}
+        if start_ts is None and end_ts is None:
+            redis = await redis_service._get_client()
+            data = await redis.hgetall(f"agg:occ:heat:{maCX}" if maCX else "agg:occ:heat")
+            for field, value in data.items():
+                weekday, hour, metric = field.split(":")
+                cells.setdefault(f"{weekday}:{hour}", {"trips": 0, "seats": 0, "sold": 0})[metric] = int(value)
+        else:
+            trips = await AggregateService.get_trip_occupancy(maCX, start_ts, end_ts, limit=None)
+            for trip in trips:
+                departure = from_epoch(trip["departureTs"])
+                cell = cells.setdefault(f"{departure.weekday()}:{departure.hour}", {"trips": 0, "seats": 0, "sold": 0})
+                cell["trips"] += 1
+                cell["seats"] += trip["seats"]
+                cell["sold"] += trip["seats_sold"]
+
+        matrix = [[None] * 24 for _ in range(7)]
+        total = {"trips": 0, "seats": 0, "sold": 0}
+        for key, cell in cells.items():
+            weekday, hour = (int(x) for x in key.split(":"))
+            matrix[weekday][hour] = round(cell["sold"] / cell["seats"] * 100, 2) if cell["seats"] else None
+            for metric in total:
+                total[metric] += cell[metric]
+
+        return {
+            "weekdays": WEEKDAY_NAMES,
+            "hours": list(range(24)),
+            "occupancy": matrix,
+            "cells": [
+                {"weekday": int(k.split(":")[0]), "hour": int(k.split(":")[1]), **v}
+                for k, v in sorted(cells.items(), key=lambda kv: tuple(int(x) for x in kv[0].split(":")))
+            ],
+            "trips": total["trips"],
+            "seats": total["seats"],
+            "seats_sold": total["sold"],
+            "overall_occupancy": round(total["sold"] / total["seats"] * 100, 2) if total["seats"] else 0.0
+        }
+
+    @staticmethod
+    async def get_bucket(key: str) -> dict:
+        """Đọc một bucket, vd: "total", "month:2025-12", "route:CX001" """
+        redis = await redis_service._get_client()
+        return _parse_bucket(await redis.hgetall(f"agg:{key}"))
+
+    @staticmethod
+    async def get_buckets(keys: List[str]) -> List[dict]:
+        """Đọc nhiều bucket trong một round trip (pipeline HGETALL)"""
+        if not keys:
+            return []
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hgetall(f"agg:{key}")
+        return [_parse_bucket(data) for data in await pipeline.execute()]
+
+    @staticmethod
+    async def get_days(start: datetime, end: datetime, maCX: Optional[str] = None) -> List[dict]:
+        """
+        Các bucket ngày trong [start, end], đủ mọi ngày (ngày không có giao dịch = 0)
+
+        Args:
+            maCX: Nếu có, đọc bucket ngày của tuyến (agg:route:{maCX}:day:*)
+        """
+        days = []
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day.date() <= end.date():
+            days.append(day.strftime("%Y-%m-%d"))
+            day += timedelta(days=1)
+
+        prefix = f"route:{maCX}:day" if maCX else "day"
+        buckets = await AggregateService.get_buckets([f"{prefix}:{date}" for date in days])
+        return [{"date": date, **bucket} for date, bucket in zip(days, buckets)]
+
+    @staticmethod
+    async def get_range(start: Optional[datetime], end: Optional[datetime],
+                        maCX: Optional[str] = None) -> dict:
+        """
+        Tổng các bucket trong [start, end] (None = toàn thời gian), ghép từ ít bucket nhất:
+        tháng trọn vẹn đọc bucket tháng, phần lẻ đọc bucket ngày
+        """
+        prefix = f"route:{maCX}" if maCX else None
+        keys = []
+        for period in _range_periods(start, end):
+            if period == "all":
+                keys.append(prefix or "total")
+            else:
+                keys.append(f"{prefix}:{period}" if prefix else period)
+        return AggregateService.sum_buckets(await AggregateService.get_buckets(keys))
+
+    @staticmethod
+    async def get_months(months: int, maCX: Optional[str] = None) -> List[dict]:
+        """
+        Bucket của `months` tháng gần nhất (tính cả tháng hiện tại), cũ trước mới sau
+        """
+        now = local_now()
+        keys = []
+        for i in range(months - 1, -1, -1):
+            month = now.month - i
+            year = now.year
+            while month <= 0:
+                month += 12
+                year -= 1
+            keys.append(f"{year:04d}-{month:02d}")
+        prefix = f"route:{maCX}:month" if maCX else "month"
+        buckets = await AggregateService.get_buckets([f"{prefix}:{month}" for month in keys])
+        return [{"month": month, **bucket} for month, bucket in zip(keys, buckets)]
+
+    @staticmethod
+    async def get_leaderboard(entity: str, sort_by: str, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None, limit: Optional[int] = 10) -> List[dict]:
+        """
+        Top `limit` thực thể theo `sort_by` trong khoảng [start, end] (None = toàn thời gian).
+        limit=None trả về toàn bộ bảng xếp hạng (dùng cho xuất file).
+
+        Returns:
+            [{"id": mã, metric: giá trị, ...}] theo thứ tự giảm dần, kèm mọi metric của entity
+        """
+        metrics = LEADERBOARD_METRICS[entity]
+        if sort_by not in metrics:
+            raise ValueError(f"sort_by phải là một trong: {', '.join(metrics)}")
+
+        periods = _range_periods(start, end)
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        keys = {}
+        for metric in metrics:
+            sources = [f"lb:{entity}:{metric}:{period}" for period in periods]
+            if len(sources) == 1:
+                keys[metric] = sources[0]
+            else:
+                digest = hashlib.sha1("|".join(sources).encode("utf-8")).hexdigest()[:16]
+                keys[metric] = f"lb:tmp:{entity}:{metric}:{digest}"
+                pipeline.zunionstore(keys[metric], sources)
+                pipeline.expire(keys[metric], UNION_TTL)
+        pipeline.zrevrange(keys[sort_by], 0, (limit or 0) - 1, withscores=True)
+        top = (await pipeline.execute())[-1]
+        if not top:
+            return []
+
+        other_metrics = [m for m in metrics if m != sort_by]
+        pipeline = redis.pipeline(transaction=False)
+        for member, _ in top:
+            for metric in other_metrics:
+                pipeline.zscore(keys[metric], member)
+        scores = await pipeline.execute()
+
+        result = []
+        for i, (member, score) in enumerate(top):
+            row = {"id": member, sort_by: score}
+            for j, metric in enumerate(other_metrics):
+                row[metric] = scores[i * len(other_metrics) + j] or 0
+            result.append(row)
+        return result
+
+    @staticmethod
+    def sum_buckets(buckets: List[dict]) -> dict:
+        """Cộng dồn nhiều bucket đã parse"""
+        total = _parse_bucket({})
+        for bucket in buckets:
+            for field in AGG_FIELDS + ["net_revenue"]:
+                total[field] += bucket.get(field, 0)
+        total["occupancy"] = _occupancy(total)
+        return total
+
+    @staticmethod
+    async def rebuild() -> dict:
+        """
+        Xóa và tính lại toàn bộ bucket từ hoaDon và veXe đã hoàn
+
+        Returns:
+            Số hóa đơn và số vé hoàn đã cộng
+        """
+        redis = await redis_service._get_client()
+        invoices = await redis_service.get_all_hoa_don()
+        tickets = {ve.get("maVe"): ve for ve in await redis_service.get_all("veXe")}
+        schedules = {lc.get("maLC"): lc for lc in await redis_service.get_all_lich_chay()}
+
+        def ticket_route(ve: Optional[dict]) -> Optional[str]:
+            if not ve:
+                return None
+            return ve.get("maCX") or (schedules.get(ve.get("maLC")) or {}).get("maCX")
+
+        old_keys = [key async for key in redis.scan_iter(match="agg:*")]
+        old_keys += [key async for key in redis.scan_iter(match="lb:*")]
+
+        pipeline = redis.pipeline(transaction=True)
+        if old_keys:
+            pipeline.delete(*old_keys)
+
+        invoice_count = 0
+        refund_count = 0
+        methods = {}
+        for hd in invoices:
+            date = invoice_date(hd)
+            if not date:
+                continue
+            danh_sach_ve = hd.get("danhSachVe", []) or []
+            maCX = hd.get("maCX") or (ticket_route(tickets.get(danh_sach_ve[0])) if danh_sach_ve else None)
+            AggregateService._queue_payment(
+                pipeline, date, float(hd.get("tongTien", 0) or 0), len(danh_sach_ve),
+                maCX, hd.get("phuongThucThanhToan"), hd.get("maKH")
+            )
+            pipeline.sadd(RECORDED_KEY, f"pay:{hd.get('maHD')}")
+            methods[hd.get("maHD")] = hd.get("phuongThucThanhToan")
+            invoice_count += 1
+
+        for maVe, ve in tickets.items():
+            if ve.get("trangThai") != "refunded":
+                continue
+            date = str(ve.get("ngayHuy") or ve.get("ngayDat") or "")[:10]
+            if not date:
+                continue
+            AggregateService._queue_refund(
+                pipeline, date, float(ve.get("tienHoan", 0) or 0), 1,
+                ticket_route(ve), methods.get(ve.get("maHD")), ve.get("maKH")
+            )
+            pipeline.sadd(RECORDED_KEY, f"refund:{maVe}")
+            refund_count += 1
+
+        # Ghế đã bán của các lịch chạy đã hoàn thành
+        sold_by_schedule: Dict[str, set] = {}
+        for ve in tickets.values():
+            if ve.get("trangThai") in redis_service.BOOKED_STATUSES:
+                sold_by_schedule.setdefault(ve.get("maLC"), set()).update(redis_service._ticket_seats(ve))
+        buses = {xe.get("maXe"): xe for xe in await redis_service.get_all("xe")}
+        trip_count = 0
+        for maLC, lc in schedules.items():
+            ts = doc_epoch("lichChay", lc, "ngayKhoiHanhTs")
+            if lc.get("trangThai") != "completed" or ts is None:
+                continue
+            seats = AggregateService.trip_capacity(buses.get(lc.get("maXe")))
+            sold = len(sold_by_schedule.get(maLC, ()))
+            AggregateService._queue_trip(pipeline, maLC, ts, lc.get("maCX"), seats, min(sold, seats))
+            pipeline.sadd(RECORDED_KEY, f"trip:{maLC}")
+            trip_count += 1
+
+        await pipeline.execute()
+        return {"invoices": invoice_count, "refunds": refund_count, "trips": trip_count}
+
+
+# Singleton instance
+aggregate_service = AggregateService()
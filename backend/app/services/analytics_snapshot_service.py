@@ -0,0 +1,466 @@
+"""
+Analytics Snapshot Service - Snapshot dạng cột (NumPy) cho phân tích vé và hóa đơn
+
+Snapshot được ghi ra đĩa thành các file .npy và mở lại bằng mmap (mmap_mode="r"),
+nên nhiều worker dùng chung page cache của hệ điều hành mà không phải copy dữ liệu:
+
+    {ANALYTICS_DIR}/current.json            -> {"generation": n}
+    {ANALYTICS_DIR}/gen-{n}/meta.json       -> số dòng, thời điểm tạo, bảng mã (vocab)
+    {ANALYTICS_DIR}/gen-{n}/{table}.{col}.npy
+
+Bảng tickets: day (int32, số ngày từ 1970-01-01), amount (float64), route / customer /
+bus (int32, mã phân loại, -1 = không có), status (int8)
+Bảng invoices: day, amount, customer, route, method (int32), tickets (int16)
+
+- rebuild(): đọc toàn bộ hoaDon / veXe và ghi một generation mới
+- append(): đọc các hóa đơn mới từ hàng đợi analytics:new_invoices (confirm_payment đẩy vào)
+  và ghi generation mới = generation cũ + các dòng mới
+Hàng đợi chỉ được cắt sau khi generation đã ghi xong: append LTRIM đúng số phần tử đã đọc,
+rebuild LREM các hóa đơn đã có trong lần build toàn bộ (hóa đơn đẩy vào trong lúc build
+không bị mất, cũng không bị nối hai lần). Lock build mang token riêng của từng lần giữ.
+Các thay đổi trạng thái (hoàn vé, ...) được cập nhật ở lần rebuild định kỳ.
+Mỗi generation mới được "công bố" bằng os.replace(current.json) nên người đọc không
+bao giờ thấy snapshot ghi dở.
+"""
+import asyncio
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, date
+from typing import Optional, List, Dict
+
+import numpy as np
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.utils import from_epoch
+
+NEW_INVOICES_KEY = "analytics:new_invoices"
+LOCK_KEY = "analytics:lock"
+LOCK_TTL = 300
+KEEP_GENERATIONS = 2
+WAIT_TIMEOUT = 10.0  # Thời gian chờ worker khác build xong generation đầu tiên
+
+# Chỉ xóa lock nếu vẫn là token của mình (build chạy quá LOCK_TTL không xóa lock của worker khác)
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+TABLES = {
+    "tickets": {
+        "day": np.int32, "amount": np.float64, "route": np.int32,
+        "customer": np.int32, "bus": np.int32, "status": np.int8
+    },
+    "invoices": {
+        "day": np.int32, "amount": np.float64, "customer": np.int32,
+        "route": np.int32, "method": np.int32, "tickets": np.int16
+    },
+}
+CATEGORICAL = ["route", "customer", "bus", "status", "method"]
+GROUP_BY = CATEGORICAL + ["day", "month", "weekday"]
+EPOCH = date(1970, 1, 1)
+
+
+class SnapshotUnavailableError(Exception):
+    """Chưa có snapshot và worker đang build chưa xong trong WAIT_TIMEOUT"""
+
+    def __init__(self):
+        super().__init__("Snapshot phân tích đang được build, vui lòng thử lại sau")
+
+
+def epoch_day(value) -> int:
+    """Chuyển chuỗi ngày (ISO, YYYY-MM-DD, DD/MM/YYYY) sang số ngày từ 1970-01-01, -1 nếu lỗi"""
+    if not value:
+        return -1
+    date_part = str(value).split("T")[0]
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
+        try:
+            return (datetime.strptime(date_part, fmt).date() - EPOCH).days
+        except ValueError:
+            continue
+    return -1
+
+
+def doc_day(doc: dict, ts_field: str, *date_fields: str) -> int:
+    """Số ngày từ 1970-01-01 của document, ưu tiên field epoch *Ts đã chuẩn hóa"""
+    ts = doc.get(ts_field)
+    if ts is not None:
+        return (from_epoch(ts).date() - EPOCH).days
+    return epoch_day(next((doc[f] for f in date_fields if doc.get(f)), None))
+
+
+def day_to_str(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+
+class _Vocab:
+    """Bảng mã phân loại: giá trị chuỗi <-> mã int"""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values = list(values or [])
+        self.codes = {v: i for i, v in enumerate(self.values)}
+
+    def code(self, value) -> int:
+        if value in (None, ""):
+            return -1
+        value = str(value)
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+
+class AnalyticsSnapshot:
+    """Một generation đã mở (các cột là np.memmap chỉ đọc)"""
+
+    def __init__(self, generation: int, meta: dict, tables: Dict[str, Dict[str, np.ndarray]]):
+        self.generation = generation
+        self.meta = meta
+        self.tables = tables
+        self.vocab = meta.get("vocab", {})
+
+    @property
+    def generated_at(self) -> str:
+        return self.meta.get("generatedAt", "")
+
+
+class AnalyticsSnapshotService:
+    """
+    Build, append và truy vấn snapshot phân tích dạng cột
+    """
+
+    _cache: Optional[AnalyticsSnapshot] = None
+
+    @staticmethod
+    def _base_dir() -> str:
+        return settings.ANALYTICS_DIR
+
+    @staticmethod
+    def _gen_dir(generation: int) -> str:
+        return os.path.join(AnalyticsSnapshotService._base_dir(), f"gen-{generation}")
+
+    @staticmethod
+    def _current_generation() -> Optional[int]:
+        path = os.path.join(AnalyticsSnapshotService._base_dir(), "current.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["generation"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # ==================== ĐỌC ====================
+
+    @staticmethod
+    def load() -> Optional[AnalyticsSnapshot]:
+        """Mở generation hiện tại (dùng lại bản đã mở nếu chưa có generation mới)"""
+        generation = AnalyticsSnapshotService._current_generation()
+        if generation is None:
+            return None
+        cached = AnalyticsSnapshotService._cache
+        if cached and cached.generation == generation:
+            return cached
+
+        gen_dir = AnalyticsSnapshotService._gen_dir(generation)
+        with open(os.path.join(gen_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        tables = {}
+        for table, columns in TABLES.items():
+            tables[table] = {}
+            for column in columns:
+                path = os.path.join(gen_dir, f"{table}.{column}.npy")
+                # File rỗng không mmap được
+                if meta["rows"][table] == 0:
+                    tables[table][column] = np.load(path)
+                else:
+                    tables[table][column] = np.load(path, mmap_mode="r")
+        snapshot = AnalyticsSnapshot(generation, meta, tables)
+        AnalyticsSnapshotService._cache = snapshot
+        return snapshot
+
+    @staticmethod
+    async def ensure_snapshot() -> AnalyticsSnapshot:
+        """
+        Snapshot hiện tại; chưa có thì tự build, hoặc chờ worker đang giữ lock build xong
+
+        Raises:
+            SnapshotUnavailableError: Worker kia chưa build xong trong WAIT_TIMEOUT
+        """
+        snapshot = AnalyticsSnapshotService.load()
+        if snapshot is not None:
+            return snapshot
+        if await AnalyticsSnapshotService.rebuild() is not None:
+            return AnalyticsSnapshotService.load()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WAIT_TIMEOUT
+        while loop.time() < deadline:
+            await asyncio.sleep(0.2)
+            snapshot = AnalyticsSnapshotService.load()
+            if snapshot is not None:
+                return snapshot
+        raise SnapshotUnavailableError()
+
+    @staticmethod
+    def group_by(snapshot: AnalyticsSnapshot, table: str, by: str,
+                 date_from: Optional[str] = None, date_to: Optional[str] = None,
+                 status: Optional[List[str]] = None, exclude_status: Optional[List[str]] = None) -> List[dict]:
+        """
+        Lọc vector hóa theo ngày / trạng thái rồi gộp nhóm bằng np.bincount
+
+        Returns:
+            [{"key": giá trị nhóm, "count": số dòng, "amount": tổng tiền}, ...]
+        """
+        if table not in TABLES:
+            raise ValueError(f"table phải là một trong: {', '.join(TABLES)}")
+        columns = snapshot.tables[table]
+        if by not in GROUP_BY or (by in CATEGORICAL and by not in columns):
+            raise ValueError(f"Không thể nhóm bảng {table} theo {by}")
+
+        day = columns["day"]
+        mask = day >= 0
+        if date_from:
+            mask &= day >= epoch_day(date_from)
+        if date_to:
+            mask &= day <= epoch_day(date_to)
+        if (status or exclude_status) and "status" in columns:
+            status_vocab = _Vocab(snapshot.vocab.get("status", []))
+            if status:
+                mask &= np.isin(columns["status"], [status_vocab.codes.get(s, -2) for s in status])
+            if exclude_status:
+                mask &= ~np.isin(columns["status"], [status_vocab.codes.get(s, -2) for s in exclude_status])
+
+        amount = columns["amount"][mask]
+        if by in CATEGORICAL:
+            keys = columns[by][mask]
+            labels = snapshot.vocab.get(by, [])
+            offset = 1  # dịch -1 (không có) về 0 cho bincount
+        else:
+            days = day[mask]
+            if by == "day":
+                keys = days
+            elif by == "month":
+                keys = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            else:
+                keys = (days + 3) % 7  # 1970-01-01 là thứ Năm -> 0 = thứ Hai
+            offset = 0
+            labels = None
+
+        if keys.size == 0:
+            return []
+        base = int(keys.min()) if by in ("day", "month") else 0
+        shifted = keys.astype(np.int64) - base + offset
+        counts = np.bincount(shifted)
+        sums = np.bincount(shifted, weights=amount)
+
+        result = []
+        for idx in np.flatnonzero(counts):
+            raw = int(idx) + base - offset
+            if by in CATEGORICAL:
+                key = labels[raw] if 0 <= raw < len(labels) else None
+            elif by == "day":
+                key = day_to_str(raw)
+            elif by == "month":
+                key = str(np.datetime64(raw, "M"))
+            else:
+                key = raw
+            result.append({"key": key, "count": int(counts[idx]), "amount": float(sums[idx])})
+        return result
+
+    # ==================== GHI ====================
+
+    @staticmethod
+    def _ticket_row(ve: dict, schedules: Dict[str, dict], vocab: Dict[str, _Vocab]) -> tuple:
+        lich_chay = schedules.get(ve.get("maLC")) or {}
+        return (
+            doc_day(ve, "ngayDatTs", "ngayDat"),
+            float(ve.get("giaVe", 0) or 0),
+            vocab["route"].code(ve.get("maCX") or lich_chay.get("maCX")),
+            vocab["customer"].code(ve.get("maKH")),
+            vocab["bus"].code(lich_chay.get("maXe")),
+            vocab["status"].code(ve.get("trangThai")),
+        )
+
+    @staticmethod
+    def _invoice_row(hd: dict, route: Optional[str], vocab: Dict[str, _Vocab]) -> tuple:
+        return (
+            doc_day(hd, "ngayLapTs", "ngayTao", "ngayLap"),
+            float(hd.get("tongTien", 0) or 0),
+            vocab["customer"].code(hd.get("maKH")),
+            vocab["route"].code(hd.get("maCX") or route),
+            vocab["method"].code(hd.get("phuongThucThanhToan")),
+            len(hd.get("danhSachVe", []) or []),
+        )
+
+    @staticmethod
+    def _write_generation(tables: Dict[str, Dict[str, np.ndarray]], vocab: Dict[str, _Vocab],
+                          previous: Optional[AnalyticsSnapshot] = None) -> int:
+        """Ghi generation mới (nối tiếp các cột của `previous` nếu có) và công bố nó"""
+        base_dir = AnalyticsSnapshotService._base_dir()
+        os.makedirs(base_dir, exist_ok=True)
+        generation = (AnalyticsSnapshotService._current_generation() or 0) + 1
+        gen_dir = AnalyticsSnapshotService._gen_dir(generation)
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        os.makedirs(gen_dir)
+
+        rows = {}
+        for table, columns in TABLES.items():
+            new_rows = len(tables[table]["day"])
+            old_rows = previous.meta["rows"][table] if previous else 0
+            rows[table] = old_rows + new_rows
+            for column, dtype in columns.items():
+                path = os.path.join(gen_dir, f"{table}.{column}.npy")
+                out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(rows[table],))
+                if old_rows:
+                    out[:old_rows] = previous.tables[table][column]
+                if new_rows:
+                    out[old_rows:] = tables[table][column]
+                out.flush()
+                del out
+
+        meta = {
+            "generation": generation,
+            "generatedAt": datetime.now().isoformat(),
+            "rows": rows,
+            "vocab": {name: v.values for name, v in vocab.items()}
+        }
+        with open(os.path.join(gen_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        tmp_path = os.path.join(base_dir, "current.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation}, f)
+        os.replace(tmp_path, os.path.join(base_dir, "current.json"))
+
+        # Dọn các generation cũ (reader đang mmap vẫn giữ được inode đã xóa)
+        for name in os.listdir(base_dir):
+            if name.startswith("gen-"):
+                try:
+                    if int(name[4:]) <= generation - KEEP_GENERATIONS:
+                        shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+                except ValueError:
+                    pass
+        return generation
+
+    @staticmethod
+    def _to_columns(table: str, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        columns = list(TABLES[table].items())
+        if not rows:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in columns}
+        data = list(zip(*rows))
+        return {name: np.asarray(data[i], dtype=dtype) for i, (name, dtype) in enumerate(columns)}
+
+    @staticmethod
+    async def _acquire_lock() -> Optional[str]:
+        """Token của lần giữ lock, None nếu worker khác đang giữ"""
+        redis = await redis_service._get_client()
+        token = uuid.uuid4().hex
+        return token if await redis.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL) else None
+
+    @staticmethod
+    async def _release_lock(token: str):
+        redis = await redis_service._get_client()
+        await redis.eval(RELEASE_LOCK, 1, LOCK_KEY, token)
+
+    @staticmethod
+    async def rebuild() -> Optional[int]:
+        """
+        Build lại toàn bộ snapshot từ Redis (single-flight giữa các worker qua SET NX)
+
+        Returns:
+            Generation mới, None nếu worker khác đang build
+        """
+        token = await AnalyticsSnapshotService._acquire_lock()
+        if not token:
+            return None
+        try:
+            invoices = await redis_service.get_all_hoa_don()
+            tickets = await redis_service.get_all("veXe")
+            schedules = {lc.get("maLC"): lc for lc in await redis_service.get_all_lich_chay()}
+
+            vocab = {name: _Vocab() for name in CATEGORICAL}
+            ticket_rows = [AnalyticsSnapshotService._ticket_row(ve, schedules, vocab) for ve in tickets]
+            first_ticket = {ve.get("maVe"): ve for ve in tickets}
+            invoice_rows = []
+            for hd in invoices:
+                danh_sach_ve = hd.get("danhSachVe", []) or []
+                ve = first_ticket.get(danh_sach_ve[0]) if danh_sach_ve else None
+                route = (ve or {}).get("maCX") or (schedules.get((ve or {}).get("maLC")) or {}).get("maCX")
+                invoice_rows.append(AnalyticsSnapshotService._invoice_row(hd, route, vocab))
+
+            tables = {
+                "tickets": AnalyticsSnapshotService._to_columns("tickets", ticket_rows),
+                "invoices": AnalyticsSnapshotService._to_columns("invoices", invoice_rows),
+            }
+            generation = await asyncio.to_thread(AnalyticsSnapshotService._write_generation, tables, vocab)
+
+            # Bỏ khỏi hàng đợi các hóa đơn đã có trong lần build này, giữ lại hóa đơn đến sau
+            redis = await redis_service._get_client()
+            built = {hd.get("maHD") for hd in invoices}
+            queued = [maHD for maHD in dict.fromkeys(await redis.lrange(NEW_INVOICES_KEY, 0, -1)) if maHD in built]
+            if queued:
+                pipeline = redis.pipeline(transaction=False)
+                for maHD in queued:
+                    pipeline.lrem(NEW_INVOICES_KEY, 0, maHD)
+                await pipeline.execute()
+            return generation
+        finally:
+            await AnalyticsSnapshotService._release_lock(token)
+
+    @staticmethod
+    async def append() -> int:
+        """
+        Nối các hóa đơn mới (và vé của chúng) vào snapshot hiện tại
+
+        Returns:
+            Số hóa đơn đã nối
+        """
+        if AnalyticsSnapshotService.load() is None:
+            await AnalyticsSnapshotService.rebuild()
+            return 0
+        token = await AnalyticsSnapshotService._acquire_lock()
+        if not token:
+            return 0
+        try:
+            # Đọc lại sau khi giữ lock: worker khác có thể vừa ghi generation mới
+            previous = AnalyticsSnapshotService.load()
+            redis = await redis_service._get_client()
+            queued = await redis.lrange(NEW_INVOICES_KEY, 0, -1)
+            ma_hd_list = list(dict.fromkeys(queued))
+            if not ma_hd_list:
+                return 0
+
+            invoices = [hd for hd in await redis_service.get_multiple("hoaDon", ma_hd_list) if hd]
+            ma_ve_list = [maVe for hd in invoices for maVe in (hd.get("danhSachVe", []) or [])]
+            tickets = [ve for ve in await redis_service.get_multiple("veXe", ma_ve_list) if ve]
+            ma_lc_list = list({ve.get("maLC") for ve in tickets if ve.get("maLC")})
+            schedules = {
+                lc.get("maLC"): lc
+                for lc in await redis_service.get_multiple("lichChay", ma_lc_list) if lc
+            }
+
+            vocab = {name: _Vocab(previous.vocab.get(name, [])) for name in CATEGORICAL}
+            ticket_rows = [AnalyticsSnapshotService._ticket_row(ve, schedules, vocab) for ve in tickets]
+            invoice_rows = [AnalyticsSnapshotService._invoice_row(hd, None, vocab) for hd in invoices]
+            tables = {
+                "tickets": AnalyticsSnapshotService._to_columns("tickets", ticket_rows),
+                "invoices": AnalyticsSnapshotService._to_columns("invoices", invoice_rows),
+            }
+            await asyncio.to_thread(AnalyticsSnapshotService._write_generation, tables, vocab, previous)
+            # Chỉ cắt các phần tử đã đọc sau khi ghi xong; hóa đơn đẩy vào sau đó vẫn ở cuối hàng đợi
+            await redis.ltrim(NEW_INVOICES_KEY, len(queued), -1)
+            return len(invoices)
+        finally:
+            await AnalyticsSnapshotService._release_lock(token)
+
+    @staticmethod
+    async def enqueue_invoice(maHD: str):
+        """Đánh dấu hóa đơn mới để lần append kế tiếp đưa vào snapshot"""
+        redis = await redis_service._get_client()
+        await redis.rpush(NEW_INVOICES_KEY, maHD)
+
+
+# Singleton instance
+analytics_snapshot_service = AnalyticsSnapshotService()
@@ -0,0 +1,316 @@
+"""
+Booking Metrics Service - Chuỗi thời gian đặt vé nhiều độ phân giải (phút / giờ / ngày)
+
+Mỗi sự kiện chỉ ghi một pipeline HINCRBY vào bucket phút:
+- ts:booking:1m:{epoch đầu phút} -> HASH bookings, tickets, revenue, holds, expiries
+- ts:booking:1h:{epoch đầu giờ} -> HASH cùng field, cộng từ 60 bucket phút
+- ts:booking:1d:{epoch 0h giờ Việt Nam} -> HASH cùng field, cộng từ 24 bucket giờ
+
+Rollup định kỳ (METRICS_ROLLUP_INTERVAL) tính lại giờ / ngày hiện tại và các giờ / ngày
+chưa chốt kể từ cursor ts:booking:rollup:{1h|1d}; mỗi bucket được ghi đè bằng tổng nên
+chạy lại nhiều lần không bị cộng trùng. Mỗi độ phân giải có TTL riêng
+(METRICS_*_RETENTION) nên bộ nhớ không tăng theo thời gian.
+
+Giữ chỗ hết hạn không sinh sự kiện: ts:booking:holds là ZSET maHD -> thời điểm hết hạn,
+thanh toán / hủy thì ZREM, rollup quét các phần tử quá hạn còn lại và ghi expiries
+vào phút hết hạn (ZREM thành công mới đếm nên nhiều worker không đếm trùng).
+"""
+import asyncio
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional, Set
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.utils import from_epoch, day_range
+
+METRIC_FIELDS = ["bookings", "tickets", "revenue", "holds", "expiries"]
+
+BUCKET_KEY = "ts:booking:{resolution}:{ts}"
+ROLLUP_CURSOR_KEY = "ts:booking:rollup:{resolution}"
+HOLDS_KEY = "ts:booking:holds"
+ROLLUP_LOCK_KEY = "ts:booking:rollup:lock"
+ROLLUP_LOCK_TTL = 60
+
+# Chỉ xóa lock nếu vẫn là token của mình (rollup chạy quá ROLLUP_LOCK_TTL không xóa lock của worker khác)
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+MINUTE = 60
+HOUR = 3600
+MAX_POINTS = 1500  # Số điểm tối đa một lần truy vấn
+RETENTION_SLACK = MINUTE  # end_ts do người gọi lấy trước khi kiểm tra retention
+
+# Giữ tham chiếu tới các task ghi nền để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _day_start(ts: int) -> int:
+    """Epoch 0h (giờ Việt Nam) của ngày chứa ts"""
+    return day_range(from_epoch(ts).strftime("%Y-%m-%d"))[0]
+
+
+def _next_day(ts: int) -> int:
+    return int((from_epoch(ts) + timedelta(days=1)).timestamp())
+
+
+def _align(resolution: str, ts: int) -> int:
+    if resolution == "1m":
+        return ts - ts % MINUTE
+    if resolution == "1h":
+        return ts - ts % HOUR
+    return _day_start(ts)
+
+
+def _step(resolution: str, ts: int) -> int:
+    if resolution == "1m":
+        return ts + MINUTE
+    if resolution == "1h":
+        return ts + HOUR
+    return _next_day(ts)
+
+
+def _retention(resolution: str) -> int:
+    return {
+        "1m": settings.METRICS_MINUTE_RETENTION,
+        "1h": settings.METRICS_HOUR_RETENTION,
+        "1d": settings.METRICS_DAY_RETENTION,
+    }[resolution]
+
+
+def _bucket_key(resolution: str, ts: int) -> str:
+    return BUCKET_KEY.format(resolution=resolution, ts=ts)
+
+
+def _parse(data: dict) -> Dict[str, int]:
+    return {field: int(float(data.get(field, 0) or 0)) for field in METRIC_FIELDS}
+
+
+class BookingMetricsService:
+    """
+    Ghi sự kiện đặt vé vào bucket phút, rollup lên giờ / ngày và đọc chuỗi thời gian
+    """
+
+    # ========== GHI ==========
+
+    @staticmethod
+    async def _incr(ts: int, counts: Dict[str, int], pipeline=None):
+        """Cộng các field vào bucket phút chứa ts (dùng pipeline có sẵn nếu truyền vào)"""
+        key = _bucket_key("1m", _align("1m", ts))
+        own = pipeline is None
+        if own:
+            redis = await redis_service._get_client()
+            pipeline = redis.pipeline(transaction=False)
+        for field, value in counts.items():
+            if value:
+                pipeline.hincrby(key, field, int(value))
+        pipeline.expire(key, settings.METRICS_MINUTE_RETENTION)
+        if own:
+            await pipeline.execute()
+
+    @staticmethod
+    async def record_booking(hoa_don: dict):
+        """Ghi một hóa đơn vừa thanh toán (và đóng giữ chỗ tương ứng)"""
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        await BookingMetricsService._incr(int(time.time()), {
+            "bookings": 1,
+            "tickets": len(hoa_don.get("danhSachVe") or []),
+            "revenue": hoa_don.get("tongTien", 0) or 0
+        }, pipeline)
+        pipeline.zrem(HOLDS_KEY, hoa_don.get("maHD", ""))
+        await pipeline.execute()
+
+    @staticmethod
+    async def record_hold(maHD: str, expire_at: int):
+        """Ghi một lượt giữ chỗ, theo dõi thời điểm hết hạn để đếm expiries"""
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        await BookingMetricsService._incr(int(time.time()), {"holds": 1}, pipeline)
+        pipeline.zadd(HOLDS_KEY, {maHD: expire_at})
+        await pipeline.execute()
+
+    @staticmethod
+    async def release_hold(maHD: str):
+        """Giữ chỗ bị hủy chủ động: không tính là hết hạn"""
+        redis = await redis_service._get_client()
+        await redis.zrem(HOLDS_KEY, maHD)
+
+    @staticmethod
+    def record_nowait(coro):
+        """Chạy một hàm ghi ở background, không làm chậm response"""
+        task = asyncio.create_task(BookingMetricsService._record_safely(coro))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @staticmethod
+    async def _record_safely(coro):
+        try:
+            await coro
+        except Exception as e:
+            # Thống kê không được làm hỏng luồng đặt vé
+            print(f"Error recording booking metrics: {e}")
+
+    # ========== ROLLUP ==========
+
+    @staticmethod
+    async def sweep_expired_holds(now: Optional[int] = None) -> int:
+        """
+        Đếm các giữ chỗ đã quá hạn mà không thanh toán / hủy
+
+        Returns:
+            Số giữ chỗ hết hạn vừa ghi nhận
+        """
+        redis = await redis_service._get_client()
+        now = now or int(time.time())
+        expired = await redis.zrangebyscore(HOLDS_KEY, "-inf", now, withscores=True)
+        if not expired:
+            return 0
+
+        pipeline = redis.pipeline(transaction=False)
+        for maHD, _ in expired:
+            pipeline.zrem(HOLDS_KEY, maHD)
+        removed = await pipeline.execute()
+
+        # Chỉ đếm phần tử worker này thực sự xóa được
+        per_minute: Dict[int, int] = {}
+        for (maHD, score), ok in zip(expired, removed):
+            if ok:
+                minute = _align("1m", int(score))
+                per_minute[minute] = per_minute.get(minute, 0) + 1
+        if per_minute:
+            pipeline = redis.pipeline(transaction=False)
+            for minute, count in per_minute.items():
+                await BookingMetricsService._incr(minute, {"expiries": count}, pipeline)
+            await pipeline.execute()
+        return sum(per_minute.values())
+
+    @staticmethod
+    async def _rollup_level(redis, source: str, target: str, now: int) -> int:
+        """
+        Tính lại các bucket `target` từ cursor đến bucket hiện tại bằng tổng các bucket `source`
+
+        Returns:
+            Số bucket đã ghi
+        """
+        cursor_key = ROLLUP_CURSOR_KEY.format(resolution=target)
+        current = _align(target, now)
+        # Không tính lại bucket mà dữ liệu nguồn đã (một phần) hết hạn
+        oldest = _step(target, _align(target, now - _retention(source)))
+        saved = await redis.get(cursor_key)
+        start = max(int(saved), oldest) if saved else current
+
+        written = 0
+        bucket = start
+        while bucket <= current:
+            end = _step(target, bucket)
+            source_keys = []
+            ts = bucket
+            while ts < end:
+                source_keys.append(_bucket_key(source, ts))
+                ts = _step(source, ts)
+
+            pipeline = redis.pipeline(transaction=False)
+            for key in source_keys:
+                pipeline.hgetall(key)
+            totals = dict.fromkeys(METRIC_FIELDS, 0)
+            for data in await pipeline.execute():
+                for field, value in _parse(data).items():
+                    totals[field] += value
+
+            if any(totals.values()):
+                key = _bucket_key(target, bucket)
+                pipeline = redis.pipeline(transaction=False)
+                pipeline.hset(key, mapping=totals)
+                pipeline.expire(key, _retention(target))
+                await pipeline.execute()
+                written += 1
+            bucket = end
+
+        # Bucket hiện tại chưa chốt: lần sau tính lại từ đây
+        await redis.set(cursor_key, current)
+        return written
+
+    @staticmethod
+    async def rollup(now: Optional[int] = None) -> Optional[dict]:
+        """
+        Quét giữ chỗ hết hạn rồi rollup phút -> giờ -> ngày (single-flight qua lock Redis)
+
+        Returns:
+            {"expiries", "hours", "days"}, hoặc None nếu worker khác đang chạy
+        """
+        redis = await redis_service._get_client()
+        token = uuid.uuid4().hex
+        if not await redis.set(ROLLUP_LOCK_KEY, token, nx=True, ex=ROLLUP_LOCK_TTL):
+            return None
+        try:
+            now = now or int(time.time())
+            expiries = await BookingMetricsService.sweep_expired_holds(now)
+            hours = await BookingMetricsService._rollup_level(redis, "1m", "1h", now)
+            days = await BookingMetricsService._rollup_level(redis, "1h", "1d", now)
+            return {"expiries": expiries, "hours": hours, "days": days}
+        finally:
+            await redis.eval(RELEASE_LOCK, 1, ROLLUP_LOCK_KEY, token)
+
+    # ========== ĐỌC ==========
+
+    @staticmethod
+    def pick_resolution(window: int) -> str:
+        """Độ phân giải nhỏ nhất mà cửa sổ `window` giây không vượt MAX_POINTS và còn trong retention"""
+        for resolution, size in (("1m", MINUTE), ("1h", HOUR), ("1d", 24 * HOUR)):
+            if window // size <= MAX_POINTS and window <= _retention(resolution):
+                return resolution
+        return "1d"
+
+    @staticmethod
+    async def get_series(start_ts: int, end_ts: int, resolution: Optional[str] = None) -> dict:
+        """
+        Chuỗi thời gian [start_ts, end_ts] (điểm trống = 0)
+
+        Args:
+            resolution: "1m", "1h", "1d" hoặc None để tự chọn theo độ dài cửa sổ
+
+        Returns:
+            {"resolution", "points": [{ts, time, bookings, ...}], "totals": {...}}
+        """
+        start_ts, end_ts = int(start_ts), int(end_ts)
+        if end_ts < start_ts:
+            raise ValueError("Thời điểm kết thúc phải sau thời điểm bắt đầu")
+        window = end_ts - start_ts
+        resolution = resolution or BookingMetricsService.pick_resolution(window)
+        if start_ts < int(time.time()) - _retention(resolution) - RETENTION_SLACK:
+            raise ValueError(f"Dữ liệu độ phân giải {resolution} chỉ được giữ "
+                             f"{_retention(resolution) // HOUR} giờ")
+
+        buckets: List[int] = []
+        ts = _align(resolution, start_ts)
+        while ts <= end_ts:
+            buckets.append(ts)
+            if len(buckets) > MAX_POINTS:
+                raise ValueError(f"Quá nhiều điểm (tối đa {MAX_POINTS}), hãy chọn độ phân giải lớn hơn")
+            ts = _step(resolution, ts)
+
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for bucket in buckets:
+            pipeline.hgetall(_bucket_key(resolution, bucket))
+        results = await pipeline.execute() if buckets else []
+
+        points = []
+        totals = dict.fromkeys(METRIC_FIELDS, 0)
+        for bucket, data in zip(buckets, results):
+            values = _parse(data)
+            for field, value in values.items():
+                totals[field] += value
+            points.append({"ts": bucket, "time": from_epoch(bucket).isoformat(), **values})
+
+        return {"resolution": resolution, "points": points, "totals": totals}
+
+
+# Singleton instance
+booking_metrics_service = BookingMetricsService()
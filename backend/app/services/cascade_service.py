@@ -0,0 +1,336 @@
+"""
+Cascade Service - Xóa document kèm các document phụ thuộc bằng background job
+
+Quan hệ giữa các collection được khai báo trong CASCADES:
+collection cha -> [(collection con, field tham chiếu, hành động)]
+
+Hành động với document con:
+- delete: xóa hẳn (ghế của xe)
+- archive: chuyển vào archive:{collection} (HASH key -> JSON) rồi xóa khỏi collection
+- archive_finished: lịch chạy đã kết thúc (completed / cancelled) thì archive,
+  lịch chạy chưa chạy thì detach để nhân viên gán lại
+- detach: giữ document, đặt field tham chiếu về None (vé, hóa đơn vẫn cần cho doanh thu)
+
+Document cha được xóa ngay khi gọi; document con được đọc và xử lý theo lô
+CASCADE_BATCH_SIZE mỗi pipeline (qua set index nếu có, không thì duyệt collection theo lô)
+trong asyncio task. Document đã xử lý không còn tham chiếu tới cha, nên chạy lại một
+bước từ đầu chỉ gặp các document còn lại.
+
+- job:cascade:{jobId} -> HASH trạng thái job (status, step, processed, total, result, ...),
+  hết hạn sau JOB_TTL giây
+- job:cascade:{jobId}:lease -> token của worker đang chạy job (SET NX EX, gia hạn mỗi lô)
+- job:cascade:pending -> SET jobId chưa xong; vòng lặp định kỳ resume() chạy tiếp các job
+  không còn lease (worker chạy job đã dừng giữa chừng)
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from app.services.redis_service import redis_service
+from app.services.departure_board_service import departure_board_service
+from app.services.trip_scheduler_service import trip_scheduler_service
+
+CASCADES = {
+    "xe": [
+        ("gheNgoi", "maXe", "delete"),
+        ("lichChay", "maXe", "archive_finished"),
+    ],
+    "khachHang": [
+        ("yeuCauHuy", "maKH", "archive"),
+        ("veXe", "maKH", "detach"),
+        ("hoaDon", "maKH", "detach"),
+    ],
+    "nhanVien": [
+        ("xe", "maNV", "detach"),
+        ("lichChay", "maNV", "detach"),
+    ],
+}
+
+FINISHED_STATUSES = ["completed", "cancelled"]
+CASCADE_BATCH_SIZE = 200
+JOB_KEY = "job:cascade:{job_id}"
+LEASE_KEY = "job:cascade:{job_id}:lease"
+PENDING_KEY = "job:cascade:pending"
+JOB_TTL = 24 * 3600
+LEASE_TTL = 60
+MAX_ATTEMPTS = 3
+ARCHIVE_KEY = "archive:{collection}"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Chỉ xóa lease nếu vẫn là token của mình
+RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Giữ tham chiếu tới các job đang chạy để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class CascadeService:
+    """
+    Xóa document cha và xử lý document con theo CASCADES
+    """
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return JOB_KEY.format(job_id=job_id)
+
+    @staticmethod
+    async def _dependent_batches(collection: str, field: str, value: str) -> AsyncIterator[List[dict]]:
+        """
+        Các lô (tối đa CASCADE_BATCH_SIZE) document con còn tham chiếu tới value
+
+        Lô trước phải được xử lý xong trước khi đọc lô sau: với set index, lô tiếp theo
+        được lấy lại từ index (document đã xử lý đã rời khỏi index)
+        """
+        redis = await redis_service._get_client()
+        if field in redis_service.SET_INDEXES.get(collection, {}):
+            await redis_service.ensure_set_indexes(collection)
+            index_key = redis_service.set_index_key(collection, field, value)
+            while True:
+                keys = await redis.srandmember(index_key, CASCADE_BATCH_SIZE)
+                if not keys:
+                    return
+                docs = await redis_service.get_multiple(collection, keys)
+                batch = [doc for doc in docs if doc and doc.get(field) == value]
+                stale = [key for key, doc in zip(keys, docs) if not doc or doc.get(field) != value]
+                if stale:
+                    # Index lệch với document (ghi thẳng bởi script): bỏ để không lặp lại mãi
+                    await redis.srem(index_key, *stale)
+                if batch:
+                    yield batch
+        else:
+            pending: List[dict] = []
+            async for docs in redis_service.iter_batches(collection):
+                pending += [doc for doc in docs if doc.get(field) == value]
+                while len(pending) >= CASCADE_BATCH_SIZE:
+                    yield pending[:CASCADE_BATCH_SIZE]
+                    pending = pending[CASCADE_BATCH_SIZE:]
+            if pending:
+                yield pending
+
+    @staticmethod
+    async def _count_dependents(collection: str, field: str, value: str) -> int:
+        """Số document con (SCARD nếu có set index, không thì đếm khi duyệt theo lô)"""
+        if field in redis_service.SET_INDEXES.get(collection, {}):
+            return (await redis_service.count_by_set_index(collection, field, [value]))[0]
+        count = 0
+        async for docs in redis_service.iter_batches(collection):
+            count += sum(1 for doc in docs if doc.get(field) == value)
+        return count
+
+    @staticmethod
+    async def delete(collection: str, key_value: str) -> dict:
+        """
+        Xóa document cha ngay, xử lý document con ở background
+
+        Returns:
+            Trạng thái job
+        """
+        if collection not in CASCADES:
+            raise ValueError(f"Collection không hỗ trợ xóa liên kết: {collection}")
+        await redis_service.delete(collection, key_value)
+
+        redis = await redis_service._get_client()
+        job_id = uuid.uuid4().hex
+        job_key = CascadeService._job_key(job_id)
+        pipeline = redis.pipeline()
+        pipeline.hset(job_key, mapping={
+            "jobId": job_id,
+            "collection": collection,
+            "key": key_value,
+            "status": STATUS_RUNNING,
+            "step": 0,
+            "attempts": 0,
+            "processed": 0,
+            "result": "{}",
+            "createdAt": time.time()
+        })
+        pipeline.expire(job_key, JOB_TTL)
+        pipeline.sadd(PENDING_KEY, job_id)
+        await pipeline.execute()
+
+        task = asyncio.create_task(CascadeService._run(job_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return await CascadeService.get(job_id)
+
+    @staticmethod
+    async def _run(job_id: str) -> bool:
+        """
+        Chạy (tiếp) job từ bước đã lưu trong job hash
+
+        Returns:
+            False nếu worker khác đang giữ lease của job
+        """
+        redis = await redis_service._get_client()
+        job_key = CascadeService._job_key(job_id)
+        lease_key = LEASE_KEY.format(job_id=job_id)
+        token = uuid.uuid4().hex
+        if not await redis.set(lease_key, token, nx=True, ex=LEASE_TTL):
+            return False
+
+        try:
+            job = await redis.hgetall(job_key)
+            if not job:
+                # Job đã hết hạn: không còn gì để báo tiến độ
+                await redis.srem(PENDING_KEY, job_id)
+                return True
+            attempts = int(job.get("attempts") or 0) + 1
+            pipeline = redis.pipeline()
+            pipeline.hset(job_key, mapping={"status": STATUS_RUNNING, "attempts": attempts})
+            pipeline.hdel(job_key, "finishedAt")
+            await pipeline.execute()
+            try:
+                await CascadeService._run_steps(job_id, job, lease_key)
+            except Exception as e:
+                print(f"❌ Cascade job {job_id} failed: {e}")
+                pipeline = redis.pipeline()
+                pipeline.hset(job_key, mapping={
+                    "status": STATUS_FAILED,
+                    "error": str(e),
+                    "finishedAt": time.time()
+                })
+                # Lỗi tạm thời (mất kết nối, ...) được resume() chạy lại, tối đa MAX_ATTEMPTS lần
+                if attempts >= MAX_ATTEMPTS:
+                    pipeline.srem(PENDING_KEY, job_id)
+                await pipeline.execute()
+            return True
+        finally:
+            await redis.eval(RELEASE_LEASE, 1, lease_key, token)
+
+    @staticmethod
+    async def _run_steps(job_id: str, job: dict, lease_key: str):
+        redis = await redis_service._get_client()
+        job_key = CascadeService._job_key(job_id)
+        collection, key_value = job["collection"], job["key"]
+        steps = CASCADES[collection]
+        step = int(job.get("step") or 0)
+        processed = int(job.get("processed") or 0)
+        result: Dict[str, Dict[str, int]] = json.loads(job.get("result") or "{}")
+
+        if "total" not in job:
+            total = processed
+            for child, field, _ in steps[step:]:
+                total += await CascadeService._count_dependents(child, field, key_value)
+            await redis.hset(job_key, "total", total)
+
+        for index in range(step, len(steps)):
+            child, field, action = steps[index]
+            counts = result.setdefault(child, {})
+            async for batch in CascadeService._dependent_batches(child, field, key_value):
+                for done_action, count in (await CascadeService._apply(child, field, action, batch)).items():
+                    counts[done_action] = counts.get(done_action, 0) + count
+                processed += len(batch)
+                pipeline = redis.pipeline()
+                pipeline.hset(job_key, mapping={"processed": processed, "result": json.dumps(result)})
+                pipeline.expire(lease_key, LEASE_TTL)
+                await pipeline.execute()
+            await redis.hset(job_key, "step", index + 1)
+
+        pipeline = redis.pipeline()
+        pipeline.hset(job_key, mapping={"status": STATUS_DONE, "finishedAt": time.time()})
+        pipeline.hdel(job_key, "error")
+        pipeline.srem(PENDING_KEY, job_id)
+        await pipeline.execute()
+
+    @staticmethod
+    async def resume() -> int:
+        """
+        Chạy tiếp các job chưa xong mà không worker nào giữ lease
+        (worker chạy job bị tắt / restart giữa chừng, hoặc job lỗi tạm thời)
+
+        Returns:
+            Số job đã chạy tiếp
+        """
+        redis = await redis_service._get_client()
+        resumed = 0
+        for job_id in await redis.smembers(PENDING_KEY):
+            if await redis.exists(LEASE_KEY.format(job_id=job_id)):
+                continue
+            if await CascadeService._run(job_id):
+                resumed += 1
+        return resumed
+
+    @staticmethod
+    async def _apply(collection: str, field: str, action: str, docs: List[dict]) -> Dict[str, int]:
+        """
+        Xử lý một lô document con trong một pipeline
+
+        Returns:
+            {hành động đã làm: số document}
+        """
+        key_field = redis_service._key_field(collection)
+        if action == "archive_finished":
+            groups = {
+                "archive": [doc for doc in docs if doc.get("trangThai") in FINISHED_STATUSES],
+                "detach": [doc for doc in docs if doc.get("trangThai") not in FINISHED_STATUSES],
+            }
+        else:
+            groups = {action: docs}
+
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline()
+        now = time.time()
+        for done_action, group in groups.items():
+            if done_action == "archive":
+                for doc in group:
+                    pipeline.hset(
+                        ARCHIVE_KEY.format(collection=collection), doc[key_field],
+                        json.dumps({**doc, "archivedAt": now}, ensure_ascii=False)
+                    )
+            if done_action in ("delete", "archive"):
+                redis_service.queue_delete_many(pipeline, collection, key_field, group)
+            elif done_action == "detach":
+                redis_service.queue_update_many(pipeline, collection, key_field, group, {field: None})
+        await pipeline.execute()
+
+        # Lịch chạy còn nằm trên bảng giờ xuất bến / hàng đợi trip scheduler
+        if collection == "lichChay":
+            for doc in groups.get("delete", []) + groups.get("archive", []):
+                await departure_board_service.remove_schedule(doc[key_field])
+                await trip_scheduler_service.unschedule(doc[key_field])
+            for doc in groups.get("detach", []):
+                await departure_board_service.sync_schedule(doc[key_field])
+
+        return {done_action: len(group) for done_action, group in groups.items() if group}
+
+    @staticmethod
+    async def get(job_id: str) -> Optional[dict]:
+        """
+        Trạng thái job, None nếu không tồn tại hoặc đã hết hạn
+
+        Returns:
+            {jobId, collection, key, status, processed, total, progress (0-100), result, ...}
+        """
+        redis = await redis_service._get_client()
+        data = await redis.hgetall(CascadeService._job_key(job_id))
+        if not data:
+            return None
+
+        job = dict(data)
+        job["result"] = json.loads(job.get("result") or "{}")
+        for field in ("processed", "total", "step", "attempts"):
+            job[field] = int(job.get(field) or 0)
+        for field in ("createdAt", "finishedAt"):
+            if field in job:
+                job[field] = float(job[field])
+        if job["status"] == STATUS_DONE:
+            job["progress"] = 100
+        elif job["total"]:
+            job["progress"] = min(99, job["processed"] * 100 // job["total"])
+        else:
+            job["progress"] = 0
+        return job
+
+
+# Singleton instance
+cascade_service = CascadeService()
@@ -0,0 +1,239 @@
+"""
+Dashboard Service - Dashboard admin được tính sẵn và cache trong Redis (stale-while-revalidate)
+
+- dashboard:admin -> JSON {"generatedAt": epoch, "data": {...}} do background refresher ghi
+- dashboard:admin:lock -> lock SET NX EX (token riêng mỗi lần giữ) để chỉ một worker
+  tính lại tại một thời điểm
+
+Request đọc thẳng bản cache; nếu bản cache cũ hơn DASHBOARD_STALE_AFTER giây thì
+kích hoạt tính lại ở background và vẫn trả về bản cũ ngay. Chỉ khi chưa có cache
+(lần đầu / sau khi flush Redis) request mới phải chờ tính.
+"""
+import asyncio
+import json
+import time
+import uuid
+from typing import Optional, Set
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.services.aggregate_service import aggregate_service
+from app.utils import local_now
+
+CACHE_KEY = "dashboard:admin"
+LOCK_KEY = "dashboard:admin:lock"
+LOCK_TTL = 60
+CACHE_TTL = 24 * 3600  # Bản cache quá cũ (không ai xem) tự hết hạn
+WAIT_TIMEOUT = 5.0  # Thời gian chờ worker khác tính xong khi chưa có cache
+RECENT_BOOKINGS = 10
+
+# Chỉ xóa lock nếu vẫn là token của mình (tính quá LOCK_TTL không xóa lock của worker khác)
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Giữ tham chiếu tới các task refresh nền để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class DashboardService:
+    """
+    Tính và cache dữ liệu dashboard admin
+    """
+
+    @staticmethod
+    async def compute() -> dict:
+        """
+        Tính toàn bộ dữ liệu dashboard từ bucket tổng hợp và bảng xếp hạng,
+        chỉ đọc theo lô các document cần hiển thị
+        """
+        now = local_now()
+
+        # === COUNTS ===
+        total_customers = await redis_service.count("khachHang")
+        total = await aggregate_service.get_bucket("total")
+
+        # === DOANH THU 6 THÁNG (bucket agg:month:*) ===
+        months = []
+        for i in range(5, -1, -1):
+            month = now.month - i
+            year = now.year
+            while month <= 0:
+                month += 12
+                year -= 1
+            months.append((year, month))
+        buckets = await asyncio.gather(*[
+            aggregate_service.get_bucket(f"month:{year:04d}-{month:02d}") for year, month in months
+        ])
+        monthly_revenue = [
+            {
+                "month": f"Tháng {month}",
+                "revenue": bucket["revenue"] / 1000000  # Convert to millions
+            }
+            for (year, month), bucket in zip(months, buckets)
+        ]
+        month_revenue = buckets[-1]["revenue"]
+
+        # === VÉ GẦN ĐÂY (sorted index theo ngày đặt) ===
+        recent_tickets = (await redis_service.page("veXe", "created", limit=RECENT_BOOKINGS))["items"]
+
+        kh_list = await redis_service.get_multiple(
+            "khachHang", [t.get("maKH", "") for t in recent_tickets]
+        )
+        lich_chay_list = await redis_service.get_multiple(
+            "lichChay", [t.get("maLC", "") for t in recent_tickets]
+        )
+        ma_cx_list = list({
+            (t.get("maCX") or (lc or {}).get("maCX", ""))
+            for t, lc in zip(recent_tickets, lich_chay_list)
+        } - {""})
+        chuyen_xe_map = {
+            maCX: cx
+            for maCX, cx in zip(ma_cx_list, await redis_service.get_multiple("chuyenXe", ma_cx_list))
+            if cx
+        }
+
+        recent_bookings = []
+        for ticket, kh, lich_chay in zip(recent_tickets, kh_list, lich_chay_list):
+            maCX = ticket.get("maCX") or (lich_chay or {}).get("maCX", "")
+            chuyen_xe = chuyen_xe_map.get(maCX)
+
+            route_name = "N/A"
+            gia_ve = ticket.get("giaVe", 0)
+            if chuyen_xe:
+                route_name = f"{chuyen_xe.get('diemDi', '')} → {chuyen_xe.get('diemDen', '')}"
+                # Fallback: lấy giá từ chuyenXe nếu vé không có giaVe
+                if not gia_ve:
+                    gia_ve = chuyen_xe.get("giaChuyenXe", 0)
+
+            recent_bookings.append({
+                "maVe": ticket.get("maVe", ""),
+                "customer": kh.get("hoTen", "N/A") if kh else "N/A",
+                "route": route_name,
+                "seats": ticket.get("maGhe", "N/A"),
+                "price": gia_ve,
+                "status": ticket.get("trangThai", "unknown"),
+                "time": ticket.get("ngayDat", "N/A")
+            })
+
+        # === XE ĐANG HOẠT ĐỘNG ===
+        all_buses = await redis_service.get_all_xe()
+        active_buses = []
+        for bus in all_buses[:5]:
+            active_buses.append({
+                "maXe": bus.get("maXe", ""),
+                "bienSo": bus.get("bienSoXe", "N/A"),
+                "loaiXe": bus.get("loaiXe", "N/A"),
+                "status": bus.get("trangThai", "active"),
+                "soChoNgoi": bus.get("soChoNgoi", 34)
+            })
+
+        # === TOP TUYẾN ===
+        top = await aggregate_service.get_leaderboard("route", "bookings", limit=5)
+        chuyen_xe_list = await redis_service.get_multiple("chuyenXe", [row["id"] for row in top])
+        top_routes = [
+            {
+                "name": f"{chuyen_xe.get('diemDi', '')} - {chuyen_xe.get('diemDen', '')}" if chuyen_xe else "N/A",
+                "count": row["bookings"]
+            }
+            for row, chuyen_xe in zip(top, chuyen_xe_list)
+        ]
+        total_route_bookings = sum(r["count"] for r in top_routes)
+
+        top_routes_data = []
+        for route in top_routes:
+            percentage = (route["count"] / total_route_bookings * 100) if total_route_bookings > 0 else 0
+            top_routes_data.append({
+                "name": route["name"],
+                "percentage": round(percentage)
+            })
+
+        return {
+            "stats": {
+                "totalUsers": total_customers,
+                "totalBookings": total["tickets"] - total["refunded_tickets"],
+                "totalBuses": len([b for b in all_buses if b.get("trangThai") == "active"]),
+                "totalRevenue": month_revenue
+            },
+            "recentBookings": recent_bookings,
+            "activeBuses": active_buses,
+            "revenueChart": monthly_revenue,
+            "topRoutes": top_routes_data
+        }
+
+    @staticmethod
+    async def refresh() -> Optional[dict]:
+        """
+        Tính lại và ghi cache (single-flight qua lock Redis)
+
+        Returns:
+            Bản cache mới, hoặc None nếu worker khác đang tính
+        """
+        redis = await redis_service._get_client()
+        token = uuid.uuid4().hex
+        if not await redis.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL):
+            return None
+        try:
+            document = {
+                "generatedAt": time.time(),
+                "data": await DashboardService.compute()
+            }
+            await redis.set(CACHE_KEY, json.dumps(document, ensure_ascii=False), ex=CACHE_TTL)
+            return document
+        finally:
+            await redis.eval(RELEASE_LOCK, 1, LOCK_KEY, token)
+
+    @staticmethod
+    def refresh_nowait():
+        """Tính lại cache ở background, không làm chậm response"""
+        task = asyncio.create_task(DashboardService._refresh_safely())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @staticmethod
+    async def _refresh_safely():
+        try:
+            await DashboardService.refresh()
+        except Exception as e:
+            print(f"Error refreshing dashboard cache: {e}")
+
+    @staticmethod
+    async def _read_cache() -> Optional[dict]:
+        redis = await redis_service._get_client()
+        data = await redis.get(CACHE_KEY)
+        return json.loads(data) if data else None
+
+    @staticmethod
+    async def get_dashboard() -> dict:
+        """
+        Dữ liệu dashboard kèm thời điểm tính (stale-while-revalidate)
+
+        Returns:
+            {"generatedAt": epoch, "data": {...}}
+        """
+        document = await DashboardService._read_cache()
+        if document:
+            if time.time() - document.get("generatedAt", 0) > settings.DASHBOARD_STALE_AFTER:
+                DashboardService.refresh_nowait()
+            return document
+
+        # Chưa có cache: tự tính, hoặc chờ worker đang giữ lock tính xong
+        document = await DashboardService.refresh()
+        if document:
+            return document
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WAIT_TIMEOUT
+        while loop.time() < deadline:
+            await asyncio.sleep(0.1)
+            document = await DashboardService._read_cache()
+            if document:
+                return document
+        # Worker kia quá chậm: tính trực tiếp nhưng không ghi cache
+        return {"generatedAt": time.time(), "data": await DashboardService.compute()}
+
+
+# Singleton instance
+dashboard_service = DashboardService()
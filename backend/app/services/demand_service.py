@@ -0,0 +1,160 @@
+"""
+Demand Service - Thống kê nhu cầu tìm kiếm tuyến xe với chi phí cố định
+
+Mỗi lần tìm kiếm ghi một pipeline (không chờ kết quả) vào các cấu trúc gọn:
+- demand:count:{ngayDi} -> HASH ("diemDi|diemDen" -> số lượt tìm cho ngày đi)
+- demand:unmatched:{ngayDi} -> ZSET ("diemDi|diemDen" -> số lượt không có chuyến còn ghế),
+  đọc top-k bằng ZREVRANGE
+- demand:hll:{ngayDi}:{diemDi}|{diemDen} -> HyperLogLog session tìm kiếm tuyến + ngày
+- demand:hll:{ngayDi} -> HyperLogLog session tìm kiếm trong ngày đi
+
+Mọi key có TTL DEMAND_TTL nên dung lượng không tăng theo thời gian.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Set
+
+from app.services.redis_service import redis_service
+
+DEMAND_TTL = 90 * 24 * 3600  # 90 ngày
+PAIR_SEPARATOR = "|"
+
+# Giữ tham chiếu tới các task ghi nền để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _pair(diemDi: str, diemDen: str) -> str:
+    return f"{diemDi}{PAIR_SEPARATOR}{diemDen}"
+
+
+def _split_pair(pair: str) -> Dict[str, str]:
+    diemDi, _, diemDen = pair.partition(PAIR_SEPARATOR)
+    return {"diemDi": diemDi, "diemDen": diemDen}
+
+
+class DemandService:
+    """
+    Ghi và đọc thống kê nhu cầu tìm kiếm
+    """
+
+    @staticmethod
+    async def record_search(diemDi: str, diemDen: str, ngayDi: str,
+                            session: Optional[str], matched: bool):
+        """
+        Ghi một lượt tìm kiếm (một round trip, pipeline không transaction)
+
+        Args:
+            diemDi, diemDen, ngayDi: Tham số tìm kiếm
+            session: Session ID của client (hoặc IP) để đếm số người tìm duy nhất
+            matched: Có ít nhất một chuyến còn ghế trống hay không
+        """
+        redis = await redis_service._get_client()
+        pair = _pair(diemDi, diemDen)
+
+        count_key = f"demand:count:{ngayDi}"
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hincrby(count_key, pair, 1)
+        pipeline.expire(count_key, DEMAND_TTL)
+        if session:
+            for hll_key in (f"demand:hll:{ngayDi}:{pair}", f"demand:hll:{ngayDi}"):
+                pipeline.pfadd(hll_key, session)
+                pipeline.expire(hll_key, DEMAND_TTL)
+        if not matched:
+            unmatched_key = f"demand:unmatched:{ngayDi}"
+            pipeline.zincrby(unmatched_key, 1, pair)
+            pipeline.expire(unmatched_key, DEMAND_TTL)
+        await pipeline.execute()
+
+    @staticmethod
+    def record_search_nowait(diemDi: str, diemDen: str, ngayDi: str,
+                             session: Optional[str], matched: bool):
+        """Ghi lượt tìm kiếm ở background, không làm chậm response"""
+        task = asyncio.create_task(
+            DemandService._record_safely(diemDi, diemDen, ngayDi, session, matched)
+        )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @staticmethod
+    async def _record_safely(*args):
+        try:
+            await DemandService.record_search(*args)
+        except Exception as e:
+            # Thống kê không được làm hỏng luồng tìm kiếm
+            print(f"Error recording search demand: {e}")
+
+    @staticmethod
+    async def get_demand(date_from: str, date_to: str, top: int = 20) -> dict:
+        """
+        Tổng hợp nhu cầu theo khoảng ngày đi [date_from, date_to]
+
+        Returns:
+            {
+                "routes": [{diemDi, diemDen, searches, unmatched, uniqueSessions}, ...],
+                "uniqueSessions": số session duy nhất (ước lượng HLL),
+                "topUnmatched": [{diemDi, diemDen, count}, ...]
+            }
+        """
+        try:
+            start = datetime.strptime(date_from, "%Y-%m-%d")
+            end = datetime.strptime(date_to, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("Ngày không hợp lệ. Định dạng: YYYY-MM-DD")
+        if end < start:
+            raise ValueError("date_to phải sau hoặc bằng date_from")
+        days = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+        if len(days) > 92:
+            raise ValueError("Khoảng thời gian tối đa 92 ngày")
+
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for day in days:
+            pipeline.hgetall(f"demand:count:{day}")
+            # Số cặp thành phố có giới hạn nên đọc cả ZSET để cộng dồn chính xác
+            pipeline.zrevrange(f"demand:unmatched:{day}", 0, -1, withscores=True)
+        pipeline.pfcount(*[f"demand:hll:{day}" for day in days])
+        results = await pipeline.execute()
+        unique_sessions = results.pop()
+
+        searches: Dict[str, int] = {}
+        unmatched: Dict[str, int] = {}
+        for i in range(len(days)):
+            counts, misses = results[2 * i: 2 * i + 2]
+            for pair, value in counts.items():
+                searches[pair] = searches.get(pair, 0) + int(value)
+            for pair, score in misses:
+                unmatched[pair] = unmatched.get(pair, 0) + int(score)
+
+        ranked = sorted(searches, key=lambda p: searches[p], reverse=True)[:top]
+
+        # Số session duy nhất theo tuyến: PFCOUNT gộp các ngày của từng tuyến
+        pipeline = redis.pipeline(transaction=False)
+        for pair in ranked:
+            pipeline.pfcount(*[f"demand:hll:{day}:{pair}" for day in days])
+        route_sessions = await pipeline.execute() if ranked else []
+
+        routes: List[dict] = []
+        for pair, sessions in zip(ranked, route_sessions):
+            routes.append({
+                **_split_pair(pair),
+                "searches": searches[pair],
+                "unmatched": unmatched.get(pair, 0),
+                "uniqueSessions": sessions
+            })
+
+        return {
+            "dateFrom": date_from,
+            "dateTo": date_to,
+            "totalSearches": sum(searches.values()),
+            "totalUnmatched": sum(unmatched.values()),
+            "uniqueSessions": unique_sessions,
+            "routes": routes,
+            "topUnmatched": [
+                {**_split_pair(pair), "count": int(count)}
+                for pair, count in sorted(unmatched.items(), key=lambda x: x[1], reverse=True)[:top]
+            ]
+        }
+
+
+# Singleton instance
+demand_service = DemandService()
@@ -0,0 +1,299 @@
+"""
+Departure Board Service - Bảng giờ xuất bến theo thành phố (màn hình tại bến)
+
+Index cuộn trong Redis, được cập nhật khi lịch chạy được tạo / sửa / hoàn thành / hủy
+và khi tuyến / xe của các dòng đang hiển thị thay đổi (sync_related):
+- departures:{diemDi} -> ZSET (member: maLC, score: epoch giờ khởi hành)
+- departures:data:{diemDi} -> HASH (maLC -> JSON một dòng trên bảng)
+- departures:city -> HASH (maLC -> diemDi hiện tại, để gỡ dòng khi đổi tuyến)
+- ver:departures:{diemDi} -> version counter cho ETag
+- Kênh pub/sub departures:events:{diemDi} -> sự kiện {"type": "upsert" | "remove", ...}
+
+Màn hình đọc snapshot (ZRANGEBYSCORE + HMGET) hoặc nghe SSE, không chạm tới các
+collection lichChay / chuyenXe / xe. Các dòng đã khởi hành quá DEPARTED_GRACE được
+dọn dần mỗi lần đọc.
+"""
+import asyncio
+import json
+from typing import List, Optional, AsyncIterator
+
+from app.services.redis_service import redis_service
+from app.utils import doc_epoch, get_current_timestamp_hcm
+
+DEPARTED_GRACE = 15 * 60  # Giữ dòng trên bảng 15 phút sau giờ khởi hành
+INACTIVE_STATUSES = ["completed", "cancelled"]
+CITY_INDEX_KEY = "departures:city"
+
+
+def departure_timestamp(lich_chay: dict) -> Optional[float]:
+    """Epoch giờ khởi hành (giờ Việt Nam) của lịch chạy, None nếu không có giờ khởi hành"""
+    if not lich_chay.get("gioKhoiHanh", lich_chay.get("thoiGianXuatBen")):
+        return None
+    return doc_epoch("lichChay", lich_chay, "ngayKhoiHanhTs")
+
+
+class DepartureBoardService:
+    """
+    Duy trì và đọc bảng giờ xuất bến theo thành phố
+    """
+
+    @staticmethod
+    def _zset_key(city: str) -> str:
+        return f"departures:{city}"
+
+    @staticmethod
+    def _data_key(city: str) -> str:
+        return f"departures:data:{city}"
+
+    @staticmethod
+    def channel(city: str) -> str:
+        return f"departures:events:{city}"
+
+    @staticmethod
+    def version_key(city: str) -> str:
+        return redis_service.version_key("departures", city)
+
+    @staticmethod
+    def build_entry(lich_chay: dict, chuyen_xe: dict, xe: Optional[dict], ts: float) -> dict:
+        """Một dòng trên bảng giờ xuất bến"""
+        xe = xe or {}
+        return {
+            "maLC": lich_chay.get("maLC"),
+            "maCX": lich_chay.get("maCX"),
+            "diemDi": chuyen_xe.get("diemDi", ""),
+            "diemDen": chuyen_xe.get("diemDen", ""),
+            "ngayKhoiHanh": lich_chay.get("ngayKhoiHanh", ""),
+            "gioKhoiHanh": lich_chay.get("gioKhoiHanh", lich_chay.get("thoiGianXuatBen", "")),
+            "thoiGianDenDuKien": lich_chay.get("thoiGianDenDuKien", ""),
+            "departureTs": int(ts),
+            "maXe": lich_chay.get("maXe", ""),
+            "bienSoXe": xe.get("bienSoXe", ""),
+            "loaiXe": xe.get("loaiXe", ""),
+            "trangThai": lich_chay.get("trangThai", "scheduled")
+        }
+
+    @staticmethod
+    async def sync_schedule(maLC: str):
+        """
+        Đồng bộ một lịch chạy vào bảng sau khi tạo / cập nhật / đổi trạng thái.
+        Lịch chạy đã hoàn thành, đã hủy hoặc không còn tồn tại sẽ bị gỡ khỏi bảng.
+        """
+        lich_chay = await redis_service.get_lich_chay(maLC)
+        if not lich_chay or lich_chay.get("trangThai") in INACTIVE_STATUSES:
+            await DepartureBoardService.remove_schedule(maLC)
+            return
+
+        chuyen_xe = await redis_service.get_chuyen_xe(lich_chay.get("maCX", ""))
+        ts = departure_timestamp(lich_chay)
+        if not chuyen_xe or not chuyen_xe.get("diemDi") or ts is None:
+            await DepartureBoardService.remove_schedule(maLC)
+            return
+
+        xe = await redis_service.get_xe(lich_chay.get("maXe", ""))
+        redis = await redis_service._get_client()
+        old_city = await redis.hget(CITY_INDEX_KEY, maLC)
+
+        pipeline = redis.pipeline()
+        if old_city and old_city != chuyen_xe.get("diemDi"):
+            DepartureBoardService._queue_remove(pipeline, old_city, maLC)
+        DepartureBoardService.queue_upsert(pipeline, lich_chay, chuyen_xe, xe)
+        await pipeline.execute()
+
+    @staticmethod
+    async def sync_related(field: str, value: str) -> int:
+        """
+        Đồng bộ lại các dòng đang trên bảng có field = value (maCX khi sửa tuyến, maXe khi
+        sửa xe), vì mỗi dòng chép sẵn điểm đi / điểm đến / biển số / loại xe
+
+        Returns:
+            Số lịch chạy đã đồng bộ
+        """
+        redis = await redis_service._get_client()
+        by_city = {}
+        for maLC, city in (await redis.hgetall(CITY_INDEX_KEY)).items():
+            by_city.setdefault(city, []).append(maLC)
+        if not by_city:
+            return 0
+
+        pipeline = redis.pipeline(transaction=False)
+        for city, ma_lc_list in by_city.items():
+            pipeline.hmget(DepartureBoardService._data_key(city), ma_lc_list)
+        matched = []
+        for ma_lc_list, entries in zip(by_city.values(), await pipeline.execute()):
+            for maLC, data in zip(ma_lc_list, entries):
+                if data and json.loads(data).get(field) == value:
+                    matched.append(maLC)
+
+        for maLC in matched:
+            await DepartureBoardService.sync_schedule(maLC)
+        return len(matched)
+
+    @staticmethod
+    def queue_upsert(pipeline, lich_chay: dict, chuyen_xe: dict, xe: Optional[dict]):
+        """
+        Thêm lệnh ghi một dòng lên bảng vào pipeline (bỏ qua lịch chạy không hiển thị được).
+        Dùng trực tiếp khi tạo hàng loạt lịch chạy mới (chưa có dòng cũ cần gỡ).
+        """
+        ts = departure_timestamp(lich_chay)
+        if lich_chay.get("trangThai") in INACTIVE_STATUSES or not chuyen_xe.get("diemDi") or ts is None:
+            return
+        maLC = lich_chay.get("maLC")
+        entry = DepartureBoardService.build_entry(lich_chay, chuyen_xe, xe, ts)
+        city = entry["diemDi"]
+        payload = json.dumps(entry, ensure_ascii=False)
+        pipeline.zadd(DepartureBoardService._zset_key(city), {maLC: ts})
+        pipeline.hset(DepartureBoardService._data_key(city), maLC, payload)
+        pipeline.hset(CITY_INDEX_KEY, maLC, city)
+        pipeline.incr(DepartureBoardService.version_key(city))
+        pipeline.publish(
+            DepartureBoardService.channel(city),
+            json.dumps({"type": "upsert", "entry": entry}, ensure_ascii=False)
+        )
+
+    @staticmethod
+    def _queue_remove(pipeline, city: str, maLC: str):
+        pipeline.zrem(DepartureBoardService._zset_key(city), maLC)
+        pipeline.hdel(DepartureBoardService._data_key(city), maLC)
+        pipeline.incr(DepartureBoardService.version_key(city))
+        pipeline.publish(
+            DepartureBoardService.channel(city),
+            json.dumps({"type": "remove", "maLC": maLC})
+        )
+
+    @staticmethod
+    async def remove_schedule(maLC: str):
+        """Gỡ lịch chạy khỏi bảng (hoàn thành, hủy hoặc bị xóa)"""
+        redis = await redis_service._get_client()
+        city = await redis.hget(CITY_INDEX_KEY, maLC)
+        if not city:
+            return
+        pipeline = redis.pipeline()
+        DepartureBoardService._queue_remove(pipeline, city, maLC)
+        pipeline.hdel(CITY_INDEX_KEY, maLC)
+        await pipeline.execute()
+
+    @staticmethod
+    async def get_board(city: str, hours: int = 6, limit: int = 50) -> List[dict]:
+        """
+        Các chuyến xuất bến từ `city` trong `hours` giờ tới (kèm các chuyến vừa chạy
+        trong DEPARTED_GRACE), sắp theo giờ khởi hành.
+        """
+        redis = await redis_service._get_client()
+        now = get_current_timestamp_hcm()
+        cutoff = now - DEPARTED_GRACE
+        zset_key = DepartureBoardService._zset_key(city)
+        data_key = DepartureBoardService._data_key(city)
+
+        pipeline = redis.pipeline()
+        pipeline.zrangebyscore(zset_key, "-inf", f"({cutoff}")
+        pipeline.zrangebyscore(zset_key, cutoff, now + hours * 3600, start=0, num=limit)
+        departed, upcoming = await pipeline.execute()
+
+        pipeline = redis.pipeline()
+        if departed:
+            # Dọn các chuyến đã chạy khỏi index cuộn
+            pipeline.zrem(zset_key, *departed)
+            pipeline.hdel(data_key, *departed)
+            pipeline.hdel(CITY_INDEX_KEY, *departed)
+        if upcoming:
+            pipeline.hmget(data_key, upcoming)
+        results = await pipeline.execute()
+
+        if not upcoming:
+            return []
+        board = []
+        for data in results[-1]:
+            if data:
+                board.append(json.loads(data))
+        return board
+
+    @staticmethod
+    async def stream(city: str, hours: int = 6, limit: int = 50,
+                     keepalive: int = 15, refresh: int = 300) -> AsyncIterator[str]:
+        """
+        Luồng Server-Sent Events cho một thành phố:
+        - event "snapshot": toàn bộ bảng khi kết nối và định kỳ mỗi `refresh` giây
+          (để chuyến mới lọt vào cửa sổ `hours` giờ hiện lên)
+        - event "upsert" / "remove": thay đổi từ kênh pub/sub
+        - comment keepalive mỗi `keepalive` giây
+        """
+        redis = await redis_service._get_client()
+        pubsub = redis.pubsub()
+        await pubsub.subscribe(DepartureBoardService.channel(city))
+        try:
+            board = await DepartureBoardService.get_board(city, hours, limit)
+            yield _sse("snapshot", board)
+            loop = asyncio.get_running_loop()
+            last_snapshot = last_sent = loop.time()
+
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                now = loop.time()
+                if message and message.get("type") == "message":
+                    event = json.loads(message["data"])
+                    entry = event.get("entry")
+                    if event.get("type") == "upsert" and entry and \
+                            entry.get("departureTs", 0) > get_current_timestamp_hcm() + hours * 3600:
+                        # Ngoài cửa sổ hiển thị: với màn hình chỉ là gỡ dòng (nếu có)
+                        event = {"type": "remove", "maLC": entry.get("maLC")}
+                    yield _sse(event.get("type", "upsert"), event)
+                    last_sent = now
+                elif now - last_snapshot >= refresh:
+                    board = await DepartureBoardService.get_board(city, hours, limit)
+                    yield _sse("snapshot", board)
+                    last_snapshot = last_sent = now
+                elif now - last_sent >= keepalive:
+                    yield ": keepalive\n\n"
+                    last_sent = now
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.reset()
+
+    @staticmethod
+    async def rebuild() -> int:
+        """
+        Xây lại toàn bộ bảng từ lichChay (dùng khi build index / sau khi import dữ liệu)
+
+        Returns:
+            Số lịch chạy đang có trên bảng
+        """
+        redis = await redis_service._get_client()
+        schedules = await redis_service.get_all_lich_chay()
+        routes = {cx.get("maCX"): cx for cx in await redis_service.get_all_chuyen_xe()}
+        buses = {xe.get("maXe"): xe for xe in await redis_service.get_all("xe")}
+        now = get_current_timestamp_hcm()
+
+        old_keys = [key async for key in redis.scan_iter(match="departures:*")]
+
+        pipeline = redis.pipeline()
+        if old_keys:
+            pipeline.delete(*old_keys)
+        cities = set()
+        count = 0
+        for lich_chay in schedules:
+            if lich_chay.get("trangThai") in INACTIVE_STATUSES:
+                continue
+            chuyen_xe = routes.get(lich_chay.get("maCX"))
+            ts = departure_timestamp(lich_chay)
+            if not chuyen_xe or not chuyen_xe.get("diemDi") or ts is None or ts < now - DEPARTED_GRACE:
+                continue
+            entry = DepartureBoardService.build_entry(lich_chay, chuyen_xe, buses.get(lich_chay.get("maXe")), ts)
+            city = entry["diemDi"]
+            cities.add(city)
+            pipeline.zadd(DepartureBoardService._zset_key(city), {entry["maLC"]: ts})
+            pipeline.hset(DepartureBoardService._data_key(city), entry["maLC"], json.dumps(entry, ensure_ascii=False))
+            pipeline.hset(CITY_INDEX_KEY, entry["maLC"], city)
+            count += 1
+        for city in cities:
+            pipeline.incr(DepartureBoardService.version_key(city))
+        await pipeline.execute()
+        return count
+
+
+def _sse(event: str, data) -> str:
+    """Định dạng một Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Singleton instance
+departure_board_service = DepartureBoardService()
@@ -0,0 +1,209 @@
+"""
+Export Job Service - Chạy các export lớn ở background và lưu file kết quả ra đĩa
+
+- job:export:{jobId} -> HASH trạng thái job (status, processed, total, file, ...),
+  hết hạn sau EXPORT_ARTIFACT_TTL giây
+- job:export:dedupe:{digest} -> jobId của job cùng loại + tham số gần nhất,
+  hết hạn sau EXPORT_DEDUPE_WINDOW giây (gửi lại trong khoảng này dùng lại job cũ)
+- File: {EXPORT_DIR}/{jobId}.csv, được dọn định kỳ khi quá EXPORT_ARTIFACT_TTL
+
+Job chạy như asyncio task trong worker nhận request (việc export chủ yếu chờ I/O Redis);
+trạng thái nằm trong Redis nên worker nào cũng trả lời được khi client poll.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Callable, Optional, Set
+
+from app.config import settings
+from app.services.redis_service import redis_service
+
+JOB_KEY = "job:export:{job_id}"
+DEDUPE_KEY = "job:export:dedupe:{digest}"
+PROGRESS_FLUSH_INTERVAL = 1.0  # Giây giữa hai lần ghi tiến độ vào Redis
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Giữ tham chiếu tới các job đang chạy để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class ExportProgress:
+    """Bộ đếm tiến độ truyền vào hàm sinh dữ liệu (số document đã duyệt)"""
+
+    def __init__(self):
+        self.processed = 0
+
+    def __call__(self, count: int):
+        self.processed += count
+
+
+class ExportJobService:
+    """
+    Tạo, theo dõi và dọn dẹp các export job
+    """
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return JOB_KEY.format(job_id=job_id)
+
+    @staticmethod
+    def file_path(job_id: str) -> str:
+        return os.path.join(settings.EXPORT_DIR, f"{job_id}.csv")
+
+    @staticmethod
+    def _digest(kind: str, params: dict) -> str:
+        raw = json.dumps({"kind": kind, "params": params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    async def submit(kind: str, params: dict, filename: str, total: int,
+                     chunks: Callable[[ExportProgress], AsyncIterator[bytes]]) -> dict:
+        """
+        Tạo job export (hoặc trả về job giống hệt vừa tạo gần đây)
+
+        Args:
+            kind: Loại export (invoices, tickets, revenue)
+            params: Tham số export, dùng để nhận diện job trùng
+            filename: Tên file khi tải về
+            total: Ước lượng số document cần duyệt (để tính % tiến độ)
+            chunks: Hàm nhận bộ đếm tiến độ, trả về các chunk bytes của file
+
+        Returns:
+            Trạng thái job
+        """
+        redis = await redis_service._get_client()
+        dedupe_key = DEDUPE_KEY.format(digest=ExportJobService._digest(kind, params))
+
+        job_id = uuid.uuid4().hex
+        # Giữ chỗ dedupe trước khi tạo job để hai request đồng thời không tạo hai job
+        if not await redis.set(dedupe_key, job_id, nx=True, ex=settings.EXPORT_DEDUPE_WINDOW):
+            existing_id = await redis.get(dedupe_key)
+            existing = await ExportJobService.get(existing_id) if existing_id else None
+            if existing and existing["status"] != STATUS_FAILED:
+                return existing
+            await redis.set(dedupe_key, job_id, ex=settings.EXPORT_DEDUPE_WINDOW)
+
+        job = {
+            "jobId": job_id,
+            "type": kind,
+            "params": json.dumps(params, ensure_ascii=False),
+            "filename": filename,
+            "status": STATUS_QUEUED,
+            "processed": 0,
+            "total": total,
+            "size": 0,
+            "createdAt": time.time()
+        }
+        job_key = ExportJobService._job_key(job_id)
+        pipeline = redis.pipeline()
+        pipeline.hset(job_key, mapping=job)
+        pipeline.expire(job_key, settings.EXPORT_ARTIFACT_TTL)
+        await pipeline.execute()
+
+        task = asyncio.create_task(ExportJobService._run(job_id, chunks))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return await ExportJobService.get(job_id)
+
+    @staticmethod
+    async def _run(job_id: str, chunks: Callable[[ExportProgress], AsyncIterator[bytes]]):
+        """Ghi file export vào {jobId}.csv.part rồi đổi tên khi xong"""
+        redis = await redis_service._get_client()
+        job_key = ExportJobService._job_key(job_id)
+        path = ExportJobService.file_path(job_id)
+        tmp_path = f"{path}.part"
+        progress = ExportProgress()
+
+        await redis.hset(job_key, mapping={"status": STATUS_RUNNING, "startedAt": time.time()})
+        try:
+            os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+            size = 0
+            last_flush = time.monotonic()
+            with open(tmp_path, "wb") as f:
+                async for chunk in chunks(progress):
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+                    if time.monotonic() - last_flush >= PROGRESS_FLUSH_INTERVAL:
+                        await redis.hset(job_key, mapping={"processed": progress.processed, "size": size})
+                        last_flush = time.monotonic()
+            os.replace(tmp_path, path)
+
+            pipeline = redis.pipeline()
+            pipeline.hset(job_key, mapping={
+                "status": STATUS_DONE,
+                "processed": progress.processed,
+                "size": size,
+                "finishedAt": time.time()
+            })
+            # File được giữ EXPORT_ARTIFACT_TTL tính từ lúc hoàn thành
+            pipeline.expire(job_key, settings.EXPORT_ARTIFACT_TTL)
+            await pipeline.execute()
+        except Exception as e:
+            print(f"❌ Export job {job_id} failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            await redis.hset(job_key, mapping={
+                "status": STATUS_FAILED,
+                "error": str(e),
+                "finishedAt": time.time()
+            })
+
+    @staticmethod
+    async def get(job_id: str) -> Optional[dict]:
+        """
+        Trạng thái job, None nếu không tồn tại hoặc đã hết hạn
+
+        Returns:
+            {jobId, type, params, status, processed, total, progress (0-100), size, ...}
+        """
+        redis = await redis_service._get_client()
+        data = await redis.hgetall(ExportJobService._job_key(job_id))
+        if not data:
+            return None
+
+        job = dict(data)
+        job["params"] = json.loads(job.get("params") or "{}")
+        for field in ("processed", "total", "size"):
+            job[field] = int(job.get(field) or 0)
+        for field in ("createdAt", "startedAt", "finishedAt"):
+            if field in job:
+                job[field] = float(job[field])
+        if job["status"] == STATUS_DONE:
+            job["progress"] = 100
+        elif job["total"]:
+            job["progress"] = min(99, job["processed"] * 100 // job["total"])
+        else:
+            job["progress"] = 0
+        if "finishedAt" in job and job["status"] == STATUS_DONE:
+            job["expiresAt"] = job["finishedAt"] + settings.EXPORT_ARTIFACT_TTL
+        return job
+
+    @staticmethod
+    async def cleanup() -> int:
+        """
+        Xóa file export quá EXPORT_ARTIFACT_TTL (và file .part bị bỏ dở)
+
+        Returns:
+            Số file đã xóa
+        """
+        if not os.path.isdir(settings.EXPORT_DIR):
+            return 0
+        cutoff = time.time() - settings.EXPORT_ARTIFACT_TTL
+        removed = 0
+        for name in os.listdir(settings.EXPORT_DIR):
+            path = os.path.join(settings.EXPORT_DIR, name)
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+# Singleton instance
+export_job_service = ExportJobService()
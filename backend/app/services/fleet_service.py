@@ -0,0 +1,236 @@
+"""
+Fleet Service - Tạo xe kèm ghế ngồi và import đội xe hàng loạt
+
+Một xe và toàn bộ ghế (gheNgoi:{maXe}_{tenGhe}) được ghi trong một pipeline thay vì
+mỗi ghế một round trip. Ghế của xe nằm trong set index sidx:gheNgoi:maXe:{maXe},
+biển số là ràng buộc duy nhất (uniq:xe:bienSoXe), nên kiểm tra trùng biển số và
+đọc ghế của một xe không phải duyệt toàn bộ collection.
+
+Import (CSV hoặc JSON) kiểm tra từng dòng trong bộ nhớ rồi ghi theo lô
+IMPORT_BATCH_SIZE xe mỗi pipeline; dòng lỗi không chặn các dòng còn lại.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.services.redis_service import redis_service, UniqueConstraintError
+
+SEAT_PREFIXES = ["A", "B", "C", "D"]
+DEFAULT_SEATS = 34
+MAX_SEATS = 80
+DEFAULT_BUS_TYPE = "Xe giường nằm"
+BUS_STATUSES = ["active", "inactive", "maintenance"]
+IMPORT_BATCH_SIZE = 50
+MAX_IMPORT_ROWS = 1000
+
+
+def build_seats(maXe: str, soChoNgoi: int) -> List[dict]:
+    """Ghế của xe: chia đều theo dãy A-D, đánh số A01, A02, ..."""
+    seats_per_row = (soChoNgoi + len(SEAT_PREFIXES) - 1) // len(SEAT_PREFIXES)
+    seats = []
+    for prefix in SEAT_PREFIXES:
+        for num in range(1, seats_per_row + 1):
+            if len(seats) >= soChoNgoi:
+                break
+            seat_name = f"{prefix}{str(num).zfill(2)}"
+            seats.append({
+                "maGhe": f"{maXe}_{seat_name}",
+                "maXe": maXe,
+                "tenGhe": seat_name
+            })
+    return seats
+
+
+def parse_import(body: bytes, content_type: Optional[str]) -> List[dict]:
+    """
+    Đọc file import: JSON (mảng object hoặc {"buses": [...]}) hoặc CSV có dòng tiêu đề
+    (bienSoXe, soChoNgoi, loaiXe, trangThai)
+    """
+    text = body.decode("utf-8-sig")
+    if "json" in (content_type or "") or text.lstrip().startswith(("[", "{")):
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON không hợp lệ: {e}")
+        rows = data.get("buses") if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON phải là mảng các xe")
+        return rows
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def validate_row(row: dict) -> tuple:
+    """
+    Chuẩn hóa một dòng import
+
+    Returns:
+        (bus_data, errors) - bus_data chưa có maXe
+    """
+    errors = []
+    bien_so = str(row.get("bienSoXe") or "").strip()
+    if not bien_so:
+        errors.append("Thiếu biển số xe")
+
+    so_cho = row.get("soChoNgoi")
+    try:
+        so_cho = int(so_cho) if so_cho not in (None, "") else DEFAULT_SEATS
+        if not 1 <= so_cho <= MAX_SEATS:
+            errors.append(f"Số chỗ ngồi phải từ 1 đến {MAX_SEATS}")
+    except (TypeError, ValueError):
+        errors.append("Số chỗ ngồi không hợp lệ")
+
+    trang_thai = str(row.get("trangThai") or "active").strip()
+    if trang_thai not in BUS_STATUSES:
+        errors.append(f"Trạng thái phải là một trong: {', '.join(BUS_STATUSES)}")
+
+    bus_data = {
+        "bienSoXe": bien_so,
+        "soChoNgoi": so_cho,
+        "loaiXe": str(row.get("loaiXe") or DEFAULT_BUS_TYPE).strip(),
+        "trangThai": trang_thai
+    }
+    return bus_data, errors
+
+
+class FleetService:
+    """
+    Ghi xe và ghế ngồi theo pipeline
+    """
+
+    @staticmethod
+    async def plate_exists(bienSoXe: str) -> bool:
+        """Biển số đã được dùng (HGET uniq hash biển số)"""
+        return bool((await redis_service.unique_owners("xe", "bienSoXe", [bienSoXe]))[0])
+
+    @staticmethod
+    async def create_buses(buses: List[dict]) -> int:
+        """
+        Tạo nhiều xe kèm ghế trong một pipeline
+
+        Raises:
+            UniqueConstraintError: Có biển số đã được dùng (không xe nào được tạo)
+
+        Returns:
+            Số ghế đã tạo
+        """
+        seats = []
+        for bus_data in buses:
+            seats += build_seats(bus_data["maXe"], int(bus_data.get("soChoNgoi", DEFAULT_SEATS)))
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline()
+        claims: List[tuple] = []
+        try:
+            # Biển số được giành trước khi xếp lệnh, trùng thì dừng ở đây
+            await redis_service.create_many("xe", "maXe", buses, pipeline, claims)
+            await redis_service.create_many("gheNgoi", "maGhe", seats, pipeline, claims)
+            await pipeline.execute()
+        except Exception:
+            # Ghi lỗi: trả lại biển số đã giành để lần tạo sau không bị báo trùng
+            await redis_service._release_unique(claims)
+            raise
+        return len(seats)
+
+    @staticmethod
+    async def create_bus(bus_data: dict) -> int:
+        """
+        Tạo một xe kèm ghế trong một pipeline
+
+        Returns:
+            Số ghế đã tạo
+        """
+        return await FleetService.create_buses([bus_data])
+
+    @staticmethod
+    async def next_ids(count: int) -> List[str]:
+        """`count` mã xe mới liên tiếp (XE00001, ...), bỏ qua mã đã có document"""
+        if count <= 0:
+            return []
+        start = await redis_service.count("xe") + 1
+        ids: List[str] = []
+        while len(ids) < count:
+            candidates = [f"XE{str(n).zfill(5)}" for n in range(start, start + count - len(ids))]
+            start += len(candidates)
+            existing = await redis_service.get_multiple("xe", candidates)
+            ids += [maXe for maXe, doc in zip(candidates, existing) if not doc]
+        return ids
+
+    @staticmethod
+    async def import_buses(rows: List[dict], dry_run: bool = False) -> dict:
+        """
+        Import nhiều xe (kèm ghế)
+
+        Args:
+            rows: Các dòng đã đọc từ file (bienSoXe, soChoNgoi, loaiXe, trangThai)
+            dry_run: Chỉ kiểm tra, không ghi
+
+        Returns:
+            {"total", "created", "failed", "seats", "rows": [{row, bienSoXe, status, maXe | errors}]}
+        """
+        if len(rows) > MAX_IMPORT_ROWS:
+            raise ValueError(f"Tối đa {MAX_IMPORT_ROWS} xe mỗi lần import")
+
+        validated = [validate_row(row) for row in rows]
+        plates = list({bus["bienSoXe"] for bus, _ in validated if bus["bienSoXe"]})
+        owners = await redis_service.unique_owners("xe", "bienSoXe", plates)
+        taken = {plate for plate, owner in zip(plates, owners) if owner}
+
+        report: List[dict] = []
+        valid: List[dict] = []
+        seen: Dict[str, int] = {}
+        for index, (bus_data, errors) in enumerate(validated, start=1):
+            plate = bus_data["bienSoXe"]
+            if plate in taken:
+                errors.append("Biển số xe đã tồn tại")
+            elif plate in seen:
+                errors.append(f"Trùng biển số với dòng {seen[plate]}")
+            if plate and plate not in seen:
+                seen[plate] = index
+            entry = {"row": index, "bienSoXe": plate}
+            if errors:
+                report.append({**entry, "status": "error", "errors": errors})
+            else:
+                report.append({**entry, "status": "valid" if dry_run else "created"})
+                valid.append(bus_data)
+
+        seat_total = 0
+        if valid and not dry_run:
+            ids = await FleetService.next_ids(len(valid))
+            now = datetime.now().isoformat()
+            for bus_data, maXe in zip(valid, ids):
+                bus_data.update({"maXe": maXe, "ngayTao": now})
+            failed: Dict[str, str] = {}
+            for start in range(0, len(valid), IMPORT_BATCH_SIZE):
+                batch = valid[start:start + IMPORT_BATCH_SIZE]
+                try:
+                    seat_total += await FleetService.create_buses(batch)
+                except UniqueConstraintError:
+                    # Biển số vừa bị request khác dùng: tạo lại từng xe để chỉ bỏ xe bị trùng
+                    for bus_data in batch:
+                        try:
+                            seat_total += await FleetService.create_bus(bus_data)
+                        except UniqueConstraintError as e:
+                            failed[bus_data["maXe"]] = str(e)
+            created = iter(valid)
+            for entry in report:
+                if entry["status"] == "created":
+                    maXe = next(created)["maXe"]
+                    if maXe in failed:
+                        entry.update({"status": "error", "errors": [failed[maXe]]})
+                    else:
+                        entry["maXe"] = maXe
+        else:
+            seat_total = sum(int(bus["soChoNgoi"]) for bus in valid)
+
+        return {
+            "total": len(rows),
+            "created": sum(1 for entry in report if entry["status"] == "created"),
+            "failed": sum(1 for entry in report if entry["status"] == "error"),
+            "seats": seat_total,
+            "rows": report
+        }
+
+
+# Singleton instance
+fleet_service = FleetService()
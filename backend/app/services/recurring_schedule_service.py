@@ -0,0 +1,157 @@
+"""
+Recurring Schedule Service - Sinh hàng loạt lịch chạy lặp lại (vd: 06:00 và 14:00 mỗi ngày trong 8 tuần)
+
+Xe / tài xế được xoay vòng theo danh sách truyền vào. Xung đột được kiểm tra trong bộ nhớ
+với index bận theo ngày (busy:xe:{date}, busy:nv:{date}) đọc một lần cho cả khoảng ngày,
+cộng với các slot vừa xếp trong cùng đợt; mỗi xe / tài xế tối đa một lịch chạy mỗi ngày
+như POST /admin/trips.
+
+Toàn bộ lichChay, index phụ, hàng đợi trip scheduler và bảng giờ xuất bến được ghi trong
+một pipeline MULTI/EXEC.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.services.redis_service import redis_service
+from app.services.departure_board_service import departure_board_service
+from app.services.trip_scheduler_service import trip_scheduler_service
+
+MAX_SLOTS = 1000  # Số lịch chạy tối đa một lần sinh
+
+
+def schedule_hours(thoiGianChay: Optional[str], chuyen_xe: dict) -> int:
+    """Số giờ chạy: từ thoiGianChay, không có thì lấy thoiGianDuKien của tuyến, mặc định 5"""
+    try:
+        return int(thoiGianChay.split()[0])
+    except (AttributeError, ValueError, IndexError):
+        try:
+            return int(str(chuyen_xe.get("thoiGianDuKien") or "5").split()[0])
+        except (ValueError, IndexError):
+            return 5
+
+
+def build_schedule(maLC: str, chuyen_xe: dict, xe: dict, maNV: str, ngayKhoiHanh: str,
+                   gioKhoiHanh: str, thoiGianChay: str) -> dict:
+    """Document lichChay mới (giờ đến dự kiến tính từ giờ khởi hành + số giờ chạy)"""
+    hours = schedule_hours(thoiGianChay, chuyen_xe)
+    gio_parts = gioKhoiHanh.split(":")
+    hour_start = int(gio_parts[0])
+    minute_start = int(gio_parts[1]) if len(gio_parts) > 1 else 0
+    arrival_time = f"{(hour_start + hours) % 24:02d}:{minute_start:02d}"
+
+    return {
+        "maLC": maLC,
+        "maCX": chuyen_xe.get("maCX"),
+        "maXe": xe.get("maXe"),
+        "maNV": maNV,
+        "ngayKhoiHanh": ngayKhoiHanh,
+        "gioKhoiHanh": gioKhoiHanh,
+        "thoiGianXuatBen": gioKhoiHanh,
+        "thoiGianChay": thoiGianChay,
+        "thoiGianDenDuKien": arrival_time,
+        "trangThai": "scheduled",
+        "soGheTrong": int(xe.get("soChoNgoi", xe.get("soGhe", 34))),
+        "gheDaDat": [],
+        "ngayTao": datetime.now().isoformat()
+    }
+
+
+def recurring_dates(start: str, weeks: int, weekdays: Optional[List[int]] = None) -> List[str]:
+    """Các ngày YYYY-MM-DD trong `weeks` tuần từ `start`, lọc theo thứ (0 = Thứ 2 ... 6 = Chủ nhật)"""
+    first = datetime.strptime(start, "%Y-%m-%d")
+    days = [first + timedelta(days=i) for i in range(weeks * 7)]
+    return [d.strftime("%Y-%m-%d") for d in days if weekdays is None or d.weekday() in weekdays]
+
+
+class RecurringScheduleService:
+    """
+    Xếp xe / tài xế cho các slot lặp lại và ghi hàng loạt lịch chạy
+    """
+
+    @staticmethod
+    def _pick(candidates: List[str], start: int, taken: set) -> Optional[int]:
+        """Vị trí ứng viên đầu tiên còn rảnh, tính vòng từ `start`"""
+        for offset in range(len(candidates)):
+            index = (start + offset) % len(candidates)
+            if candidates[index] not in taken:
+                return index
+        return None
+
+    @staticmethod
+    async def generate(chuyen_xe: dict, buses: List[dict], drivers: List[str], dates: List[str],
+                       times: List[str], thoiGianChay: str, dry_run: bool = False) -> dict:
+        """
+        Sinh lịch chạy cho mọi (ngày, giờ), xoay vòng xe và tài xế
+
+        Args:
+            chuyen_xe: Tuyến đường
+            buses: Các xe (đã kiểm tra tồn tại, đang hoạt động) theo thứ tự xoay vòng
+            drivers: Mã tài xế theo thứ tự xoay vòng
+            dates: Các ngày khởi hành YYYY-MM-DD
+            times: Các giờ khởi hành HH:MM trong ngày
+            dry_run: Chỉ trả về báo cáo, không ghi
+
+        Returns:
+            {"created", "conflicts", "days": [{ngayKhoiHanh, schedules, conflicts}]}
+        """
+        if len(dates) * len(times) > MAX_SLOTS:
+            raise ValueError(f"Tối đa {MAX_SLOTS} lịch chạy mỗi lần tạo")
+
+        maCX = chuyen_xe.get("maCX")
+        bus_by_id = {bus.get("maXe"): bus for bus in buses}
+        bus_ids = list(bus_by_id)
+        slots = [(date, time) for date in dates for time in sorted(times)]
+        slot_ids = [f"LC_{maCX}_{date}_{time.replace(':', '')}" for date, time in slots]
+
+        busy = await redis_service.get_busy_sets(dates)
+        existing = await redis_service.get_multiple("lichChay", slot_ids)
+
+        schedules: List[dict] = []
+        report: Dict[str, dict] = {
+            date: {"ngayKhoiHanh": date, "schedules": [], "conflicts": []} for date in dates
+        }
+        bus_next = driver_next = 0
+        for (date, time), maLC, current in zip(slots, slot_ids, existing):
+            day = report[date]
+            if current:
+                day["conflicts"].append({"gioKhoiHanh": time, "lyDo": f"Lịch chạy {maLC} đã tồn tại"})
+                continue
+            busy_buses, busy_drivers = busy[date]
+            bus_index = RecurringScheduleService._pick(bus_ids, bus_next, busy_buses)
+            driver_index = RecurringScheduleService._pick(drivers, driver_next, busy_drivers)
+            if bus_index is None or driver_index is None:
+                reasons = []
+                if bus_index is None:
+                    reasons.append("không còn xe rảnh trong ngày")
+                if driver_index is None:
+                    reasons.append("không còn tài xế rảnh trong ngày")
+                day["conflicts"].append({"gioKhoiHanh": time, "lyDo": ", ".join(reasons).capitalize()})
+                continue
+
+            maXe, maNV = bus_ids[bus_index], drivers[driver_index]
+            busy_buses.add(maXe)
+            busy_drivers.add(maNV)
+            bus_next, driver_next = bus_index + 1, driver_index + 1
+
+            schedules.append(build_schedule(maLC, chuyen_xe, bus_by_id[maXe], maNV, date, time, thoiGianChay))
+            day["schedules"].append({"maLC": maLC, "gioKhoiHanh": time, "maXe": maXe, "maNV": maNV})
+
+        if schedules and not dry_run:
+            redis = await redis_service._get_client()
+            pipeline = redis.pipeline()
+            await redis_service.create_many("lichChay", "maLC", schedules, pipeline)
+            for lich_chay in schedules:
+                trip_scheduler_service.queue_schedule(pipeline, lich_chay)
+                departure_board_service.queue_upsert(pipeline, lich_chay, chuyen_xe, bus_by_id[lich_chay["maXe"]])
+            await pipeline.execute()
+
+        return {
+            "created": 0 if dry_run else len(schedules),
+            "planned": len(schedules),
+            "conflicts": sum(len(day["conflicts"]) for day in report.values()),
+            "days": list(report.values())
+        }
+
+
+# Singleton instance
+recurring_schedule_service = RecurringScheduleService()
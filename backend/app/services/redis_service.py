@@ -14,11 +14,44 @@ Schema Redis:
 
 Mỗi collection có thêm index key để liệt kê tất cả keys:
 - idx:{collection_name} -> Set chứa tất cả keys của collection đó
+
+Version counters (dùng cho ETag / conditional GET), tăng mỗi khi ghi:
+- ver:{collection_name} -> Tăng khi có bất kỳ thay đổi nào trong collection
+- ver:route:{maCX} -> Tăng khi chuyến xe, lịch chạy hoặc trạng thái ghế của tuyến thay đổi
+- ver:schedule:{maLC} -> Tăng khi lịch chạy hoặc trạng thái ghế của lịch chạy thay đổi
+- ver:departures:{maCX}:{ngayKhoiHanh} -> Tăng khi lịch chạy của tuyến trong ngày thay đổi
+  (không tăng khi giữ / đặt ghế)
+
+Sorted-set index cho phân trang theo cursor (SORTED_INDEXES), cập nhật trong create/update/delete:
+- zidx:{collection}:{order} -> ZSET key -> epoch của field sắp xếp
+- zidx:{collection}:{order}:{trangThai} -> như trên, chỉ các document có trạng thái đó
+
+Set index (SET_INDEXES) và index xe / tài xế bận theo ngày, cũng cập nhật khi ghi:
+- sidx:{collection}:{field}:{value} -> SET key của các document có field = value
+- busy:xe:{YYYY-MM-DD}, busy:nv:{YYYY-MM-DD} -> SET maXe / maNV có lịch chạy chưa kết thúc
+  trong ngày (busy:{...}:count -> HASH số lịch chạy, chỉ SREM khi về 0)
+
+Ràng buộc duy nhất (UNIQUE_CONSTRAINTS):
+- uniq:{collection}:{field} -> HASH giá trị -> key của document đang giữ giá trị đó
+  Giá trị được giành (claim) bằng Lua trước khi ghi document, trả lại khi xóa / đổi giá trị
 """
+import base64
 import json
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from datetime import datetime
 from app.core.database import redis_client
+from app.utils import epoch_fields, strip_epoch_fields, doc_epoch, epoch_date, day_range
+
+
+class UniqueConstraintError(ValueError):
+    """Giá trị của field duy nhất đã thuộc về document khác"""
+    
+    def __init__(self, collection: str, field: str, value: str):
+        self.collection = collection
+        self.field = field
+        self.value = value
+        label = RedisService.UNIQUE_LABELS.get(field, field)
+        super().__init__(f"{label} đã được sử dụng")
 
 
 class RedisService:
@@ -26,6 +59,111 @@ class RedisService:
     Service xử lý CRUD operations cho Redis
     """
     
+    # Field dùng để xác định version key theo phạm vi (ngoài ver:{collection})
+    # collection -> [(scope, field)] => ver:{scope}:{doc[field]}
+    # field là tuple => ver:{scope}:{doc[f1]}:{doc[f2]} (field đầu bắt buộc, các field sau có thể rỗng)
+    # Trạng thái vé được tính là đã chiếm ghế
+    BOOKED_STATUSES = ["paid", "confirmed", "cancel_pending"]
+    
+    # Cờ đánh dấu các set booked:{maLC} đã được build đầy đủ từ veXe
+    BOOKED_INDEX_READY_KEY = "idx:booked:ready"
+    
+    VERSION_SCOPES = {
+        "chuyenXe": [("route", "maCX")],
+        "lichChay": [("route", "maCX"), ("schedule", "maLC"), ("departures", ("maCX", "ngayKhoiHanh"))],
+        "veXe": [("schedule", "maLC")],
+    }
+    
+    # Thứ tự phân trang: collection -> {tên thứ tự: field epoch làm score}
+    SORTED_INDEXES = {
+        "khachHang": {"created": "ngayTaoTs"},
+        "nhanVien": {"created": "ngayTaoTs"},
+        "veXe": {"created": "ngayDatTs"},
+        "yeuCauHuy": {"created": "ngayTaoTs"},
+        "lichChay": {"departure": "ngayKhoiHanhTs"},
+    }
+    
+    # Field trạng thái để lọc: mỗi giá trị có sorted set riêng
+    STATUS_FIELDS = {
+        "veXe": "trangThai",
+        "yeuCauHuy": "trangThai",
+        "lichChay": "trangThai",
+    }
+    
+    # Set các collection đã build sorted index đầy đủ
+    SORTED_INDEX_READY_KEY = "idx:sorted:ready"
+    
+    # Set index theo giá trị field: collection -> {field: giá trị mặc định khi thiếu}
+    SET_INDEXES = {
+        "xe": {"trangThai": "active"},
+        "nhanVien": {"maCV": None},
+        "gheNgoi": {"maXe": None},
+        "lichChay": {"maCX": None},
+    }
+    
+    # Field không được trùng giữa các document của collection
+    UNIQUE_CONSTRAINTS = {
+        "khachHang": ["email", "CCCD", "SDT"],
+        "nhanVien": ["email", "CCCD", "SDT"],
+        "xe": ["bienSoXe"],
+    }
+    UNIQUE_LABELS = {
+        "email": "Email",
+        "CCCD": "Số CCCD",
+        "SDT": "Số điện thoại",
+        "bienSoXe": "Biển số xe",
+    }
+    
+    # Set các collection đã build uniq hash đầy đủ
+    UNIQUE_INDEX_READY_KEY = "idx:uniq:ready"
+    
+    # Giành các cặp (uniq hash, giá trị) cho owner, tất cả hoặc không:
+    # KEYS = uniq hash, ARGV = [giá trị, owner] theo từng KEY.
+    # Trả về vị trí (1-based) cặp bị trùng đầu tiên, 0 nếu đã giành được hết
+    CLAIM_UNIQUE = """
+local claimed = {}
+for i, key in ipairs(KEYS) do
+    local value, owner = ARGV[2 * i - 1], ARGV[2 * i]
+    local current = redis.call('HGET', key, value) or claimed[key .. '\0' .. value]
+    if current and current ~= owner then
+        return i
+    end
+    claimed[key .. '\0' .. value] = owner
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, ARGV[2 * i - 1], ARGV[2 * i])
+end
+return 0
+"""
+    
+    # Trả lại các giá trị owner đang giữ (bỏ qua giá trị đã thuộc document khác)
+    RELEASE_UNIQUE = """
+for i, key in ipairs(KEYS) do
+    if redis.call('HGET', key, ARGV[2 * i - 1]) == ARGV[2 * i] then
+        redis.call('HDEL', key, ARGV[2 * i - 1])
+    end
+end
+return 0
+"""
+    
+    # Lịch chạy chưa kết thúc chiếm xe / tài xế trong ngày khởi hành: loại -> field
+    BUSY_INDEXES = {"xe": "maXe", "nv": "maNV"}
+    INACTIVE_SCHEDULE_STATUSES = ["completed", "cancelled"]
+    BUSY_RETENTION = 7 * 24 * 3600  # Giữ index bận sau ngày khởi hành
+    
+    # Set các index (collection trong SET_INDEXES, "busy") đã build đầy đủ
+    SET_INDEX_READY_KEY = "idx:set:ready"
+    
+    # Giảm số lịch chạy chiếm xe / tài xế, gỡ khỏi set bận khi về 0
+    RELEASE_BUSY = """
+local n = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if n <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('SREM', KEYS[2], ARGV[1])
+end
+return n
+"""
+    
     # ==================== HELPER METHODS ====================
     
     @staticmethod
@@ -54,6 +192,59 @@ class RedisService:
             data = data.decode('utf-8')
         return json.loads(data)
     
+    # ==================== VERSION COUNTERS ====================
+    
+    @staticmethod
+    def version_key(scope: str, value: str = None) -> str:
+        """Tạo version key: ver:{scope} hoặc ver:{scope}:{value}"""
+        return f"ver:{scope}:{value}" if value else f"ver:{scope}"
+    
+    @staticmethod
+    def _version_keys(collection: str, *docs: Optional[dict]) -> List[str]:
+        """Danh sách version keys cần tăng khi ghi các document của collection"""
+        keys = [RedisService.version_key(collection)]
+        for scope, field in RedisService.VERSION_SCOPES.get(collection, []):
+            fields = field if isinstance(field, tuple) else (field,)
+            for doc in docs:
+                value = doc.get(fields[0]) if doc else None
+                if value and len(fields) > 1:
+                    value = ":".join(str(doc.get(f) or "") for f in fields)
+                if value:
+                    key = RedisService.version_key(scope, value)
+                    if key not in keys:
+                        keys.append(key)
+        return keys
+    
+    @staticmethod
+    async def get_versions(keys: List[str]) -> List[int]:
+        """
+        Đọc nhiều version counters trong một lệnh MGET
+        
+        Returns:
+            List version (0 nếu chưa từng ghi)
+        """
+        if not keys:
+            return []
+        redis = await RedisService._get_client()
+        values = await redis.mget(keys)
+        return [int(v) if v else 0 for v in values]
+    
+    @staticmethod
+    async def bump_seat_version(maLC: str, maCX: Optional[str] = None):
+        """
+        Tăng version khi trạng thái ghế (đã đặt / đang giữ) của lịch chạy thay đổi
+        
+        Args:
+            maLC: Mã lịch chạy
+            maCX: Mã chuyến xe (nếu biết) để tăng version của tuyến
+        """
+        redis = await RedisService._get_client()
+        pipeline = redis.pipeline()
+        pipeline.incr(RedisService.version_key("schedule", maLC))
+        if maCX:
+            pipeline.incr(RedisService.version_key("route", maCX))
+        await pipeline.execute()
+    
     # ==================== GENERIC CRUD ====================
     
     @staticmethod
@@ -76,14 +267,93 @@ class RedisService:
         
         redis_key = f"{collection}:{key_value}"
         
+        # Epoch chuẩn hóa (*Ts) chỉ thêm vào bản lưu, dict của người gọi giữ nguyên
+        stored = {**data, **epoch_fields(collection, data)}
+        
+        # Giành các giá trị duy nhất trước khi ghi (request đồng thời chỉ một bên thắng)
+        claims = RedisService._unique_claims(collection, key_value, None, stored)
+        await RedisService._claim_unique(collection, claims)
+        
+        pipeline = redis.pipeline()
+        
         # Lưu document
-        await redis.set(redis_key, RedisService._serialize(data))
+        pipeline.set(redis_key, RedisService._serialize(stored))
         
         # Thêm vào index
-        await redis.sadd(f"idx:{collection}", key_value)
+        pipeline.sadd(f"idx:{collection}", key_value)
+        RedisService._queue_indexes(pipeline, collection, key_value, None, stored)
+        
+        # Tăng version
+        for version_key in RedisService._version_keys(collection, stored):
+            pipeline.incr(version_key)
+        
+        try:
+            await pipeline.execute()
+        except Exception:
+            await RedisService._release_unique(claims)
+            raise
         
         return data
     
+    @staticmethod
+    async def create_many(collection: str, key_field: str, docs: List[dict], pipeline=None,
+                          claims: Optional[list] = None) -> List[dict]:
+        """
+        Tạo nhiều document cùng lúc: document, index và version trong một pipeline
+        
+        Args:
+            collection: Tên collection
+            key_field: Tên field làm key
+            docs: Danh sách data dict
+            pipeline: Pipeline có sẵn (chỉ thêm lệnh, người gọi tự execute để ghi
+                      kèm các index khác trong cùng một lần)
+            claims: Danh sách nhận các giá trị duy nhất đã giành khi dùng pipeline có sẵn,
+                    người gọi trả lại (_release_unique) nếu execute lỗi
+        
+        Raises:
+            UniqueConstraintError: Có giá trị duy nhất đã thuộc document khác
+        
+        Returns:
+            Danh sách document đã tạo
+        """
+        if any(not doc.get(key_field) for doc in docs):
+            raise ValueError(f"Missing required field: {key_field}")
+        
+        # Giành giá trị duy nhất của cả lô trong một lệnh (trùng thì không ghi document nào)
+        stored_docs = [{**data, **epoch_fields(collection, data)} for data in docs]
+        new_claims = []
+        for data in stored_docs:
+            new_claims += RedisService._unique_claims(collection, data[key_field], None, data)
+        await RedisService._claim_unique(collection, new_claims)
+        if claims is not None:
+            claims += new_claims
+        
+        own = pipeline is None
+        if own:
+            redis = await RedisService._get_client()
+            pipeline = redis.pipeline()
+        
+        version_keys = []
+        for data in stored_docs:
+            key_value = data[key_field]
+            pipeline.set(f"{collection}:{key_value}", RedisService._serialize(data))
+            RedisService._queue_indexes(pipeline, collection, key_value, None, data)
+            for version_key in RedisService._version_keys(collection, data):
+                if version_key not in version_keys:
+                    version_keys.append(version_key)
+        if docs:
+            pipeline.sadd(f"idx:{collection}", *[data[key_field] for data in docs])
+        for version_key in version_keys:
+            pipeline.incr(version_key)
+        
+        if own and docs:
+            try:
+                await pipeline.execute()
+            except Exception:
+                await RedisService._release_unique(new_claims)
+                raise
+        return docs
+    
     @staticmethod
     async def get_by_key(collection: str, key_value: str) -> Optional[dict]:
         """
@@ -134,6 +404,34 @@ class RedisService:
         
         return result
     
+    @staticmethod
+    async def iter_batches(collection: str, batch_size: int = 500) -> AsyncIterator[List[dict]]:
+        """
+        Duyệt collection theo lô (SSCAN trên index + MGET) thay vì đọc toàn bộ một lần
+        
+        Args:
+            collection: Tên collection
+            batch_size: Số key gợi ý cho mỗi lần SSCAN
+        
+        Yields:
+            List documents của từng lô (bỏ qua document đã bị xóa)
+        """
+        redis = await RedisService._get_client()
+        # SSCAN có thể trả lặp key khi set được rehash: chỉ giữ lại key đã thấy
+        seen = set()
+        cursor = 0
+        while True:
+            cursor, keys = await redis.sscan(f"idx:{collection}", cursor=cursor, count=batch_size)
+            keys = [key for key in keys if key not in seen]
+            seen.update(keys)
+            if keys:
+                results = await redis.mget([f"{collection}:{key}" for key in keys])
+                batch = [RedisService._deserialize(data) for data in results if data]
+                if batch:
+                    yield batch
+            if cursor == 0:
+                break
+    
     @staticmethod
     async def get_multiple(collection: str, key_values: List[str]) -> List[Optional[dict]]:
         """
@@ -214,7 +512,7 @@ class RedisService:
             update_data: Data cần update
         
         Returns:
-            Document đã cập nhật hoặc None
+            Document đã cập nhật (không kèm field *Ts) hoặc None
         """
         redis = await RedisService._get_client()
         redis_key = f"{collection}:{key_value}"
@@ -225,14 +523,33 @@ class RedisService:
             return None
         
         current_data = RedisService._deserialize(current)
+        old_data = dict(current_data)
         
         # Merge data
         current_data.update(update_data)
+        current_data.update(epoch_fields(collection, current_data))
+        
+        # Giành giá trị duy nhất mới, giá trị cũ được trả lại cùng lúc ghi
+        claims = RedisService._unique_claims(collection, key_value, old_data, current_data)
+        await RedisService._claim_unique(collection, claims)
+        
+        pipeline = redis.pipeline()
         
         # Lưu lại
-        await redis.set(redis_key, RedisService._serialize(current_data))
+        pipeline.set(redis_key, RedisService._serialize(current_data))
+        RedisService._queue_indexes(pipeline, collection, key_value, old_data, current_data)
         
-        return current_data
+        # Tăng version (cả phạm vi cũ và mới nếu field phạm vi thay đổi)
+        for version_key in RedisService._version_keys(collection, old_data, current_data):
+            pipeline.incr(version_key)
+        
+        try:
+            await pipeline.execute()
+        except Exception:
+            await RedisService._release_unique(claims)
+            raise
+        
+        return strip_epoch_fields(collection, current_data)
     
     @staticmethod
     async def delete(collection: str, key_value: str) -> bool:
@@ -249,14 +566,525 @@ class RedisService:
         redis = await RedisService._get_client()
         redis_key = f"{collection}:{key_value}"
         
+        # Lấy document hiện tại để biết version theo phạm vi và các index theo giá trị field
+        current_data = None
+        if (collection in RedisService.VERSION_SCOPES or collection in RedisService.STATUS_FIELDS
+                or collection in RedisService.SET_INDEXES or collection in RedisService.UNIQUE_CONSTRAINTS):
+            current_data = RedisService._deserialize(await redis.get(redis_key))
+        
+        pipeline = redis.pipeline()
+        
         # Xóa document
-        await redis.delete(redis_key)
+        pipeline.delete(redis_key)
         
         # Xóa khỏi index
-        await redis.srem(f"idx:{collection}", key_value)
+        pipeline.srem(f"idx:{collection}", key_value)
+        RedisService._queue_indexes(pipeline, collection, key_value, current_data, None)
+        
+        # Tăng version
+        for version_key in RedisService._version_keys(collection, current_data):
+            pipeline.incr(version_key)
+        
+        await pipeline.execute()
         
         return True
     
+    @staticmethod
+    def queue_update_many(pipeline, collection: str, key_field: str, docs: List[dict], update_data: dict) -> List[dict]:
+        """
+        Thêm lệnh ghi đè nhiều document (đã đọc sẵn) với cùng update_data vào pipeline,
+        kèm index và version
+        
+        Returns:
+            Các document sau khi cập nhật
+        """
+        updated = []
+        version_keys = []
+        for old_data in docs:
+            key_value = old_data[key_field]
+            new_data = {**old_data, **update_data}
+            new_data.update(epoch_fields(collection, new_data))
+            pipeline.set(f"{collection}:{key_value}", RedisService._serialize(new_data))
+            RedisService._queue_indexes(pipeline, collection, key_value, old_data, new_data)
+            for version_key in RedisService._version_keys(collection, old_data, new_data):
+                if version_key not in version_keys:
+                    version_keys.append(version_key)
+            updated.append(new_data)
+        for version_key in version_keys:
+            pipeline.incr(version_key)
+        return updated
+    
+    @staticmethod
+    def queue_delete_many(pipeline, collection: str, key_field: str, docs: List[dict]):
+        """Thêm lệnh xóa nhiều document (đã đọc sẵn) vào pipeline, kèm index và version"""
+        if not docs:
+            return
+        version_keys = []
+        for data in docs:
+            key_value = data[key_field]
+            pipeline.delete(f"{collection}:{key_value}")
+            RedisService._queue_indexes(pipeline, collection, key_value, data, None)
+            for version_key in RedisService._version_keys(collection, data):
+                if version_key not in version_keys:
+                    version_keys.append(version_key)
+        pipeline.srem(f"idx:{collection}", *[data[key_field] for data in docs])
+        for version_key in version_keys:
+            pipeline.incr(version_key)
+    
+    # ==================== INDEXES ====================
+    
+    @staticmethod
+    def _queue_indexes(pipeline, collection: str, key_value: str,
+                       old: Optional[dict], new: Optional[dict]):
+        """Thêm lệnh cập nhật mọi index phụ của document vào pipeline (new = None khi xóa)"""
+        RedisService._queue_sorted_indexes(pipeline, collection, key_value, old, new)
+        RedisService._queue_set_indexes(pipeline, collection, key_value, old, new)
+        RedisService._queue_release_unique(pipeline, collection, key_value, old, new)
+        if collection == "lichChay":
+            RedisService._queue_busy_indexes(pipeline, old, new)
+    
+    @staticmethod
+    def unique_key(collection: str, field: str) -> str:
+        """uniq:{collection}:{field}"""
+        return f"uniq:{collection}:{field}"
+    
+    @staticmethod
+    def _unique_claims(collection: str, key_value: str, old: Optional[dict], new: dict) -> List[tuple]:
+        """Các (uniq hash, giá trị, owner) mới mà document cần giành"""
+        claims = []
+        for field in RedisService.UNIQUE_CONSTRAINTS.get(collection, []):
+            value = new.get(field)
+            if value and (not old or old.get(field) != value):
+                claims.append((RedisService.unique_key(collection, field), str(value), key_value))
+        return claims
+    
+    @staticmethod
+    def _unique_args(claims: List[tuple]) -> list:
+        args = [len(claims)] + [key for key, _, _ in claims]
+        for _, value, owner in claims:
+            args += [value, owner]
+        return args
+    
+    @staticmethod
+    async def _claim_unique(collection: str, claims: List[tuple]):
+        """
+        Giành nguyên tử các giá trị duy nhất (Lua), tất cả hoặc không
+        
+        Raises:
+            UniqueConstraintError: Giá trị đã thuộc document khác
+        """
+        if not claims:
+            return
+        await RedisService.ensure_unique_indexes(collection)
+        redis = await RedisService._get_client()
+        conflict = await redis.eval(RedisService.CLAIM_UNIQUE, *RedisService._unique_args(claims))
+        if conflict:
+            key, value, _ = claims[int(conflict) - 1]
+            raise UniqueConstraintError(collection, key.rsplit(":", 1)[1], value)
+    
+    @staticmethod
+    async def _release_unique(claims: List[tuple]):
+        """Trả lại các giá trị vừa giành khi ghi document thất bại"""
+        if not claims:
+            return
+        redis = await RedisService._get_client()
+        await redis.eval(RedisService.RELEASE_UNIQUE, *RedisService._unique_args(claims))
+    
+    @staticmethod
+    def _queue_release_unique(pipeline, collection: str, key_value: str,
+                              old: Optional[dict], new: Optional[dict]):
+        """Thêm lệnh trả lại giá trị duy nhất cũ (document bị xóa hoặc đổi giá trị) vào pipeline"""
+        releases = []
+        for field in RedisService.UNIQUE_CONSTRAINTS.get(collection, []):
+            value = (old or {}).get(field)
+            if value and (not new or new.get(field) != value):
+                releases.append((RedisService.unique_key(collection, field), str(value), key_value))
+        if releases:
+            pipeline.eval(RedisService.RELEASE_UNIQUE, *RedisService._unique_args(releases))
+    
+    @staticmethod
+    async def build_unique_indexes(collection: str):
+        """
+        Xóa và build lại uniq hash của collection từ dữ liệu hiện có
+        (dữ liệu cũ đã trùng thì document gặp trước giữ giá trị)
+        """
+        redis = await RedisService._get_client()
+        fields = RedisService.UNIQUE_CONSTRAINTS.get(collection, [])
+        await redis.delete(*[RedisService.unique_key(collection, field) for field in fields])
+        key_field = RedisService._key_field(collection)
+        async for batch in RedisService.iter_batches(collection):
+            pipeline = redis.pipeline(transaction=False)
+            for doc in batch:
+                for field in fields:
+                    if doc.get(field):
+                        pipeline.hsetnx(RedisService.unique_key(collection, field), str(doc[field]), doc.get(key_field))
+            await pipeline.execute()
+        await redis.sadd(RedisService.UNIQUE_INDEX_READY_KEY, collection)
+    
+    @staticmethod
+    async def ensure_unique_indexes(collection: str):
+        """Build lần đầu uniq hash (dữ liệu có từ trước khi có ràng buộc)"""
+        redis = await RedisService._get_client()
+        if not await redis.sismember(RedisService.UNIQUE_INDEX_READY_KEY, collection):
+            await RedisService.build_unique_indexes(collection)
+    
+    @staticmethod
+    async def unique_owners(collection: str, field: str, values: List[str]) -> List[Optional[str]]:
+        """Key của document đang giữ từng giá trị (HMGET, None nếu còn trống)"""
+        if not values:
+            return []
+        await RedisService.ensure_unique_indexes(collection)
+        redis = await RedisService._get_client()
+        return await redis.hmget(RedisService.unique_key(collection, field), [str(v) for v in values])
+    
+    @staticmethod
+    async def find_unique(collection: str, field: str, value: str,
+                          fallback_scan: bool = False) -> Optional[dict]:
+        """
+        Document có field duy nhất = value, O(1) qua uniq hash
+        
+        Args:
+            fallback_scan: Hash không có giá trị (document ghi thẳng bởi script sau khi
+                hash đã build) thì quét collection như trước và ghi bù vào hash
+        """
+        owner = (await RedisService.unique_owners(collection, field, [value]))[0]
+        doc = await RedisService.get_by_key(collection, owner) if owner else None
+        if doc or not fallback_scan:
+            return doc
+        
+        doc = await RedisService.find_one(collection, {field: value})
+        if doc:
+            redis = await RedisService._get_client()
+            key_field = RedisService._key_field(collection)
+            await redis.hsetnx(RedisService.unique_key(collection, field), str(value), doc.get(key_field))
+        return doc
+    
+    @staticmethod
+    def set_index_key(collection: str, field: str, value) -> str:
+        """sidx:{collection}:{field}:{value}"""
+        return f"sidx:{collection}:{field}:{value}"
+    
+    @staticmethod
+    def _queue_set_indexes(pipeline, collection: str, key_value: str,
+                           old: Optional[dict], new: Optional[dict]):
+        for field, default in RedisService.SET_INDEXES.get(collection, {}).items():
+            old_value = (old or {}).get(field) or default if old else None
+            new_value = (new or {}).get(field) or default if new else None
+            if old_value == new_value:
+                continue
+            if old_value:
+                pipeline.srem(RedisService.set_index_key(collection, field, old_value), key_value)
+            if new_value:
+                pipeline.sadd(RedisService.set_index_key(collection, field, new_value), key_value)
+    
+    @staticmethod
+    def busy_key(kind: str, date: str) -> str:
+        """busy:{xe|nv}:{YYYY-MM-DD}"""
+        return f"busy:{kind}:{date}"
+    
+    @staticmethod
+    def _busy_entries(lich_chay: Optional[dict]) -> Dict[str, tuple]:
+        """loại -> (ngày khởi hành, mã xe / tài xế) mà lịch chạy đang chiếm"""
+        if not lich_chay or lich_chay.get("trangThai") in RedisService.INACTIVE_SCHEDULE_STATUSES:
+            return {}
+        ts = doc_epoch("lichChay", lich_chay, "ngayKhoiHanhTs")
+        if ts is None:
+            return {}
+        date = epoch_date(ts)
+        return {
+            kind: (date, lich_chay.get(field))
+            for kind, field in RedisService.BUSY_INDEXES.items()
+            if lich_chay.get(field)
+        }
+    
+    @staticmethod
+    def _queue_busy_indexes(pipeline, old: Optional[dict], new: Optional[dict]):
+        old_entries = RedisService._busy_entries(old)
+        new_entries = RedisService._busy_entries(new)
+        for kind in RedisService.BUSY_INDEXES:
+            before, after = old_entries.get(kind), new_entries.get(kind)
+            if before == after:
+                continue
+            if before:
+                key = RedisService.busy_key(kind, before[0])
+                pipeline.eval(RedisService.RELEASE_BUSY, 2, f"{key}:count", key, before[1])
+            if after:
+                key = RedisService.busy_key(kind, after[0])
+                expire_at = day_range(after[0])[1] + RedisService.BUSY_RETENTION
+                pipeline.hincrby(f"{key}:count", after[1], 1)
+                pipeline.sadd(key, after[1])
+                pipeline.expireat(f"{key}:count", expire_at)
+                pipeline.expireat(key, expire_at)
+    
+    @staticmethod
+    async def build_set_indexes(name: str):
+        """
+        Xóa và build lại set index của một collection trong SET_INDEXES,
+        hoặc index xe / tài xế bận (name = "busy") từ lichChay
+        """
+        redis = await RedisService._get_client()
+        pattern = "busy:*" if name == "busy" else f"sidx:{name}:*"
+        old_keys = [key async for key in redis.scan_iter(match=pattern)]
+        if old_keys:
+            await redis.delete(*old_keys)
+        collection = "lichChay" if name == "busy" else name
+        async for batch in RedisService.iter_batches(collection):
+            pipeline = redis.pipeline(transaction=False)
+            for doc in batch:
+                if name == "busy":
+                    RedisService._queue_busy_indexes(pipeline, None, doc)
+                else:
+                    RedisService._queue_set_indexes(
+                        pipeline, collection, doc.get(RedisService._key_field(collection)), None, doc
+                    )
+            await pipeline.execute()
+        await redis.sadd(RedisService.SET_INDEX_READY_KEY, name)
+    
+    @staticmethod
+    async def ensure_set_indexes(*names: str):
+        """Build lần đầu các set index chưa sẵn sàng (dữ liệu có từ trước khi có index)"""
+        redis = await RedisService._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for name in names:
+            pipeline.sismember(RedisService.SET_INDEX_READY_KEY, name)
+        for name, ready in zip(names, await pipeline.execute()):
+            if not ready:
+                await RedisService.build_set_indexes(name)
+    
+    @staticmethod
+    async def find_by_set_index(collection: str, field: str, value: str) -> List[dict]:
+        """Các document có field = value, đọc qua set index (SMEMBERS + MGET)"""
+        await RedisService.ensure_set_indexes(collection)
+        redis = await RedisService._get_client()
+        keys = await redis.smembers(RedisService.set_index_key(collection, field, value))
+        docs = await RedisService.get_multiple(collection, sorted(keys))
+        return [doc for doc in docs if doc]
+    
+    @staticmethod
+    async def count_by_set_index(collection: str, field: str, values: List[str]) -> List[int]:
+        """Số document có field = từng giá trị trong values (SCARD theo lô)"""
+        if not values:
+            return []
+        await RedisService.ensure_set_indexes(collection)
+        redis = await RedisService._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for value in values:
+            pipeline.scard(RedisService.set_index_key(collection, field, value))
+        return await pipeline.execute()
+    
+    @staticmethod
+    async def is_busy(kind: str, date: str, value: str) -> bool:
+        """Xe (kind="xe") / tài xế (kind="nv") đã có lịch chạy chưa kết thúc trong ngày"""
+        await RedisService.ensure_set_indexes("busy")
+        redis = await RedisService._get_client()
+        return bool(await redis.sismember(RedisService.busy_key(kind, date), value))
+    
+    @staticmethod
+    async def get_busy_sets(dates: List[str]) -> Dict[str, tuple]:
+        """
+        Xe và tài xế bận của nhiều ngày trong một round trip
+        
+        Returns:
+            {date: (set maXe, set maNV)}
+        """
+        await RedisService.ensure_set_indexes("busy")
+        redis = await RedisService._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for date in dates:
+            pipeline.smembers(RedisService.busy_key("xe", date))
+            pipeline.smembers(RedisService.busy_key("nv", date))
+        results = await pipeline.execute() if dates else []
+        return {
+            date: (set(results[2 * i]), set(results[2 * i + 1]))
+            for i, date in enumerate(dates)
+        }
+    
+    @staticmethod
+    async def get_available_buses(date: str) -> List[dict]:
+        """Xe đang hoạt động và chưa có lịch chạy trong ngày (SDIFF, không duyệt lichChay)"""
+        await RedisService.ensure_set_indexes("xe", "busy")
+        redis = await RedisService._get_client()
+        keys = await redis.sdiff(
+            RedisService.set_index_key("xe", "trangThai", "active"),
+            RedisService.busy_key("xe", date)
+        )
+        buses = await RedisService.get_multiple("xe", sorted(keys))
+        return [bus for bus in buses if bus]
+    
+    @staticmethod
+    async def get_available_drivers(date: str, driver_roles: List[str]) -> List[dict]:
+        """
+        Nhân viên có chức vụ trong driver_roles, không lái lịch chạy nào trong ngày
+        và không phải tài xế của xe đang có lịch chạy trong ngày
+        """
+        await RedisService.ensure_set_indexes("nhanVien", "busy")
+        redis = await RedisService._get_client()
+        busy_drivers_key = RedisService.busy_key("nv", date)
+        pipeline = redis.pipeline(transaction=False)
+        for maCV in driver_roles:
+            pipeline.sdiff(RedisService.set_index_key("nhanVien", "maCV", maCV), busy_drivers_key)
+        pipeline.smembers(RedisService.busy_key("xe", date))
+        results = await pipeline.execute()
+        
+        candidates = set().union(*results[:-1]) if driver_roles else set()
+        busy_buses = await RedisService.get_multiple("xe", list(results[-1]))
+        candidates -= {bus.get("maNV") for bus in busy_buses if bus}
+        employees = await RedisService.get_multiple("nhanVien", sorted(candidates))
+        return [emp for emp in employees if emp]
+    
+    # ==================== SORTED INDEXES / PHÂN TRANG ====================
+    
+    @staticmethod
+    def sorted_index_key(collection: str, order: str, status: Optional[str] = None) -> str:
+        """zidx:{collection}:{order} hoặc zidx:{collection}:{order}:{status}"""
+        key = f"zidx:{collection}:{order}"
+        return f"{key}:{status}" if status else key
+    
+    @staticmethod
+    def _queue_sorted_indexes(pipeline, collection: str, key_value: str,
+                              old: Optional[dict], new: Optional[dict]):
+        """Thêm lệnh cập nhật sorted index vào pipeline (new = None khi xóa)"""
+        indexes = RedisService.SORTED_INDEXES.get(collection)
+        if not indexes:
+            return
+        status_field = RedisService.STATUS_FIELDS.get(collection)
+        old_status = (old or {}).get(status_field) if status_field else None
+        new_status = (new or {}).get(status_field) if status_field else None
+        for order, ts_field in indexes.items():
+            if old_status and old_status != new_status:
+                pipeline.zrem(RedisService.sorted_index_key(collection, order, old_status), key_value)
+            if new is None:
+                pipeline.zrem(RedisService.sorted_index_key(collection, order), key_value)
+                continue
+            # Document chưa backfill *Ts: tính từ chuỗi gốc, không có ngày thì xếp cuối
+            score = {key_value: new.get(ts_field) or epoch_fields(collection, new).get(ts_field) or 0}
+            pipeline.zadd(RedisService.sorted_index_key(collection, order), score)
+            if new_status:
+                pipeline.zadd(RedisService.sorted_index_key(collection, order, new_status), score)
+    
+    @staticmethod
+    async def build_sorted_indexes(collection: str):
+        """Xóa và build lại sorted index của collection từ idx:{collection}"""
+        redis = await RedisService._get_client()
+        old_keys = [key async for key in redis.scan_iter(match=f"zidx:{collection}:*")]
+        if old_keys:
+            await redis.delete(*old_keys)
+        async for batch in RedisService.iter_batches(collection):
+            pipeline = redis.pipeline(transaction=False)
+            for doc in batch:
+                RedisService._queue_sorted_indexes(
+                    pipeline, collection, doc.get(RedisService._key_field(collection)), None, doc
+                )
+            await pipeline.execute()
+        await redis.sadd(RedisService.SORTED_INDEX_READY_KEY, collection)
+    
+    @staticmethod
+    def _key_field(collection: str) -> str:
+        return {
+            "khachHang": "maKH",
+            "nhanVien": "maNV",
+            "xe": "maXe",
+            "gheNgoi": "maGhe",
+            "hoaDon": "maHD",
+            "veXe": "maVe",
+            "yeuCauHuy": "maYeuCauHuy",
+            "lichChay": "maLC",
+        }[collection]
+    
+    @staticmethod
+    def encode_cursor(score: float, key_value: str) -> str:
+        """Cursor mờ (base64url) từ vị trí (score, key) của phần tử cuối trang"""
+        raw = json.dumps([int(score) if score == int(score) else score, key_value], ensure_ascii=False)
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """(score, key) từ cursor, ValueError nếu cursor không hợp lệ"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            score, key_value = json.loads(raw)
+            return float(score), str(key_value)
+        except Exception:
+            raise ValueError("Cursor không hợp lệ")
+    
+    @staticmethod
+    async def page(collection: str, order: str, status: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: Optional[int] = None,
+                   descending: bool = True) -> dict:
+        """
+        Một trang document theo sorted index (chi phí như nhau ở mọi trang)
+        
+        Vị trí bắt đầu tính từ cursor bằng ZCOUNT + các phần tử cùng score, rồi
+        đọc trang bằng ZRANGE theo rank và MGET.
+        
+        Args:
+            collection: Tên collection (có trong SORTED_INDEXES)
+            order: Tên thứ tự (vd: "created", "departure")
+            status: Lọc theo trạng thái (STATUS_FIELDS)
+            cursor: nextCursor của trang trước
+            limit: Số phần tử mỗi trang (None = tất cả từ cursor)
+            descending: Mới nhất trước
+        
+        Returns:
+            {"items": [...], "nextCursor": str | None, "total": số phần tử khớp bộ lọc}
+        """
+        redis = await RedisService._get_client()
+        if not await redis.sismember(RedisService.SORTED_INDEX_READY_KEY, collection):
+            await RedisService.build_sorted_indexes(collection)
+        index_key = RedisService.sorted_index_key(collection, order, status)
+        
+        start = 0
+        if cursor:
+            score, key_value = RedisService.decode_cursor(cursor)
+            pipeline = redis.pipeline(transaction=False)
+            if descending:
+                pipeline.zcount(index_key, f"({score}", "+inf")
+            else:
+                pipeline.zcount(index_key, "-inf", f"({score}")
+            pipeline.zrangebyscore(index_key, score, score)
+            before, ties = await pipeline.execute()
+            # Cùng score thì ZSET xếp theo key: bỏ qua các key đã nằm ở trang trước
+            if descending:
+                start = before + sum(1 for tie in ties if tie >= key_value)
+            else:
+                start = before + sum(1 for tie in ties if tie <= key_value)
+        
+        stop = start + limit - 1 if limit else -1
+        pipeline = redis.pipeline(transaction=False)
+        if descending:
+            pipeline.zrevrange(index_key, start, stop, withscores=True)
+        else:
+            pipeline.zrange(index_key, start, stop, withscores=True)
+        pipeline.zcard(index_key)
+        members, total = await pipeline.execute()
+        
+        docs = await RedisService.get_multiple(collection, [member for member, _ in members])
+        items = [doc for doc in docs if doc]
+        stale = [member for (member, _), doc in zip(members, docs) if not doc]
+        if stale:
+            # Document đã bị xóa ngoài service (vd: script seed / restore): dọn khỏi index
+            await redis.zrem(index_key, *stale)
+        
+        next_cursor = None
+        if limit and len(members) == limit:
+            last_key, last_score = members[-1]
+            next_cursor = RedisService.encode_cursor(last_score, last_key)
+        return {"items": items, "nextCursor": next_cursor, "total": total}
+    
+    @staticmethod
+    async def count_sorted(collection: str, order: str, status: Optional[str] = None) -> int:
+        """Số document theo sorted index (ZCARD, O(1), một round trip khi index đã sẵn sàng)"""
+        redis = await RedisService._get_client()
+        key = RedisService.sorted_index_key(collection, order, status)
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.sismember(RedisService.SORTED_INDEX_READY_KEY, collection)
+        pipeline.zcard(key)
+        ready, total = await pipeline.execute()
+        if not ready:
+            await RedisService.build_sorted_indexes(collection)
+            total = await redis.zcard(key)
+        return total
+    
     @staticmethod
     async def count(collection: str) -> int:
         """
@@ -296,7 +1124,7 @@ class RedisService:
     
     @staticmethod
     async def get_khach_hang_by_email(email: str) -> Optional[dict]:
-        return await RedisService.find_one("khachHang", {"email": email})
+        return await RedisService.find_unique("khachHang", "email", email, fallback_scan=True)
     
     @staticmethod
     async def create_khach_hang(data: dict) -> dict:
@@ -313,7 +1141,7 @@ class RedisService:
     
     @staticmethod
     async def get_nhan_vien_by_email(email: str) -> Optional[dict]:
-        return await RedisService.find_one("nhanVien", {"email": email})
+        return await RedisService.find_unique("nhanVien", "email", email, fallback_scan=True)
     
     @staticmethod
     async def create_nhan_vien(data: dict) -> dict:
@@ -345,7 +1173,7 @@ class RedisService:
     @staticmethod
     async def get_ghe_by_xe(maXe: str) -> List[dict]:
         """Lấy tất cả ghế của một xe"""
-        return await RedisService.find("gheNgoi", {"maXe": maXe})
+        return await RedisService.find_by_set_index("gheNgoi", "maXe", maXe)
     
     # ---------- CHUYẾN XE ----------
     @staticmethod
@@ -372,18 +1200,36 @@ class RedisService:
             if diem_di and diem_den and ma_cx:
                 await redis.sadd(f"routes:{diem_di}:{diem_den}", ma_cx)
         
-        # Index cho booked seats: booked:{maLC} -> set of maGhe (populate from existing veXe)
+        # Index cho booked seats: booked:{maLC} -> set of maGhe (build lại từ veXe)
+        booked_by_lc = {}
         ve_list = await RedisService.get_all("veXe")
         for ve in ve_list:
-            if ve.get("trangThai") in ["paid", "confirmed"]:
-                ma_lc = ve.get("maLC", "")
-                if ma_lc:
-                    booked_key = f"booked:{ma_lc}"
-                    if ve.get("maGhe"):
-                        await redis.sadd(booked_key, ve.get("maGhe"))
-                    elif ve.get("soGhe"):
-                        for ghe in ve.get("soGhe", []):
-                            await redis.sadd(booked_key, ghe)
+            ma_lc = ve.get("maLC", "")
+            if ma_lc and ve.get("trangThai") in RedisService.BOOKED_STATUSES:
+                booked_by_lc.setdefault(ma_lc, set()).update(RedisService._ticket_seats(ve))
+        
+        pipeline = redis.pipeline()
+        cursor = 0
+        while True:
+            cursor, keys = await redis.scan(cursor, match="booked:*", count=500)
+            for key in keys:
+                pipeline.delete(key)
+            if cursor == 0:
+                break
+        for ma_lc, seats in booked_by_lc.items():
+            if seats:
+                pipeline.sadd(f"booked:{ma_lc}", *seats)
+        # Đánh dấu index booked đã đầy đủ -> không cần fallback scan veXe nữa
+        pipeline.set(RedisService.BOOKED_INDEX_READY_KEY, 1)
+        await pipeline.execute()
+        
+        # Sorted / set index (dữ liệu có thể đã được ghi thẳng bởi script seed)
+        for collection in RedisService.SORTED_INDEXES:
+            await RedisService.build_sorted_indexes(collection)
+        for name in [*RedisService.SET_INDEXES, "busy"]:
+            await RedisService.build_set_indexes(name)
+        for collection in RedisService.UNIQUE_CONSTRAINTS:
+            await RedisService.build_unique_indexes(collection)
     
     @staticmethod
     async def search_chuyen_xe_indexed(diemDi: str, diemDen: str) -> List[dict]:
@@ -421,7 +1267,7 @@ class RedisService:
     @staticmethod
     async def get_lich_chay_by_chuyen(maCX: str) -> List[dict]:
         """Lấy tất cả lịch chạy của một chuyến xe"""
-        return await RedisService.find("lichChay", {"maCX": maCX})
+        return await RedisService.find_by_set_index("lichChay", "maCX", maCX)
     
     @staticmethod
     async def get_all_lich_chay() -> List[dict]:
@@ -474,6 +1320,16 @@ class RedisService:
     async def get_all_hoa_don() -> List[dict]:
         return await RedisService.get_all("hoaDon")
     
+    # ---------- YÊU CẦU HỦY ----------
+    @staticmethod
+    async def get_yeu_cau_huy(maYeuCauHuy: str) -> Optional[dict]:
+        return await RedisService.get_by_key("yeuCauHuy", maYeuCauHuy)
+    
+    @staticmethod
+    async def count_yeu_cau_huy(trangThai: Optional[str] = None) -> int:
+        """Số yêu cầu hủy (theo trạng thái), đọc từ index trạng thái thay vì duyệt collection"""
+        return await RedisService.count_sorted("yeuCauHuy", "created", trangThai)
+    
     # ==================== UTILITY METHODS ====================
     
     @staticmethod
@@ -492,6 +1348,13 @@ class RedisService:
         count = await RedisService.count(collection)
         return f"{prefix}{str(count + 1).zfill(digits)}"
     
+    @staticmethod
+    def _ticket_seats(ve: dict) -> List[str]:
+        """Ghế của một vé: maGhe (single) hoặc soGhe (list)"""
+        if ve.get("maGhe"):
+            return [ve.get("maGhe")]
+        return list(ve.get("soGhe", []) or [])
+    
     @staticmethod
     async def get_booked_seats_by_lich_chay(maLC: str) -> List[str]:
         """
@@ -512,22 +1375,156 @@ class RedisService:
         if booked_seats:
             return list(booked_seats)
         
+        # Index đã build đầy đủ -> set rỗng nghĩa là chưa có ghế nào được đặt
+        if await redis.exists(RedisService.BOOKED_INDEX_READY_KEY):
+            return []
+        
         # Fallback to scanning veXe (slower)
         ve_list = await RedisService.find("veXe", {"maLC": maLC})
         booked_seats = []
         for ve in ve_list:
-            if ve.get("trangThai") in ["paid", "confirmed"]:
-                # Có thể là maGhe (single) hoặc soGhe (list)
-                if ve.get("maGhe"):
-                    booked_seats.append(ve.get("maGhe"))
-                elif ve.get("soGhe"):
-                    booked_seats.extend(ve.get("soGhe", []))
+            if ve.get("trangThai") in RedisService.BOOKED_STATUSES:
+                booked_seats.extend(RedisService._ticket_seats(ve))
         
         # Cache the result in set for future use
         if booked_seats:
             await redis.sadd(booked_set_key, *booked_seats)
         
         return booked_seats
+    
+    @staticmethod
+    async def add_booked_seats(maLC: str, seats: List[str]):
+        """
+        Thêm ghế vào set booked:{maLC} khi thanh toán thành công
+        
+        Khi index chưa build và set chưa được cache thì bỏ qua: lần đọc sau sẽ
+        quét veXe (đã bao gồm vé mới) và tạo set đầy đủ, tránh set chỉ có ghế mới.
+        """
+        if not seats:
+            return
+        redis = await RedisService._get_client()
+        booked_set_key = f"booked:{maLC}"
+        pipeline = redis.pipeline()
+        pipeline.exists(RedisService.BOOKED_INDEX_READY_KEY)
+        pipeline.exists(booked_set_key)
+        index_ready, set_exists = await pipeline.execute()
+        if index_ready or set_exists:
+            await redis.sadd(booked_set_key, *seats)
+    
+    @staticmethod
+    async def remove_booked_seats(maLC: str, seats: List[str]):
+        """Xóa ghế khỏi set booked:{maLC} khi vé được hoàn/hủy"""
+        if not seats:
+            return
+        redis = await RedisService._get_client()
+        await redis.srem(f"booked:{maLC}", *seats)
+    
+    @staticmethod
+    async def get_availability(
+        ma_lc_list: List[str],
+        ngayDi: Optional[str] = None,
+        sessionId: Optional[str] = None,
+        include_seats: bool = False
+    ) -> Dict[str, dict]:
+        """
+        Lấy tình trạng ghế (đã đặt, đang giữ, còn trống) cho nhiều lịch chạy cùng lúc
+        
+        Round trip 1: lichChay + booked:{maLC} của tất cả lịch chạy
+        Round trip 2: pending_booking:{maLC}:{ngayDi} + xe (tổng số ghế)
+        
+        Args:
+            ma_lc_list: Danh sách mã lịch chạy
+            ngayDi: Ngày đi (YYYY-MM-DD); mặc định là ngayKhoiHanh của từng lịch chạy
+            sessionId: Session của user để tách ghế "tôi đang giữ"
+            include_seats: Trả kèm danh sách mã ghế
+        
+        Returns:
+            Dict maLC -> {totalSeats, booked, held, free, [bookedSeats, heldSeats, myHeldSeats]}
+            (lịch chạy không tồn tại sẽ không có trong kết quả)
+        """
+        ma_lc_list = list(dict.fromkeys(m for m in ma_lc_list if m))
+        if not ma_lc_list:
+            return {}
+        
+        redis = await RedisService._get_client()
+        
+        pipeline = redis.pipeline()
+        for maLC in ma_lc_list:
+            pipeline.get(f"lichChay:{maLC}")
+            pipeline.smembers(f"booked:{maLC}")
+        pipeline.exists(RedisService.BOOKED_INDEX_READY_KEY)
+        results = await pipeline.execute()
+        index_ready = results.pop()
+        
+        schedules = {}
+        booked = {}
+        for i, maLC in enumerate(ma_lc_list):
+            lich_chay = RedisService._deserialize(results[2 * i])
+            if lich_chay:
+                schedules[maLC] = lich_chay
+                booked[maLC] = set(results[2 * i + 1] or [])
+        
+        # Index chưa build: fallback một lần quét veXe cho các lịch chạy có set rỗng
+        missing = [m for m in schedules if not booked[m]]
+        if missing and not index_ready:
+            missing_set = set(missing)
+            for ve in await RedisService.get_all("veXe"):
+                if ve.get("maLC") in missing_set and ve.get("trangThai") in RedisService.BOOKED_STATUSES:
+                    booked[ve["maLC"]].update(RedisService._ticket_seats(ve))
+            cache_pipeline = redis.pipeline()
+            for maLC in missing:
+                if booked[maLC]:
+                    cache_pipeline.sadd(f"booked:{maLC}", *booked[maLC])
+            await cache_pipeline.execute()
+        
+        ma_xe_list = list({lc.get("maXe") for lc in schedules.values() if lc.get("maXe")})
+        pipeline = redis.pipeline()
+        for maLC, lich_chay in schedules.items():
+            pipeline.get(f"pending_booking:{maLC}:{ngayDi or lich_chay.get('ngayKhoiHanh', '')}")
+        for maXe in ma_xe_list:
+            pipeline.get(f"xe:{maXe}")
+        results = await pipeline.execute()
+        pending_results = results[:len(schedules)]
+        xe_dict = {
+            maXe: RedisService._deserialize(data)
+            for maXe, data in zip(ma_xe_list, results[len(schedules):])
+        }
+        
+        availability = {}
+        for (maLC, lich_chay), pending_data in zip(schedules.items(), pending_results):
+            held_seats, my_held_seats = [], []
+            if pending_data:
+                try:
+                    for session, booking_info in json.loads(pending_data).items():
+                        seats = booking_info.get("danhSachGhe", [])
+                        if sessionId and session == sessionId:
+                            my_held_seats.extend(seats)
+                        else:
+                            held_seats.extend(seats)
+                except (json.JSONDecodeError, AttributeError):
+                    pass
+            
+            xe = xe_dict.get(lich_chay.get("maXe")) or {}
+            total_seats = int(xe.get("soChoNgoi", xe.get("soGhe", 34)) or 0)
+            booked_seats = booked[maLC]
+            occupied = booked_seats | set(held_seats) | set(my_held_seats)
+            
+            item = {
+                "maLC": maLC,
+                "ngayDi": ngayDi or lich_chay.get("ngayKhoiHanh", ""),
+                "totalSeats": total_seats,
+                "booked": len(booked_seats),
+                "held": len(set(held_seats) - booked_seats),
+                "myHeld": len(set(my_held_seats) - booked_seats),
+                "free": max(total_seats - len(occupied), 0)
+            }
+            if include_seats:
+                item["bookedSeats"] = sorted(booked_seats)
+                item["heldSeats"] = held_seats
+                item["myHeldSeats"] = my_held_seats
+            availability[maLC] = item
+        
+        return availability
 
     @staticmethod
     async def get_pending_seats_by_lich_chay(maLC: str, ngayDi: str) -> Dict[str, List[str]]:
@@ -0,0 +1,346 @@
+"""
+Search Snapshot Service - Snapshot dạng cột cho tìm kiếm tuyến xe
+
+Mỗi bộ (điểm đi, điểm đến, ngày đi) có một snapshot gọn trong Redis:
+- search_snap:{diemDi}:{diemDen}:{ngayDi} -> JSON
+    {
+        "versionKeys": [...],       # Các version counter snapshot phụ thuộc
+        "versions": [...],          # Giá trị của versionKeys lúc build
+        "loaiXe": ["Xe giường nằm", ...],   # Bảng mã loại xe
+        "columns": {
+            "gioDi": [...],         # Phút khởi hành trong ngày (0-1439, -1 = không đọc được)
+            "giaVe": [...],         # Giá vé
+            "loaiXe": [...],        # Mã loại xe (index trong bảng "loaiXe")
+            "tongGhe": [...]        # Tổng số ghế
+        },
+        "rows": [...]               # Các field tĩnh của RouteSearchResponse, cùng thứ tự
+    }
+
+Snapshot phụ thuộc vào ver:chuyenXe, ver:xe, ver:gheNgoi (chỉ đổi khi admin sửa tuyến / đội xe)
+và ver:departures:{maCX}:{ngayDi} của từng tuyến trong snapshot (lịch chạy của tuyến trong ngày),
+nên giữ / đặt ghế hay sửa lịch chạy của tuyến khác không làm snapshot hết hạn. Build lại chỉ đọc
+lịch chạy của các tuyến tìm được (set index sidx:lichChay:maCX) và đếm ghế bằng SCARD.
+
+Số ghế đã đặt / đang giữ là dữ liệu động nên không lưu trong snapshot mà được đọc theo lô
+(RedisService.get_availability) chỉ cho các dòng còn lại sau khi lọc.
+Lọc và sắp xếp chạy vector hóa bằng NumPy trên các cột.
+"""
+import json
+from typing import List, Optional, Dict, Any
+import numpy as np
+
+from app.services.redis_service import redis_service
+
+SNAPSHOT_TTL = 3600  # 1 giờ
+SNAPSHOT_VERSION_SCOPES = ["chuyenXe", "xe", "gheNgoi"]
+
+SORT_FIELDS = {
+    "gioKhoiHanh": "gioDi",
+    "giaVe": "giaVe",
+    "soGheTrong": "soGheTrong",
+}
+
+
+def parse_minute_of_day(value: str) -> Optional[int]:
+    """Chuyển "HH:MM" (hoặc "HHMM") sang số phút trong ngày, None nếu không hợp lệ"""
+    if not value:
+        return None
+    digits = str(value).replace(":", "").strip()[:4]
+    if not digits.isdigit() or len(digits) < 3:
+        return None
+    digits = digits.zfill(4)
+    hour, minute = int(digits[:2]), int(digits[2:])
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def format_duration(thoi_gian_chay) -> str:
+    """Chuyển thời gian chạy (số phút) sang dạng "X giờ Y phút" """
+    if isinstance(thoi_gian_chay, (int, float)):
+        hours = int(thoi_gian_chay) // 60
+        mins = int(thoi_gian_chay) % 60
+        return f"{hours} giờ" if mins == 0 else f"{hours} giờ {mins} phút"
+    return str(thoi_gian_chay)
+
+
+class SearchSnapshotService:
+    """
+    Build, cache và truy vấn snapshot dạng cột cho tìm kiếm tuyến xe
+    """
+
+    @staticmethod
+    def _snapshot_key(diemDi: str, diemDen: str, ngayDi: str) -> str:
+        return f"search_snap:{diemDi}:{diemDen}:{ngayDi}"
+
+    @staticmethod
+    def _departure_version_keys(ma_cx_list: List[str], ngayDi: str) -> List[str]:
+        """ver:departures của các tuyến trong ngày (kèm lịch chạy không ghi ngày khởi hành)"""
+        keys = []
+        for maCX in ma_cx_list:
+            keys.append(redis_service.version_key("departures", f"{maCX}:{ngayDi}"))
+            keys.append(redis_service.version_key("departures", f"{maCX}:"))
+        return keys
+
+    @staticmethod
+    async def get_snapshot(diemDi: str, diemDen: str, ngayDi: str) -> dict:
+        """
+        Lấy snapshot từ cache nếu mọi version nó phụ thuộc còn đúng, ngược lại build lại
+        (GET snapshot, rồi MGET các version counters đã lưu trong snapshot)
+        """
+        redis = await redis_service._get_client()
+        key = SearchSnapshotService._snapshot_key(diemDi, diemDen, ngayDi)
+
+        cached = await redis.get(key)
+        if cached:
+            try:
+                snapshot = json.loads(cached)
+                if snapshot.get("versions") == await redis_service.get_versions(snapshot["versionKeys"]):
+                    return snapshot
+            except (json.JSONDecodeError, TypeError, KeyError):
+                pass
+
+        # Đọc version trước khi build: ghi xen giữa sẽ làm snapshot hết hạn ở lần đọc sau
+        chuyen_xe_list = await redis_service.search_chuyen_xe(diemDi, diemDen)
+        version_keys = [redis_service.version_key(scope) for scope in SNAPSHOT_VERSION_SCOPES]
+        version_keys += SearchSnapshotService._departure_version_keys(
+            [cx.get("maCX") for cx in chuyen_xe_list], ngayDi
+        )
+        versions = await redis_service.get_versions(version_keys)
+
+        snapshot = await SearchSnapshotService.build_snapshot(diemDi, diemDen, ngayDi, chuyen_xe_list)
+        snapshot["versionKeys"] = version_keys
+        snapshot["versions"] = versions
+        try:
+            await redis.setex(key, SNAPSHOT_TTL, json.dumps(snapshot, ensure_ascii=False))
+        except Exception:
+            # Cache lỗi thì vẫn trả snapshot vừa build
+            pass
+        return snapshot
+
+    @staticmethod
+    async def build_snapshot(diemDi: str, diemDen: str, ngayDi: str,
+                             chuyen_xe_list: Optional[List[dict]] = None) -> dict:
+        """
+        Build snapshot dạng cột từ chuyenXe, lichChay, xe, gheNgoi
+        (chỉ đọc lịch chạy và số ghế của các tuyến tìm được)
+        """
+        loai_xe_codes: Dict[str, int] = {}
+        columns = {"gioDi": [], "giaVe": [], "loaiXe": [], "tongGhe": []}
+        rows: List[dict] = []
+        snapshot = {"ngayDi": ngayDi, "loaiXe": [], "columns": columns, "rows": rows}
+
+        if chuyen_xe_list is None:
+            chuyen_xe_list = await redis_service.search_chuyen_xe(diemDi, diemDen)
+        if not chuyen_xe_list:
+            return snapshot
+
+        # Batch lấy xe
+        ma_xe_list = list({cx.get("maXe") for cx in chuyen_xe_list if cx.get("maXe")})
+        xe_list = await redis_service.get_multiple("xe", ma_xe_list)
+        xe_dict = {ma_xe: xe for ma_xe, xe in zip(ma_xe_list, xe_list) if xe}
+
+        # Số ghế theo xe (SCARD set index ghế) và lịch chạy theo tuyến (set index lịch chạy)
+        ghe_count = dict(zip(ma_xe_list, await redis_service.count_by_set_index("gheNgoi", "maXe", ma_xe_list)))
+        lich_chay_by_cx: Dict[str, List[dict]] = {}
+        for cx in chuyen_xe_list:
+            maCX = cx.get("maCX")
+            if maCX and maCX not in lich_chay_by_cx:
+                lich_chay_by_cx[maCX] = await redis_service.get_lich_chay_by_chuyen(maCX)
+
+        for chuyen_xe in chuyen_xe_list:
+            maCX = chuyen_xe.get("maCX")
+            maXe = chuyen_xe.get("maXe")
+            xe = xe_dict.get(maXe)
+            if not xe:
+                continue
+
+            lich_chay_list = lich_chay_by_cx.get(maCX, [])
+
+            # Nếu không có lịch chạy, tạo một lịch chạy ảo cho ngày được search
+            if not lich_chay_list:
+                lich_chay_list = [{
+                    "maLC": f"LC_{maCX}_{ngayDi}_0600",
+                    "maCX": maCX,
+                    "maXe": maXe,
+                    "ngayKhoiHanh": ngayDi,
+                    "gioKhoiHanh": "06:00",
+                    "thoiGianXuatBen": "06:00",
+                    "thoiGianDenDuKien": "",
+                    "thoiGianChay": chuyen_xe.get("thoiGianDuKien", ""),
+                }]
+
+            total_seats = ghe_count.get(maXe) or xe.get("soGhe", 34)
+            gia_ve = float(chuyen_xe.get("giaChuyenXe", chuyen_xe.get("giaVe", 0)))
+            loai_xe = xe.get("loaiXe", "")
+            if loai_xe not in loai_xe_codes:
+                loai_xe_codes[loai_xe] = len(loai_xe_codes)
+
+            for lich_chay in lich_chay_list:
+                maLC = lich_chay.get("maLC") or lich_chay.get("maLich", "")
+                ngayKhoiHanh = lich_chay.get("ngayKhoiHanh", "")
+
+                # Filter theo ngày đi nếu có
+                if ngayKhoiHanh and ngayKhoiHanh != ngayDi:
+                    continue
+
+                gio_xuat_ben = str(lich_chay.get("thoiGianXuatBen", lich_chay.get("gioKhoiHanh", "")))
+                gio_di = parse_minute_of_day(lich_chay.get("gioKhoiHanh") or gio_xuat_ben)
+                thoi_gian_chay = format_duration(
+                    lich_chay.get("thoiGianChay", chuyen_xe.get("thoiGianDuKien", ""))
+                )
+
+                columns["gioDi"].append(gio_di if gio_di is not None else -1)
+                columns["giaVe"].append(gia_ve)
+                columns["loaiXe"].append(loai_xe_codes[loai_xe])
+                columns["tongGhe"].append(int(total_seats))
+                rows.append({
+                    "maCX": maCX,
+                    "maLC": maLC,
+                    "maXe": maXe,
+                    "diemDi": chuyen_xe.get("diemDi", ""),
+                    "diemDen": chuyen_xe.get("diemDen", ""),
+                    "quangDuong": float(chuyen_xe.get("quangDuong", chuyen_xe.get("khoangCach", 0))),
+                    "giaChuyenXe": gia_ve,
+                    "thoiGianXuatBen": gio_xuat_ben,
+                    "thoiGianDenDuKien": str(lich_chay.get("thoiGianDenDuKien", "")),
+                    "thoiGianChay": thoi_gian_chay,
+                    "loaiXe": loai_xe,
+                    "ngayKhoiHanh": ngayKhoiHanh,
+                    "gioKhoiHanh": lich_chay.get("gioKhoiHanh", ""),
+                    # Alias fields cho frontend
+                    "maTuyenXe": maCX,
+                    "giaVe": gia_ve,
+                    "thoiGianQuangDuong": thoi_gian_chay
+                })
+
+        snapshot["loaiXe"] = list(loai_xe_codes.keys())
+        return snapshot
+
+    @staticmethod
+    async def _count_seats(ma_lc_list: List[str], ngayDi: str) -> tuple:
+        """
+        Đếm ghế đã đặt và đang giữ cho nhiều lịch chạy bằng một lần đọc availability theo lô
+
+        Returns:
+            (booked, held) - hai mảng cùng thứ tự ma_lc_list
+        """
+        booked = np.zeros(len(ma_lc_list), dtype=np.int32)
+        held = np.zeros(len(ma_lc_list), dtype=np.int32)
+        if not ma_lc_list:
+            return booked, held
+        availability = await redis_service.get_availability(ma_lc_list, ngayDi=ngayDi)
+        for i, maLC in enumerate(ma_lc_list):
+            info = availability.get(maLC)
+            if info:
+                booked[i] = info["booked"]
+                held[i] = info["held"] + info["myHeld"]
+        return booked, held
+
+    @staticmethod
+    async def query(
+        snapshot: dict,
+        limit: int,
+        gia_min: Optional[float] = None,
+        gia_max: Optional[float] = None,
+        gio_di_tu: Optional[str] = None,
+        gio_di_den: Optional[str] = None,
+        loai_xe: Optional[List[str]] = None,
+        so_ghe_toi_thieu: Optional[int] = None,
+        sort_by: Optional[str] = None,
+        sort_order: str = "asc"
+    ) -> List[Dict[str, Any]]:
+        """
+        Lọc, sắp xếp trên snapshot và trả về tối đa `limit` dòng kèm số ghế trống
+
+        Raises:
+            ValueError: Tham số lọc/sắp xếp không hợp lệ
+        """
+        rows = snapshot.get("rows", [])
+        if not rows:
+            return []
+
+        cols = snapshot["columns"]
+        gio_di = np.asarray(cols["gioDi"], dtype=np.int32)
+        gia_ve = np.asarray(cols["giaVe"], dtype=np.float64)
+        loai_xe_col = np.asarray(cols["loaiXe"], dtype=np.int32)
+        tong_ghe = np.asarray(cols["tongGhe"], dtype=np.int32)
+
+        if sort_by is not None and sort_by not in SORT_FIELDS:
+            raise ValueError(f"sortBy không hợp lệ. Chấp nhận: {', '.join(SORT_FIELDS)}")
+        if sort_order not in ("asc", "desc"):
+            raise ValueError("sortOrder không hợp lệ. Chấp nhận: asc, desc")
+
+        # === Lọc trên các cột tĩnh ===
+        mask = np.ones(len(rows), dtype=bool)
+        if gia_min is not None:
+            mask &= gia_ve >= gia_min
+        if gia_max is not None:
+            mask &= gia_ve <= gia_max
+        if gio_di_tu or gio_di_den:
+            tu = parse_minute_of_day(gio_di_tu) if gio_di_tu else 0
+            den = parse_minute_of_day(gio_di_den) if gio_di_den else 24 * 60 - 1
+            if tu is None or den is None:
+                raise ValueError("Giờ đi không hợp lệ. Định dạng: HH:MM")
+            mask &= (gio_di >= tu) & (gio_di <= den)
+        if loai_xe:
+            codes = [i for i, name in enumerate(snapshot.get("loaiXe", [])) if name in set(loai_xe)]
+            mask &= np.isin(loai_xe_col, codes)
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+
+        ma_lc_all = [rows[i]["maLC"] for i in range(len(rows))]
+        needs_seats_first = so_ghe_toi_thieu is not None or sort_by == "soGheTrong"
+
+        # === Ghế trống: đọc cho toàn bộ ứng viên chỉ khi cần lọc/sắp xếp theo ghế ===
+        so_ghe_trong = None
+        if needs_seats_first:
+            booked, held = await SearchSnapshotService._count_seats(
+                [ma_lc_all[i] for i in candidates], snapshot.get("ngayDi")
+            )
+            so_ghe_trong = tong_ghe[candidates] - booked - held
+            if so_ghe_toi_thieu is not None:
+                keep = so_ghe_trong >= so_ghe_toi_thieu
+                candidates, so_ghe_trong = candidates[keep], so_ghe_trong[keep]
+                booked, held = booked[keep], held[keep]
+                if candidates.size == 0:
+                    return []
+
+        # === Sắp xếp ===
+        sort_field = SORT_FIELDS.get(sort_by or "gioKhoiHanh")
+        unknown = np.zeros(candidates.size, dtype=bool)
+        if sort_field == "soGheTrong":
+            keys = so_ghe_trong
+        elif sort_field == "giaVe":
+            keys = gia_ve[candidates]
+        else:
+            keys = gio_di[candidates]
+            # Giờ không đọc được (-1) luôn xếp cuối, kể cả khi sắp xếp tăng dần
+            unknown = keys < 0
+        # lexsort: khóa cuối là khóa chính, ổn định như argsort(kind="stable")
+        order = np.lexsort((-keys if sort_order == "desc" else keys, unknown))[:limit]
+        selected = candidates[order]
+
+        if so_ghe_trong is not None:
+            so_ghe_trong, booked, held = so_ghe_trong[order], booked[order], held[order]
+        else:
+            booked, held = await SearchSnapshotService._count_seats(
+                [ma_lc_all[i] for i in selected], snapshot.get("ngayDi")
+            )
+            so_ghe_trong = tong_ghe[selected] - booked - held
+
+        result = []
+        for i, free, da_dat, dang_giu in zip(selected.tolist(), so_ghe_trong.tolist(),
+                                             booked.tolist(), held.tolist()):
+            result.append({
+                **rows[i],
+                "soGheTrong": int(free),
+                "soGheDaDat": int(da_dat),
+                "soGheDangGiu": int(dang_giu)
+            })
+        return result
+
+
+search_snapshot_service = SearchSnapshotService()
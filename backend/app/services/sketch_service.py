@@ -0,0 +1,225 @@
+"""
+Sketch Service - Phân vị (p50/p90/p99) bằng histogram bucket log có thể gộp (kiểu DDSketch)
+
+Mỗi giá trị dương x rơi vào bucket i = ceil(log_gamma(x)) với gamma = (1 + a) / (1 - a),
+nên giá trị ước lượng của bucket sai số tương đối tối đa a (SKETCH_ACCURACY = 1%).
+Một sketch là HASH {i: count} (giá trị 0 đếm ở field "z"), gộp sketch = cộng count
+theo bucket, nên HINCRBY lúc ghi và cộng nhiều HASH lúc đọc là đủ.
+
+- sketch:{metric}:{YYYY-MM-DD} -> HASH sketch của cả hệ thống trong ngày
+- sketch:{metric}:{YYYY-MM-DD}:{maCX} -> HASH sketch theo tuyến trong ngày
+
+Metric (đơn vị):
+- price: giá từng vé (VNĐ)
+- lead_time: từ lúc đặt đến giờ khởi hành (phút)
+- hold_to_pay: từ lúc giữ ghế đến lúc thanh toán (giây)
+
+Ghi lúc thanh toán; truy vấn một khoảng ngày chỉ đọc và gộp vài HASH (mỗi HASH
+chỉ vài trăm field), không duyệt veXe.
+"""
+import asyncio
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.services.redis_service import redis_service
+from app.utils import epoch_date, doc_epoch
+
+METRICS = {"price": "VNĐ", "lead_time": "phút", "hold_to_pay": "giây"}
+SKETCH_ACCURACY = 0.01
+SKETCH_TTL_DAYS = 400
+SKETCH_TTL = SKETCH_TTL_DAYS * 24 * 3600
+ZERO_FIELD = "z"
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99]
+
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Giữ tham chiếu tới các task ghi nền để không bị garbage collect giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _sketch_key(metric: str, date: str, maCX: Optional[str] = None) -> str:
+    return f"sketch:{metric}:{date}:{maCX}" if maCX else f"sketch:{metric}:{date}"
+
+
+def bucket_index(value: float) -> str:
+    """Field của bucket chứa value"""
+    if value <= 0:
+        return ZERO_FIELD
+    return str(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def bucket_value(field: str) -> float:
+    """Giá trị đại diện của bucket (sai số tương đối <= SKETCH_ACCURACY)"""
+    if field == ZERO_FIELD:
+        return 0.0
+    return 2 * GAMMA ** int(field) / (GAMMA + 1)
+
+
+def merge(sketches: Iterable[dict]) -> Dict[str, int]:
+    """Gộp nhiều sketch (HASH) thành một"""
+    merged: Dict[str, int] = {}
+    for sketch in sketches:
+        for field, count in (sketch or {}).items():
+            merged[field] = merged.get(field, 0) + int(count)
+    return merged
+
+
+def quantiles(sketch: Dict[str, int], qs: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Phân vị từ sketch đã gộp
+
+    Returns:
+        {"p50": giá trị, ...}, None nếu sketch rỗng
+    """
+    ordered = sorted(sketch.items(), key=lambda item: -math.inf if item[0] == ZERO_FIELD else int(item[0]))
+    total = sum(count for _, count in ordered)
+    result: Dict[str, Optional[float]] = {}
+    for q in qs:
+        label = f"p{q * 100:g}"
+        if not total:
+            result[label] = None
+            continue
+        rank = q * (total - 1)
+        seen = 0
+        for field, count in ordered:
+            seen += count
+            if seen > rank:
+                result[label] = round(bucket_value(field), 2)
+                break
+    return result
+
+
+class SketchService:
+    """
+    Ghi và truy vấn sketch phân vị
+    """
+
+    @staticmethod
+    def _queue(pipeline, metric: str, date: str, maCX: Optional[str], values: List[float]):
+        """Thêm các HINCRBY của một lô giá trị vào pipeline"""
+        counts: Dict[str, int] = {}
+        for value in values:
+            field = bucket_index(value)
+            counts[field] = counts.get(field, 0) + 1
+        for key in [_sketch_key(metric, date)] + ([_sketch_key(metric, date, maCX)] if maCX else []):
+            for field, count in counts.items():
+                pipeline.hincrby(key, field, count)
+            pipeline.expire(key, SKETCH_TTL)
+
+    @staticmethod
+    async def record_payment(hoa_don: dict, prices: List[float], paid_ts: int,
+                             departure_ts: Optional[int] = None, hold_started_ts: Optional[float] = None):
+        """
+        Ghi các giá trị của một lần thanh toán (một round trip)
+
+        Args:
+            hoa_don: Hóa đơn vừa tạo (lấy maCX)
+            prices: Giá từng vé
+            paid_ts: Thời điểm thanh toán (epoch giây)
+            departure_ts: Giờ khởi hành của lịch chạy (epoch giây)
+            hold_started_ts: Thời điểm bắt đầu giữ ghế (epoch giây)
+        """
+        redis = await redis_service._get_client()
+        date = epoch_date(paid_ts)
+        maCX = hoa_don.get("maCX")
+
+        pipeline = redis.pipeline(transaction=False)
+        SketchService._queue(pipeline, "price", date, maCX, prices)
+        if departure_ts is not None and departure_ts >= paid_ts:
+            lead_minutes = (departure_ts - paid_ts) / 60
+            SketchService._queue(pipeline, "lead_time", date, maCX, [lead_minutes] * len(prices))
+        if hold_started_ts is not None and hold_started_ts <= paid_ts:
+            SketchService._queue(pipeline, "hold_to_pay", date, maCX, [paid_ts - hold_started_ts])
+        await pipeline.execute()
+
+    @staticmethod
+    def record_payment_nowait(*args, **kwargs):
+        """Ghi sketch ở background, không làm chậm response"""
+        task = asyncio.create_task(SketchService._record_safely(*args, **kwargs))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @staticmethod
+    async def _record_safely(*args, **kwargs):
+        try:
+            await SketchService.record_payment(*args, **kwargs)
+        except Exception as e:
+            # Thống kê không được làm hỏng luồng thanh toán
+            print(f"Error recording sketches: {e}")
+
+    @staticmethod
+    async def get_quantiles(metric: str, start: datetime, end: datetime, maCX: Optional[str] = None,
+                            qs: Optional[List[float]] = None) -> dict:
+        """
+        Phân vị của metric trong khoảng ngày [start, end], gộp sketch từng ngày
+
+        Returns:
+            {"metric", "unit", "count", "quantiles": {"p50": ..., "p90": ..., "p99": ...}}
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Metric không hợp lệ: {metric}")
+        qs = qs or DEFAULT_QUANTILES
+        days = []
+        current = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while current.date() <= end.date():
+            days.append(current.strftime("%Y-%m-%d"))
+            current += timedelta(days=1)
+        if len(days) > SKETCH_TTL_DAYS:
+            raise ValueError(f"Khoảng thời gian tối đa {SKETCH_TTL_DAYS} ngày")
+
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline(transaction=False)
+        for day in days:
+            pipeline.hgetall(_sketch_key(metric, day, maCX))
+        sketch = merge(await pipeline.execute() if days else [])
+        return {
+            "metric": metric,
+            "unit": METRICS[metric],
+            "count": sum(sketch.values()),
+            "quantiles": quantiles(sketch, qs)
+        }
+
+    @staticmethod
+    async def rebuild() -> dict:
+        """
+        Xóa và tính lại sketch price / lead_time từ veXe
+        (hold_to_pay không có trong dữ liệu đã lưu nên chỉ có từ lúc bật tính năng)
+
+        Returns:
+            {"tickets": số vé đã ghi}
+        """
+        redis = await redis_service._get_client()
+        old_keys = [key async for key in redis.scan_iter(match="sketch:price:*")]
+        old_keys += [key async for key in redis.scan_iter(match="sketch:lead_time:*")]
+        if old_keys:
+            await redis.delete(*old_keys)
+
+        # maLC -> (giờ khởi hành, maCX)
+        schedules: Dict[str, tuple] = {}
+        count = 0
+        async for tickets in redis_service.iter_batches("veXe"):
+            # Mọi veXe đều được tạo lúc thanh toán (kể cả vé đã hoàn sau đó)
+            missing = list({ve.get("maLC") for ve in tickets if ve.get("maLC") not in schedules} - {None, ""})
+            for maLC, lc in zip(missing, await redis_service.get_multiple("lichChay", missing)):
+                schedules[maLC] = (doc_epoch("lichChay", lc, "ngayKhoiHanhTs"), lc.get("maCX")) if lc else (None, None)
+
+            pipeline = redis.pipeline(transaction=False)
+            for ve in tickets:
+                booked_ts = doc_epoch("veXe", ve, "ngayDatTs")
+                if booked_ts is None:
+                    continue
+                date = epoch_date(booked_ts)
+                departure_ts, schedule_route = schedules.get(ve.get("maLC"), (None, None))
+                maCX = ve.get("maCX") or schedule_route
+                SketchService._queue(pipeline, "price", date, maCX, [float(ve.get("giaVe", 0) or 0)])
+                if departure_ts is not None and departure_ts >= booked_ts:
+                    SketchService._queue(pipeline, "lead_time", date, maCX, [(departure_ts - booked_ts) / 60])
+                count += 1
+            await pipeline.execute()
+        return {"tickets": count}
+
+
+# Singleton instance
+sketch_service = SketchService()
@@ -0,0 +1,191 @@
+"""
+Trip Scheduler Service - Chuyển trạng thái lịch chạy theo giờ: scheduled → running → completed
+
+- sched:trips:depart -> ZSET maLC -> epoch giờ khởi hành (chờ chuyển sang running)
+- sched:trips:arrive -> ZSET maLC -> epoch giờ đến dự kiến (chờ chuyển sang completed)
+- sched:trips:leader -> ID worker đang giữ quyền chạy scheduler (SET NX PX, gia hạn mỗi vòng)
+- sched:trips:ready -> cờ đánh dấu hai ZSET đã được build từ toàn bộ lichChay
+
+Lịch chạy được đưa vào ZSET khi tạo / sửa (schedule) và gỡ khi xóa (unschedule).
+Mọi worker đều chạy vòng lặp TRIP_SCHEDULER_INTERVAL nhưng chỉ leader xử lý các
+phần tử đến hạn; khi leader chết, key hết hạn sau TRIP_LEADER_TTL và worker khác lên thay.
+"""
+import os
+import socket
+import time
+import uuid
+from typing import Optional
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.services.departure_board_service import departure_board_service
+from app.services.aggregate_service import aggregate_service
+from app.utils import doc_epoch
+
+DEPART_KEY = "sched:trips:depart"
+ARRIVE_KEY = "sched:trips:arrive"
+LEADER_KEY = "sched:trips:leader"
+READY_KEY = "sched:trips:ready"
+BATCH_SIZE = 100
+MAX_BATCHES_PER_TICK = 20  # Phần còn lại để vòng sau xử lý
+DEFAULT_TRIP_HOURS = 5  # Giống create_schedule khi không có thoiGianChay
+
+# Gia hạn leader chỉ khi key vẫn thuộc worker này
+RENEW_LEADER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def trip_status(lich_chay: dict) -> str:
+    """Trạng thái lịch chạy, thiếu / rỗng coi như scheduled (dữ liệu cũ)"""
+    return lich_chay.get("trangThai") or "scheduled"
+
+
+def trip_hours(lich_chay: dict) -> int:
+    """Số giờ chạy dự kiến từ thoiGianChay ("5 giờ", "5")"""
+    try:
+        return int(str(lich_chay.get("thoiGianChay")).split()[0])
+    except (ValueError, IndexError):
+        return DEFAULT_TRIP_HOURS
+
+
+class TripSchedulerService:
+    """
+    Hàng đợi chuyển trạng thái lịch chạy theo thời gian
+    """
+
+    @staticmethod
+    def queue_schedule(pipeline, lich_chay: dict):
+        """Thêm lệnh đặt lịch chạy vào đúng ZSET theo trạng thái hiện tại"""
+        maLC = lich_chay.get("maLC")
+        departure_ts = doc_epoch("lichChay", lich_chay, "ngayKhoiHanhTs")
+        status = trip_status(lich_chay)
+        pipeline.zrem(DEPART_KEY, maLC)
+        pipeline.zrem(ARRIVE_KEY, maLC)
+        if departure_ts is None:
+            return
+        if status == "scheduled":
+            pipeline.zadd(DEPART_KEY, {maLC: departure_ts})
+        elif status == "running":
+            pipeline.zadd(ARRIVE_KEY, {maLC: departure_ts + trip_hours(lich_chay) * 3600})
+
+    @staticmethod
+    async def schedule(lich_chay: dict):
+        """Đặt (lại) thời điểm chuyển trạng thái sau khi lịch chạy được tạo / sửa"""
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline()
+        TripSchedulerService.queue_schedule(pipeline, lich_chay)
+        await pipeline.execute()
+
+    @staticmethod
+    async def unschedule(maLC: str):
+        """Gỡ lịch chạy đã xóa khỏi hàng đợi"""
+        redis = await redis_service._get_client()
+        pipeline = redis.pipeline()
+        pipeline.zrem(DEPART_KEY, maLC)
+        pipeline.zrem(ARRIVE_KEY, maLC)
+        await pipeline.execute()
+
+    @staticmethod
+    async def rebuild() -> int:
+        """
+        Build lại hai ZSET từ toàn bộ lichChay (dữ liệu cũ / ghi thẳng bởi script)
+
+        Returns:
+            Số lịch chạy đang chờ chuyển trạng thái
+        """
+        redis = await redis_service._get_client()
+        await redis.delete(DEPART_KEY, ARRIVE_KEY)
+        async for batch in redis_service.iter_batches("lichChay"):
+            pipeline = redis.pipeline(transaction=False)
+            for lich_chay in batch:
+                TripSchedulerService.queue_schedule(pipeline, lich_chay)
+            await pipeline.execute()
+        await redis.set(READY_KEY, 1)
+        return await redis.zcard(DEPART_KEY) + await redis.zcard(ARRIVE_KEY)
+
+    @staticmethod
+    async def acquire_leadership() -> bool:
+        """Giành hoặc gia hạn quyền leader (TTL TRIP_LEADER_TTL giây)"""
+        redis = await redis_service._get_client()
+        ttl_ms = settings.TRIP_LEADER_TTL * 1000
+        if await redis.set(LEADER_KEY, WORKER_ID, nx=True, px=ttl_ms):
+            return True
+        return bool(await redis.eval(RENEW_LEADER, 1, LEADER_KEY, WORKER_ID, ttl_ms))
+
+    @staticmethod
+    async def _due(key: str, now: float) -> list:
+        redis = await redis_service._get_client()
+        return await redis.zrangebyscore(key, "-inf", now, start=0, num=BATCH_SIZE)
+
+    @staticmethod
+    async def _set_status(lich_chay: dict, status: str):
+        maLC = lich_chay.get("maLC")
+        updated = await redis_service.update("lichChay", "maLC", maLC, {"trangThai": status})
+        if not updated:
+            await TripSchedulerService.unschedule(maLC)
+            return None
+        await TripSchedulerService.schedule(updated)
+        await departure_board_service.sync_schedule(maLC)
+        if status == "completed":
+            await aggregate_service.record_trip(updated)
+        return updated
+
+    @staticmethod
+    async def _advance(key: str, from_status: str, to_status: str, now: float) -> int:
+        """
+        Chuyển các lịch chạy đến hạn trong `key` từ from_status sang to_status
+
+        Tối đa MAX_BATCHES_PER_TICK lô mỗi vòng; dừng sớm nếu lô đến hạn chỉ còn các
+        phần tử đã xử lý trong vòng này (được đặt lại nhưng vẫn đến hạn)
+
+        Returns:
+            Số lịch chạy đã chuyển
+        """
+        count = 0
+        seen = set()
+        for _ in range(MAX_BATCHES_PER_TICK):
+            due = [maLC for maLC in await TripSchedulerService._due(key, now) if maLC not in seen]
+            if not due:
+                break
+            seen.update(due)
+            for maLC, lich_chay in zip(due, await redis_service.get_multiple("lichChay", due)):
+                if not lich_chay or trip_status(lich_chay) != from_status:
+                    # Đã bị xóa / đổi trạng thái ngoài scheduler: đặt lại theo trạng thái hiện tại
+                    if lich_chay:
+                        await TripSchedulerService.schedule(lich_chay)
+                    else:
+                        await TripSchedulerService.unschedule(maLC)
+                    continue
+                await TripSchedulerService._set_status(lich_chay, to_status)
+                count += 1
+        return count
+
+    @staticmethod
+    async def tick(now: Optional[float] = None) -> Optional[dict]:
+        """
+        Xử lý các lịch chạy đến hạn (chỉ leader)
+
+        Returns:
+            {"running", "completed"} số lịch chạy đã chuyển, None nếu không phải leader
+        """
+        if not await TripSchedulerService.acquire_leadership():
+            return None
+        redis = await redis_service._get_client()
+        if not await redis.exists(READY_KEY):
+            await TripSchedulerService.rebuild()
+
+        now = now or time.time()
+        running = await TripSchedulerService._advance(DEPART_KEY, "scheduled", "running", now)
+        # Chạy sau bước trên nên chuyến đã quá cả giờ đến (vd: worker dừng lâu) được hoàn thành ngay
+        completed = await TripSchedulerService._advance(ARRIVE_KEY, "running", "completed", now)
+        return {"running": running, "completed": completed}
+
+
+# Singleton instance
+trip_scheduler_service = TripSchedulerService()
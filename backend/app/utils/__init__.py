@@ -34,5 +34,9 @@ def format_datetime_hcm(dt: datetime = None):
 
 # Import future utility functions here
 # Example: from .validators import validate_phone, validate_cccd
+from .timestamps import (to_epoch, from_epoch, local_now, epoch_date, day_range, epoch_fields,
+                         strip_epoch_fields, doc_epoch)
 
-__all__ = ['get_current_time_hcm', 'get_current_timestamp_hcm', 'format_datetime_hcm', 'HO_CHI_MINH_TZ']
+__all__ = ['get_current_time_hcm', 'get_current_timestamp_hcm', 'format_datetime_hcm', 'HO_CHI_MINH_TZ',
+           'to_epoch', 'from_epoch', 'local_now', 'epoch_date', 'day_range', 'epoch_fields',
+           'strip_epoch_fields', 'doc_epoch']
@@ -0,0 +1,116 @@
+"""
+Epoch timestamps chuẩn hóa cho các field ngày giờ dạng chuỗi
+
+Dữ liệu cũ lưu ngày giờ ở nhiều định dạng (ISO có / không timezone, YYYY-MM-DD,
+DD/MM/YYYY, giờ "HH:MM" tách riêng). Mỗi lần ghi document, các field *Ts (epoch giây)
+được tính một lần theo EPOCH_FIELDS để lọc thời gian chỉ còn là so sánh số nguyên.
+Chuỗi không có timezone được hiểu là giờ Việt Nam.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from . import HO_CHI_MINH_TZ, get_current_timestamp_hcm
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d")
+
+# collection -> {field epoch: (các field ngày theo thứ tự ưu tiên, các field giờ)}
+EPOCH_FIELDS: Dict[str, Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]]] = {
+    "hoaDon": {"ngayLapTs": (("ngayTao", "ngayLap"), ())},
+    "veXe": {"ngayDatTs": (("ngayDat",), ())},
+    "lichChay": {"ngayKhoiHanhTs": (("ngayKhoiHanh", "ngayChay"), ("gioKhoiHanh", "thoiGianXuatBen"))},
+    "yeuCauHuy": {"ngayTaoTs": (("ngayTao",), ())},
+    "khachHang": {"ngayTaoTs": (("ngayTao", "createdAt"), ())},
+    "nhanVien": {"ngayTaoTs": (("ngayTao", "createdAt"), ())},
+}
+
+
+def to_epoch(date_value, time_value=None) -> Optional[int]:
+    """
+    Chuyển ngày (và giờ "HH:MM" nếu có) sang epoch giây
+
+    Returns:
+        Epoch giây, None nếu không parse được
+    """
+    if not date_value:
+        return None
+    if isinstance(date_value, datetime):
+        dt = date_value
+    else:
+        value = str(date_value).strip()
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            dt = None
+            for fmt in DATE_FORMATS:
+                try:
+                    dt = datetime.strptime(value.split("T")[0], fmt)
+                    break
+                except ValueError:
+                    continue
+            if dt is None:
+                return None
+
+    if time_value:
+        digits = str(time_value).replace(":", "")[:4]
+        try:
+            hour = int(digits[:2]) if len(digits) >= 2 else 0
+            minute = int(digits[2:4]) if len(digits) >= 4 else 0
+            dt = dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        except ValueError:
+            pass
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=HO_CHI_MINH_TZ)
+    return int(dt.timestamp())
+
+
+def from_epoch(ts: int) -> datetime:
+    """Epoch giây -> datetime giờ Việt Nam"""
+    return datetime.fromtimestamp(ts, HO_CHI_MINH_TZ)
+
+
+def local_now() -> datetime:
+    """
+    Giờ Việt Nam hiện tại dạng naive, cùng cách hiểu với to_epoch / epoch_date
+    (khoảng thời gian thống kê khớp với bucket theo ngày dù server chạy UTC)
+    """
+    return from_epoch(get_current_timestamp_hcm()).replace(tzinfo=None)
+
+
+def epoch_date(ts: int) -> str:
+    """Epoch giây -> ngày YYYY-MM-DD theo giờ Việt Nam"""
+    return from_epoch(ts).strftime("%Y-%m-%d")
+
+
+def day_range(date_value) -> Optional[Tuple[int, int]]:
+    """Khoảng epoch [đầu ngày, đầu ngày hôm sau) của một ngày"""
+    start = to_epoch(str(date_value).split("T")[0]) if date_value else None
+    if start is None:
+        return None
+    return start, int((from_epoch(start) + timedelta(days=1)).timestamp())
+
+
+def epoch_fields(collection: str, doc: dict) -> Dict[str, int]:
+    """Các field *Ts tính được từ document (bỏ qua field không parse được)"""
+    result = {}
+    for ts_field, (date_fields, time_fields) in EPOCH_FIELDS.get(collection, {}).items():
+        date_value = next((doc[f] for f in date_fields if doc.get(f)), None)
+        time_value = next((doc[f] for f in time_fields if doc.get(f)), None)
+        ts = to_epoch(date_value, time_value)
+        if ts is not None:
+            result[ts_field] = ts
+    return result
+
+
+def strip_epoch_fields(collection: str, doc: dict) -> dict:
+    """Bản sao document bỏ các field *Ts (chỉ dùng nội bộ, không trả ra API)"""
+    fields = EPOCH_FIELDS.get(collection, {})
+    return {key: value for key, value in doc.items() if key not in fields}
+
+
+def doc_epoch(collection: str, doc: dict, ts_field: str) -> Optional[int]:
+    """Đọc field *Ts, tính lại từ chuỗi gốc nếu document chưa được backfill"""
+    ts = doc.get(ts_field)
+    if ts is not None:
+        return ts
+    return epoch_fields(collection, doc).get(ts_field)
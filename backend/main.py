@@ -2,6 +2,7 @@
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.core import redis_client
+from app.core.tasks import start_background_tasks, stop_background_tasks
 from app.config import settings
 from app.routes import auth_router, users_router, routes_router
 from app.routes.bookings_redis import router as bookings_router
@@ -11,7 +12,9 @@ from app.routes.admin_redis import router as admin_router
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await redis_client.connect()
+    start_background_tasks()
     yield
+    await stop_background_tasks()
     await redis_client.disconnect()
 
 app = FastAPI(
@@ -33,6 +36,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Phân trang của các endpoint admin trả về list
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
 app.include_router(auth_router)
@@ -0,0 +1,99 @@
+"""
+Script backfill các field epoch chuẩn hóa (*Ts) cho document cũ
+(hoaDon.ngayLapTs, veXe.ngayDatTs, lichChay.ngayKhoiHanhTs, yeuCauHuy / khachHang / nhanVien.ngayTaoTs)
+
+- Duyệt idx:{collection} bằng SSCAN theo lô, đọc bằng MGET
+- Ghi bằng compare-and-set (Lua) nên không đè lên thay đổi xảy ra trong lúc chạy
+- Cursor được lưu ở migration:epoch:{collection} sau mỗi lô: chạy lại sẽ tiếp tục
+  từ chỗ đã dừng; collection đã xong được đánh dấu "done"
+
+Chạy: python scripts/backfill_epoch_fields.py [--reset]
+"""
+import asyncio
+import json
+import sys
+import os
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import redis_client
+from app.utils.timestamps import EPOCH_FIELDS, epoch_fields
+
+BATCH_SIZE = 500
+CURSOR_KEY = "migration:epoch:{collection}"
+
+# Chỉ ghi nếu document chưa bị thay đổi kể từ lúc đọc
+COMPARE_AND_SET = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+async def backfill_collection(redis, collection: str) -> dict:
+    """Backfill một collection, tiếp tục từ cursor đã lưu"""
+    cursor_key = CURSOR_KEY.format(collection=collection)
+    saved = await redis.get(cursor_key)
+    if saved == "done":
+        return {"updated": 0, "skipped": 0, "conflicts": 0, "resumed": False}
+
+    cursor = int(saved or 0)
+    stats = {"updated": 0, "skipped": 0, "conflicts": 0, "resumed": cursor != 0}
+    while True:
+        cursor, keys = await redis.sscan(f"idx:{collection}", cursor=cursor, count=BATCH_SIZE)
+        redis_keys = [f"{collection}:{key}" for key in keys]
+        raw_docs = await redis.mget(redis_keys) if redis_keys else []
+
+        pipeline = redis.pipeline(transaction=False)
+        queued = 0
+        for redis_key, raw in zip(redis_keys, raw_docs):
+            if not raw:
+                continue
+            doc = json.loads(raw)
+            fields = epoch_fields(collection, doc)
+            if all(doc.get(name) == value for name, value in fields.items()):
+                stats["skipped"] += 1
+                continue
+            doc.update(fields)
+            pipeline.eval(COMPARE_AND_SET, 1, redis_key, raw, json.dumps(doc, ensure_ascii=False))
+            queued += 1
+        if queued:
+            for ok in await pipeline.execute():
+                stats["updated" if ok else "conflicts"] += 1
+
+        # Lưu cursor sau mỗi lô để có thể chạy tiếp khi bị ngắt
+        await redis.set(cursor_key, "done" if cursor == 0 else str(cursor))
+        if cursor == 0:
+            return stats
+
+
+async def backfill(reset: bool = False):
+    """Backfill tất cả collection trong EPOCH_FIELDS"""
+
+    await redis_client.connect()
+    redis = redis_client.get_client()
+    if not redis:
+        print("❌ Không thể kết nối Redis!")
+        return
+
+    if reset:
+        await redis.delete(*[CURSOR_KEY.format(collection=c) for c in EPOCH_FIELDS])
+        print("🔄 Đã xóa cursor, chạy lại từ đầu")
+
+    print("🕒 Đang backfill epoch timestamps...")
+    for collection in EPOCH_FIELDS:
+        stats = await backfill_collection(redis, collection)
+        note = " (tiếp tục từ lần trước)" if stats["resumed"] else ""
+        print(f"   ✅ {collection}: cập nhật {stats['updated']}, bỏ qua {stats['skipped']}, "
+              f"xung đột {stats['conflicts']}{note}")
+        if stats["conflicts"]:
+            print("      ⚠️  Document bị sửa trong lúc chạy đã tự có *Ts khi được ghi lại")
+
+    await redis_client.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill(reset="--reset" in sys.argv))
@@ -0,0 +1,44 @@
+"""
+Script tính lại các bucket doanh thu tổng hợp (agg:*) từ hoaDon và veXe,
+và sketch phân vị (sketch:price:*, sketch:lead_time:*) từ veXe
+Dùng để backfill dữ liệu cũ hoặc sau khi restore Redis
+Chạy: python scripts/rebuild_aggregates.py
+"""
+import asyncio
+import sys
+import os
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import redis_client
+from app.services.aggregate_service import aggregate_service
+from app.services.sketch_service import sketch_service
+
+
+async def rebuild():
+    """Xóa và tính lại toàn bộ bucket thống kê"""
+
+    await redis_client.connect()
+    if not redis_client.get_client():
+        print("❌ Không thể kết nối Redis!")
+        return
+
+    print("📊 Đang tính lại thống kê doanh thu...")
+    result = await aggregate_service.rebuild()
+    print(f"   ✅ Hóa đơn: {result['invoices']}")
+    print(f"   ✅ Vé đã hoàn: {result['refunds']}")
+    print(f"   ✅ Chuyến đã chạy: {result['trips']}")
+
+    print("📈 Đang tính lại sketch phân vị giá vé / thời gian đặt trước...")
+    sketches = await sketch_service.rebuild()
+    print(f"   ✅ Vé: {sketches['tickets']}")
+
+    total = await aggregate_service.get_bucket("total")
+    print(f"   💰 Tổng doanh thu: {total['revenue']:,.0f} VNĐ (ròng: {total['net_revenue']:,.0f} VNĐ)")
+
+    await redis_client.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
@@ -10,7 +10,6 @@ Schema:
 - ChucVu: maCV, tenChucVu, moTa, danhSachNhanVien
 """
 import asyncio
-import json
 import sys
 import os
 from datetime import datetime
@@ -20,6 +19,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.core.database import redis_client
 from app.core import hash_password
+from app.services.fleet_service import fleet_service
+from app.services.redis_service import redis_service, UniqueConstraintError
 
 
 async def seed_data():
@@ -38,8 +39,7 @@ async def seed_data():
     # ========== TẠO CHỨC VỤ TÀI XẾ (nếu chưa có) ==========
     print("\n📋 Kiểm tra chức vụ tài xế...")
     
-    driver_role_key = "chucVu:CV003"
-    existing_role = await client.get(driver_role_key)
+    existing_role = await redis_service.get_by_key("chucVu", "CV003")
     
     if not existing_role:
         driver_role = {
@@ -48,8 +48,7 @@ async def seed_data():
             "moTa": "Nhân viên lái xe",
             "danhSachNhanVien": []
         }
-        await client.set(driver_role_key, json.dumps(driver_role, ensure_ascii=False))
-        await client.sadd("idx:chucVu", "CV003")
+        await redis_service.create("chucVu", "maCV", driver_role)
         print("   ✅ Đã tạo chức vụ tài xế (CV003)")
     else:
         print("   ℹ️ Chức vụ tài xế đã tồn tại")
@@ -90,35 +89,9 @@ async def seed_data():
             print(f"   ⏭️ Xe {bus['maXe']} đã tồn tại, bỏ qua")
             continue
         
-        # Lưu xe
-        await client.set(bus_key, json.dumps(bus, ensure_ascii=False))
-        await client.sadd("idx:xe", bus['maXe'])
+        # Lưu xe và toàn bộ ghế trong một pipeline (kèm index)
+        seat_count = await fleet_service.create_bus(bus)
         print(f"   ✅ Đã tạo xe {bus['maXe']} ({bus['bienSoXe']}) - {bus['loaiXe']}")
-        
-        # Tạo ghế cho xe
-        seat_count = 0
-        seat_prefixes = ["A", "B", "C", "D"]
-        seats_per_row = (bus['soChoNgoi'] + len(seat_prefixes) - 1) // len(seat_prefixes)
-        
-        for prefix in seat_prefixes:
-            for num in range(1, seats_per_row + 1):
-                if seat_count >= bus['soChoNgoi']:
-                    break
-                
-                seat_name = f"{prefix}{str(num).zfill(2)}"
-                ma_ghe = f"{bus['maXe']}_{seat_name}"
-                
-                seat_data = {
-                    "maGhe": ma_ghe,
-                    "maXe": bus['maXe'],
-                    "tenGhe": seat_name
-                }
-                
-                seat_key = f"gheNgoi:{ma_ghe}"
-                await client.set(seat_key, json.dumps(seat_data, ensure_ascii=False))
-                await client.sadd("idx:gheNgoi", ma_ghe)
-                seat_count += 1
-        
         print(f"      ➕ Đã tạo {seat_count} ghế cho xe {bus['maXe']}")
     
     # ========== TẠO 5 TÀI XẾ MỚI ==========
@@ -192,28 +165,29 @@ async def seed_data():
     
     created_drivers = []
     for driver in drivers:
-        driver_key = f"nhanVien:{driver['maNV']}"
-        
         # Kiểm tra đã tồn tại chưa
-        existing = await client.get(driver_key)
+        existing = await redis_service.get_by_key("nhanVien", driver['maNV'])
         if existing:
             print(f"   ⏭️ Tài xế {driver['maNV']} đã tồn tại, bỏ qua")
             continue
         
-        # Lưu nhân viên
-        await client.set(driver_key, json.dumps(driver, ensure_ascii=False))
-        await client.sadd("idx:nhanVien", driver['maNV'])
+        # Lưu nhân viên qua redis_service để có đủ index (chức vụ, lịch bận, email / SĐT / CCCD)
+        try:
+            await redis_service.create("nhanVien", "maNV", driver)
+        except UniqueConstraintError as e:
+            print(f"   ⏭️ Tài xế {driver['maNV']}: {e}, bỏ qua")
+            continue
         created_drivers.append(driver['maNV'])
         print(f"   ✅ Đã tạo tài xế {driver['maNV']}: {driver['hoTen']} ({driver['email']})")
     
     # Cập nhật danh sách nhân viên trong chức vụ tài xế
     if created_drivers:
-        role_data = await client.get(driver_role_key)
-        if role_data:
-            role = json.loads(role_data)
+        role = await redis_service.get_by_key("chucVu", "CV003")
+        if role:
             existing_nv = role.get("danhSachNhanVien", [])
-            role["danhSachNhanVien"] = list(set(existing_nv + created_drivers))
-            await client.set(driver_role_key, json.dumps(role, ensure_ascii=False))
+            await redis_service.update("chucVu", "maCV", "CV003", {
+                "danhSachNhanVien": list(set(existing_nv + created_drivers))
+            })
             print(f"\n   📋 Đã cập nhật danh sách nhân viên cho chức vụ tài xế")
     
     # ========== THỐNG KÊ ==========
@@ -0,0 +1,52 @@
+"""
+Fixture chung cho test: Redis giả lập bằng fakeredis (Lua chạy qua lupa)
+
+Chạy từ thư mục backend:
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import sys
+
+# Settings đọc biến môi trường lúc import, đặt giá trị giả trước khi import app
+os.environ.setdefault("REDIS_PASSWORD", "test")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("SMTP_EMAIL", "test@example.com")
+os.environ.setdefault("SMTP_PASSWORD", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis.aioredis
+import httpx
+import pytest
+
+from app.core.middleware import get_current_user, get_current_customer, get_current_employee, get_current_admin
+from app.core.database import redis_client
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def redis():
+    """Redis rỗng cho mỗi test, gắn vào redis_client như lúc app khởi động"""
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    redis_client.client = client
+    yield client
+    await client.aclose()
+    redis_client.client = None
+
+
+@pytest.fixture
+async def api(redis):
+    """Client gọi app FastAPI (không chạy lifespan), đăng nhập sẵn bằng tài khoản admin"""
+    from main import app
+
+    user = {"maNV": "NV001", "maKH": "KH00001", "email": "admin@busgo.vn", "role": "admin"}
+    for dependency in (get_current_user, get_current_customer, get_current_employee, get_current_admin):
+        app.dependency_overrides[dependency] = lambda: user
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from app.services.aggregate_service import aggregate_service, RECORDED_KEY
+from app.services.redis_service import redis_service
+from app.routes import statistics_redis
+from app.utils import timestamps
+
+pytestmark = pytest.mark.anyio
+
+HOA_DON = {
+    "maHD": "HD00001",
+    "maKH": "KH00001",
+    "maCX": "CX001",
+    "tongTien": 500000,
+    "danhSachVe": ["VE00001", "VE00002"],
+    "phuongThucThanhToan": "VietQR",
+    "ngayTao": "2030-01-15T09:30:00",
+}
+
+
+async def test_record_payment_counts_each_invoice_once(redis):
+    await aggregate_service.record_payment(HOA_DON)
+    await aggregate_service.record_payment(HOA_DON)
+
+    day = await aggregate_service.get_bucket("day:2030-01-15")
+    assert day["revenue"] == 500000
+    assert day["bookings"] == 1
+    assert day["tickets"] == 2
+    assert (await aggregate_service.get_bucket("route:CX001"))["bookings"] == 1
+    assert await redis.zscore("lb:route:tickets:all", "CX001") == 2
+    assert await redis.zscore("lb:customer:spent:month:2030-01", "KH00001") == 500000
+
+
+async def test_failed_write_does_not_mark_invoice_recorded(redis, monkeypatch):
+    original_eval = redis.eval
+    calls = []
+
+    async def flaky_eval(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ConnectionError("connection reset")
+        return await original_eval(*args)
+
+    monkeypatch.setattr(redis, "eval", flaky_eval)
+
+    with pytest.raises(ConnectionError):
+        await aggregate_service.record_payment(HOA_DON)
+    assert not await redis.sismember(RECORDED_KEY, "pay:HD00001")
+    assert (await aggregate_service.get_bucket("total"))["bookings"] == 0
+
+    # Gọi lại sau lỗi vẫn cộng được, và chỉ một lần
+    await aggregate_service.record_payment(HOA_DON)
+    await aggregate_service.record_payment(HOA_DON)
+    total = await aggregate_service.get_bucket("total")
+    assert total["bookings"] == 1
+    assert total["revenue"] == 500000
+
+
+async def test_record_refund_counts_each_ticket_once(redis):
+    await aggregate_service.record_payment(HOA_DON)
+    for _ in range(2):
+        await aggregate_service.record_refund("VE00001", 250000, "2030-01-16", "CX001", "VietQR", "KH00001")
+
+    total = await aggregate_service.get_bucket("total")
+    assert total["refunds"] == 250000
+    assert total["refunded_tickets"] == 1
+    assert total["net_revenue"] == 250000
+    assert await redis.zscore("lb:customer:spent:all", "KH00001") == 250000
+
+
+def test_date_range_uses_vietnam_time(monkeypatch):
+    # 31/01 20:00 UTC là 01/02 03:00 giờ Việt Nam
+    utc_evening = datetime(2030, 1, 31, 20, 0, tzinfo=timezone.utc).timestamp()
+    monkeypatch.setattr(timestamps, "get_current_timestamp_hcm", lambda: utc_evening)
+
+    start, end = statistics_redis.get_date_range("month")
+    assert start == datetime(2030, 2, 1)
+    assert end.date() == datetime(2030, 2, 1).date()
+    assert statistics_redis.get_date_range("today")[0] == datetime(2030, 2, 1)
+
+
+async def test_refund_approved_after_vietnam_midnight_lands_on_vietnam_day(api, redis, monkeypatch):
+    # 31/01 18:30 UTC là 01/02 01:30 giờ Việt Nam
+    utc_evening = datetime(2030, 1, 31, 18, 30, tzinfo=timezone.utc).timestamp()
+    monkeypatch.setattr(timestamps, "get_current_timestamp_hcm", lambda: utc_evening)
+    await redis_service.create("veXe", "maVe", {"maVe": "VE00001", "maKH": "KH00001", "maCX": "CX001"})
+    await redis_service.create("yeuCauHuy", "maYeuCauHuy", {
+        "maYeuCauHuy": "YC00001", "maDatVe": "VE00001", "trangThai": "pending", "tienHoanDuKien": 90000
+    })
+
+    response = await api.put("/api/v1/admin/bookings/cancel-requests/YC00001", json={"action": "approve"})
+
+    assert response.status_code == 200
+    assert (await aggregate_service.get_bucket("day:2030-02-01"))["refunds"] == 90000
+    assert (await aggregate_service.get_bucket("month:2030-02"))["refunds"] == 90000
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.services import analytics_snapshot_service as snapshot_module
+from app.services.analytics_snapshot_service import (
+    analytics_snapshot_service, AnalyticsSnapshotService, SnapshotUnavailableError, NEW_INVOICES_KEY, LOCK_KEY
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def analytics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ANALYTICS_DIR", str(tmp_path))
+    monkeypatch.setattr(AnalyticsSnapshotService, "_cache", None)
+
+
+async def _create_invoice(maHD: str, amount: float = 100000):
+    await redis_service.create("hoaDon", "maHD", {
+        "maHD": maHD, "maKH": "KH00001", "tongTien": amount, "danhSachVe": [], "ngayTao": "2030-01-15T08:00:00"
+    })
+    await analytics_snapshot_service.enqueue_invoice(maHD)
+
+
+def _invoice_count() -> int:
+    return analytics_snapshot_service.load().meta["rows"]["invoices"]
+
+
+async def test_append_keeps_queue_when_write_fails(redis, monkeypatch):
+    await analytics_snapshot_service.rebuild()
+    await _create_invoice("HD00001")
+
+    def failing_write(*args):
+        raise OSError("disk full")
+
+    original_write = AnalyticsSnapshotService._write_generation
+    monkeypatch.setattr(AnalyticsSnapshotService, "_write_generation", staticmethod(failing_write))
+    with pytest.raises(OSError):
+        await analytics_snapshot_service.append()
+    assert await redis.lrange(NEW_INVOICES_KEY, 0, -1) == ["HD00001"]
+
+    monkeypatch.setattr(AnalyticsSnapshotService, "_write_generation", staticmethod(original_write))
+    assert await analytics_snapshot_service.append() == 1
+    assert await redis.llen(NEW_INVOICES_KEY) == 0
+    assert _invoice_count() == 1
+
+
+async def test_rebuild_only_drops_invoices_it_included(redis, monkeypatch):
+    await _create_invoice("HD00001")
+    original_get_all = redis_service.get_all_hoa_don
+
+    async def get_all_then_new_invoice():
+        invoices = await original_get_all()
+        # Hóa đơn thanh toán xong trong lúc đang build
+        await _create_invoice("HD00002")
+        return invoices
+
+    monkeypatch.setattr(redis_service, "get_all_hoa_don", get_all_then_new_invoice)
+    await analytics_snapshot_service.rebuild()
+    assert _invoice_count() == 1
+    assert await redis.lrange(NEW_INVOICES_KEY, 0, -1) == ["HD00002"]
+
+    assert await analytics_snapshot_service.append() == 1
+    assert _invoice_count() == 2
+
+
+async def test_release_lock_keeps_lock_taken_over_by_another_worker(redis):
+    token = await AnalyticsSnapshotService._acquire_lock()
+    assert token
+    assert await AnalyticsSnapshotService._acquire_lock() is None
+
+    # Lock hết hạn giữa chừng và worker khác đã giữ lock mới
+    await redis.set(LOCK_KEY, "other-worker")
+    await AnalyticsSnapshotService._release_lock(token)
+    assert await redis.get(LOCK_KEY) == "other-worker"
+
+    await redis.set(LOCK_KEY, token)
+    await AnalyticsSnapshotService._release_lock(token)
+    assert await redis.get(LOCK_KEY) is None
+
+
+async def test_ensure_snapshot_waits_for_lock_holder(redis):
+    await _create_invoice("HD00001")
+    await redis.set(LOCK_KEY, "other-worker")
+
+    async def other_worker_builds():
+        await asyncio.sleep(0.3)
+        await redis.delete(LOCK_KEY)
+        await analytics_snapshot_service.rebuild()
+
+    snapshot, _ = await asyncio.gather(analytics_snapshot_service.ensure_snapshot(), other_worker_builds())
+    assert snapshot.meta["rows"]["invoices"] == 1
+
+
+async def test_ensure_snapshot_times_out_while_lock_is_held(redis, monkeypatch):
+    monkeypatch.setattr(snapshot_module, "WAIT_TIMEOUT", 0.3)
+    await redis.set(LOCK_KEY, "other-worker")
+
+    with pytest.raises(SnapshotUnavailableError):
+        await analytics_snapshot_service.ensure_snapshot()
+
+
+async def test_analytics_endpoint_returns_503_while_first_build_runs(api, redis, monkeypatch):
+    monkeypatch.setattr(snapshot_module, "WAIT_TIMEOUT", 0.3)
+    await redis.set(LOCK_KEY, "other-worker")
+
+    assert (await api.get("/api/v1/statistics/analytics")).status_code == 503
+    assert (await api.get("/api/v1/statistics/export/routes")).status_code == 503
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from app.routes.routes_redis import MAX_AVAILABILITY_SCHEDULES
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+DEPARTURE = "2030-01-15"
+
+
+async def _seed(redis):
+    await redis_service.create("xe", "maXe", {"maXe": "XE001", "soChoNgoi": 10})
+    await redis_service.create("xe", "maXe", {"maXe": "XE002", "soChoNgoi": 20})
+    for maLC, maXe in (("LC001", "XE001"), ("LC002", "XE002"), ("LC003", "XE001")):
+        await redis_service.create("lichChay", "maLC", {
+            "maLC": maLC, "maCX": "CX001", "maXe": maXe, "ngayKhoiHanh": DEPARTURE, "gioKhoiHanh": "08:00"
+        })
+    await redis_service.create("veXe", "maVe", {"maVe": "VE001", "maLC": "LC001", "maGhe": "A01", "trangThai": "paid"})
+    await redis_service.create("veXe", "maVe", {"maVe": "VE002", "maLC": "LC001", "maGhe": "A02", "trangThai": "refunded"})
+    await redis_service.create("veXe", "maVe", {"maVe": "VE003", "maLC": "LC002", "maGhe": "B01", "trangThai": "paid"})
+    await redis.set(f"pending_booking:LC001:{DEPARTURE}", json.dumps({
+        "S1": {"danhSachGhe": ["A03"]},
+        "S2": {"danhSachGhe": ["A04", "A05"]}
+    }))
+
+
+def _count_pipelines(redis, monkeypatch) -> list:
+    calls = []
+    original = redis.pipeline
+
+    def pipeline(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(redis, "pipeline", pipeline)
+    return calls
+
+
+async def test_availability_counts(redis):
+    await _seed(redis)
+
+    result = await redis_service.get_availability(["LC001", "LC002", "LC003", "LC404"], sessionId="S1", include_seats=True)
+
+    assert set(result) == {"LC001", "LC002", "LC003"}
+    assert result["LC001"] == {
+        "maLC": "LC001", "ngayDi": DEPARTURE, "totalSeats": 10, "booked": 1, "held": 2, "myHeld": 1, "free": 6,
+        "bookedSeats": ["A01"], "heldSeats": ["A04", "A05"], "myHeldSeats": ["A03"]
+    }
+    assert (result["LC002"]["totalSeats"], result["LC002"]["booked"], result["LC002"]["free"]) == (20, 1, 19)
+    assert result["LC003"]["free"] == 10
+    # Fallback quét veXe đã cache lại set booked
+    assert await redis.smembers("booked:LC001") == {"A01"}
+
+
+async def test_availability_two_round_trips_when_index_ready(redis, monkeypatch):
+    await _seed(redis)
+    await redis.set(redis_service.BOOKED_INDEX_READY_KEY, "1")
+    await redis.sadd("booked:LC001", "A01")
+    calls = _count_pipelines(redis, monkeypatch)
+
+    result = await redis_service.get_availability(["LC001", "LC002", "LC003"])
+
+    assert len(calls) == 2
+    assert result["LC001"]["booked"] == 1
+    # Index đã build: set rỗng nghĩa là chưa có vé, không quét veXe
+    assert result["LC002"]["booked"] == 0
+
+
+async def test_endpoint_keeps_request_order(api, redis):
+    await _seed(redis)
+
+    response = await api.get("/routes/availability", params={"maLC": "LC003, LC404,LC001,LC003"})
+
+    assert response.status_code == 200
+    assert [item["maLC"] for item in response.json()] == ["LC003", "LC001"]
+    assert "bookedSeats" not in response.json()[0]
+
+
+@pytest.mark.parametrize("params", [
+    {"maLC": " , "},
+    {"maLC": ",".join(f"LC{i:03d}" for i in range(MAX_AVAILABILITY_SCHEDULES + 1))},
+    {"maLC": "LC001", "date": "15/01/2030"},
+])
+async def test_endpoint_rejects_bad_requests(api, params):
+    response = await api.get("/routes/availability", params=params)
+
+    assert response.status_code == 400
@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from app.config import settings
+from app.services import booking_metrics_service as metrics_module
+from app.services.booking_metrics_service import booking_metrics_service, BookingMetricsService, ROLLUP_LOCK_KEY
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rollup_keeps_lock_taken_over_by_another_worker(redis, monkeypatch):
+    async def slow_sweep(now):
+        # Lock hết hạn giữa chừng và worker khác đã giữ lock mới
+        await redis.set(ROLLUP_LOCK_KEY, "other-worker")
+        return 0
+
+    monkeypatch.setattr(BookingMetricsService, "sweep_expired_holds", staticmethod(slow_sweep))
+    assert await booking_metrics_service.rollup() is not None
+    assert await redis.get(ROLLUP_LOCK_KEY) == "other-worker"
+
+
+async def test_rollup_is_single_flight(redis):
+    await redis.set(ROLLUP_LOCK_KEY, "other-worker")
+
+    assert await booking_metrics_service.rollup() is None
+
+
+async def test_series_at_full_retention_window_is_accepted(redis, monkeypatch):
+    # Cửa sổ dài nhất pick_resolution cho phép: đúng bằng retention của độ phân giải ngày
+    retention = settings.METRICS_DAY_RETENTION
+    end_ts = int(time.time())
+    # Request tới đúng giới hạn retention, kiểm tra chạy vài giây sau khi end_ts được lấy
+    monkeypatch.setattr(metrics_module.time, "time", lambda: end_ts + 2.5)
+
+    series = await booking_metrics_service.get_series(end_ts - retention, end_ts)
+
+    assert series["resolution"] == "1d"
+    with pytest.raises(ValueError):
+        await booking_metrics_service.get_series(end_ts - retention - 3600, end_ts - 3600, "1d")
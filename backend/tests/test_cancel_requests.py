@@ -0,0 +1,74 @@
+import pytest
+
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+PENDING_COUNT = "/api/v1/admin/bookings/cancel-requests/pending/count"
+
+
+async def _seed():
+    for i in range(1, 4):
+        await redis_service.create("veXe", "maVe", {
+            "maVe": f"VE0000{i}", "maKH": "KH00001", "maLC": "LC001", "maGhe": f"A0{i}", "giaVe": 100000
+        })
+        await redis_service.create("yeuCauHuy", "maYeuCauHuy", {
+            "maYeuCauHuy": f"YC0000{i}", "maDatVe": f"VE0000{i}", "trangThai": "pending", "tienHoanDuKien": 90000
+        })
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": "LC001", "maCX": "CX001", "ngayKhoiHanh": "2030-01-15", "gioKhoiHanh": "08:00"
+    })
+    await redis_service.create("chuyenXe", "maCX", {"maCX": "CX001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt"})
+
+
+@pytest.fixture
+def no_scan(monkeypatch):
+    async def get_all(collection, *args, **kwargs):
+        raise AssertionError(f"get_all({collection}) không được gọi")
+
+    monkeypatch.setattr(redis_service, "get_all", get_all)
+
+
+async def test_pending_count_follows_approve_and_reject(api):
+    await _seed()
+    assert (await api.get(PENDING_COUNT)).json() == {"count": 3}
+
+    approve = await api.put("/api/v1/admin/bookings/cancel-requests/YC00001", json={"action": "approve"})
+    reject = await api.put("/api/v1/admin/bookings/cancel-requests/YC00002", json={
+        "action": "reject", "lyDoTuChoi": "Quá hạn hủy"
+    })
+
+    assert approve.status_code == reject.status_code == 200
+    assert (await api.get(PENDING_COUNT)).json() == {"count": 1}
+    assert await redis_service.count_yeu_cau_huy() == 3
+    assert (await redis_service.get_yeu_cau_huy("YC00002"))["trangThai"] == "rejected"
+
+
+async def test_detail_reads_by_key(api, no_scan):
+    await _seed()
+
+    response = await api.get("/api/v1/admin/bookings/cancel-requests/YC00002")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["soGheNgoi"] == ["A02"]
+    assert (body["ngayDi"], body["gioDi"]) == ("2030-01-15", "08:00")
+    assert body["routeInfo"] == {"diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt"}
+    assert (await api.get("/api/v1/admin/bookings/cancel-requests/YC09999")).status_code == 404
+
+
+async def test_count_is_one_round_trip_when_index_ready(redis, monkeypatch):
+    await _seed()
+    await redis_service.build_sorted_indexes("yeuCauHuy")
+    calls = []
+    original = redis.pipeline
+
+    def pipeline(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(redis, "pipeline", pipeline)
+    monkeypatch.setattr(redis_service, "build_sorted_indexes", None)
+
+    assert await redis_service.count_yeu_cau_huy("pending") == 3
+    assert len(calls) == 1
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services import cascade_service as cascade_module
+from app.services.cascade_service import cascade_service, CascadeService, STATUS_DONE, STATUS_RUNNING, PENDING_KEY
+from app.services.fleet_service import fleet_service
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def _finish_jobs():
+    await asyncio.gather(*list(cascade_module._background_tasks))
+
+
+async def test_delete_bus_cascades_to_seats_and_schedules(redis):
+    await fleet_service.create_bus({"maXe": "XE00001", "bienSoXe": "51B-123.45", "soChoNgoi": 4})
+    for maLC, trang_thai in [("LC001", "completed"), ("LC002", "scheduled")]:
+        await redis_service.create("lichChay", "maLC", {
+            "maLC": maLC, "maXe": "XE00001", "maCX": "CX001", "trangThai": trang_thai,
+            "ngayKhoiHanh": "2030-01-15", "gioKhoiHanh": "08:00"
+        })
+
+    job = await cascade_service.delete("xe", "XE00001")
+    await _finish_jobs()
+    job = await cascade_service.get(job["jobId"])
+
+    assert job["status"] == STATUS_DONE
+    assert job["processed"] == job["total"] == 6
+    assert await redis_service.find_by_set_index("gheNgoi", "maXe", "XE00001") == []
+    assert await redis_service.get_by_key("lichChay", "LC001") is None
+    assert json.loads(await redis.hget("archive:lichChay", "LC001"))["trangThai"] == "completed"
+    assert (await redis_service.get_by_key("lichChay", "LC002"))["maXe"] is None
+    # Biển số của xe đã xóa được trả lại
+    assert not await fleet_service.plate_exists("51B-123.45")
+
+
+async def test_delete_customer_detaches_tickets(redis):
+    await redis_service.create("khachHang", "maKH", {"maKH": "KH00001", "email": "khach@gmail.com"})
+    await redis_service.create("veXe", "maVe", {"maVe": "VE00001", "maKH": "KH00001"})
+
+    job = await cascade_service.delete("khachHang", "KH00001")
+    await _finish_jobs()
+
+    assert (await cascade_service.get(job["jobId"]))["status"] == STATUS_DONE
+    assert (await redis_service.get_by_key("veXe", "VE00001"))["maKH"] is None
+
+
+async def test_unsupported_collection(redis):
+    with pytest.raises(ValueError):
+        await cascade_service.delete("hoaDon", "HD00001")
+
+
+async def _create_bus_with_schedules(count: int):
+    await fleet_service.create_bus({"maXe": "XE00001", "bienSoXe": "51B-123.45", "soChoNgoi": 5})
+    for i in range(1, count + 1):
+        await redis_service.create("lichChay", "maLC", {
+            "maLC": f"LC{i:03d}", "maXe": "XE00001", "maCX": "CX001", "trangThai": "completed",
+            "ngayKhoiHanh": "2030-01-15", "gioKhoiHanh": "08:00"
+        })
+
+
+async def test_resume_finishes_job_interrupted_mid_batch(redis, monkeypatch):
+    monkeypatch.setattr(cascade_module, "CASCADE_BATCH_SIZE", 2)
+    await _create_bus_with_schedules(3)
+    original_apply = CascadeService._apply
+    batches = []
+
+    async def apply_then_crash(collection, field, action, docs):
+        batches.append((collection, len(docs)))
+        if len(batches) == 2:
+            # Worker bị tắt giữa chừng
+            raise asyncio.CancelledError()
+        return await original_apply(collection, field, action, docs)
+
+    monkeypatch.setattr(CascadeService, "_apply", staticmethod(apply_then_crash))
+    job = await cascade_service.delete("xe", "XE00001")
+    with pytest.raises(asyncio.CancelledError):
+        await _finish_jobs()
+    assert (await cascade_service.get(job["jobId"]))["status"] == STATUS_RUNNING
+    assert await redis.sismember(PENDING_KEY, job["jobId"])
+
+    monkeypatch.setattr(CascadeService, "_apply", staticmethod(original_apply))
+    assert await cascade_service.resume() == 1
+
+    job = await cascade_service.get(job["jobId"])
+    assert job["status"] == STATUS_DONE
+    assert job["total"] == 8
+    assert job["result"] == {"gheNgoi": {"delete": 5}, "lichChay": {"archive": 3}}
+    assert await redis_service.find_by_set_index("gheNgoi", "maXe", "XE00001") == []
+    assert await redis.hlen("archive:lichChay") == 3
+    assert not await redis.sismember(PENDING_KEY, job["jobId"])
+    assert all(size <= 2 for _, size in batches)
+
+
+async def test_resume_skips_job_with_live_lease(redis, monkeypatch):
+    async def worker_dies_before_start(job_id):
+        return True
+
+    monkeypatch.setattr(CascadeService, "_run", staticmethod(worker_dies_before_start))
+    await _create_bus_with_schedules(1)
+    job = await cascade_service.delete("xe", "XE00001")
+    monkeypatch.undo()
+
+    await redis.set(f"job:cascade:{job['jobId']}:lease", "other-worker")
+    assert await cascade_service.resume() == 0
+
+    await redis.delete(f"job:cascade:{job['jobId']}:lease")
+    assert await cascade_service.resume() == 1
+    assert (await cascade_service.get(job["jobId"]))["status"] == STATUS_DONE
@@ -0,0 +1,68 @@
+import csv
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from app.routes import statistics_redis
+from app.routes.statistics_redis import _csv_chunks, accepts_gzip, CSV_CHUNK_SIZE
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", True),
+    ("br;q=1.0, gzip;q=0.8", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("deflate", False),
+    ("", False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(SimpleNamespace(headers={"accept-encoding": header})) is expected
+
+
+async def test_chunks_are_bounded():
+    row = ["x" * 1000]
+
+    async def rows():
+        for _ in range(500):
+            yield row
+
+    chunks = [chunk async for chunk in _csv_chunks(rows())]
+
+    assert len(chunks) > 1
+    assert max(len(chunk) for chunk in chunks) < CSV_CHUNK_SIZE + 2 * len(row[0])
+    assert b"".join(chunks).decode("utf-8-sig").splitlines() == ["x" * 1000] * 500
+
+
+async def _seed():
+    await redis_service.create("khachHang", "maKH", {"maKH": "KH00001", "hoTen": "Nguyễn Văn A"})
+    for i in range(5):
+        await redis_service.create("hoaDon", "maHD", {
+            "maHD": f"HD{i:05d}", "maKH": "KH00001", "tongTien": 100000 * (i + 1),
+            "danhSachVe": ["VE1"], "ngayTao": "2030-01-15T08:00:00"
+        })
+
+
+def _parse(response) -> list:
+    return list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "identity"])
+async def test_invoice_export_streams_all_batches(api, monkeypatch, encoding):
+    monkeypatch.setattr(statistics_redis, "EXPORT_BATCH_SIZE", 2)
+    await _seed()
+
+    response = await api.get(
+        "/api/v1/statistics/export/invoices", params={"period": "all"}, headers={"Accept-Encoding": encoding}
+    )
+
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == ("gzip" if encoding == "gzip" else None)
+    assert response.headers["vary"] == "Accept-Encoding"
+    rows = _parse(response)
+    assert rows[0][0] == "Mã HĐ"
+    assert sorted(row[0] for row in rows[1:]) == [f"HD{i:05d}" for i in range(5)]
+    assert {row[2] for row in rows[1:]} == {"Nguyễn Văn A"}
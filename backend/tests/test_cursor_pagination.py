@@ -0,0 +1,58 @@
+import pytest
+
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create_tickets(redis):
+    # Hai vé cùng ngày đặt để kiểm tra phân trang qua các phần tử cùng score
+    days = ["2030-01-01", "2030-01-02", "2030-01-02", "2030-01-03", "2030-01-04"]
+    for i, day in enumerate(days, start=1):
+        await redis_service.create("veXe", "maVe", {
+            "maVe": f"VE0000{i}", "ngayDat": f"{day}T08:00:00",
+            "trangThai": "paid" if i % 2 else "cancelled"
+        })
+
+
+async def _all_pages(limit: int, **kwargs) -> list:
+    keys, cursor = [], None
+    while True:
+        page = await redis_service.page("veXe", "created", cursor=cursor, limit=limit, **kwargs)
+        keys += [doc["maVe"] for doc in page["items"]]
+        cursor = page["nextCursor"]
+        if not cursor:
+            return keys
+
+
+async def test_pages_cover_every_document_once(redis):
+    await _create_tickets(redis)
+
+    assert await _all_pages(2) == ["VE00005", "VE00004", "VE00003", "VE00002", "VE00001"]
+    assert await _all_pages(2, descending=False) == ["VE00001", "VE00002", "VE00003", "VE00004", "VE00005"]
+
+
+async def test_status_filter_and_total(redis):
+    await _create_tickets(redis)
+
+    page = await redis_service.page("veXe", "created", status="paid", limit=2)
+
+    assert [doc["maVe"] for doc in page["items"]] == ["VE00005", "VE00003"]
+    assert page["total"] == 3
+    assert await _all_pages(2, status="cancelled") == ["VE00004", "VE00002"]
+
+
+async def test_page_drops_documents_deleted_outside_service(redis):
+    await _create_tickets(redis)
+    await redis_service.build_sorted_indexes("veXe")
+    await redis.delete("veXe:VE00004")
+
+    page = await redis_service.page("veXe", "created", limit=2)
+
+    assert [doc["maVe"] for doc in page["items"]] == ["VE00005"]
+    assert await redis.zscore("zidx:veXe:created", "VE00004") is None
+
+
+async def test_invalid_cursor(redis):
+    with pytest.raises(ValueError):
+        await redis_service.page("veXe", "created", cursor="not-a-cursor", limit=2)
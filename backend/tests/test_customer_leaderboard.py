@@ -0,0 +1,70 @@
+import csv
+import io
+
+import pytest
+
+from app.services.aggregate_service import aggregate_service
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def _pay(maHD, maKH, tongTien, tickets, ngayTao="2030-01-15T08:00:00"):
+    await aggregate_service.record_payment({
+        "maHD": maHD, "maKH": maKH, "maCX": "CX001", "tongTien": tongTien,
+        "danhSachVe": [f"{maHD}-{i}" for i in range(tickets)], "ngayTao": ngayTao
+    })
+
+
+async def _seed():
+    await redis_service.create("khachHang", "maKH", {
+        "maKH": "KH00001", "hoTen": "Nguyễn Văn A", "email": "a@example.com", "SDT": "0900000001"
+    })
+    await redis_service.create("khachHang", "maKH", {
+        "maKH": "KH00002", "hoTen": "Trần Thị B", "email": "b@example.com", "SDT": "0900000002"
+    })
+    await _pay("HD1", "KH00001", 300000, 1)
+    await _pay("HD2", "KH00001", 400000, 2, "2030-02-01T08:00:00")
+    await _pay("HD3", "KH00002", 500000, 1)
+
+
+async def test_refund_lowers_spend_but_keeps_bookings(redis):
+    await _seed()
+    await aggregate_service.record_refund("HD2-0", 200000, "2030-02-03", "CX001", None, "KH00001")
+
+    top = await aggregate_service.get_leaderboard("customer", "spent")
+
+    assert {row["id"]: row for row in top} == {
+        "KH00001": {"id": "KH00001", "spent": 500000, "bookings": 2, "tickets": 2},
+        "KH00002": {"id": "KH00002", "spent": 500000, "bookings": 1, "tickets": 1},
+    }
+    # Hoàn tiền trừ vào kỳ của ngày duyệt hoàn
+    assert await redis.zscore("lb:customer:spent:month:2030-02", "KH00001") == 200000
+    assert await redis.zscore("lb:customer:spent:month:2030-01", "KH00001") == 300000
+
+
+async def test_top_customers_endpoint(api):
+    await _seed()
+
+    response = await api.get("/api/v1/statistics/customers/top", params={"period": "all", "limit": 1})
+
+    assert response.status_code == 200
+    assert response.json()["customers"] == [{
+        "maKH": "KH00001", "hoTen": "Nguyễn Văn A", "email": "a@example.com", "SDT": "0900000001",
+        "total_bookings": 2, "total_tickets": 3, "total_spent": 700000
+    }]
+
+
+async def test_export_customers_lists_whole_board(api):
+    await _seed()
+    await _pay("HD4", "KH00404", 100000, 1)
+
+    response = await api.get("/api/v1/statistics/export/customers", params={"period": "all"})
+
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert [row[:3] for row in rows[1:]] == [
+        ["1", "KH00001", "Nguyễn Văn A"],
+        ["2", "KH00002", "Trần Thị B"],
+        ["3", "KH00404", "N/A"],
+    ]
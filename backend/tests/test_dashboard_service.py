@@ -0,0 +1,41 @@
+import pytest
+
+from app.services import dashboard_service as dashboard_module
+from app.services.dashboard_service import dashboard_service, LOCK_KEY
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_recent_bookings_come_from_sorted_index(redis, monkeypatch):
+    for i in range(1, 13):
+        await redis_service.create("veXe", "maVe", {
+            "maVe": f"VE{i:05d}", "ngayDat": f"2030-01-{i:02d}T08:00:00", "trangThai": "paid"
+        })
+    original_get_all = redis_service.get_all
+
+    async def get_all_without_tickets(collection, *args, **kwargs):
+        assert collection != "veXe", "dashboard không được đọc toàn bộ vé"
+        return await original_get_all(collection, *args, **kwargs)
+
+    monkeypatch.setattr(redis_service, "get_all", get_all_without_tickets)
+    data = await dashboard_service.compute()
+
+    assert [b["maVe"] for b in data["recentBookings"]] == [f"VE{i:05d}" for i in range(12, 2, -1)]
+
+
+async def test_refresh_keeps_lock_taken_over_by_another_worker(redis, monkeypatch):
+    async def slow_compute():
+        # Lock hết hạn giữa chừng và worker khác đã giữ lock mới
+        await redis.set(LOCK_KEY, "other-worker")
+        return {}
+
+    monkeypatch.setattr(dashboard_module.DashboardService, "compute", staticmethod(slow_compute))
+    assert await dashboard_service.refresh() is not None
+    assert await redis.get(LOCK_KEY) == "other-worker"
+
+
+async def test_refresh_is_single_flight(redis):
+    await redis.set(LOCK_KEY, "other-worker")
+
+    assert await dashboard_service.refresh() is None
@@ -0,0 +1,62 @@
+import pytest
+
+from app.services.demand_service import demand_service, DEMAND_TTL
+
+pytestmark = pytest.mark.anyio
+
+
+async def _search(diemDi, diemDen, ngayDi, session, matched=True):
+    await demand_service.record_search(diemDi, diemDen, ngayDi, session, matched)
+
+
+async def test_demand_aggregates_days(redis):
+    await _search("Hồ Chí Minh", "Đà Lạt", "2030-01-15", "S1")
+    await _search("Hồ Chí Minh", "Đà Lạt", "2030-01-15", "S1")
+    await _search("Hồ Chí Minh", "Đà Lạt", "2030-01-16", "S2", matched=False)
+    await _search("Cần Thơ", "Vũng Tàu", "2030-01-16", "S1", matched=False)
+    await _search("Cần Thơ", "Vũng Tàu", "2030-01-16", None, matched=False)
+    # Ngoài khoảng truy vấn
+    await _search("Hồ Chí Minh", "Đà Lạt", "2030-01-17", "S9")
+
+    result = await demand_service.get_demand("2030-01-15", "2030-01-16")
+
+    assert result["totalSearches"] == 5
+    assert result["totalUnmatched"] == 3
+    assert result["uniqueSessions"] == 2
+    assert result["routes"] == [
+        {"diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "searches": 3, "unmatched": 1, "uniqueSessions": 2},
+        {"diemDi": "Cần Thơ", "diemDen": "Vũng Tàu", "searches": 2, "unmatched": 2, "uniqueSessions": 1},
+    ]
+    assert result["topUnmatched"][0] == {"diemDi": "Cần Thơ", "diemDen": "Vũng Tàu", "count": 2}
+
+
+async def test_demand_keys_expire(redis):
+    await _search("Hồ Chí Minh", "Đà Lạt", "2030-01-15", "S1", matched=False)
+
+    keys = [key async for key in redis.scan_iter(match="demand:*")]
+
+    assert len(keys) == 4
+    for key in keys:
+        assert 0 < await redis.ttl(key) <= DEMAND_TTL
+
+
+async def test_demand_top_limit(redis):
+    for i in range(5):
+        for _ in range(i + 1):
+            await _search(f"City{i}", "Đà Lạt", "2030-01-15", "S1")
+
+    result = await demand_service.get_demand("2030-01-15", "2030-01-15", top=2)
+
+    assert [route["diemDi"] for route in result["routes"]] == ["City4", "City3"]
+    assert result["totalSearches"] == 15
+
+
+@pytest.mark.parametrize("date_from, date_to", [
+    ("15/01/2030", "2030-01-16"),
+    ("2030-01-16", "2030-01-15"),
+    ("2030-01-01", "2030-06-01"),
+])
+async def test_invalid_range_rejected(api, date_from, date_to):
+    response = await api.get("/api/v1/statistics/search-demand", params={"date_from": date_from, "date_to": date_to})
+
+    assert response.status_code == 400
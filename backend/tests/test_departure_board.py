@@ -0,0 +1,86 @@
+import pytest
+
+from app.services import departure_board_service as board_module
+from app.services.departure_board_service import departure_board_service
+from app.services.redis_service import redis_service
+from app.utils import to_epoch
+
+pytestmark = pytest.mark.anyio
+
+DEPARTURE = "2030-01-15"
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(board_module, "get_current_timestamp_hcm", lambda: to_epoch(f"{DEPARTURE}T06:00:00"))
+
+
+async def _seed(redis):
+    await redis_service.create("xe", "maXe", {
+        "maXe": "XE001", "bienSoXe": "51B-111.11", "loaiXe": "Giường nằm", "soChoNgoi": 34, "trangThai": "active"
+    })
+    await redis_service.create("chuyenXe", "maCX", {
+        "maCX": "CX001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "giaChuyenXe": 300000
+    })
+    for maLC, gio in (("LC002", "09:00"), ("LC001", "07:00")):
+        await redis_service.create("lichChay", "maLC", {
+            "maLC": maLC, "maCX": "CX001", "maXe": "XE001", "ngayKhoiHanh": DEPARTURE,
+            "gioKhoiHanh": gio, "trangThai": "scheduled"
+        })
+        await departure_board_service.sync_schedule(maLC)
+
+
+async def test_board_sorted_by_departure(redis):
+    await _seed(redis)
+
+    board = await departure_board_service.get_board("Hồ Chí Minh")
+
+    assert [entry["maLC"] for entry in board] == ["LC001", "LC002"]
+    assert board[0]["bienSoXe"] == "51B-111.11"
+    assert board[0]["diemDen"] == "Đà Lạt"
+    # Ngoài cửa sổ 2 giờ
+    assert [entry["maLC"] for entry in await departure_board_service.get_board("Hồ Chí Minh", hours=2)] == ["LC001"]
+
+
+async def test_cancelled_schedule_leaves_board(redis):
+    await _seed(redis)
+    await redis_service.update("lichChay", "maLC", "LC001", {"trangThai": "cancelled"})
+
+    await departure_board_service.sync_schedule("LC001")
+
+    assert [entry["maLC"] for entry in await departure_board_service.get_board("Hồ Chí Minh")] == ["LC002"]
+    assert await redis.hget(board_module.CITY_INDEX_KEY, "LC001") is None
+
+
+async def test_route_change_moves_entry_to_new_city(redis):
+    await _seed(redis)
+    await redis_service.update("chuyenXe", "maCX", "CX001", {"diemDi": "Cần Thơ"})
+
+    assert await departure_board_service.sync_related("maCX", "CX001") == 2
+
+    assert await departure_board_service.get_board("Hồ Chí Minh") == []
+    assert [entry["maLC"] for entry in await departure_board_service.get_board("Cần Thơ")] == ["LC001", "LC002"]
+
+
+async def test_bus_update_resyncs_board(api, redis):
+    await _seed(redis)
+    version = await redis.get(departure_board_service.version_key("Hồ Chí Minh"))
+
+    response = await api.put("/api/v1/admin/buses/XE001", json={"bienSoXe": "51B-222.22"})
+
+    assert response.status_code == 200
+    board = await departure_board_service.get_board("Hồ Chí Minh")
+    assert {entry["bienSoXe"] for entry in board} == {"51B-222.22"}
+    assert int(await redis.get(departure_board_service.version_key("Hồ Chí Minh"))) > int(version)
+
+
+async def test_rebuild_skips_departed_and_inactive(redis):
+    await _seed(redis)
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": "LC003", "maCX": "CX001", "maXe": "XE001", "ngayKhoiHanh": DEPARTURE,
+        "gioKhoiHanh": "05:00", "trangThai": "scheduled"
+    })
+    await redis_service.update("lichChay", "maLC", "LC002", {"trangThai": "completed"})
+
+    assert await departure_board_service.rebuild() == 1
+    assert [entry["maLC"] for entry in await departure_board_service.get_board("Hồ Chí Minh")] == ["LC001"]
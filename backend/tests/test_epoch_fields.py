@@ -0,0 +1,35 @@
+import pytest
+
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_create_keeps_derived_fields_out_of_caller_dict(redis):
+    hoa_don = {"maHD": "HD00001", "tongTien": 100000, "ngayTao": "2030-01-15T09:30:00"}
+
+    returned = await redis_service.create("hoaDon", "maHD", hoa_don)
+
+    assert "ngayLapTs" not in hoa_don
+    assert "ngayLapTs" not in returned
+    assert "ngayLapTs" in await redis_service.get_by_key("hoaDon", "HD00001")
+
+
+async def test_create_many_keeps_derived_fields_out_of_caller_dicts(redis):
+    ve_xe = [{"maVe": f"VE0000{i}", "ngayDat": "2030-01-15T09:30:00"} for i in range(1, 3)]
+
+    await redis_service.create_many("veXe", "maVe", ve_xe)
+
+    assert all("ngayDatTs" not in ve for ve in ve_xe)
+    assert "ngayDatTs" in await redis_service.get_by_key("veXe", "VE00001")
+
+
+async def test_update_returns_document_without_derived_fields(redis):
+    await redis_service.create("hoaDon", "maHD", {"maHD": "HD00001", "ngayTao": "2030-01-15T09:30:00"})
+
+    updated = await redis_service.update("hoaDon", "maHD", "HD00001", {"ngayTao": "2030-02-01T08:00:00"})
+
+    assert updated["ngayTao"] == "2030-02-01T08:00:00"
+    assert "ngayLapTs" not in updated
+    stored = await redis_service.get_by_key("hoaDon", "HD00001")
+    assert stored["ngayLapTs"] > 0
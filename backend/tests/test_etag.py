@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.etag import build_etag, is_not_modified
+from app.routes import bookings_redis
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+def _request(if_none_match=None):
+    return SimpleNamespace(headers={"if-none-match": if_none_match} if if_none_match else {})
+
+
+def test_build_etag_depends_on_versions_and_params():
+    etag = build_etag([1, 2], "2030-01-15")
+
+    assert etag.startswith('W/"')
+    assert build_etag([1, 2], "2030-01-15") == etag
+    assert build_etag([1, 3], "2030-01-15") != etag
+    assert build_etag([1, 2], "2030-01-16") != etag
+    assert build_etag([1, 2], None) != build_etag([1, 2])
+
+
+def test_if_none_match_weak_comparison():
+    etag = build_etag([5])
+    strong = etag[2:]
+
+    assert is_not_modified(_request(etag), etag)
+    assert is_not_modified(_request(strong), etag)
+    assert is_not_modified(_request(f'W/"other", {strong}'), etag)
+    assert is_not_modified(_request("*"), etag)
+    assert not is_not_modified(_request('W/"other"'), etag)
+    assert not is_not_modified(_request(), etag)
+
+
+async def _seed():
+    await redis_service.create("xe", "maXe", {"maXe": "XE001", "bienSoXe": "51B-111.11", "soChoNgoi": 34})
+    await redis_service.create("chuyenXe", "maCX", {
+        "maCX": "CX001", "maXe": "XE001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "giaChuyenXe": 300000
+    })
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": "LC001", "maCX": "CX001", "maXe": "XE001", "ngayKhoiHanh": "2030-01-15", "gioKhoiHanh": "08:00"
+    })
+
+
+async def test_cities_304_until_routes_change(api):
+    await _seed()
+    first = await api.get("/routes/cities")
+    etag = first.headers["ETag"]
+
+    cached = await api.get("/routes/cities", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert cached.content == b""
+
+    await redis_service.create("chuyenXe", "maCX", {"maCX": "CX002", "diemDi": "Cần Thơ", "diemDen": "Đà Lạt"})
+    changed = await api.get("/routes/cities", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert "Cần Thơ" in changed.json()
+
+
+async def test_seat_hold_bumps_schedule_version(api, monkeypatch):
+    async def fake_qr(ma_dat_ve, amount, **kwargs):
+        return None
+
+    monkeypatch.setattr(bookings_redis.vietqr_service, "create_payment_qr", fake_qr)
+    await _seed()
+    url = "/routes/schedule/LC001?date=2030-01-15"
+    etag = (await api.get(url)).headers["ETag"]
+    versions = await redis_service.get_versions([
+        redis_service.version_key("schedule", "LC001"), redis_service.version_key("route", "CX001")
+    ])
+    assert (await api.get(url, headers={"If-None-Match": etag})).status_code == 304
+
+    response = await api.post("/api/v1/bookings", json={
+        "maLC": "LC001", "ngayDi": "2030-01-15", "danhSachGhe": ["A01"], "sessionId": "S1"
+    })
+    assert response.status_code == 201
+
+    assert await redis_service.get_versions([
+        redis_service.version_key("schedule", "LC001"), redis_service.version_key("route", "CX001")
+    ]) == [v + 1 for v in versions]
+    refreshed = await api.get(url, headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["ETag"] != etag
@@ -0,0 +1,51 @@
+import gzip
+import os
+
+import pytest
+
+from app.config import settings
+from app.routes.statistics_redis import _csv_chunks
+from app.services.export_job_service import ExportJobService, STATUS_DONE, STATUS_FAILED
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def export_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_DIR", str(tmp_path))
+
+
+async def _rows(fail: bool = False):
+    yield ["maHD", "tongTien"]
+    yield ["HD00001", 100000]
+    if fail:
+        raise ConnectionError("redis down")
+
+
+async def _run_job(redis, fail: bool) -> dict:
+    await redis.hset("job:export:job1", mapping={"status": "queued"})
+    await ExportJobService._run("job1", lambda progress: _csv_chunks(_rows(fail)))
+    return await redis.hgetall("job:export:job1")
+
+
+async def test_export_job_fails_when_rows_raise(redis):
+    job = await _run_job(redis, fail=True)
+
+    assert job["status"] == STATUS_FAILED
+    assert "redis down" in job["error"]
+    assert os.listdir(settings.EXPORT_DIR) == []
+
+
+async def test_export_job_writes_file(redis):
+    job = await _run_job(redis, fail=False)
+
+    assert job["status"] == STATUS_DONE
+    with open(ExportJobService.file_path("job1"), encoding="utf-8-sig") as f:
+        assert f.read().splitlines() == ["maHD,tongTien", "HD00001,100000"]
+
+
+async def test_streaming_response_ends_file_on_error():
+    chunks = [chunk async for chunk in _csv_chunks(_rows(fail=True), compress=True, swallow_errors=True)]
+
+    text = gzip.decompress(b"".join(chunks)).decode("utf-8-sig")
+    assert text.splitlines() == ["maHD,tongTien", "HD00001,100000"]
@@ -0,0 +1,46 @@
+import pytest
+from redis.exceptions import ConnectionError
+
+from app.services.fleet_service import fleet_service
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+BUS = {"maXe": "XE00001", "bienSoXe": "51B-123.45", "soChoNgoi": 4, "loaiXe": "Xe giường nằm"}
+
+
+async def test_failed_write_releases_plate(redis, monkeypatch):
+    original_pipeline = redis.pipeline
+
+    def failing_pipeline(*args, **kwargs):
+        pipeline = original_pipeline(*args, **kwargs)
+
+        async def execute(*_args, **_kwargs):
+            raise ConnectionError("redis down")
+
+        pipeline.execute = execute
+        return pipeline
+
+    monkeypatch.setattr(redis, "pipeline", failing_pipeline)
+    with pytest.raises(ConnectionError):
+        await fleet_service.create_bus(dict(BUS))
+    monkeypatch.setattr(redis, "pipeline", original_pipeline)
+
+    assert not await fleet_service.plate_exists(BUS["bienSoXe"])
+    assert await fleet_service.create_bus(dict(BUS)) == 4
+    assert await fleet_service.plate_exists(BUS["bienSoXe"])
+
+
+async def test_import_reports_duplicate_plates(redis):
+    await fleet_service.create_bus(dict(BUS))
+
+    report = await fleet_service.import_buses([
+        {"bienSoXe": "51B-123.45"},
+        {"bienSoXe": "51B-678.90", "soChoNgoi": "3"},
+        {"bienSoXe": "51B-678.90"},
+    ])
+
+    assert [row["status"] for row in report["rows"]] == ["error", "created", "error"]
+    assert report["seats"] == 3
+    maXe = report["rows"][1]["maXe"]
+    assert (await redis_service.get_by_key("xe", maXe))["bienSoXe"] == "51B-678.90"
@@ -0,0 +1,82 @@
+import pytest
+
+from app.services.aggregate_service import aggregate_service
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def _trip(redis, maLC, maCX, ngay, gio, sold, trangThai="completed"):
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": maLC, "maCX": maCX, "maXe": "XE001", "ngayKhoiHanh": ngay, "gioKhoiHanh": gio, "trangThai": trangThai
+    })
+    for i in range(sold):
+        await redis_service.create("veXe", "maVe", {
+            "maVe": f"{maLC}-{i}", "maLC": maLC, "maGhe": f"A{i:02d}", "trangThai": "paid"
+        })
+    if sold:
+        await redis.sadd(f"booked:{maLC}", *[f"A{i:02d}" for i in range(sold)])
+
+
+async def _seed(redis):
+    await redis_service.create("xe", "maXe", {"maXe": "XE001", "soChoNgoi": 10})
+    # 14/01/2030 là thứ Hai
+    await _trip(redis, "LC001", "CX001", "2030-01-14", "08:00", 4)
+    await _trip(redis, "LC002", "CX001", "2030-01-21", "08:30", 8)
+    await _trip(redis, "LC003", "CX002", "2030-01-15", "20:00", 10)
+    await _trip(redis, "LC004", "CX002", "2030-01-16", "20:00", 5, trangThai="scheduled")
+    for maLC in ("LC001", "LC002", "LC003"):
+        await aggregate_service.record_trip(await redis_service.get_lich_chay(maLC))
+
+
+async def test_completing_trip_records_occupancy_once(api, redis):
+    await redis_service.create("xe", "maXe", {"maXe": "XE001", "soChoNgoi": 10})
+    await _trip(redis, "LC001", "CX001", "2030-01-14", "08:00", 5, trangThai="running")
+
+    for _ in range(2):
+        response = await api.put("/api/v1/admin/trips/LC001", json={"trangThai": "completed"})
+        assert response.status_code == 200
+
+    trips = (await api.get("/api/v1/statistics/occupancy/trips")).json()["trips"]
+    assert [(t["maLC"], t["seats"], t["seats_sold"], t["occupancy"]) for t in trips] == [("LC001", 10, 5, 50.0)]
+    assert (await aggregate_service.get_bucket("route:CX001"))["trips"] == 1
+
+
+async def test_trip_occupancy_newest_first_and_filtered(redis):
+    await _seed(redis)
+
+    assert [t["maLC"] for t in await aggregate_service.get_trip_occupancy()] == ["LC002", "LC003", "LC001"]
+    assert [t["maLC"] for t in await aggregate_service.get_trip_occupancy("CX001", limit=1)] == ["LC002"]
+
+
+async def test_heatmap_by_weekday_and_hour(api, redis):
+    await _seed(redis)
+
+    body = (await api.get("/api/v1/statistics/occupancy/heatmap")).json()
+
+    assert body["occupancy"][0][8] == 60.0  # T2 08h: 12 / 20 ghế
+    assert body["occupancy"][1][20] == 100.0
+    assert body["occupancy"][2][20] is None  # Lịch chạy chưa hoàn thành
+    assert (body["trips"], body["seats"], body["seats_sold"]) == (3, 30, 22)
+
+    ranged = (await api.get("/api/v1/statistics/occupancy/heatmap", params={
+        "maCX": "CX001", "date_from": "2030-01-20", "date_to": "2030-01-31"
+    })).json()
+    assert ranged["cells"] == [{"weekday": 0, "hour": 8, "trips": 1, "seats": 10, "sold": 8}]
+    assert ranged["overall_occupancy"] == 80.0
+
+
+async def test_rebuild_restores_occupancy(redis):
+    await _seed(redis)
+    before = await aggregate_service.get_occupancy_heatmap()
+
+    await aggregate_service.rebuild()
+
+    assert await aggregate_service.get_occupancy_heatmap() == before
+    assert len(await aggregate_service.get_trip_occupancy()) == 3
+
+
+async def test_invalid_date_rejected(api):
+    response = await api.get("/api/v1/statistics/occupancy/trips", params={"date_from": "2030-13-45"})
+
+    assert response.status_code == 400
@@ -0,0 +1,91 @@
+import pytest
+
+from app.services.departure_board_service import CITY_INDEX_KEY
+from app.services.recurring_schedule_service import recurring_dates, MAX_SLOTS
+from app.services.redis_service import redis_service
+from app.services.trip_scheduler_service import DEPART_KEY
+
+pytestmark = pytest.mark.anyio
+
+URL = "/api/v1/admin/trips/recurring"
+
+
+def _request(**fields):
+    return {
+        # 14/01/2030 là thứ Hai; thứ Hai và thứ Tư trong một tuần
+        "maCX": "CX001", "ngayBatDau": "2030-01-14", "soTuan": 1, "thuTrongTuan": [0, 2],
+        "gioKhoiHanh": ["14:00", "06:00"], "danhSachXe": ["XE001", "XE002"],
+        "danhSachTaiXe": ["NV001", "NV002"], **fields
+    }
+
+
+async def _seed():
+    await redis_service.create("chuyenXe", "maCX", {
+        "maCX": "CX001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "thoiGianDuKien": "6 giờ"
+    })
+    for i in (1, 2):
+        await redis_service.create("xe", "maXe", {"maXe": f"XE00{i}", "soChoNgoi": 30 + i, "trangThai": "active"})
+        await redis_service.create("nhanVien", "maNV", {"maNV": f"NV00{i}", "hoTen": f"Tài xế {i}", "maCV": "TX"})
+
+
+def test_recurring_dates_filters_weekdays():
+    assert recurring_dates("2030-01-14", 2, [0, 2]) == ["2030-01-14", "2030-01-16", "2030-01-21", "2030-01-23"]
+    assert len(recurring_dates("2030-01-14", 1)) == 7
+
+
+async def test_rotates_buses_and_drivers(api, redis):
+    await _seed()
+    # XE001 đã có lịch chạy tuyến khác ngày 16/01
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": "LC_OTHER", "maCX": "CX009", "maXe": "XE001", "maNV": "NV009",
+        "ngayKhoiHanh": "2030-01-16", "gioKhoiHanh": "09:00", "trangThai": "scheduled"
+    })
+
+    response = await api.post(URL, json=_request(thoiGianChay="7 giờ"))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["conflicts"]) == (3, 1)
+    monday, wednesday = body["days"]
+    assert [(s["gioKhoiHanh"], s["maXe"], s["maNV"]) for s in monday["schedules"]] == [
+        ("06:00", "XE001", "NV001"), ("14:00", "XE002", "NV002")
+    ]
+    assert [(s["gioKhoiHanh"], s["maXe"]) for s in wednesday["schedules"]] == [("06:00", "XE002")]
+    assert wednesday["conflicts"] == [{"gioKhoiHanh": "14:00", "lyDo": "Không còn xe rảnh trong ngày"}]
+
+    lich_chay = await redis_service.get_lich_chay("LC_CX001_2030-01-14_0600")
+    assert (lich_chay["thoiGianDenDuKien"], lich_chay["soGheTrong"]) == ("13:00", 31)
+    assert await redis.zscore(DEPART_KEY, "LC_CX001_2030-01-14_0600") is not None
+    assert await redis.hget(CITY_INDEX_KEY, "LC_CX001_2030-01-16_0600") == "Hồ Chí Minh"
+    assert await redis_service.is_busy("nv", "2030-01-14", "NV002")
+
+
+async def test_dry_run_and_rerun(api, redis):
+    await _seed()
+
+    dry = (await api.post(URL, json=_request(chiKiemTra=True))).json()
+    assert (dry["created"], dry["planned"]) == (0, 4)
+    assert await redis_service.count("lichChay") == 0
+    assert await redis.zcard(DEPART_KEY) == 0
+
+    assert (await api.post(URL, json=_request())).json()["created"] == 4
+    rerun = (await api.post(URL, json=_request())).json()
+    assert (rerun["created"], rerun["conflicts"]) == (0, 4)
+    assert rerun["days"][0]["conflicts"][0]["lyDo"] == "Lịch chạy LC_CX001_2030-01-14_0600 đã tồn tại"
+
+
+@pytest.mark.parametrize("fields, status", [
+    ({"gioKhoiHanh": ["25:00"]}, 400),
+    ({"thuTrongTuan": [7]}, 400),
+    ({"danhSachXe": ["XE404"]}, 404),
+    ({"danhSachTaiXe": ["NV404"]}, 404),
+    ({"soTuan": 26, "thuTrongTuan": None, "gioKhoiHanh": [f"{h:02d}:00" for h in range(6)]}, 400),
+])
+async def test_rejects_invalid_requests(api, fields, status):
+    await _seed()
+    assert 26 * 7 * 6 > MAX_SLOTS
+
+    response = await api.post(URL, json=_request(**fields))
+
+    assert response.status_code == status
+    assert await redis_service.count("lichChay") == 0
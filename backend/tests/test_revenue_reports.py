@@ -0,0 +1,88 @@
+import pytest
+
+from app.services.aggregate_service import aggregate_service
+from app.services.redis_service import redis_service
+from app.utils import timestamps, to_epoch
+
+pytestmark = pytest.mark.anyio
+
+NOW = "2030-02-10T10:00:00"
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(timestamps, "get_current_timestamp_hcm", lambda: to_epoch(NOW))
+
+
+async def _pay(maHD, maCX, ngayTao, tongTien, tickets=1):
+    await aggregate_service.record_payment({
+        "maHD": maHD, "maKH": "KH00001", "maCX": maCX, "tongTien": tongTien,
+        "danhSachVe": [f"{maHD}-{i}" for i in range(tickets)], "ngayTao": ngayTao
+    })
+
+
+async def _seed():
+    await redis_service.create("chuyenXe", "maCX", {
+        "maCX": "CX001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "giaChuyenXe": 100000
+    })
+    await _pay("HD1", "CX001", "2029-12-20T08:00:00", 100000)
+    await _pay("HD2", "CX001", "2030-01-05T08:00:00", 200000, tickets=2)
+    await _pay("HD3", "CX002", "2030-02-09T08:00:00", 300000)
+    await _pay("HD4", "CX001", "2030-02-10T08:00:00", 400000, tickets=4)
+    await aggregate_service.record_refund("HD4-0", 100000, "2030-02-10", "CX001", None, "KH00001")
+
+
+async def test_monthly_revenue(api):
+    await _seed()
+
+    response = await api.get("/api/v1/statistics/revenue/monthly", params={"months": 3})
+
+    assert response.status_code == 200
+    assert [(m["month"], m["revenue"], m["net_revenue"]) for m in response.json()["monthly_data"]] == [
+        ("2029-12", 100000, 100000),
+        ("2030-01", 200000, 200000),
+        ("2030-02", 700000, 600000),
+    ]
+
+
+async def test_route_stats(api, redis):
+    await _seed()
+    await redis_service.create("xe", "maXe", {"maXe": "XE001", "soChoNgoi": 10})
+    await redis.sadd("booked:LC001", "A01", "A02", "A03", "A04")
+    await aggregate_service.record_trip({
+        "maLC": "LC001", "maCX": "CX001", "maXe": "XE001", "ngayKhoiHanh": "2030-02-10", "gioKhoiHanh": "08:00"
+    })
+
+    response = await api.get("/api/v1/statistics/routes/CX001", params={"period": "month", "days": 3})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["route_info"] == {"maCX": "CX001", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt", "giaVe": 100000}
+    assert body["stats"]["total_revenue"] == 400000
+    assert body["stats"]["total_refunds"] == 100000
+    assert (body["stats"]["trips"], body["stats"]["seats_sold"], body["stats"]["occupancy"]) == (1, 4, 40.0)
+    assert [(d["date"], d["revenue"]) for d in body["daily_breakdown"]] == [
+        ("2030-02-08", 0), ("2030-02-09", 0), ("2030-02-10", 400000)
+    ]
+
+    all_time = (await api.get("/api/v1/statistics/routes/CX001", params={"period": "all"})).json()
+    assert all_time["stats"]["total_bookings"] == 3
+    assert (await api.get("/api/v1/statistics/routes/CX404")).status_code == 404
+
+
+async def test_summary(api):
+    await _seed()
+    await redis_service.create("yeuCauHuy", "maYeuCauHuy", {"maYeuCauHuy": "YC00001", "trangThai": "pending"})
+
+    response = await api.get("/api/v1/statistics/summary")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["overview"]["today"]["total_revenue"] == 400000
+    assert body["overview"]["today"]["average_ticket_price"] == 100000
+    assert body["overview"]["this_month"]["total_revenue"] == 700000
+    assert body["overview"]["this_month"]["net_revenue"] == 600000
+    assert body["counts"] == {"total_customers": 0, "total_routes": 1, "pending_cancel_requests": 1}
+    assert [r["maCX"] for r in body["popular_routes"]] in (["CX001", "CX002"], ["CX002", "CX001"])
+    assert [d["date"] for d in body["revenue_chart"]][-1] == "2030-02-10"
+    assert len(body["revenue_chart"]) == 7
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytest
+
+from app.services.aggregate_service import aggregate_service, _range_periods
+from app.services.redis_service import redis_service
+
+pytestmark = pytest.mark.anyio
+
+
+def _invoice(maHD, maCX, ngayTao, tongTien, tickets=1):
+    return {
+        "maHD": maHD, "maKH": "KH00001", "maCX": maCX, "tongTien": tongTien,
+        "danhSachVe": [f"{maHD}-{i}" for i in range(tickets)], "ngayTao": ngayTao
+    }
+
+
+async def _seed():
+    await aggregate_service.record_payment(_invoice("HD1", "CX001", "2030-01-10T08:00:00", 100000))
+    await aggregate_service.record_payment(_invoice("HD2", "CX001", "2030-01-20T08:00:00", 200000, tickets=2))
+    await aggregate_service.record_payment(_invoice("HD3", "CX002", "2030-02-05T08:00:00", 900000, tickets=3))
+    await aggregate_service.record_payment(_invoice("HD4", "CX002", "2030-02-25T08:00:00", 300000))
+
+
+def test_range_uses_month_sets_for_whole_months():
+    assert _range_periods(datetime(2030, 1, 1), datetime(2030, 2, 2)) == [
+        "month:2030-01", "day:2030-02-01", "day:2030-02-02"
+    ]
+    assert _range_periods(None, None) == ["all"]
+
+
+async def test_leaderboard_all_time(redis):
+    await _seed()
+
+    top = await aggregate_service.get_leaderboard("route", "bookings")
+
+    assert {row["id"]: row for row in top} == {
+        "CX001": {"id": "CX001", "bookings": 2, "tickets": 3, "revenue": 300000},
+        "CX002": {"id": "CX002", "bookings": 2, "tickets": 4, "revenue": 1200000},
+    }
+    assert [row["id"] for row in await aggregate_service.get_leaderboard("route", "revenue", limit=1)] == ["CX002"]
+
+
+async def test_leaderboard_merges_month_and_days(redis):
+    await _seed()
+
+    top = await aggregate_service.get_leaderboard("route", "tickets", datetime(2030, 1, 15), datetime(2030, 2, 10))
+
+    assert top == [
+        {"id": "CX002", "tickets": 3, "bookings": 1, "revenue": 900000},
+        {"id": "CX001", "tickets": 2, "bookings": 1, "revenue": 200000},
+    ]
+    # ZSET gộp tạm có TTL ngắn
+    async for key in redis.scan_iter(match="lb:tmp:*"):
+        assert await redis.ttl(key) > 0
+
+
+async def test_leaderboard_rejects_unknown_metric(redis):
+    with pytest.raises(ValueError):
+        await aggregate_service.get_leaderboard("route", "spent")
+
+
+async def test_popular_routes_endpoint(api):
+    await _seed()
+    await redis_service.create("chuyenXe", "maCX", {"maCX": "CX002", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt"})
+
+    response = await api.get("/api/v1/statistics/routes/popular", params={"period": "all", "limit": 5})
+
+    assert response.status_code == 200
+    routes = {route["maCX"]: route for route in response.json()["routes"]}
+    assert routes["CX002"] == {
+        "maCX": "CX002", "diemDi": "Hồ Chí Minh", "diemDen": "Đà Lạt",
+        "total_bookings": 2, "total_tickets": 4, "total_revenue": 1200000
+    }
+    # Tuyến đã bị xóa vẫn hiện trong bảng xếp hạng
+    assert routes["CX001"]["diemDi"] == "N/A"
+
+
+async def test_rebuild_backfills_route_leaderboard(redis):
+    # Hóa đơn cũ chưa có maCX: tuyến lấy từ vé -> lịch chạy
+    await redis_service.create("lichChay", "maLC", {"maLC": "LC001", "maCX": "CX009"})
+    await redis_service.create("veXe", "maVe", {"maVe": "VE1", "maLC": "LC001", "trangThai": "paid"})
+    await redis_service.create("hoaDon", "maHD", {
+        "maHD": "HD1", "tongTien": 150000, "danhSachVe": ["VE1"], "ngayTao": "2030-01-10T08:00:00"
+    })
+
+    await aggregate_service.rebuild()
+
+    assert await aggregate_service.get_leaderboard("route", "revenue") == [
+        {"id": "CX009", "revenue": 150000, "tickets": 1, "bookings": 1}
+    ]
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from app.services.redis_service import redis_service
+from app.services.search_snapshot_service import search_snapshot_service, SearchSnapshotService
+from app.services.fleet_service import fleet_service
+
+pytestmark = pytest.mark.anyio
+
+NGAY = "2030-01-15"
+
+
+async def _seed_route(redis, maCX: str, maXe: str, diemDen: str = "Da Lat"):
+    await fleet_service.create_bus({"maXe": maXe, "bienSoXe": f"51B-{maXe}", "soChoNgoi": 8, "loaiXe": "Limousine"})
+    await redis_service.create("chuyenXe", "maCX", {
+        "maCX": maCX, "maXe": maXe, "diemDi": "Sai Gon", "diemDen": diemDen, "giaChuyenXe": 250000
+    })
+    await redis.sadd(f"routes:Sai Gon:{diemDen}", maCX)
+
+
+async def _create_schedule(maLC: str, maCX: str, maXe: str, gio: str = "08:00", ngay: str = NGAY):
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": maLC, "maCX": maCX, "maXe": maXe, "ngayKhoiHanh": ngay, "gioKhoiHanh": gio
+    })
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Đếm số lần snapshot được build lại"""
+    calls = []
+    original = SearchSnapshotService.build_snapshot
+
+    async def counting(*args, **kwargs):
+        calls.append(args[:3])
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(SearchSnapshotService, "build_snapshot", staticmethod(counting))
+    return calls
+
+
+async def test_snapshot_survives_unrelated_writes(redis, builds):
+    await _seed_route(redis, "CX1", "XE1")
+    await _seed_route(redis, "CX2", "XE2", diemDen="Nha Trang")
+    await _create_schedule("LC1", "CX1", "XE1")
+
+    snapshot = await search_snapshot_service.get_snapshot("Sai Gon", "Da Lat", NGAY)
+    assert [row["maLC"] for row in snapshot["rows"]] == ["LC1"]
+    assert snapshot["columns"]["tongGhe"] == [8]
+
+    # Giữ ghế, lịch chạy của tuyến khác và của ngày khác không làm snapshot hết hạn
+    await redis_service.bump_seat_version("LC1", "CX1")
+    await _create_schedule("LC2", "CX2", "XE2")
+    await _create_schedule("LC3", "CX1", "XE1", ngay="2030-01-16")
+    await search_snapshot_service.get_snapshot("Sai Gon", "Da Lat", NGAY)
+    assert len(builds) == 1
+
+    # Lịch chạy mới của chính tuyến trong ngày thì build lại
+    await _create_schedule("LC4", "CX1", "XE1", gio="14:00")
+    snapshot = await search_snapshot_service.get_snapshot("Sai Gon", "Da Lat", NGAY)
+    assert len(builds) == 2
+    assert sorted(row["maLC"] for row in snapshot["rows"]) == ["LC1", "LC4"]
+
+
+async def test_query_reports_booked_and_held_separately(redis):
+    await _seed_route(redis, "CX1", "XE1")
+    await _create_schedule("LC1", "CX1", "XE1")
+    await redis.set(redis_service.BOOKED_INDEX_READY_KEY, 1)
+    await redis_service.add_booked_seats("LC1", ["XE1_A01", "XE1_A02"])
+    await redis.set(f"pending_booking:LC1:{NGAY}", json.dumps({"session-1": {"danhSachGhe": ["XE1_B01"]}}))
+
+    snapshot = await search_snapshot_service.get_snapshot("Sai Gon", "Da Lat", NGAY)
+    [row] = await search_snapshot_service.query(snapshot, limit=10)
+
+    assert row["soGheDaDat"] == 2
+    assert row["soGheDangGiu"] == 1
+    assert row["soGheTrong"] == 5
+
+
+@pytest.mark.parametrize("sort_order, expected", [
+    ("asc", ["LC2", "LC1", "LC3"]),
+    ("desc", ["LC1", "LC2", "LC3"]),
+])
+async def test_unparseable_departure_time_sorts_last(redis, sort_order, expected):
+    await _seed_route(redis, "CX1", "XE1")
+    await _create_schedule("LC1", "CX1", "XE1", gio="14:00")
+    await _create_schedule("LC2", "CX1", "XE1", gio="08:00")
+    await _create_schedule("LC3", "CX1", "XE1", gio="chưa rõ")
+
+    snapshot = await search_snapshot_service.get_snapshot("Sai Gon", "Da Lat", NGAY)
+    rows = await search_snapshot_service.query(snapshot, limit=10, sort_by="gioKhoiHanh", sort_order=sort_order)
+
+    assert [row["maLC"] for row in rows] == expected
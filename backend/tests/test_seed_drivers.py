@@ -0,0 +1,35 @@
+import pytest
+
+from app.core.database import redis_client
+from app.services.redis_service import redis_service
+from scripts.seed_buses_drivers import seed_data
+
+pytestmark = pytest.mark.anyio
+
+DRIVERS = ["NV004", "NV005", "NV006", "NV007", "NV008"]
+
+
+@pytest.fixture
+async def seeded(redis, monkeypatch):
+    async def keep_client():
+        pass
+
+    monkeypatch.setattr(redis_client, "connect", keep_client)
+    monkeypatch.setattr(redis_client, "disconnect", keep_client)
+    # Index đã được build trước khi seed (app đang chạy)
+    await redis_service.ensure_set_indexes("nhanVien", "busy")
+    await seed_data()
+    return redis
+
+
+async def test_seeded_drivers_are_available(seeded):
+    drivers = await redis_service.get_available_drivers("2030-01-15", ["CV003"])
+
+    assert [driver["maNV"] for driver in drivers] == DRIVERS
+    assert (await redis_service.get_by_key("chucVu", "CV003"))["danhSachNhanVien"]
+
+
+async def test_seeding_twice_skips_existing_drivers(seeded):
+    await seed_data()
+
+    assert await seeded.scard("idx:nhanVien") == len(DRIVERS)
@@ -0,0 +1,88 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from app.services.sketch_service import (
+    sketch_service, merge, quantiles, bucket_index, SKETCH_ACCURACY, ZERO_FIELD
+)
+from app.utils import to_epoch
+
+pytestmark = pytest.mark.anyio
+
+QS = [0.01, 0.25, 0.5, 0.9, 0.99, 1.0]
+
+
+def _sketch(values) -> dict:
+    sketch = {}
+    for value in values:
+        field = bucket_index(value)
+        sketch[field] = sketch.get(field, 0) + 1
+    return sketch
+
+
+def _exact(values, q) -> float:
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_quantiles_within_relative_accuracy(seed):
+    rng = random.Random(seed)
+    values = [rng.lognormvariate(12, 1.5) for _ in range(5000)]
+
+    result = quantiles(_sketch(values), QS)
+
+    for q in QS:
+        exact = _exact(values, q)
+        assert abs(result[f"p{q * 100:g}"] - exact) <= SKETCH_ACCURACY * exact + 0.01
+
+
+def test_merge_equals_sketch_of_union():
+    rng = random.Random(7)
+    a = [rng.uniform(1, 1000) for _ in range(300)]
+    b = [rng.uniform(500, 5000) for _ in range(700)]
+    # Sketch đọc từ Redis có count dạng chuỗi
+    stored = [{field: str(count) for field, count in _sketch(part).items()} for part in (a, b)]
+
+    merged = merge(stored + [None, {}])
+
+    assert merged == _sketch(a + b)
+    assert quantiles(merged, QS) == quantiles(_sketch(a + b), QS)
+
+
+def test_zero_values_and_empty_sketch():
+    assert quantiles({}, [0.5]) == {"p50": None}
+    sketch = _sketch([0, 0, 0, 100])
+    assert sketch[ZERO_FIELD] == 3
+    result = quantiles(sketch, [0.5, 1.0])
+    assert result["p50"] == 0.0
+    assert result["p100"] == pytest.approx(100, rel=SKETCH_ACCURACY)
+
+
+async def test_record_and_query_across_days(redis):
+    day1 = to_epoch("2030-01-15T10:00:00")
+    day2 = to_epoch("2030-01-16T10:00:00")
+    await sketch_service.record_payment({"maCX": "CX001"}, [100000, 200000], day1,
+                                        departure_ts=day1 + 3600, hold_started_ts=day1 - 90)
+    await sketch_service.record_payment({"maCX": "CX002"}, [400000], day2)
+
+    total = await sketch_service.get_quantiles("price", datetime(2030, 1, 15), datetime(2030, 1, 16), qs=[0.5, 1.0])
+    route = await sketch_service.get_quantiles("price", datetime(2030, 1, 15), datetime(2030, 1, 16), "CX001", [1.0])
+    lead = await sketch_service.get_quantiles("lead_time", datetime(2030, 1, 15), datetime(2030, 1, 15), qs=[0.5])
+    hold = await sketch_service.get_quantiles("hold_to_pay", datetime(2030, 1, 15), datetime(2030, 1, 15), qs=[0.5])
+
+    assert total["count"] == 3
+    assert total["quantiles"]["p50"] == pytest.approx(200000, rel=SKETCH_ACCURACY)
+    assert total["quantiles"]["p100"] == pytest.approx(400000, rel=SKETCH_ACCURACY)
+    assert route["count"] == 2
+    assert route["quantiles"]["p100"] == pytest.approx(200000, rel=SKETCH_ACCURACY)
+    assert lead["count"] == 2
+    assert lead["quantiles"]["p50"] == pytest.approx(60, rel=SKETCH_ACCURACY)
+    assert hold["count"] == 1
+    assert hold["quantiles"]["p50"] == pytest.approx(90, rel=SKETCH_ACCURACY)
+
+
+async def test_unknown_metric_rejected(redis):
+    with pytest.raises(ValueError):
+        await sketch_service.get_quantiles("speed", datetime(2030, 1, 15), datetime(2030, 1, 15))
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from app.services.redis_service import redis_service
+from app.services.trip_scheduler_service import trip_scheduler_service, DEPART_KEY, ARRIVE_KEY
+from app.utils import to_epoch
+
+pytestmark = pytest.mark.anyio
+
+DEPARTURE = "2030-01-15"
+
+
+async def _create_schedule(maLC: str, **fields):
+    await redis_service.create("lichChay", "maLC", {
+        "maLC": maLC, "maCX": "CX001", "ngayKhoiHanh": DEPARTURE, "gioKhoiHanh": "08:00",
+        "thoiGianChay": "5 giờ", **fields
+    })
+
+
+async def _tick(now: float) -> dict:
+    # Vòng lặp không kết thúc sẽ làm test fail thay vì treo
+    return await asyncio.wait_for(trip_scheduler_service.tick(now), timeout=5)
+
+
+async def test_schedule_without_status_departs(redis):
+    await _create_schedule("LC001")
+    departure = to_epoch(f"{DEPARTURE}T08:00:00")
+
+    assert await _tick(departure + 60) == {"running": 1, "completed": 0}
+    assert (await redis_service.get_by_key("lichChay", "LC001"))["trangThai"] == "running"
+    assert await redis.zscore(DEPART_KEY, "LC001") is None
+    assert await redis.zscore(ARRIVE_KEY, "LC001") == departure + 5 * 3600
+
+
+async def test_overdue_schedule_completes_in_one_tick(redis):
+    await _create_schedule("LC001", trangThai="")
+    await _create_schedule("LC002", trangThai="cancelled")
+
+    result = await _tick(to_epoch(f"{DEPARTURE}T23:00:00"))
+
+    assert result == {"running": 1, "completed": 1}
+    assert (await redis_service.get_by_key("lichChay", "LC001"))["trangThai"] == "completed"
+    assert await redis.zcard(DEPART_KEY) == 0
+    assert await redis.zcard(ARRIVE_KEY) == 0
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.services.redis_service import redis_service, UniqueConstraintError
+
+pytestmark = pytest.mark.anyio
+
+
+def _customer(maKH: str, email: str, **fields) -> dict:
+    return {"maKH": maKH, "email": email, **fields}
+
+
+async def test_concurrent_creates_claim_email_once(redis):
+    results = await asyncio.gather(
+        redis_service.create("khachHang", "maKH", _customer("KH00001", "a@gmail.com")),
+        redis_service.create("khachHang", "maKH", _customer("KH00002", "a@gmail.com")),
+        return_exceptions=True
+    )
+
+    assert sum(isinstance(r, UniqueConstraintError) for r in results) == 1
+    assert await redis.scard("idx:khachHang") == 1
+
+
+async def test_conflict_claims_nothing(redis):
+    await redis_service.create("khachHang", "maKH", _customer("KH00001", "a@gmail.com", SDT="0901"))
+
+    with pytest.raises(UniqueConstraintError):
+        await redis_service.create("khachHang", "maKH", _customer("KH00002", "b@gmail.com", SDT="0901"))
+
+    # Email của lần tạo thất bại không bị giữ lại
+    assert await redis.hget("uniq:khachHang:email", "b@gmail.com") is None
+
+
+async def test_update_and_delete_release_old_values(redis):
+    await redis_service.create("khachHang", "maKH", _customer("KH00001", "a@gmail.com"))
+
+    await redis_service.update("khachHang", "maKH", "KH00001", {"email": "b@gmail.com"})
+    await redis_service.create("khachHang", "maKH", _customer("KH00002", "a@gmail.com"))
+    with pytest.raises(UniqueConstraintError):
+        await redis_service.update("khachHang", "maKH", "KH00002", {"email": "b@gmail.com"})
+
+    await redis_service.delete("khachHang", "KH00001")
+    await redis_service.update("khachHang", "maKH", "KH00002", {"email": "b@gmail.com"})
+    assert (await redis_service.get_khach_hang_by_email("b@gmail.com"))["maKH"] == "KH00002"
+    assert await redis.hget("uniq:khachHang:email", "a@gmail.com") is None
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from app.services.redis_service import redis_service, UniqueConstraintError
+
+pytestmark = pytest.mark.anyio
+
+
+async def _write_raw(redis, collection: str, key: str, doc: dict):
+    # Giống script seed cũ: SET + SADD, không qua uniq hash
+    await redis.set(f"{collection}:{key}", json.dumps(doc, ensure_ascii=False))
+    await redis.sadd(f"idx:{collection}", key)
+
+
+@pytest.fixture
+async def raw_records(redis):
+    # Hash đã build (app đang chạy) trước khi script ghi thẳng dữ liệu
+    await redis_service.ensure_unique_indexes("nhanVien")
+    await redis_service.ensure_unique_indexes("khachHang")
+    await _write_raw(redis, "nhanVien", "NV004", {"maNV": "NV004", "email": "taixe@busgo.vn"})
+    await _write_raw(redis, "khachHang", "KH00001", {"maKH": "KH00001", "email": "khach@gmail.com"})
+    return redis
+
+
+async def test_email_lookup_after_build_indexes(raw_records):
+    await redis_service.build_indexes()
+
+    assert (await redis_service.get_nhan_vien_by_email("taixe@busgo.vn"))["maNV"] == "NV004"
+    assert (await redis_service.get_khach_hang_by_email("khach@gmail.com"))["maKH"] == "KH00001"
+
+
+async def test_email_lookup_falls_back_to_scan_and_backfills(raw_records):
+    assert (await redis_service.get_nhan_vien_by_email("taixe@busgo.vn"))["maNV"] == "NV004"
+    assert (await redis_service.get_khach_hang_by_email("khach@gmail.com"))["maKH"] == "KH00001"
+    assert await raw_records.hget("uniq:nhanVien:email", "taixe@busgo.vn") == "NV004"
+
+    with pytest.raises(UniqueConstraintError):
+        await redis_service.create("nhanVien", "maNV", {"maNV": "NV009", "email": "taixe@busgo.vn"})
+
+
+async def test_email_lookup_miss(raw_records):
+    assert await redis_service.get_nhan_vien_by_email("khong.co@busgo.vn") is None